@@ -40,6 +40,8 @@ from routes.return_orders import return_orders_bp
 # Import export script
 from scripts.export_data import export_all_data_from_supabase
 from utils.supabase_db import db as supabase_db
+from utils.json_helpers import flush_pending_writes
+from utils.process_coordination import change_counter, sync_leader
 
 # Import sync manager
 try:
@@ -91,14 +93,34 @@ def create_app(config_name='default'):
     if ENHANCED_SYNC_AVAILABLE:
         app.sync_manager = get_sync_manager(app.config['BASE_DIR'])
         app.logger.info("Enhanced sync manager initialized")
-        try:
+
+        def start_background_sync():
             app.sync_manager.start_background_sync()
             app.logger.info("Background sync scheduler started")
+
+        # With several workers only the elected one runs the scheduler; the
+        # others take over if it exits.
+        try:
+            sync_leader.run_when_elected(start_background_sync)
         except Exception as e:
             app.logger.error(f"Failed to start background sync scheduler: {e}", exc_info=True)
     else:
         app.sync_manager = None
         app.logger.warning("Running without enhanced sync manager")
+
+    # Bill cloud writes queued by checkout are drained by the elected worker.
+    try:
+        from utils.bill_outbox import bill_outbox
+        sync_leader.run_when_elected(bill_outbox.start)
+    except Exception as e:
+        app.logger.error(f"Failed to start bill outbox workers: {e}", exc_info=True)
+
+    # The elected worker also checks the Supabase sales ledger for drift.
+    try:
+        from services.products_service import start_sales_ledger_verifier
+        sync_leader.run_when_elected(start_sales_ledger_verifier)
+    except Exception as e:
+        app.logger.error(f"Failed to start sales ledger verification: {e}", exc_info=True)
     
     # Register blueprints
     app.register_blueprint(products_bp)
@@ -124,6 +146,11 @@ def create_app(config_name='default'):
     app.register_blueprint(return_orders_bp)
     
     # Register middleware
+    @app.before_request
+    def refresh_shared_caches():
+        # Drop response caches another worker invalidated (no-op single-process).
+        change_counter.poll()
+
     @app.before_request
     def log_request_info():
         app.logger.info(
@@ -165,6 +192,10 @@ def create_app(config_name='default'):
         """Gracefully shutdown the Flask backend"""
         app.logger.info("Shutdown request received from frontend")
 
+        # Make sure every acknowledged local save is on disk before exiting.
+        if not flush_pending_writes(timeout=5.0):
+            app.logger.warning("Timed out flushing pending local writes before shutdown")
+
         # Try Werkzeug's shutdown (available when using app.run)
         func = request.environ.get("werkzeug.server.shutdown")
         if func is not None:
@@ -283,7 +314,9 @@ with app.app_context():
         except Exception:
             cloud_reachable = False
 
-        if cloud_reachable:
+        if not sync_leader.is_leader():
+            app.logger.info("Skipping initial Supabase export; the sync leader worker performs it.")
+        elif cloud_reachable:
             export_all_data_from_supabase()
             app.logger.info("Initial data export from Supabase completed successfully.")
         else:
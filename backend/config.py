@@ -57,6 +57,9 @@ class Config:
     DATA_BASE_DIR = os.path.join(BASE_DIR, "data")
     JSON_DIR = os.path.join(DATA_BASE_DIR, "json")
     LOGS_DIR = os.path.join(DATA_BASE_DIR, "logs")
+    # Outside JSON_DIR: not an entity file, never served by the SQLite engine.
+    INVOICE_SERIALS_FILE = os.path.join(DATA_BASE_DIR, "invoice_serials.json")
+    BILL_OUTBOX_FILE = os.path.join(DATA_BASE_DIR, "bill_outbox.json")
 
     # File paths
     PRODUCTS_FILE = os.path.join(JSON_DIR, "products.json")
@@ -94,6 +97,66 @@ class Config:
     ENHANCED_SYNC_AVAILABLE = True
     ENABLE_DESTRUCTIVE_ADMIN_ACTIONS = _env_bool("ENABLE_DESTRUCTIVE_ADMIN_ACTIONS", False)
 
+    # Local storage: journaled row writes are folded back into the snapshot
+    # file once the journal grows past this many bytes.
+    JOURNAL_COMPACT_BYTES = int(os.environ.get("JOURNAL_COMPACT_BYTES", str(2 * 1024 * 1024)))
+
+    # Local storage engine: "json" (flat files) or "sqlite" (indexed rows in
+    # SQLITE_DB_FILE, imported from the JSON files on first use).
+    LOCAL_STORAGE_ENGINE = os.environ.get("LOCAL_STORAGE_ENGINE", "json").strip().lower()
+    SQLITE_DB_FILE = os.environ.get("SQLITE_DB_FILE") or os.path.join(DATA_BASE_DIR, "local_store.sqlite3")
+    # On-disk format of local snapshots (see utils/storage_codec.py): "json"
+    # (compact) or "msgpack" for the large tables in LOCAL_BINARY_FILES.
+    LOCAL_STORAGE_FORMAT = os.environ.get("LOCAL_STORAGE_FORMAT", "json").strip().lower()
+    LOCAL_BINARY_FILES = ("products.json", "bills.json", "billitems.json")
+
+    # Concurrent saves of one file are coalesced into a single write; a
+    # non-zero window lingers that long to let more writers join.
+    JSON_GROUP_COMMIT_WINDOW_MS = float(os.environ.get("JSON_GROUP_COMMIT_WINDOW_MS", "0"))
+
+    # Per-store/month copy of bills under JSON_DIR/bills for scoped local reads.
+    LOCAL_BILL_SHARDS = _env_bool("LOCAL_BILL_SHARDS", True)
+
+    # Several gunicorn workers sharing JSON_DIR: cross-process file locks,
+    # shared cache-invalidation counters and one elected sync worker (see
+    # utils/process_coordination.py). Implied when WEB_WORKERS > 1.
+    WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "1"))
+    LOCAL_STORAGE_MULTIPROCESS = _env_bool("LOCAL_STORAGE_MULTIPROCESS", WEB_WORKERS > 1)
+    SYNC_LEADER_RETRY_SECONDS = float(os.environ.get("SYNC_LEADER_RETRY_SECONDS", "30"))
+
+    # Bill cloud writes go through a durable outbox drained by the sync
+    # leader (utils/bill_outbox.py). Off: checkout drains its own entry inline.
+    BILL_CLOUD_WRITE_BEHIND = _env_bool("BILL_CLOUD_WRITE_BEHIND", True)
+    BILL_OUTBOX_WORKERS = int(os.environ.get("BILL_OUTBOX_WORKERS", "2"))
+    BILL_OUTBOX_POLL_SECONDS = float(os.environ.get("BILL_OUTBOX_POLL_SECONDS", "2"))
+
+    # Business day of the bill summary tiles ("today", from/to days). The
+    # bill rollups migration buckets days in Asia/Kolkata; change both together.
+    BUSINESS_TIMEZONE = os.environ.get("BUSINESS_TIMEZONE", "Asia/Kolkata")
+
+    # Chunked lookups of one request run on a bounded pool within a time
+    # budget (utils/fetch_plan.py), e.g. bill detail enrichment.
+    FETCH_PLAN_CONCURRENCY = int(os.environ.get("FETCH_PLAN_CONCURRENCY", "6"))
+    FETCH_PLAN_BUDGET_SECONDS = float(os.environ.get("FETCH_PLAN_BUDGET_SECONDS", "20"))
+
+    # Concurrent page requests per full-table Supabase read
+    # (utils/supabase_pagination.py).
+    SUPABASE_PAGE_CONCURRENCY = int(os.environ.get("SUPABASE_PAGE_CONCURRENCY", "4"))
+
+    # Cloud aggregates refreshed from changed rows (utils/delta_cache.py):
+    # full rebuild interval (catches hard deletes), and how far before the
+    # newest seen timestamp each delta query starts.
+    DELTA_CACHE_FULL_REBUILD_SECONDS = float(os.environ.get("DELTA_CACHE_FULL_REBUILD_SECONDS", "600"))
+    DELTA_CACHE_OVERLAP_SECONDS = float(os.environ.get("DELTA_CACHE_OVERLAP_SECONDS", "300"))
+
+    # Live storeinventory allocation index (utils/allocation_index.py): how
+    # often its row count / newest updatedat are checked against Supabase.
+    ALLOCATION_INDEX_VERIFY_SECONDS = float(os.environ.get("ALLOCATION_INDEX_VERIFY_SECONDS", "30"))
+
+    # How often the sync leader checks the Supabase product_sales_ledger
+    # against a full recomputation (migrations/20261017_product_sales_ledger.sql).
+    SALES_LEDGER_VERIFY_SECONDS = float(os.environ.get("SALES_LEDGER_VERIFY_SECONDS", "3600"))
+
     # Log settings
     LOG_RETENTION_DAYS = 30
 
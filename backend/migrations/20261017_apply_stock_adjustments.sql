@@ -0,0 +1,48 @@
+-- Batched product stock adjustment.
+--   apply_stock_adjustments(items) applies
+--       stock = greatest(0, stock - qty)
+--   to every {"product_id", "qty"} element of `items` in one statement and
+--   returns the new stock per product. Negative qty restocks.
+--
+-- Replaces the backend's read-then-write loop (one SELECT plus one UPDATE per
+-- product, racing with other terminals) used by bill create/update/cancel/
+-- revise, audits and return orders. Duplicate product ids are summed; unknown
+-- ids are skipped and simply missing from the result. Rows are locked in id
+-- order so two terminals adjusting overlapping products cannot deadlock.
+--
+-- Shared Supabase: run this ONCE. Safe to re-run. Until it is applied the
+-- backend falls back to the per-product loop (utils/stock_adjustments.py).
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION public.apply_stock_adjustments(items jsonb)
+RETURNS TABLE (product_id character varying, stock integer)
+LANGUAGE sql
+AS $$
+  WITH wanted AS (
+    SELECT e->>'product_id' AS product_id,
+           SUM(COALESCE((e->>'qty')::integer, 0)) AS qty
+    FROM jsonb_array_elements(COALESCE(items, '[]'::jsonb)) AS e
+    WHERE e->>'product_id' IS NOT NULL
+    GROUP BY 1
+  ),
+  locked AS (
+    SELECT p.id
+    FROM public.products p
+    JOIN wanted w ON w.product_id = p.id
+    ORDER BY p.id
+    FOR UPDATE OF p
+  )
+  UPDATE public.products p
+     SET stock = GREATEST(0, COALESCE(p.stock, 0) - w.qty),
+         updatedat = CURRENT_TIMESTAMP
+    FROM wanted w
+   WHERE p.id = w.product_id
+     AND p.id IN (SELECT id FROM locked)
+  RETURNING p.id, p.stock::integer;
+$$;
+
+REVOKE ALL ON FUNCTION public.apply_stock_adjustments(jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_stock_adjustments(jsonb) TO service_role;
+
+COMMIT;
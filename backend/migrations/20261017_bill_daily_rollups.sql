@@ -0,0 +1,270 @@
+-- Daily sales rollups per store.
+--   bill_daily_rollups(storeid, business_day) holds, for that store and day:
+--     bill_count        non-cancelled bills
+--     revenue           sum of their bills.total
+--     adjusted_revenue  the same, but a bill with replacements counts the
+--                       swap difference it was paid for (sum of
+--                       replacements.final_amount, floored at 0)
+--     cancelled_count   cancelled/voided bills
+--
+-- /api/bills/summary used to download every bill in the requested window and
+-- sum it in Python. It now calls bill_sales_summary(), which adds up these
+-- rows (one per store and day) instead.
+--
+-- Maintenance is incremental: triggers on bills and replacements call
+-- rollup_bill(bill_id), which recomputes that one bill's contribution, takes
+-- the difference from the contribution it last recorded
+-- (bill_rollup_contributions) and applies it to the affected day rows. Any
+-- writer -- checkout, edits, cancel, revise, delete, the sync manager, the
+-- dashboard -- is covered. rebuild_bill_daily_rollups() recomputes
+-- everything from history; it runs once at the end of this migration.
+--
+-- The business day is the date part of the bill's date/timestamp/created_at
+-- in Asia/Kolkata (the summary endpoint used the server's local day before;
+-- the backend's Config.BUSINESS_TIMEZONE must name the same zone).
+--
+-- Shared Supabase: run this ONCE. Safe to re-run. Until it is applied the
+-- backend keeps summing bills.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.bill_daily_rollups (
+  storeid          text           NOT NULL,
+  business_day     date           NOT NULL,
+  bill_count       integer        NOT NULL DEFAULT 0,
+  revenue          numeric(14, 2) NOT NULL DEFAULT 0,
+  adjusted_revenue numeric(14, 2) NOT NULL DEFAULT 0,
+  cancelled_count  integer        NOT NULL DEFAULT 0,
+  updated_at       timestamptz    NOT NULL DEFAULT now(),
+  PRIMARY KEY (storeid, business_day)
+);
+
+CREATE INDEX IF NOT EXISTS bill_daily_rollups_day_idx ON public.bill_daily_rollups (business_day);
+
+-- What each bill currently contributes, so a change can be applied as a delta.
+CREATE TABLE IF NOT EXISTS public.bill_rollup_contributions (
+  bill_id          text           PRIMARY KEY,
+  storeid          text           NOT NULL,
+  business_day     date           NOT NULL,
+  cancelled        boolean        NOT NULL,
+  revenue          numeric(14, 2) NOT NULL,
+  adjusted_revenue numeric(14, 2) NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS replacements_bill_id_idx ON public.replacements (bill_id);
+
+CREATE OR REPLACE FUNCTION public.bill_business_day(bill jsonb)
+RETURNS date
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT left(COALESCE(NULLIF(bill->>'date', ''), NULLIF(bill->>'timestamp', ''), bill->>'created_at'), 10)::date
+$$;
+
+CREATE OR REPLACE FUNCTION public.apply_bill_rollup_delta(
+  p_store text, p_day date, p_count integer, p_revenue numeric, p_adjusted numeric, p_cancelled integer
+) RETURNS void
+LANGUAGE sql
+AS $$
+  INSERT INTO public.bill_daily_rollups AS r
+         (storeid, business_day, bill_count, revenue, adjusted_revenue, cancelled_count, updated_at)
+  VALUES (p_store, p_day, p_count, p_revenue, p_adjusted, p_cancelled, now())
+  ON CONFLICT (storeid, business_day) DO UPDATE
+     SET bill_count = r.bill_count + EXCLUDED.bill_count,
+         revenue = r.revenue + EXCLUDED.revenue,
+         adjusted_revenue = r.adjusted_revenue + EXCLUDED.adjusted_revenue,
+         cancelled_count = r.cancelled_count + EXCLUDED.cancelled_count,
+         updated_at = now();
+$$;
+
+-- SECURITY DEFINER: bills may be written by roles that cannot touch the
+-- rollup tables; the trigger must not make those writes fail.
+CREATE OR REPLACE FUNCTION public.rollup_bill(p_bill_id text)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+SET timezone = 'Asia/Kolkata'
+AS $$
+DECLARE
+  old_c public.bill_rollup_contributions%ROWTYPE;
+  bill  jsonb;
+  new_store text;
+  new_day date;
+  new_cancelled boolean;
+  new_revenue numeric;
+  new_adjusted numeric;
+  repl_count integer;
+  repl_sum numeric;
+BEGIN
+  IF p_bill_id IS NULL THEN
+    RETURN;
+  END IF;
+
+  SELECT * INTO old_c FROM public.bill_rollup_contributions WHERE bill_id = p_bill_id FOR UPDATE;
+  IF FOUND THEN
+    PERFORM public.apply_bill_rollup_delta(
+      old_c.storeid, old_c.business_day,
+      CASE WHEN old_c.cancelled THEN 0 ELSE -1 END,
+      -old_c.revenue, -old_c.adjusted_revenue,
+      CASE WHEN old_c.cancelled THEN -1 ELSE 0 END
+    );
+    DELETE FROM public.bill_rollup_contributions WHERE bill_id = p_bill_id;
+  END IF;
+
+  SELECT to_jsonb(b) INTO bill FROM public.bills b WHERE b.id = p_bill_id;
+  IF bill IS NULL THEN
+    RETURN;  -- deleted: its old contribution is gone
+  END IF;
+  new_day := public.bill_business_day(bill);
+  IF new_day IS NULL THEN
+    RETURN;
+  END IF;
+
+  new_store := COALESCE(bill->>'storeid', '');
+  new_cancelled := lower(trim(COALESCE(bill->>'status', ''))) IN ('cancelled', 'canceled', 'void', 'voided');
+  new_revenue := CASE WHEN new_cancelled THEN 0 ELSE COALESCE((bill->>'total')::numeric, 0) END;
+
+  SELECT count(*), COALESCE(sum(r.final_amount), 0) INTO repl_count, repl_sum
+    FROM public.replacements r WHERE r.bill_id = p_bill_id;
+  new_adjusted := CASE
+    WHEN new_cancelled THEN 0
+    WHEN repl_count > 0 THEN GREATEST(0, repl_sum)
+    ELSE new_revenue
+  END;
+
+  INSERT INTO public.bill_rollup_contributions
+         (bill_id, storeid, business_day, cancelled, revenue, adjusted_revenue)
+  VALUES (p_bill_id, new_store, new_day, new_cancelled, new_revenue, new_adjusted);
+  PERFORM public.apply_bill_rollup_delta(
+    new_store, new_day,
+    CASE WHEN new_cancelled THEN 0 ELSE 1 END,
+    new_revenue, new_adjusted,
+    CASE WHEN new_cancelled THEN 1 ELSE 0 END
+  );
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.bills_rollup_trigger()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.rollup_bill(OLD.id::text);
+  END IF;
+  IF TG_OP IN ('INSERT', 'UPDATE') AND (TG_OP = 'INSERT' OR NEW.id IS DISTINCT FROM OLD.id) THEN
+    PERFORM public.rollup_bill(NEW.id::text);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.replacements_rollup_trigger()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.rollup_bill(OLD.bill_id::text);
+  END IF;
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.bill_id IS DISTINCT FROM OLD.bill_id) THEN
+    PERFORM public.rollup_bill(NEW.bill_id::text);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS bills_daily_rollup ON public.bills;
+CREATE TRIGGER bills_daily_rollup
+  AFTER INSERT OR UPDATE OR DELETE ON public.bills
+  FOR EACH ROW EXECUTE FUNCTION public.bills_rollup_trigger();
+
+DROP TRIGGER IF EXISTS replacements_daily_rollup ON public.replacements;
+CREATE TRIGGER replacements_daily_rollup
+  AFTER INSERT OR UPDATE OR DELETE ON public.replacements
+  FOR EACH ROW EXECUTE FUNCTION public.replacements_rollup_trigger();
+
+-- Recompute everything from bill history (after a bulk import, or if the
+-- triggers were disabled for a while).
+CREATE OR REPLACE FUNCTION public.rebuild_bill_daily_rollups()
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+SET timezone = 'Asia/Kolkata'
+AS $$
+DECLARE
+  n integer;
+BEGIN
+  LOCK TABLE public.bill_rollup_contributions IN EXCLUSIVE MODE;
+  DELETE FROM public.bill_rollup_contributions;
+  DELETE FROM public.bill_daily_rollups;
+
+  WITH repl AS (
+    SELECT bill_id, sum(final_amount) AS amount FROM public.replacements GROUP BY bill_id
+  ),
+  b AS (
+    SELECT x.id::text AS bill_id,
+           COALESCE(x.storeid::text, '') AS storeid,
+           public.bill_business_day(to_jsonb(x)) AS business_day,
+           lower(trim(COALESCE(x.status::text, ''))) IN ('cancelled', 'canceled', 'void', 'voided') AS cancelled,
+           COALESCE(x.total::numeric, 0) AS total,
+           repl.amount AS repl_amount
+      FROM public.bills x
+      LEFT JOIN repl ON repl.bill_id = x.id
+  )
+  INSERT INTO public.bill_rollup_contributions (bill_id, storeid, business_day, cancelled, revenue, adjusted_revenue)
+  SELECT bill_id, storeid, business_day, cancelled,
+         CASE WHEN cancelled THEN 0 ELSE total END,
+         CASE WHEN cancelled THEN 0
+              WHEN repl_amount IS NOT NULL THEN GREATEST(0, repl_amount)
+              ELSE total END
+    FROM b
+   WHERE business_day IS NOT NULL;
+  GET DIAGNOSTICS n = ROW_COUNT;
+
+  INSERT INTO public.bill_daily_rollups (storeid, business_day, bill_count, revenue, adjusted_revenue, cancelled_count)
+  SELECT storeid, business_day,
+         count(*) FILTER (WHERE NOT cancelled),
+         sum(revenue), sum(adjusted_revenue),
+         count(*) FILTER (WHERE cancelled)
+    FROM public.bill_rollup_contributions
+   GROUP BY storeid, business_day;
+
+  RETURN n;
+END;
+$$;
+
+-- The summary tiles: totals over the requested days, plus `today`'s share.
+CREATE OR REPLACE FUNCTION public.bill_sales_summary(
+  from_day date DEFAULT NULL, to_day date DEFAULT NULL, store text DEFAULT NULL, today date DEFAULT NULL
+) RETURNS jsonb
+LANGUAGE sql
+STABLE
+SET timezone = 'Asia/Kolkata'
+AS $$
+  SELECT jsonb_build_object(
+    'totalCount', COALESCE(sum(bill_count), 0),
+    'totalRevenue', COALESCE(sum(adjusted_revenue), 0),
+    'cancelledCount', COALESCE(sum(cancelled_count), 0),
+    'todayCount', COALESCE(sum(bill_count) FILTER (WHERE business_day = COALESCE(today, current_date)), 0),
+    'todayRevenue', COALESCE(sum(adjusted_revenue) FILTER (WHERE business_day = COALESCE(today, current_date)), 0),
+    'days', count(DISTINCT business_day)
+  )
+  FROM public.bill_daily_rollups
+  WHERE (from_day IS NULL OR business_day >= from_day)
+    AND (to_day IS NULL OR business_day <= to_day)
+    AND (store IS NULL OR storeid = store)
+$$;
+
+REVOKE ALL ON FUNCTION public.rollup_bill(text) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.bill_sales_summary(date, date, text, date) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.bill_sales_summary(date, date, text, date) TO service_role;
+REVOKE ALL ON FUNCTION public.rebuild_bill_daily_rollups() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.rebuild_bill_daily_rollups() TO service_role;
+GRANT SELECT ON public.bill_daily_rollups TO service_role;
+
+SELECT public.rebuild_bill_daily_rollups();
+
+COMMIT;
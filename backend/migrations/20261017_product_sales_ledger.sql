@@ -0,0 +1,328 @@
+-- Net sold quantity per product.
+--   product_sales_ledger(product_id) holds sold_qty = quantity on billitems
+--   of completed/paid bills, minus approved returns, minus replaced items
+--   (the replaced product went back to inventory). The products page shows
+--   it as soldStock and adds it to stock for lifetimeStock.
+--
+-- The backend used to rebuild that map by walking bills, billitems, returns
+-- and replacements. It now reads this table, one row per product.
+--
+-- Maintenance is incremental, like bill_daily_rollups: triggers on bills,
+-- billitems and replacements call ledger_bill(bill_id), triggers on returns
+-- call ledger_return(return_id). Each recomputes that one source's per-product
+-- quantities, takes the difference from what it last recorded
+-- (product_sales_contributions) and applies it to the ledger. So checkout,
+-- cancel, revise, return approval and replacements are all covered, whoever
+-- writes them.
+--
+-- rebuild_product_sales_ledger() recomputes everything from history and
+-- runs once at the end of this migration. verify_product_sales_ledger()
+-- compares the ledger with a fresh recomputation, rebuilds it if they differ
+-- and returns the number of products that were off; the backend's sync
+-- leader calls it periodically.
+--
+-- Shared Supabase: run this ONCE. Safe to re-run. Until it is applied the
+-- backend keeps computing the map itself.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.product_sales_ledger (
+  product_id text        PRIMARY KEY,
+  sold_qty   integer     NOT NULL DEFAULT 0,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- What each bill ('bill', bill id) or return ('return', return id) currently
+-- contributes per product, so a change can be applied as a delta.
+CREATE TABLE IF NOT EXISTS public.product_sales_contributions (
+  source     text    NOT NULL,
+  source_id  text    NOT NULL,
+  product_id text    NOT NULL,
+  qty        integer NOT NULL,
+  PRIMARY KEY (source, source_id, product_id)
+);
+
+CREATE INDEX IF NOT EXISTS billitems_billid_idx ON public.billitems (billid);
+CREATE INDEX IF NOT EXISTS replacements_bill_id_idx ON public.replacements (bill_id);
+
+-- Per-product quantities a bill counts for: its items while the bill is
+-- completed/paid (or has no status), minus its replacements.
+CREATE OR REPLACE FUNCTION public.bill_sales_quantities(p_bill_id text)
+RETURNS TABLE (product_id text, qty integer)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT pid, sum(q)::integer
+    FROM (
+      SELECT i.productid::text AS pid, COALESCE(i.quantity, 0) AS q
+        FROM public.billitems i
+        LEFT JOIN public.bills b ON b.id = i.billid
+       WHERE i.billid = p_bill_id
+         AND i.productid IS NOT NULL
+         AND lower(trim(COALESCE(b.status::text, ''))) IN ('', 'completed', 'paid')
+      UNION ALL
+      SELECT r.replaced_product_id::text, -r.quantity
+        FROM public.replacements r
+       WHERE r.bill_id = p_bill_id AND r.quantity > 0
+    ) q
+   GROUP BY pid
+  HAVING sum(q) <> 0
+$$;
+
+CREATE OR REPLACE FUNCTION public.return_sales_quantities(p_return_id text)
+RETURNS TABLE (product_id text, qty integer)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT r.product_id::text, -r.return_quantity
+    FROM public.returns r
+   WHERE r.return_id = p_return_id
+     AND r.product_id IS NOT NULL
+     AND COALESCE(r.return_quantity, 0) > 0
+     AND lower(trim(COALESCE(r.status::text, ''))) IN ('', 'approved')
+$$;
+
+-- Replace the recorded contribution of one source with `fresh`.
+CREATE OR REPLACE FUNCTION public.apply_sales_contribution(p_source text, p_source_id text, fresh jsonb)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  INSERT INTO public.product_sales_ledger AS l (product_id, sold_qty, updated_at)
+  SELECT product_id, sum(qty), now()
+    FROM (
+      SELECT c.product_id, -c.qty AS qty
+        FROM public.product_sales_contributions c
+       WHERE c.source = p_source AND c.source_id = p_source_id
+      UNION ALL
+      SELECT e->>'product_id', (e->>'qty')::integer
+        FROM jsonb_array_elements(fresh) AS e
+    ) d
+   GROUP BY product_id
+  HAVING sum(qty) <> 0
+  ON CONFLICT (product_id) DO UPDATE
+     SET sold_qty = l.sold_qty + EXCLUDED.sold_qty,
+         updated_at = now();
+
+  DELETE FROM public.product_sales_contributions
+   WHERE source = p_source AND source_id = p_source_id;
+  INSERT INTO public.product_sales_contributions (source, source_id, product_id, qty)
+  SELECT p_source, p_source_id, e->>'product_id', (e->>'qty')::integer
+    FROM jsonb_array_elements(fresh) AS e;
+END;
+$$;
+
+-- SECURITY DEFINER: bills and returns may be written by roles that cannot
+-- touch the ledger tables; the triggers must not make those writes fail.
+CREATE OR REPLACE FUNCTION public.ledger_bill(p_bill_id text)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  IF p_bill_id IS NULL THEN
+    RETURN;
+  END IF;
+  PERFORM pg_advisory_xact_lock(hashtext('ledger:bill:' || p_bill_id));
+  PERFORM public.apply_sales_contribution(
+    'bill', p_bill_id,
+    COALESCE((SELECT jsonb_agg(jsonb_build_object('product_id', product_id, 'qty', qty))
+                FROM public.bill_sales_quantities(p_bill_id)), '[]'::jsonb)
+  );
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.ledger_return(p_return_id text)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+  IF p_return_id IS NULL THEN
+    RETURN;
+  END IF;
+  PERFORM pg_advisory_xact_lock(hashtext('ledger:return:' || p_return_id));
+  PERFORM public.apply_sales_contribution(
+    'return', p_return_id,
+    COALESCE((SELECT jsonb_agg(jsonb_build_object('product_id', product_id, 'qty', qty))
+                FROM public.return_sales_quantities(p_return_id)), '[]'::jsonb)
+  );
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.bills_ledger_trigger()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' AND NEW.id IS NOT DISTINCT FROM OLD.id
+     AND NEW.status IS NOT DISTINCT FROM OLD.status THEN
+    RETURN NULL;  -- only the status decides whether the items count
+  END IF;
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.ledger_bill(OLD.id::text);
+  END IF;
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.id IS DISTINCT FROM OLD.id) THEN
+    PERFORM public.ledger_bill(NEW.id::text);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.billitems_ledger_trigger()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.ledger_bill(OLD.billid::text);
+  END IF;
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.billid IS DISTINCT FROM OLD.billid) THEN
+    PERFORM public.ledger_bill(NEW.billid::text);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.replacements_ledger_trigger()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.ledger_bill(OLD.bill_id::text);
+  END IF;
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.bill_id IS DISTINCT FROM OLD.bill_id) THEN
+    PERFORM public.ledger_bill(NEW.bill_id::text);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION public.returns_ledger_trigger()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM public.ledger_return(OLD.return_id::text);
+  END IF;
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.return_id IS DISTINCT FROM OLD.return_id) THEN
+    PERFORM public.ledger_return(NEW.return_id::text);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS bills_sales_ledger ON public.bills;
+CREATE TRIGGER bills_sales_ledger
+  AFTER INSERT OR UPDATE OR DELETE ON public.bills
+  FOR EACH ROW EXECUTE FUNCTION public.bills_ledger_trigger();
+
+DROP TRIGGER IF EXISTS billitems_sales_ledger ON public.billitems;
+CREATE TRIGGER billitems_sales_ledger
+  AFTER INSERT OR UPDATE OR DELETE ON public.billitems
+  FOR EACH ROW EXECUTE FUNCTION public.billitems_ledger_trigger();
+
+DROP TRIGGER IF EXISTS replacements_sales_ledger ON public.replacements;
+CREATE TRIGGER replacements_sales_ledger
+  AFTER INSERT OR UPDATE OR DELETE ON public.replacements
+  FOR EACH ROW EXECUTE FUNCTION public.replacements_ledger_trigger();
+
+DROP TRIGGER IF EXISTS returns_sales_ledger ON public.returns;
+CREATE TRIGGER returns_sales_ledger
+  AFTER INSERT OR UPDATE OR DELETE ON public.returns
+  FOR EACH ROW EXECUTE FUNCTION public.returns_ledger_trigger();
+
+-- Every source's per-product quantity, computed set-based from history.
+CREATE OR REPLACE FUNCTION public.expected_sales_contributions()
+RETURNS TABLE (source text, source_id text, product_id text, qty integer)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT 'bill', bill_id, pid, sum(q)::integer
+    FROM (
+      SELECT i.billid::text AS bill_id, i.productid::text AS pid, COALESCE(i.quantity, 0) AS q
+        FROM public.billitems i
+        LEFT JOIN public.bills b ON b.id = i.billid
+       WHERE i.billid IS NOT NULL AND i.productid IS NOT NULL
+         AND lower(trim(COALESCE(b.status::text, ''))) IN ('', 'completed', 'paid')
+      UNION ALL
+      SELECT r.bill_id::text, r.replaced_product_id::text, -r.quantity
+        FROM public.replacements r
+       WHERE r.quantity > 0
+    ) x
+   GROUP BY bill_id, pid
+  HAVING sum(q) <> 0
+  UNION ALL
+  SELECT 'return', r.return_id::text, r.product_id::text, -sum(r.return_quantity)::integer
+    FROM public.returns r
+   WHERE r.product_id IS NOT NULL
+     AND COALESCE(r.return_quantity, 0) > 0
+     AND lower(trim(COALESCE(r.status::text, ''))) IN ('', 'approved')
+   GROUP BY r.return_id, r.product_id
+$$;
+
+CREATE OR REPLACE FUNCTION public.rebuild_product_sales_ledger()
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  n integer;
+BEGIN
+  LOCK TABLE public.product_sales_contributions IN EXCLUSIVE MODE;
+  DELETE FROM public.product_sales_contributions;
+  DELETE FROM public.product_sales_ledger;
+
+  INSERT INTO public.product_sales_contributions (source, source_id, product_id, qty)
+  SELECT source, source_id, product_id, qty FROM public.expected_sales_contributions();
+
+  INSERT INTO public.product_sales_ledger (product_id, sold_qty)
+  SELECT product_id, sum(qty) FROM public.product_sales_contributions GROUP BY product_id;
+  GET DIAGNOSTICS n = ROW_COUNT;
+  RETURN n;
+END;
+$$;
+
+-- Products whose ledger value differs from a fresh recomputation; when there
+-- are any the ledger is rebuilt. Returns how many were off.
+CREATE OR REPLACE FUNCTION public.verify_product_sales_ledger()
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+  drift integer;
+BEGIN
+  SELECT count(*) INTO drift
+    FROM (SELECT product_id, sum(qty) AS qty
+            FROM public.expected_sales_contributions()
+           GROUP BY product_id
+          HAVING sum(qty) <> 0) e
+    FULL JOIN (SELECT product_id, sold_qty AS qty FROM public.product_sales_ledger WHERE sold_qty <> 0) l
+      USING (product_id)
+   WHERE e.qty IS DISTINCT FROM l.qty;
+  IF drift > 0 THEN
+    PERFORM public.rebuild_product_sales_ledger();
+  END IF;
+  RETURN drift;
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.ledger_bill(text) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.ledger_return(text) FROM PUBLIC, anon, authenticated;
+REVOKE ALL ON FUNCTION public.rebuild_product_sales_ledger() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.rebuild_product_sales_ledger() TO service_role;
+REVOKE ALL ON FUNCTION public.verify_product_sales_ledger() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.verify_product_sales_ledger() TO service_role;
+REVOKE ALL ON TABLE public.product_sales_contributions FROM anon, authenticated;
+GRANT SELECT ON public.product_sales_ledger TO service_role;
+
+SELECT public.rebuild_product_sales_ledger();
+
+COMMIT;
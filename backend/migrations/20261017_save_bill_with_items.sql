@@ -0,0 +1,83 @@
+-- Write a bill header and its items in one call.
+--   save_bill_with_items(bill, items) upserts the bill (only the columns
+--   present in `bill`; the others keep their defaults or current values),
+--   replaces its billitems with `items`, and returns the new item ids.
+--
+-- Checkout used to cost four round trips (bill upsert, billitems delete,
+-- max(billitems.id) lookup, billitems insert) and numbered items on the
+-- client, so two terminals billing at once could pick the same ids. Item ids
+-- now come from the column's identity/sequence, and the whole write is one
+-- transaction: a bill is never left without its items.
+--
+-- Shared Supabase: run this ONCE. Safe to re-run. Until it is applied the
+-- backend writes the header and items with separate calls (still without
+-- client-side ids).
+
+BEGIN;
+
+-- 1) billitems.id must be database-assigned. Keep an existing identity or
+--    serial sequence; create one if the column has neither. Either way move
+--    it past ids that were assigned client-side.
+DO $$
+DECLARE
+  seq text;
+BEGIN
+  seq := pg_get_serial_sequence('public.billitems', 'id');
+  IF seq IS NULL THEN
+    CREATE SEQUENCE IF NOT EXISTS public.billitems_id_seq OWNED BY public.billitems.id;
+    ALTER TABLE public.billitems ALTER COLUMN id SET DEFAULT nextval('public.billitems_id_seq');
+    seq := 'public.billitems_id_seq';
+  END IF;
+  PERFORM setval(seq, GREATEST(COALESCE((SELECT max(id) FROM public.billitems), 0), 1));
+END $$;
+
+-- 2) Header upsert + item replacement in one transaction.
+CREATE OR REPLACE FUNCTION public.save_bill_with_items(bill jsonb, items jsonb DEFAULT '[]'::jsonb)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  v_bill_id text := bill->>'id';
+  cols     text;
+  vals     text;
+  sets     text;
+  item_ids jsonb;
+BEGIN
+  IF v_bill_id IS NULL THEN
+    RAISE EXCEPTION 'save_bill_with_items: bill.id is required';
+  END IF;
+
+  SELECT string_agg(format('%I', c.column_name), ', '),
+         string_agg(format('r.%I', c.column_name), ', '),
+         string_agg(format('%I = EXCLUDED.%I', c.column_name, c.column_name), ', ')
+           FILTER (WHERE c.column_name <> 'id')
+    INTO cols, vals, sets
+    FROM information_schema.columns c
+   WHERE c.table_schema = 'public'
+     AND c.table_name = 'bills'
+     AND bill ? c.column_name;
+
+  EXECUTE format(
+    'INSERT INTO public.bills (%s) SELECT %s FROM jsonb_populate_record(NULL::public.bills, $1) r '
+    'ON CONFLICT (id) DO %s',
+    cols, vals, CASE WHEN sets IS NULL THEN 'NOTHING' ELSE 'UPDATE SET ' || sets END
+  ) USING bill;
+
+  DELETE FROM public.billitems WHERE billid = v_bill_id;
+
+  WITH inserted AS (
+    INSERT INTO public.billitems (billid, productid, quantity, price, total)
+    SELECT v_bill_id, r.productid, r.quantity, r.price, r.total
+      FROM jsonb_populate_recordset(NULL::public.billitems, COALESCE(items, '[]'::jsonb)) r
+    RETURNING id
+  )
+  SELECT COALESCE(jsonb_agg(id), '[]'::jsonb) INTO item_ids FROM inserted;
+
+  RETURN jsonb_build_object('bill_id', v_bill_id, 'item_ids', item_ids);
+END;
+$$;
+
+REVOKE ALL ON FUNCTION public.save_bill_with_items(jsonb, jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.save_bill_with_items(jsonb, jsonb) TO service_role;
+
+COMMIT;
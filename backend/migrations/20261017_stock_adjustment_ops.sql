@@ -0,0 +1,76 @@
+-- Idempotent stock adjustments.
+--   apply_stock_adjustments(items, op_id) behaves as before, but when op_id
+--   is given it is recorded in stock_adjustment_ops and a repeat call with the
+--   same op_id changes nothing and returns the current stock instead.
+--
+-- Bills are now written to Supabase by a background outbox that retries
+-- until it succeeds (utils/bill_outbox.py). A retry after a lost response
+-- must not sell the same items twice, so each outbox entry carries an op_id.
+-- Calls without op_id (audits, return orders, damage repairs) are unchanged.
+--
+-- Replaces the one-argument function from 20261017_apply_stock_adjustments.sql
+-- (two overloads would make PostgREST calls ambiguous). Apply after it.
+-- Shared Supabase: run this ONCE. Safe to re-run.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.stock_adjustment_ops (
+  op_id      text PRIMARY KEY,
+  applied_at timestamptz NOT NULL DEFAULT now()
+);
+
+DROP FUNCTION IF EXISTS public.apply_stock_adjustments(jsonb);
+
+CREATE OR REPLACE FUNCTION public.apply_stock_adjustments(items jsonb, op_id text DEFAULT NULL)
+RETURNS TABLE (product_id character varying, stock integer)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF op_id IS NOT NULL THEN
+    INSERT INTO public.stock_adjustment_ops (op_id) VALUES (apply_stock_adjustments.op_id)
+    ON CONFLICT DO NOTHING;
+    IF NOT FOUND THEN
+      -- Already applied: report the stock as it is now.
+      RETURN QUERY
+        SELECT p.id, p.stock::integer
+          FROM public.products p
+         WHERE p.id IN (SELECT DISTINCT e->>'product_id'
+                          FROM jsonb_array_elements(COALESCE(items, '[]'::jsonb)) AS e);
+      RETURN;
+    END IF;
+  END IF;
+
+  RETURN QUERY
+  WITH wanted AS (
+    SELECT e->>'product_id' AS pid,
+           SUM(COALESCE((e->>'qty')::integer, 0)) AS qty
+    FROM jsonb_array_elements(COALESCE(items, '[]'::jsonb)) AS e
+    WHERE e->>'product_id' IS NOT NULL
+    GROUP BY 1
+  ),
+  locked AS (
+    SELECT p.id
+    FROM public.products p
+    JOIN wanted w ON w.pid = p.id
+    ORDER BY p.id
+    FOR UPDATE OF p
+  )
+  UPDATE public.products p
+     SET stock = GREATEST(0, COALESCE(p.stock, 0) - w.qty),
+         updatedat = CURRENT_TIMESTAMP
+    FROM wanted w
+   WHERE p.id = w.pid
+     AND p.id IN (SELECT id FROM locked)
+  RETURNING p.id, p.stock::integer;
+END;
+$$;
+
+-- Applied op ids only need to outlive the outbox's retries.
+CREATE INDEX IF NOT EXISTS stock_adjustment_ops_applied_at_idx
+  ON public.stock_adjustment_ops (applied_at);
+
+REVOKE ALL ON FUNCTION public.apply_stock_adjustments(jsonb, text) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION public.apply_stock_adjustments(jsonb, text) TO service_role;
+REVOKE ALL ON TABLE public.stock_adjustment_ops FROM anon, authenticated;
+
+COMMIT;
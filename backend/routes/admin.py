@@ -156,6 +156,40 @@ def flush_data():
         return jsonify({"error": str(e)}), 500
 
 
+def _local_storage_stats():
+    """Lock contention, cache and group-commit counters of the local JSON layer."""
+    from utils.entity_store import entity_store
+    from utils.file_write_lock import lock_stats
+    from utils.group_commit import group_committer
+
+    return {
+        'locks': lock_stats(),
+        'cache': entity_store.stats(),
+        'group_commit': group_committer.stats(),
+    }
+
+
+def _single_flight_stats():
+    """Hit/miss/coalesced counters of the single-flight read caches."""
+    from utils.single_flight import stats
+
+    return stats()
+
+
+def _bill_outbox_stats():
+    """Depth and lag of the bill cloud write-behind outbox."""
+    from utils.bill_outbox import bill_outbox
+
+    return bill_outbox.stats()
+
+
+def _allocation_index_stats():
+    """Size and maintenance counters of the storeinventory allocation index."""
+    from utils.allocation_index import allocation_index
+
+    return allocation_index.stats()
+
+
 @admin_bp.route('/system/info', methods=['GET'])
 def get_system_info():
     """Get system information"""
@@ -168,7 +202,11 @@ def get_system_info():
             'platform': sys.platform,
             'base_dir': Config.BASE_DIR,
             'json_dir': Config.JSON_DIR,
-            'logs_dir': Config.LOGS_DIR
+            'logs_dir': Config.LOGS_DIR,
+            'local_storage': _local_storage_stats(),
+            'request_coalescing': _single_flight_stats(),
+            'bill_outbox': _bill_outbox_stats(),
+            'allocation_index': _allocation_index_stats(),
         }
         
         return jsonify(info), 200
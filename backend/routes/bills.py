@@ -5,18 +5,16 @@ Flask blueprint for all bill-related API endpoints
 
 from flask import Blueprint, jsonify, request
 import logging
-import threading
-import time
 from services import bills_service
 import utils.supabase_circuit as supabase_circuit
+from utils.single_flight import SingleFlight, invalidate as invalidate_cached
+from utils.bill_outbox import bill_outbox
 
 logger = logging.getLogger(__name__)
 
-_BILLS_CACHE_TTL_SECONDS = 30
-_BILLS_CACHE_STALE_SECONDS = 180
-_BILLS_CACHE_LOCK = threading.Lock()
-_BILLS_CACHE: dict[str, dict] = {}
-_BILLS_INFLIGHT: dict[str, threading.Event] = {}
+# Concurrent identical GETs share one load; entries are served fresh for
+# 30s and stale (refreshed in the background) for up to 180s.
+_BILLS_FLIGHT = SingleFlight("bills", ttl=30, stale=180, wait=6.0, groups=("bills",))
 
 
 def _bills_cache_key(params: dict) -> str:
@@ -24,32 +22,9 @@ def _bills_cache_key(params: dict) -> str:
     return "&".join([f"{k}={v}" for k, v in items]) or "default"
 
 
-def _get_bills_cache(key: str, allow_stale: bool = False):
-    now = time.time()
-    with _BILLS_CACHE_LOCK:
-        entry = _BILLS_CACHE.get(key)
-    if not entry:
-        return None
-    if now <= float(entry.get("expires_at") or 0):
-        return entry.get("data")
-    if allow_stale and now <= float(entry.get("stale_until") or 0):
-        return entry.get("data")
-    return None
-
-
-def _set_bills_cache(key: str, data):
-    now = time.time()
-    with _BILLS_CACHE_LOCK:
-        _BILLS_CACHE[key] = {
-            "data": data,
-            "expires_at": now + _BILLS_CACHE_TTL_SECONDS,
-            "stale_until": now + _BILLS_CACHE_STALE_SECONDS,
-        }
-
-
 def _clear_bills_cache():
-    with _BILLS_CACHE_LOCK:
-        _BILLS_CACHE.clear()
+    invalidate_cached("bills")
+
 
 # Create Blueprint
 bills_bp = Blueprint("bills", __name__, url_prefix="/api")
@@ -150,6 +125,38 @@ def create_bill():
         logger.error("Error creating bill", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+
+@bills_bp.route("/bills/outbox", methods=["GET"])
+@bills_bp.route("/bills/outbox/", methods=["GET"])
+def get_bill_outbox_status():
+    """Depth and lag of bills waiting to be written to Supabase"""
+    try:
+        return jsonify(bill_outbox.stats()), 200
+    except Exception as e:
+        logger.error("Error reading bill outbox status", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@bills_bp.route("/bills/invoice-ids/reserve", methods=["POST"])
+@bills_bp.route("/bills/invoice-ids/reserve/", methods=["POST"])
+def reserve_invoice_ids():
+    """Reserve a block of today's invoice ids for a terminal going offline"""
+    try:
+        payload = request.json or {}
+        store_id = payload.get("storeId") or payload.get("storeid") or payload.get("store_id")
+        try:
+            count = int(payload.get("count") or 0)
+        except (TypeError, ValueError):
+            return jsonify({"error": "count must be an integer"}), 400
+        block, message, status_code = bills_service.reserve_invoice_ids(store_id, count)
+        if block is None:
+            return jsonify({"error": message}), status_code
+        return jsonify({"message": message, **block}), status_code
+    except Exception as e:
+        logger.error("Error reserving invoice ids", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
 @bills_bp.route("/bills/summary", methods=["GET"])
 @bills_bp.route("/bills/summary/", methods=["GET"])
 def get_bills_summary():
@@ -157,72 +164,34 @@ def get_bills_summary():
     Server-side stats for the billing dashboard tiles. Mobile clients would
     otherwise have to download every bill just to sum 4 numbers.
     Mirrors the frontend tile math: replacement bills contribute their
-    recomputed swap-diff amount; "today" is the server's local calendar day
-    (container runs in the business timezone).
+    recomputed swap-diff amount; "today" is the calendar day in
+    Config.BUSINESS_TIMEZONE. Bills still in the outbox are included.
+    Read from the daily rollups (see bills_service.get_bills_summary).
     Returns {totalCount, totalRevenue, todayCount, todayRevenue}.
     """
-    from datetime import datetime
-
     try:
         from_date = request.args.get("from")
         to_date = request.args.get("to")
         store_id = request.args.get("storeId") or request.args.get("store_id")
-
-        result = bills_service.get_bills_paginated(
-            page=1,
-            page_size=1_000_000,
-            from_date=from_date,
-            to_date=to_date,
-            store_id=store_id,
-            include_details=False,
-        )
-        bills = (result or {}).get("data") or []
-
-        today_key = datetime.now().strftime("%Y-%m-%d")
-        active_total_count = 0
-        total_revenue = 0.0
-        today_revenue = 0.0
-        today_count = 0
-        for bill in bills:
-            if str(bill.get("status") or "").strip().lower() in {"cancelled", "canceled", "void", "voided"}:
-                continue
-            active_total_count += 1
-            is_repl = bool(bill.get("isReplacement") or bill.get("is_replacement"))
-            repl_raw = bill.get("replacementFinalAmount", bill.get("replacement_final_amount"))
-            try:
-                repl_amt = float(repl_raw)
-            except (TypeError, ValueError):
-                repl_amt = None
-            if is_repl and repl_amt is not None:
-                amount = max(0.0, repl_amt)
-            else:
-                try:
-                    amount = float(bill.get("total") or 0)
-                except (TypeError, ValueError):
-                    amount = 0.0
-            total_revenue += amount
-            raw_date = (
-                bill.get("date")
-                or bill.get("timestamp")
-                or bill.get("created_at")
-                or bill.get("createdAt")
-                or ""
-            )
-            if str(raw_date)[:10] == today_key:
-                today_count += 1
-                today_revenue += amount
-
-        return jsonify({
-            "totalCount": active_total_count,
-            "totalRevenue": total_revenue,
-            "todayCount": today_count,
-            "todayRevenue": today_revenue,
-        }), 200
+        return jsonify(bills_service.get_bills_summary(from_date, to_date, store_id)), 200
     except Exception as e:
         logger.error(f"Error computing bills summary: {e}", exc_info=True)
         return jsonify({"error": "Failed to compute bills summary"}), 500
 
 
+@bills_bp.route("/bills/summary/rebuild", methods=["POST"])
+def rebuild_bills_summary():
+    """Recompute the daily sales rollups from bill history"""
+    try:
+        result, message, status_code = bills_service.rebuild_bill_rollups()
+        if result is None:
+            return jsonify({"error": message}), status_code
+        return jsonify({"message": message, **result}), status_code
+    except Exception as e:
+        logger.error("Error rebuilding bill rollups", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
 @bills_bp.route("/bills", methods=["GET"])
 @bills_bp.route("/bills/", methods=["GET"])
 def get_bills():
@@ -233,9 +202,6 @@ def get_bills():
     2. Merged bills (local + supabase)
     3. Empty list (never break UI)
     """
-    global _BILLS_INFLIGHT
-    event_to_wait = None
-    is_leader = False
     cache_key = "default"          # ← safe sentinel; overwritten before first use
     try:
         page = request.args.get("page", type=int)
@@ -246,7 +212,7 @@ def get_bills():
         details_flag = request.args.get("details")
         paginate_flag = request.args.get("paginate")
 
-        wants_paginated = (
+        wants_paginated = bool(
             paginate_flag == "1"
             or page is not None
             or page_size is not None
@@ -273,80 +239,14 @@ def get_bills():
             }
         )
 
-        cached = _get_bills_cache(cache_key, allow_stale=False)
-        if cached is not None:
-            return jsonify(cached), 200
-
-        with _BILLS_CACHE_LOCK:
-            now = time.time()
-            entry = _BILLS_CACHE.get(cache_key)
-            if entry and now <= float(entry.get("expires_at") or 0):
-                return jsonify(entry.get("data") or []), 200
-
-            inflight = _BILLS_INFLIGHT.get(cache_key)
-            if inflight is None:
-                _BILLS_INFLIGHT[cache_key] = threading.Event()
-                is_leader = True
-            else:
-                event_to_wait = inflight
-
-        if not is_leader and event_to_wait is not None:
-            event_to_wait.wait(timeout=6.0)
-            cached_after_wait = _get_bills_cache(cache_key, allow_stale=True)
-            if cached_after_wait is not None:
-                return jsonify(cached_after_wait), 200
-            return jsonify([]), 200
-
-        # Leader path
-        if supabase_circuit.is_offline():
-            cached_stale = _get_bills_cache(cache_key, allow_stale=True)
-            if cached_stale is not None:
-                return jsonify(cached_stale), 200
-            local = bills_service.get_local_bills()
-            response_payload = local
-            if wants_paginated:
-                start = max(0, (page - 1) * page_size)
-                end = start + page_size
-                response_payload = {
-                    "data": local[start:end],
-                    "page": page,
-                    "pageSize": page_size,
-                    "hasMore": end < len(local),
-                    "total": len(local),
-                }
-            _set_bills_cache(cache_key, response_payload)
-            return jsonify(response_payload), 200
-
-        if wants_paginated or details_flag == "0":
-            result = bills_service.get_bills_paginated(
-                page=page,
-                page_size=page_size,
-                from_date=from_date,
-                to_date=to_date,
-                store_id=store_id,
-                include_details=(details_flag != "0"),
-            )
-            response_payload = result
-            _set_bills_cache(cache_key, response_payload)
-            return jsonify(response_payload), 200
-
-        logger.info("Fetching bills with details from Supabase")
-        bills = bills_service.get_supabase_bills_with_details()
-
-        if bills:
-            logger.info(f"Returning {len(bills)} bills with details")
-            _set_bills_cache(cache_key, bills)
-            return jsonify(bills), 200
-
-        logger.warning("No detailed bills found, trying merged bills")
-        bills, status_code = bills_service.get_merged_bills()
-
-        if status_code == 200:
-            logger.info(f"Returning {len(bills)} merged bills")
-            _set_bills_cache(cache_key, bills)
+        bills = _BILLS_FLIGHT.get(
+            cache_key,
+            lambda: _load_bills(wants_paginated, page, page_size, from_date, to_date, store_id, details_flag),
+        )
+        if bills is not None:
             return jsonify(bills), 200
 
-        cached_stale = _get_bills_cache(cache_key, allow_stale=True)
+        cached_stale = _BILLS_FLIGHT.peek(cache_key, allow_stale=True)
         if cached_stale is not None:
             return jsonify(cached_stale), 200
 
@@ -354,17 +254,54 @@ def get_bills():
         return jsonify([]), 200
 
     except Exception:
-        cached_stale = _get_bills_cache(cache_key, allow_stale=True)
+        cached_stale = _BILLS_FLIGHT.peek(cache_key, allow_stale=True)
         if cached_stale is not None:
             return jsonify(cached_stale), 200
         logger.error("Error in get_bills", exc_info=True)
         return jsonify([]), 200
-    finally:
-        if is_leader:
-            with _BILLS_CACHE_LOCK:
-                done_event = _BILLS_INFLIGHT.pop(cache_key, None)
-                if done_event is not None:
-                    done_event.set()
+
+
+def _load_bills(wants_paginated, page, page_size, from_date, to_date, store_id, details_flag):
+    """Load one /bills response; None when nothing usable was found (not cached)."""
+    if supabase_circuit.is_offline():
+        if wants_paginated:
+            return bills_service.get_local_bills_paginated(
+                page=page,
+                page_size=page_size,
+                from_date=from_date,
+                to_date=to_date,
+                store_id=store_id,
+            )
+        return bills_service.get_local_bills(
+            store_id=store_id,
+            from_date=from_date,
+            to_date=to_date,
+        )
+
+    if wants_paginated or details_flag == "0":
+        return bills_service.get_bills_paginated(
+            page=page,
+            page_size=page_size,
+            from_date=from_date,
+            to_date=to_date,
+            store_id=store_id,
+            include_details=(details_flag != "0"),
+        )
+
+    logger.info("Fetching bills with details from Supabase")
+    bills = bills_service.get_supabase_bills_with_details()
+
+    if bills:
+        logger.info(f"Returning {len(bills)} bills with details")
+        return bills
+
+    logger.warning("No detailed bills found, trying merged bills")
+    bills, status_code = bills_service.get_merged_bills()
+
+    if status_code == 200:
+        logger.info(f"Returning {len(bills)} merged bills")
+        return bills
+    return None
 
 
 # ======================================================
@@ -6,6 +6,7 @@ from flask import Blueprint, jsonify, request
 import logging
 
 from services import customers_service
+from utils.single_flight import invalidate as invalidate_cached
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +14,14 @@ logger = logging.getLogger(__name__)
 customers_bp = Blueprint('customers', __name__, url_prefix='/api')
 
 
+@customers_bp.after_request
+def _invalidate_after_write(response):
+    """Successful writes drop the coalesced customer reads."""
+    if request.method != 'GET' and response.status_code < 400:
+        invalidate_cached('customers')
+    return response
+
+
 # ============================================
 # LOCAL CUSTOMERS ENDPOINTS
 # ============================================
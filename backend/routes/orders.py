@@ -7,12 +7,22 @@ from flask import Blueprint, jsonify, request
 import logging
 
 from services import orders_service
+from utils.single_flight import invalidate as invalidate_cached
 
 logger = logging.getLogger(__name__)
 
 orders_bp = Blueprint("orders", __name__, url_prefix="/api")
 
 
+@orders_bp.after_request
+def _invalidate_after_write(response):
+    """Successful writes drop the coalesced order and store reads."""
+    if request.method != "GET" and response.status_code < 400:
+        invalidate_cached("transfer_orders")
+        invalidate_cached("stores")
+    return response
+
+
 def _parse_limit(value: str | None) -> int | None:
     if value is None:
         return None
@@ -214,6 +214,73 @@ def delete_product(product_id):
         return jsonify({"error": str(e)}), 500
 
 
+# ============================================
+# SEARCH
+# ============================================
+
+@products_bp.route('/products/search', methods=['GET'])
+def search_products():
+    """Ranked, typo-tolerant product search from the local search index.
+
+    Query params: ?q=text, ?limit=20 (max 100), ?offset=0, ?storeId= (adds storeStock).
+    Response: {data, query, limit, offset, total, hasMore}.
+    """
+    try:
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({"error": "q is required"}), 400
+        try:
+            limit = int(request.args.get('limit', products_service.SEARCH_DEFAULT_LIMIT))
+            offset = int(request.args.get('offset', 0))
+        except (TypeError, ValueError):
+            return jsonify({"error": "limit and offset must be integers"}), 400
+        store_id = request.args.get('storeId') or None
+
+        payload = products_service.search_products(query, limit=limit, offset=offset, store_id=store_id)
+        return jsonify(payload), 200
+    except Exception as e:
+        logger.error(f"Error in search_products: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+# ============================================
+# BARCODE SCANS
+# ============================================
+
+@products_bp.route('/products/by-barcode/<path:code>', methods=['GET'])
+def get_product_by_barcode(code):
+    """Product for one scanned barcode, from the local barcode index"""
+    try:
+        matches = products_service.find_products_by_barcodes([code]).get(code, [])
+        if not matches:
+            return jsonify({"error": "No product with this barcode", "barcode": code}), 404
+        return jsonify({"product": matches[0], "matches": matches}), 200
+    except Exception as e:
+        logger.error(f"Error in get_product_by_barcode: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
+@products_bp.route('/products/by-barcode', methods=['POST'])
+def get_products_by_barcodes():
+    """Products for many scanned barcodes: body {"codes": [...]}"""
+    try:
+        codes = (request.get_json(silent=True) or {}).get("codes")
+        if not isinstance(codes, list) or not codes:
+            return jsonify({"error": "codes must be a non-empty list"}), 400
+        if len(codes) > products_service.MAX_BARCODE_BATCH:
+            return jsonify({"error": f"At most {products_service.MAX_BARCODE_BATCH} codes per request"}), 400
+        codes = [str(c) for c in codes]
+        found = products_service.find_products_by_barcodes(codes)
+        return jsonify({
+            "found": {code: rows[0] for code, rows in found.items() if rows},
+            "matches": {code: rows for code, rows in found.items() if len(rows) > 1},
+            "missing": [code for code, rows in found.items() if not rows],
+        }), 200
+    except Exception as e:
+        logger.error(f"Error in get_products_by_barcodes: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+
 # ============================================
 # PRODUCT AVAILABILITY
 # ============================================
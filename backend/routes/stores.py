@@ -5,18 +5,16 @@ Flask blueprint for all store and inventory-related API endpoints
 
 from flask import Blueprint, jsonify, request
 import logging
-import threading
-import time
 from services import stores_service, orders_service
 import utils.supabase_circuit as supabase_circuit
+from utils.process_coordination import change_counter
+from utils.single_flight import SingleFlight, invalidate as invalidate_cached
 
 logger = logging.getLogger(__name__)
 
-_TRANSFER_ORDERS_CACHE_TTL_SECONDS = 30
-_TRANSFER_ORDERS_CACHE_STALE_SECONDS = 180
-_TRANSFER_ORDERS_CACHE_LOCK = threading.Lock()
-_TRANSFER_ORDERS_CACHE: dict[str, dict] = {}
-_TRANSFER_ORDERS_INFLIGHT: dict[str, threading.Event] = {}
+_TRANSFER_ORDERS_FLIGHT = SingleFlight(
+    "store transfer orders", ttl=30, stale=180, wait=6.0, groups=("transfer_orders",)
+)
 
 
 def _transfer_orders_cache_key(
@@ -29,42 +27,27 @@ def _transfer_orders_cache_key(
     return f"{store_id}:{status or 'all'}:{from_date or '-'}:{to_date or '-'}:{limit or '-'}"
 
 
-def _get_transfer_orders_cache(key: str, allow_stale: bool = False):
-    now = time.time()
-    with _TRANSFER_ORDERS_CACHE_LOCK:
-        entry = _TRANSFER_ORDERS_CACHE.get(key)
-    if not entry:
-        return None
-    if now <= float(entry.get("expires_at") or 0):
-        return entry.get("data")
-    if allow_stale and now <= float(entry.get("stale_until") or 0):
-        return entry.get("data")
-    return None
-
-
-def _set_transfer_orders_cache(key: str, data):
-    now = time.time()
-    with _TRANSFER_ORDERS_CACHE_LOCK:
-        _TRANSFER_ORDERS_CACHE[key] = {
-            "data": data,
-            "expires_at": now + _TRANSFER_ORDERS_CACHE_TTL_SECONDS,
-            "stale_until": now + _TRANSFER_ORDERS_CACHE_STALE_SECONDS,
-        }
-
-
 def _invalidate_transfer_orders_cache(store_id: str | None = None) -> None:
-    with _TRANSFER_ORDERS_CACHE_LOCK:
-        if store_id is None:
-            _TRANSFER_ORDERS_CACHE.clear()
-            return
+    if store_id is None:
+        _TRANSFER_ORDERS_FLIGHT.invalidate()
+    else:
         prefix = f"{store_id}:"
-        keys_to_remove = [key for key in _TRANSFER_ORDERS_CACHE.keys() if key.startswith(prefix)]
-        for key in keys_to_remove:
-            _TRANSFER_ORDERS_CACHE.pop(key, None)
+        _TRANSFER_ORDERS_FLIGHT.invalidate(lambda key: key.startswith(prefix))
+    # Other workers drop their whole cache; the counter is not per store.
+    change_counter.bump("transfer_orders")
+
 
 # Create Blueprint
 stores_bp = Blueprint('stores', __name__, url_prefix='/api')
 
+
+@stores_bp.after_request
+def _invalidate_after_write(response):
+    """Successful writes drop the coalesced store reads."""
+    if request.method != 'GET' and response.status_code < 400:
+        invalidate_cached('stores')
+    return response
+
 # ============================================
 # DIRECT SUPABASE/LOCAL ROUTES (FOR DEBUGGING)
 # ============================================
@@ -396,66 +379,35 @@ def get_store_transfer_orders(store_id):
             limit = min(limit, 1000)
 
     cache_key = _transfer_orders_cache_key(store_id, status, from_date, to_date, limit)
-    wait_event = None
-    is_leader = False
-    try:
-        cached = _get_transfer_orders_cache(cache_key, allow_stale=False)
-        if cached is not None:
-            return jsonify(cached), 200
-
-        with _TRANSFER_ORDERS_CACHE_LOCK:
-            now = time.time()
-            entry = _TRANSFER_ORDERS_CACHE.get(cache_key)
-            if entry and now <= float(entry.get("expires_at") or 0):
-                return jsonify(entry.get("data") or []), 200
-
-            existing = _TRANSFER_ORDERS_INFLIGHT.get(cache_key)
-            if existing is None:
-                _TRANSFER_ORDERS_INFLIGHT[cache_key] = threading.Event()
-                is_leader = True
-            else:
-                wait_event = existing
-
-        if not is_leader and wait_event is not None:
-            wait_event.wait(timeout=6.0)
-            cached_after_wait = _get_transfer_orders_cache(cache_key, allow_stale=True)
-            if cached_after_wait is not None:
-                return jsonify(cached_after_wait), 200
-            return jsonify([]), 200
 
+    def load():
         if supabase_circuit.is_offline():
-            cached_stale = _get_transfer_orders_cache(cache_key, allow_stale=True)
-            if cached_stale is not None:
-                return jsonify(cached_stale), 200
-            return jsonify([]), 200
-
-        orders, status_code = orders_service.get_store_transfer_orders(
+            return None
+        return orders_service.get_store_transfer_orders(
             store_id=store_id,
             status=status,
             from_date=from_date,
             to_date=to_date,
             limit=limit,
         )
-        if status_code == 200:
-            _set_transfer_orders_cache(cache_key, orders)
-            return jsonify(orders), 200
 
-        cached_stale = _get_transfer_orders_cache(cache_key, allow_stale=True)
+    try:
+        result = _TRANSFER_ORDERS_FLIGHT.get(cache_key, load)
+        if result is not None and result[1] == 200:
+            return jsonify(result[0]), 200
+
+        cached_stale = _TRANSFER_ORDERS_FLIGHT.peek(cache_key, allow_stale=True)
         if cached_stale is not None:
-            return jsonify(cached_stale), 200
-        return jsonify({'error': 'Failed to fetch transfer orders'}), status_code
+            return jsonify(cached_stale[0]), 200
+        if result is None:
+            return jsonify([]), 200
+        return jsonify({'error': 'Failed to fetch transfer orders'}), result[1]
     except Exception as e:
-        cached_stale = _get_transfer_orders_cache(cache_key, allow_stale=True)
+        cached_stale = _TRANSFER_ORDERS_FLIGHT.peek(cache_key, allow_stale=True)
         if cached_stale is not None:
-            return jsonify(cached_stale), 200
+            return jsonify(cached_stale[0]), 200
         logger.error(f"Error in get_store_transfer_orders: {e}", exc_info=True)
         return jsonify([]), 200
-    finally:
-        if is_leader:
-            with _TRANSFER_ORDERS_CACHE_LOCK:
-                done_event = _TRANSFER_ORDERS_INFLIGHT.pop(cache_key, None)
-                if done_event is not None:
-                    done_event.set()
 
 
 @stores_bp.route('/transfer-orders/<order_id>', methods=['GET'])
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark: per-row cost of the products transform, old loop
+(convert_snake_to_camel + derived fields) vs utils.product_projection.
+
+    python scripts/bench_product_projection.py [rows]
+"""
+import os
+import sys
+import time
+
+base_dir = os.environ.get('APP_BASE_DIR')
+if not base_dir:
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if base_dir not in sys.path:
+    sys.path.insert(0, base_dir)
+
+from utils.json_utils import convert_snake_to_camel
+from utils.product_projection import project_products
+
+
+def legacy(products, hsn_tax_map):
+    out = []
+    for product in products:
+        converted_product = convert_snake_to_camel(product)
+        if 'hsnCodeId' in converted_product:
+            converted_product['hsnCode'] = converted_product.pop('hsnCodeId')
+        hsn_code_id = converted_product.get("hsnCode")
+        if hsn_code_id is not None and str(hsn_code_id).strip() != "":
+            converted_product["tax"] = hsn_tax_map.get(str(hsn_code_id), 0.0)
+        else:
+            converted_product["tax"] = 0.0
+        if 'sellingPrice' in converted_product and converted_product['sellingPrice']:
+            converted_product['displayPrice'] = converted_product['sellingPrice']
+        elif 'price' in converted_product:
+            converted_product['displayPrice'] = converted_product['price']
+        barcode_str = converted_product.get('barcode')
+        if isinstance(barcode_str, str) and barcode_str.strip():
+            converted_product['barcodes'] = [b.strip() for b in barcode_str.split(',') if b.strip()]
+        else:
+            converted_product['barcodes'] = []
+        if 'batchid' in converted_product and converted_product['batchid']:
+            converted_product['batchId'] = converted_product['batchid']
+        elif 'batchId' not in converted_product:
+            converted_product['batchId'] = None
+        out.append(converted_product)
+    return out
+
+
+def make_rows(count):
+    return [
+        {
+            "id": f"P{i:06d}", "name": f"Product {i}", "description": "", "price": 100 + i % 50,
+            "selling_price": 120 + i % 50, "stock": i % 40, "assigned_stock": 0,
+            "hsn_code_id": i % 30, "barcode": f"89{i:011d}", "batchid": None,
+            "createdat": "2026-10-01T10:00:00", "updatedat": "2026-10-01T10:00:00",
+            "category": "general", "unit": "pcs", "min_stock_level": 5,
+        }
+        for i in range(count)
+    ]
+
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rows = make_rows(count)
+    hsn = {str(i): 18.0 for i in range(30)}
+    assert legacy(rows, hsn) == project_products(rows, hsn)
+
+    old = best_of(lambda: legacy(rows, hsn))
+    new = best_of(lambda: project_products(rows, hsn))
+    print(f"{count} rows")
+    print(f"  legacy loop : {old * 1000:8.1f} ms  ({old / count * 1e6:.2f} us/row)")
+    print(f"  projection  : {new * 1000:8.1f} ms  ({new / count * 1e6:.2f} us/row)")
+    print(f"  speedup     : {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
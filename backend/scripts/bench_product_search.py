@@ -0,0 +1,90 @@
+"""
+Micro-benchmark: build time and per-query latency of utils.product_search on
+a synthetic catalog, then the cost of picking up a full rewrite of the
+products file (the background resync) and query latency while it runs.
+
+    python scripts/bench_product_search.py [products]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+base_dir = os.environ.get('APP_BASE_DIR')
+if not base_dir:
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if base_dir not in sys.path:
+    sys.path.insert(0, base_dir)
+
+from utils.json_helpers import _safe_json_dump
+from utils.product_search import ProductSearchIndex
+
+WORDS = [
+    "herbal", "shampoo", "soap", "bath", "green", "tea", "masala", "coffee", "rice", "basmati",
+    "sugar", "salt", "turmeric", "chilli", "powder", "oil", "mustard", "coconut", "biscuit", "cream",
+    "toothpaste", "detergent", "noodles", "ghee", "paneer", "butter", "milk", "atta", "dal", "honey",
+]
+QUERIES = ["shampoo", "shampo", "herbl soap", "tea 25", "8900000012", "lot-1234", "3401", "s", "1", "8", "coconut oil 1"]
+
+
+def make_rows(count, rng):
+    return [
+        {
+            "id": f"P{i:06d}",
+            "name": " ".join(rng.sample(WORDS, 3)) + f" {rng.choice([50, 100, 250, 500])}g {i}",
+            "barcode": f"89{i:011d}",
+            "batchid": f"B{i % 5000}",
+            "hsn_code_id": f"H{i % 300}",
+            "stock": i % 40,
+        }
+        for i in range(count)
+    ]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        products, batches, hsn = (os.path.join(tmp, f"{n}.json") for n in ("products", "batches", "hsn"))
+        _safe_json_dump(products, make_rows(count, rng))
+        _safe_json_dump(batches, [{"id": f"B{i}", "batch_number": f"LOT-{i}"} for i in range(5000)])
+        _safe_json_dump(hsn, [{"id": f"H{i}", "hsn_code": str(3000 + i)} for i in range(300)])
+
+        index = ProductSearchIndex(products, batches, hsn)
+        start = time.perf_counter()
+        index.search("warmup")
+        print(f"build: {count} products in {time.perf_counter() - start:.2f}s, {index.stats()}")
+
+        for query in QUERIES:
+            runs = 20
+            start = time.perf_counter()
+            for _ in range(runs):
+                page, total = index.search(query, limit=20)
+            elapsed = (time.perf_counter() - start) / runs * 1000
+            print(f"{query!r:>16}: {elapsed:7.2f} ms  ({total} matches)")
+
+        # A rewrite such as get_merged_products saves: a few stock changes.
+        rows = make_rows(count, random.Random(7))
+        for row in rows[:50]:
+            row["stock"] += 1
+        _safe_json_dump(products, rows)
+        start = time.perf_counter()
+        index.search("shampoo")
+        during = []
+        while index._refresher.is_alive():
+            t0 = time.perf_counter()
+            index.search("herbl soap")
+            during.append((time.perf_counter() - t0) * 1000)
+        refreshed = time.perf_counter() - start
+        during.sort()
+        median = during[len(during) // 2] if during else 0.0
+        worst = during[-1] if during else 0.0
+        # The slowest is usually a full garbage collection pass over the
+        # index's objects, set off by the resync's row copies.
+        print(f"rewrite picked up in {refreshed:.2f}s in the background, {index.stats()}; "
+              f"{len(during)} searches meanwhile, median {median:.2f} ms, slowest {worst:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Dump local data files as indented, human-readable JSON.
+
+Local snapshots are written compact (or as msgpack, see
+utils/storage_codec.py), which is awkward to eyeball. This reads any of them,
+merges pending journal entries the same way the app does, and prints the
+result or writes readable copies to a directory:
+
+    python scripts/export_local_json.py data/json/bills.json
+    python scripts/export_local_json.py --out debug_json          # every file
+"""
+import argparse
+import json
+import os
+import sys
+
+base_dir = os.environ.get('APP_BASE_DIR')
+if not base_dir:
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if base_dir not in sys.path:
+    sys.path.insert(0, base_dir)
+
+from config import Config
+from utils.json_helpers import _safe_json_load
+
+
+def _local_files():
+    for root, _, files in os.walk(Config.JSON_DIR):
+        for name in sorted(files):
+            if name.endswith('.json'):
+                yield os.path.join(root, name)
+
+
+def export_readable(paths, out_dir=None):
+    for path in paths:
+        data = _safe_json_load(path, None)
+        if data is None:
+            print(f"Skipping {path}: missing or unreadable", file=sys.stderr)
+            continue
+        text = json.dumps(data, indent=2, ensure_ascii=False, default=str)
+        if out_dir is None:
+            print(text)
+            continue
+        rel = os.path.relpath(os.path.abspath(path), os.path.abspath(Config.JSON_DIR))
+        if rel.startswith(os.pardir):
+            rel = os.path.basename(path)
+        target = os.path.join(out_dir, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"Wrote {target}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export local data files as readable JSON")
+    parser.add_argument('paths', nargs='*', help="files to export (default: every file under JSON_DIR)")
+    parser.add_argument('--out', help="directory to write readable copies to (default: print to stdout)")
+    args = parser.parse_args(argv)
+    export_readable(args.paths or list(_local_files()), args.out)
+
+
+if __name__ == "__main__":
+    main()
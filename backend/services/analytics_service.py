@@ -13,9 +13,14 @@ from utils.json_helpers import (
     get_users_data
 )
 from utils.helpers import is_cancelled_bill
+from utils.single_flight import single_flight
 
 logger = logging.getLogger(__name__)
 
+# Dashboards poll these from every open tablet; one computation per key and
+# window serves them all.
+_ANALYTICS_GROUPS = ("bills", "products", "stores")
+
 
 def _countable_bills() -> List[Dict]:
     """Bills that count as real sales (cancelled/voided bills excluded)."""
@@ -26,6 +31,7 @@ def _countable_bills() -> List[Dict]:
 # DASHBOARD ANALYTICS
 # ============================================
 
+@single_flight("dashboard analytics", ttl=30, stale=300, groups=_ANALYTICS_GROUPS)
 def get_dashboard_analytics() -> Tuple[Dict, int]:
     """
     Get dashboard analytics summary.
@@ -77,6 +83,7 @@ def get_dashboard_analytics() -> Tuple[Dict, int]:
 # REVENUE TRENDS
 # ============================================
 
+@single_flight("analytics revenue trends", ttl=30, stale=300, groups=_ANALYTICS_GROUPS)
 def get_revenue_trends(days: int = 7) -> Tuple[List[Dict], int]:
     """
     Get revenue trends for the last N days.
@@ -116,6 +123,7 @@ def get_revenue_trends(days: int = 7) -> Tuple[List[Dict], int]:
 # TOP PRODUCTS
 # ============================================
 
+@single_flight("analytics top products", ttl=30, stale=300, groups=_ANALYTICS_GROUPS)
 def get_top_products(limit: int = 10) -> Tuple[List[Dict], int]:
     """
     Get top selling products.
@@ -167,6 +175,7 @@ def get_top_products(limit: int = 10) -> Tuple[List[Dict], int]:
 # INVENTORY HEALTH
 # ============================================
 
+@single_flight("analytics inventory health", ttl=30, stale=300, groups=_ANALYTICS_GROUPS)
 def get_inventory_health() -> Tuple[Dict, int]:
     """
     Get inventory health metrics.
@@ -206,6 +215,7 @@ def get_inventory_health() -> Tuple[Dict, int]:
 # STORE PERFORMANCE
 # ============================================
 
+@single_flight("analytics store performance", ttl=30, stale=300, groups=_ANALYTICS_GROUPS)
 def get_store_performance() -> Tuple[List[Dict], int]:
     """
     Get performance metrics for all stores.
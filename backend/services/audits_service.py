@@ -15,6 +15,8 @@ from typing import Any, Dict, List, Optional, Tuple
 
 from utils.supabase_db import db
 from utils.supabase_resilience import execute_with_retry, is_transient_supabase_error
+from utils.stock_adjustments import adjust_product_stock
+from utils.allocation_index import allocation_index
 from config import Config
 from services import stores_service
 
@@ -360,7 +362,7 @@ def _apply_action(client, store_id, product_id, item, action, qty, res, actor, a
     elif action == "allocate_from_owner":
         if qty > 0 and _product_exists(client, product_id, product_cache):
             _adjust_store_inventory(client, store_id, product_id, qty, item, now_iso)
-            _decrement_owner_stock(client, product_id, qty)
+            adjust_product_stock(client, {product_id: qty}, f"audit {audit_id}", now_iso)
 
     elif action == "create_order":
         if qty > 0 and _product_exists(client, product_id, product_cache):
@@ -391,12 +393,12 @@ def _adjust_store_inventory(client, store_id, product_id, delta, item, now_iso):
     if rows:
         row = rows[0]
         new_qty = max(0, int(row.get("quantity") or 0) + delta)
-        client.table("storeinventory").update({
+        written = client.table("storeinventory").update({
             "quantity": new_qty,
             "updatedat": now_iso,
         }).eq("id", row.get("id")).execute()
     elif delta > 0:
-        client.table("storeinventory").insert({
+        written = client.table("storeinventory").insert({
             "id": str(uuid.uuid4()),
             "storeid": store_id,
             "productid": product_id,
@@ -405,14 +407,9 @@ def _adjust_store_inventory(client, store_id, product_id, delta, item, now_iso):
             "assignedat": now_iso,
             "updatedat": now_iso,
         }).execute()
-
-
-def _decrement_owner_stock(client, product_id, qty):
-    resp = client.table("products").select("id, stock").eq("id", product_id).limit(1).execute()
-    rows = resp.data or []
-    if rows:
-        new_stock = max(0, int(rows[0].get("stock") or 0) - qty)
-        client.table("products").update({"stock": new_stock}).eq("id", product_id).execute()
+    else:
+        return
+    allocation_index.record(written.data if written else [])
 
 
 def _create_damaged_event(client, store_id, product_id, qty, res, actor, audit_id, now_iso):
@@ -5,38 +5,77 @@ Handles all bill-related business logic and database operations
 import logging
 import re
 import uuid
-import os
-import json
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple, Any
 from zoneinfo import ZoneInfo
 
 from postgrest.exceptions import APIError
-from config import Config
 from utils.supabase_db import db
 from utils.supabase_resilience import (
+    OptionalRpc,
     execute_with_retry,
     is_circuit_open_error,
+    is_missing_rpc_error,
     is_transient_supabase_error,
 )
 import utils.supabase_circuit as supabase_circuit
 from utils.json_helpers import (
     get_bills_data,
     save_bills_data,
+    get_bill_by_id,
+    query_bills_data,
+    filter_rows,
+    upsert_bills_data,
+    patch_bill_data,
+    delete_bills_data,
+    get_bill_items_by_bill,
     get_discounts_data,
     save_discounts_data,
     get_products_data,
-    save_products_data,
+    get_products_by_ids,
+    upsert_products_data,
     get_store_inventory_data,
     save_store_inventory_data,
-    get_stores_data,
-    get_users_data,
+    get_store_by_id,
+    get_user_by_id,
+    get_users_by,
 )
 from utils.json_utils import convert_camel_to_snake, convert_snake_to_camel
+from utils.stock_adjustments import adjust_product_stock
+from utils.supabase_pagination import fetch_all_rows
+from utils.fetch_plan import FetchPlan
+from utils.bill_shards import bill_shards
+from utils.invoice_serials import invoice_serials
+from utils.bill_outbox import bill_outbox
+from utils.allocation_index import allocation_index
+from utils.single_flight import invalidate as invalidate_cached
+from config import Config
 
 logger = logging.getLogger(__name__)
 INVOICE_ID_REGEX = re.compile(r"^INV-([A-Z0-9]+)-(\d{8})(\d{4})$")
 IST_ZONE = ZoneInfo("Asia/Kolkata")
+BUSINESS_ZONE = ZoneInfo(Config.BUSINESS_TIMEZONE)
+MAX_INVOICE_RESERVATION = 500
+
+# Local bill `sync_state`: pending until the outbox has written it to Supabase.
+SYNC_PENDING = "pending"
+SYNC_SYNCED = "synced"
+SYNC_ERROR = "error"
+_LOCAL_ONLY_BILL_FIELDS = frozenset(
+    {"items", "customer_name", "customer_email", "customer_phone", "sync_state", "sync_error", "synced_at"}
+)
+_UPDATE_BILL_FIELDS = (
+    "customerid",
+    "paymentmethod",
+    "status",
+    "subtotal",
+    "total",
+    "discount_amount",
+    "discount_percentage",
+    "updated_at",
+)
+_SAVE_BILL_RPC = OptionalRpc("save_bill_with_items", "20261017_save_bill_with_items.sql")
+_SUMMARY_RPC = OptionalRpc("bill_sales_summary", "20261017_bill_daily_rollups.sql")
 
 
 def _fetch_all_bills_rows(
@@ -48,66 +87,59 @@ def _fetch_all_bills_rows(
     safety_cap: int = 200000,
 ) -> List[Dict]:
     """
-    PostgREST caps each request at ~1000 rows. Paginate through bills
-    via .range() so callers see the full dataset, not just the first page.
+    PostgREST caps each request at ~1000 rows. Walk bills by keyset on
+    (order_col, id) so callers see the full dataset, each bill exactly once
+    even while new ones are being inserted.
     """
-    rows: List[Dict] = []
-    start = 0
-    while True:
-        end = start + page_size - 1
-        response = execute_with_retry(
-            lambda s=start, e=end: (
-                client.table("bills")
-                .select(select_expr)
-                .order(order_col, desc=order_desc)
-                .range(s, e)
-            ),
-            f"bills page {start // page_size + 1}",
-        )
-        page = response.data if response and response.data is not None else []
-        if not page:
-            break
-        rows.extend(page)
-        if len(page) < page_size:
-            break
-        start += page_size
-        if start >= safety_cap:
-            logger.warning("bills pagination safety cap (%s) hit", safety_cap)
-            break
-    return rows
-
-
-def _load_local_billitems() -> List[Dict[str, Any]]:
-    path = os.path.join(Config.JSON_DIR, "billitems.json")
-    if not os.path.exists(path):
-        return []
-    try:
-        with open(path, "r", encoding="utf-8") as fh:
-            data = json.load(fh)
-        return data if isinstance(data, list) else []
-    except Exception as e:
-        logger.warning("Failed to read local billitems.json: %s", e)
-        return []
+    return fetch_all_rows(
+        client,
+        "bills",
+        select_expr,
+        label="bills",
+        page_size=page_size,
+        order=(order_col, order_desc),
+        max_rows=safety_cap,
+        key=f"{order_col},id",
+    )
+
 
+def _save_local_stock(changed_products: List[Dict]) -> None:
+    """Journal local product stock changes and drop the cached product lists
+    (they carry stock) in every worker."""
+    upsert_products_data(changed_products)
+    if changed_products:
+        invalidate_cached("products")
 
-def _enrich_local_bills_with_local_items(bills: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+
+def _enrich_local_bills_with_local_items(
+    bills: List[Dict[str, Any]],
+    billitems_rows: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
     """
-    Ensure local bills include `items` by joining local billitems.json.
+    Ensure local bills include `items` by joining local billitems.json
+    (or `billitems_rows`, when the caller already holds the relevant rows).
     This prevents blank bill-item views when fallback uses local JSON bills.
     """
     if not bills:
         return bills
 
     try:
-        billitems_rows = _load_local_billitems()
+        pending_ids = [
+            str(bill.get("id") or "").strip()
+            for bill in bills
+            if not (isinstance(bill.get("items"), list) and bill.get("items"))
+        ]
+        if billitems_rows is None:
+            # Indexed lookup of just these bills' rows, not a billitems.json scan.
+            rows_by_bill = get_bill_items_by_bill([bid for bid in pending_ids if bid])
+            billitems_rows = [row for rows in rows_by_bill.values() for row in rows]
         if not billitems_rows:
             return bills
 
-        products_map: Dict[str, Dict[str, Any]] = {}
-        for product in get_products_data():
-            pid = str(product.get("id") or "").strip()
-            if pid:
-                products_map[pid] = product
+        products_map = get_products_by_ids([
+            str(row.get("productid") or row.get("product_id") or row.get("productId") or "").strip()
+            for row in billitems_rows
+        ])
 
         items_by_bill: Dict[str, List[Dict[str, Any]]] = {}
         for row in billitems_rows:
@@ -166,11 +198,11 @@ def _extract_serial_for_prefix(invoice_id: Optional[str], prefix: str) -> int:
 def _get_store_code(store_id: str) -> str:
     """Get store code from local JSON first, fall back to Supabase."""
     try:
-        for store in get_stores_data():
-            if store.get("id") == store_id:
-                code = str(store.get("storecode") or "").strip().upper()
-                if code:
-                    return code
+        store = get_store_by_id(store_id)
+        if store:
+            code = str(store.get("storecode") or "").strip().upper()
+            if code:
+                return code
     except Exception as local_error:
         logger.warning(f"Failed to get store code from local JSON: {local_error}")
 
@@ -191,14 +223,15 @@ def _get_store_code(store_id: str) -> str:
     return "STR"
 
 
-def _generate_daily_invoice_id(store_id: str) -> str:
-    store_code = _get_store_code(store_id)
-    prefix = _get_today_invoice_prefix(store_code)
+def _max_invoice_serial(store_id: str, prefix: str) -> int:
+    """Highest serial under `prefix` already used by the store, locally or in
+    Supabase. Only run to seed the allocator, once per store per day."""
     max_serial = 0
 
     # Local JSON first (offline-first storage), filtered by store
     try:
-        for bill in get_bills_data():
+        bills, _, _ = _query_local_bills(store_id or None)
+        for bill in bills:
             bill_store = str(bill.get("storeid") or bill.get("storeId") or "")
             if bill_store != store_id:
                 continue
@@ -218,7 +251,33 @@ def _generate_daily_invoice_id(store_id: str) -> str:
     except Exception as cloud_error:
         logger.warning(f"Failed reading cloud bills for invoice serial: {cloud_error}")
 
-    return f"{prefix}{max_serial + 1:04d}"
+    return max_serial
+
+
+def _generate_daily_invoice_id(store_id: str) -> str:
+    prefix = _get_today_invoice_prefix(_get_store_code(store_id))
+    return invoice_serials.next_id(store_id, prefix, lambda: _max_invoice_serial(store_id, prefix))
+
+
+def reserve_invoice_ids(store_id: str, count: int) -> Tuple[Optional[Dict], str, int]:
+    """
+    Reserve a block of today's invoice ids for a terminal that will bill
+    offline. Returns: (block, message, status_code)
+    """
+    if not store_id:
+        return None, "storeId is required", 400
+    if count < 1 or count > MAX_INVOICE_RESERVATION:
+        return None, f"count must be between 1 and {MAX_INVOICE_RESERVATION}", 400
+    try:
+        prefix = _get_today_invoice_prefix(_get_store_code(store_id))
+        first, last = invoice_serials.reserve(
+            store_id, prefix, count, lambda: _max_invoice_serial(store_id, prefix)
+        )
+        logger.info(f"Reserved invoice ids {first}..{last} for store {store_id}")
+        return {"storeId": store_id, "first": first, "last": last, "count": count}, "Invoice ids reserved", 201
+    except Exception as e:
+        logger.error(f"Error reserving invoice ids: {e}", exc_info=True)
+        return None, str(e), 500
 
 
 def _parse_datetime_for_edit_window(value: Optional[str]) -> Optional[datetime]:
@@ -264,24 +323,15 @@ def _resolve_creator_user_id(raw_value: Optional[str]) -> Optional[str]:
         return None
 
     try:
-        users = get_users_data()
-        for user in users:
-            uid = str(user.get("id") or "").strip()
-            if not uid:
-                continue
-            if candidate == uid:
-                return uid
+        user = get_user_by_id(candidate)
+        if user:
+            return str(user.get("id")).strip()
 
-        lower_candidate = candidate.lower()
-        for user in users:
-            uid = str(user.get("id") or "").strip()
-            if not uid:
-                continue
-            name = str(user.get("name") or "").strip().lower()
-            username = str(user.get("username") or "").strip().lower()
-            email = str(user.get("email") or "").strip().lower()
-            if lower_candidate in (name, username, email):
-                return uid
+        for field in ("name", "username", "email"):
+            for user in get_users_by(field, candidate):
+                uid = str(user.get("id") or "").strip()
+                if uid:
+                    return uid
     except Exception as local_error:
         logger.warning(f"Failed local createdBy resolution for '{candidate}': {local_error}")
 
@@ -314,6 +364,25 @@ def _resolve_creator_user_id(raw_value: Optional[str]) -> Optional[str]:
     return None
 
 
+def _allocated_by_product() -> Dict[str, int]:
+    """
+    {product_id: quantity allocated to stores}, from the allocation index as
+    it stands -- checkout never waits on its load or cloud checks, which run
+    in the background. Until it has loaded, the local store inventory rows
+    are summed instead.
+    """
+    try:
+        return allocation_index.by_product(wait=False)
+    except LookupError as e:
+        logger.info(f"Allocation index not loaded yet; summing local store inventory: {e}")
+    allocated: Dict[str, int] = {}
+    for row in get_store_inventory_data():
+        pid = row.get("productid")
+        if pid:
+            allocated[pid] = allocated.get(pid, 0) + int(row.get("quantity") or 0)
+    return allocated
+
+
 def _build_stock_validation_error(
     product_id: str,
     product_name: str,
@@ -329,28 +398,133 @@ def _build_stock_validation_error(
     )
 
 
-def _next_billitem_id(client) -> int:
-    """Fetch next safe billitems.id (works even if sequence is stale)."""
+def _cloud_bill_items(bill_id: str, items: List[Dict]) -> List[Dict]:
+    """billitems rows for Supabase; ids are assigned by the database."""
+    return [
+        {
+            "billid": bill_id,
+            "productid": item.get("product_id") or item.get("productid") or item.get("productId"),
+            "quantity": item.get("quantity"),
+            "price": item.get("price"),
+            "total": item.get("total"),
+        }
+        for item in items or []
+    ]
+
+
+def _save_cloud_bill(client, bill_id: str, header: Dict, items: List[Dict], label: str, insert: bool = True) -> None:
+    """
+    Write a bill header and replace its billitems in Supabase with one
+    save_bill_with_items call (migrations/20261017_save_bill_with_items.sql).
+    Until that function is installed the header and items are written with
+    separate requests; `insert=False` then only updates an existing header.
+    """
+    header = {**header, "id": bill_id}
+    rows = _cloud_bill_items(bill_id, items)
+    if _SAVE_BILL_RPC.call(client, {"bill": header, "items": rows}, label) is not None:
+        return
+
+    if insert:
+        execute_with_retry(lambda: client.table("bills").upsert(header), f"{label} upsert", retries=2)
+    else:
+        execute_with_retry(lambda: client.table("bills").update(header).eq("id", bill_id), f"{label} update", retries=2)
+    execute_with_retry(
+        lambda: client.table("billitems").delete().eq("billid", bill_id),
+        f"billitems reset for {label}",
+        retries=2,
+    )
+    if rows:
+        execute_with_retry(lambda: client.table("billitems").insert(rows), f"billitems insert for {label}", retries=2)
+
+
+def _set_bill_sync_state(bill_id: str, state: str, error: Optional[str] = None) -> None:
+    bill = get_bill_by_id(bill_id)
+    if bill is None or (bill.get("sync_state") == state and bill.get("sync_error") == error):
+        return
+    # Only the sync fields, patched onto the current row under the bills lock,
+    # so an update_bill landing meanwhile is not overwritten.
+    fields = {"sync_state": state, "sync_error": error}
+    if state == SYNC_SYNCED:
+        fields["synced_at"] = datetime.now().isoformat()
+    patch_bill_data(bill_id, fields)
+
+
+def _push_outboxed_bill(entry: Dict[str, Any]) -> None:
+    """
+    Outbox handler: write one bill change to Supabase. Every step is
+    idempotent -- the bill and its items are replaced wholesale from the
+    copy stored in the entry, and the stock change carries the entry's
+    op_id -- so a retry after a partial failure is safe. While the op_id
+    function is not installed the stock step raises and the entry waits.
+    """
+    bill_id = entry["bill_id"]
+    label = f"updated bill {bill_id}" if entry.get("op") == "update" else f"bill {bill_id}"
     try:
-        resp = execute_with_retry(
-            lambda: client.table("billitems").select("id").order("id", desc=True).limit(1),
-            "billitems max id lookup",
-            retries=1,
-        )
-        if resp.data:
-            return int(resp.data[0].get("id") or 0) + 1
+        client = db.client
+        # Entries queued before they carried the bill fall back to the local row.
+        bill = entry.get("bill") or get_bill_by_id(bill_id)
+        if bill is None:
+            # Keep the entry (and its stock change) until the bill turns up.
+            raise LookupError(f"Bill {bill_id} is neither in its outbox entry nor stored locally")
+        if entry.get("op") == "update":
+            header = {k: bill.get(k) for k in _UPDATE_BILL_FIELDS if k in bill}
+            _save_cloud_bill(client, bill_id, header, bill.get("items") or [], label, insert=False)
+        else:
+            header = {k: v for k, v in bill.items() if k not in _LOCAL_ONLY_BILL_FIELDS}
+            _save_cloud_bill(client, bill_id, header, bill.get("items") or [], label)
+        if entry.get("stock"):
+            adjust_product_stock(client, entry["stock"], label, op_id=entry.get("op_id"))
     except Exception as e:
-        logger.warning(f"Failed to fetch max billitems.id: {e}")
-    return 1
+        if not entry.get("attempts"):
+            _set_bill_sync_state(bill_id, SYNC_ERROR, str(e)[:300])
+        raise
+    # The entry itself is still queued; later edits keep the bill pending.
+    if bill_outbox.pending_for(bill_id) <= 1:
+        _set_bill_sync_state(bill_id, SYNC_SYNCED)
+
+
+bill_outbox.set_handler(_push_outboxed_bill)
 
 
-def get_local_bills() -> List[Dict]:
+def _query_local_bills(
+    store_id: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Tuple[List[Dict], int, Optional[List[Dict]]]:
     """
-    Get bills from local JSON storage
+    Newest-first local bills for a store/date window: (page, total, billitems
+    rows for the window or None). Scoped reads only open the matching
+    store/month shards; anything else goes to the flat files.
+    """
+    window = bill_shards.load_window(store_id, from_date, to_date)
+    if window is None:
+        rows, total = query_bills_data(
+            store_id=store_id, from_date=from_date, to_date=to_date, limit=limit, offset=offset
+        )
+        return rows, total, None
+    bills, billitems_rows = window
+    filters = {"storeid": store_id} if store_id else None
+    rows, total = filter_rows(bills, filters, from_date, to_date, limit=limit, offset=offset)
+    return rows, total, billitems_rows
+
+
+def get_local_bills(
+    store_id: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Get bills from local JSON storage, optionally limited to a store and/or
+    created_at window (scoped results are newest first)
     """
     try:
-        bills = get_bills_data()
-        bills = _enrich_local_bills_with_local_items(bills)
+        if store_id or from_date or to_date:
+            bills, _, billitems_rows = _query_local_bills(store_id, from_date, to_date)
+        else:
+            bills, billitems_rows = get_bills_data(), None
+        bills = _enrich_local_bills_with_local_items(bills, billitems_rows)
         transformed_bills = [convert_snake_to_camel(bill) for bill in bills]
         logger.debug(f"Returning {len(transformed_bills)} bills from local JSON.")
         return transformed_bills
@@ -406,38 +580,10 @@ def _enrich_bills_with_details(client, bills: List[Dict]) -> List[Dict]:
         text_val = str(value).strip()
         return text_val or None
 
-    def chunked(values: List[str], size: int = 200) -> List[List[str]]:
-        return [values[i:i + size] for i in range(0, len(values), size)]
-
     bill_ids = [normalize_id(bill.get("id")) for bill in bills]
     bill_ids = [bid for bid in bill_ids if bid]
 
-    # Step 2: Fetch bill items only for these bills
-    all_items: List[Dict] = []
-    if bill_ids:
-        for chunk in chunked(bill_ids):
-            items_response = execute_with_retry(
-                lambda chunk=chunk: client.table("billitems").select("*").in_("billid", chunk),
-                "billitems by bill ids",
-            )
-            all_items.extend(items_response.data or [])
-
-    # Step 3: Fetch replacements only for these bills
-    replacements: List[Dict] = []
-    if bill_ids:
-        for chunk in chunked(bill_ids):
-            replacements_response = execute_with_retry(
-                lambda chunk=chunk: client.table("replacements").select("*").in_("bill_id", chunk),
-                "replacements by bill ids",
-            )
-            replacements.extend(replacements_response.data or [])
-
-    # Look up the price the replaced product sold for on its ORIGINAL bill.
-    # This is what the customer is being credited for during the swap. We
-    # need it both to recompute the actual diff when the POS persisted a
-    # wrong `final_amount`, and to surface the credit in the dashboard.
-    original_price_lookup: Dict[tuple, float] = {}
-    if replacements:
+    def original_bill_ids_of(replacements: List[Dict]) -> List[str]:
         original_bill_ids = []
         seen_orig_bills = set()
         for replacement in replacements:
@@ -449,83 +595,134 @@ def _enrich_bills_with_details(client, bills: List[Dict]) -> List[Dict]:
             if orig_bill and orig_bill not in seen_orig_bills:
                 seen_orig_bills.add(orig_bill)
                 original_bill_ids.append(orig_bill)
+        return original_bill_ids
+
+    def product_ids_of(all_items: List[Dict], replacements: List[Dict]) -> List[str]:
+        product_ids: List[str] = []
+        seen = set()
+        for item in all_items:
+            product_id = normalize_id(
+                item.get("productid") or item.get("product_id") or item.get("productId")
+            )
+            if product_id and product_id not in seen:
+                seen.add(product_id)
+                product_ids.append(product_id)
 
-        if original_bill_ids:
-            original_items: List[Dict] = []
-            for chunk in chunked(original_bill_ids):
-                try:
-                    orig_resp = execute_with_retry(
-                        lambda chunk=chunk: client.table("billitems")
-                        .select("billid, productid, price, quantity")
-                        .in_("billid", chunk),
-                        "original bill items for replacements",
-                    )
-                    original_items.extend(orig_resp.data or [])
-                except Exception as orig_err:
-                    logger.warning(
-                        "Failed to fetch original bill items for replacement lookup: %s",
-                        orig_err,
-                    )
-            for row in original_items:
-                bid = row.get("billid")
-                pid = row.get("productid")
-                if not bid or not pid:
-                    continue
-                try:
-                    p = float(row.get("price") or 0)
-                except (TypeError, ValueError):
-                    p = 0.0
-                # Only set first occurrence — multiple lines for the same
-                # product on a single bill would aggregate; the per-line
-                # price is what we care about.
-                key = (str(bid), str(pid))
-                if key not in original_price_lookup:
-                    original_price_lookup[key] = p
-
-    # Step 4: Collect product ids from bill items and replacements
-    product_ids: List[str] = []
-    product_id_set = set()
-    for item in all_items:
-        product_id = normalize_id(
-            item.get("productid") or item.get("product_id") or item.get("productId")
+        for replacement in replacements:
+            replaced_product_id = normalize_id(
+                replacement.get("replaced_product_id")
+                or replacement.get("replacedproductid")
+                or replacement.get("replacedProductId")
+            )
+            new_product_id = normalize_id(
+                replacement.get("new_product_id")
+                or replacement.get("newproductid")
+                or replacement.get("newProductId")
+            )
+            for pid in (replaced_product_id, new_product_id):
+                if pid and pid not in seen:
+                    seen.add(pid)
+                    product_ids.append(pid)
+        return product_ids
+
+    # Steps 2-6 as one concurrent plan: billitems and replacements in
+    # parallel; the replaced bills' items as soon as replacements are in;
+    # products once both are in (HSN codes ride along as an embed, so the
+    # hsn_codes stage only fetches codes the embed did not resolve).
+    with FetchPlan(f"bill details ({len(bill_ids)} bills)") as plan:
+        items_stage = plan.chunked(
+            "billitems", bill_ids, lambda chunk: client.table("billitems").select("*").in_("billid", chunk)
         )
-        if product_id and product_id not in product_id_set:
-            product_id_set.add(product_id)
-            product_ids.append(product_id)
-
-    for replacement in replacements:
-        replaced_product_id = normalize_id(
-            replacement.get("replaced_product_id")
-            or replacement.get("replacedproductid")
-            or replacement.get("replacedProductId")
+        replacements_stage = plan.chunked(
+            "replacements", bill_ids, lambda chunk: client.table("replacements").select("*").in_("bill_id", chunk)
         )
-        new_product_id = normalize_id(
-            replacement.get("new_product_id")
-            or replacement.get("newproductid")
-            or replacement.get("newProductId")
+        # Look up the price the replaced product sold for on its ORIGINAL bill.
+        # This is what the customer is being credited for during the swap. We
+        # need it both to recompute the actual diff when the POS persisted a
+        # wrong `final_amount`, and to surface the credit in the dashboard.
+        original_items_stage = plan.after(
+            "original bill items",
+            [replacements_stage],
+            lambda replacements: plan.chunked(
+                "original bill items",
+                original_bill_ids_of(replacements),
+                lambda chunk: client.table("billitems")
+                .select("billid, productid, price, quantity")
+                .in_("billid", chunk),
+                optional=True,
+            ),
         )
-        for pid in (replaced_product_id, new_product_id):
-            if pid and pid not in product_id_set:
-                product_id_set.add(pid)
-                product_ids.append(pid)
-
-    # Step 5: Fetch products only for relevant ids
-    product_rows: List[Dict] = []
-    if product_ids:
-        for chunk in chunked(product_ids):
-            products_response = execute_with_retry(
-                lambda chunk=chunk: client.table("products").select("id,name,price,barcode,hsn_code_id,hsn_codes(tax)").in_("id", chunk),
-                "products for bills",
-            )
-            for row in products_response.data or []:
-                hsn_ref = row.get("hsn_codes")
-                if isinstance(hsn_ref, list):
-                    hsn_ref = hsn_ref[0] if hsn_ref else None
-                if isinstance(hsn_ref, dict):
-                    row["tax"] = hsn_ref.get("tax", 0) or 0
-                else:
-                    row["tax"] = row.get("tax", 0) or 0
-                product_rows.append(row)
+        products_stage = plan.after(
+            "products",
+            [items_stage, replacements_stage],
+            lambda all_items, replacements: plan.chunked(
+                "products",
+                product_ids_of(all_items, replacements),
+                lambda chunk: client.table("products")
+                .select("id,name,price,barcode,hsn_code_id,hsn_codes(tax,hsn_code)")
+                .in_("id", chunk),
+            ),
+        )
+
+        def embedded_hsn(row: Dict) -> Optional[Dict]:
+            hsn_ref = row.get("hsn_codes")
+            if isinstance(hsn_ref, list):
+                hsn_ref = hsn_ref[0] if hsn_ref else None
+            return hsn_ref if isinstance(hsn_ref, dict) else None
+
+        def unresolved_hsn_ids(product_rows: List[Dict]) -> List[str]:
+            hsn_ids: List[str] = []
+            for row in product_rows:
+                hsn_id = normalize_id(row.get("hsn_code_id") or row.get("hsncodeid"))
+                ref = embedded_hsn(row)
+                if hsn_id and not (ref and ref.get("hsn_code")) and hsn_id not in hsn_ids:
+                    hsn_ids.append(hsn_id)
+            return hsn_ids
+
+        hsn_stage = plan.after(
+            "hsn_codes",
+            [products_stage],
+            lambda product_rows: plan.chunked(
+                "hsn_codes",
+                unresolved_hsn_ids(product_rows),
+                lambda chunk: client.table("hsn_codes").select("id,hsn_code").in_("id", chunk),
+            ),
+        )
+
+        all_items: List[Dict] = plan.result(items_stage)
+        replacements: List[Dict] = plan.result(replacements_stage)
+        original_items: List[Dict] = plan.result(original_items_stage)
+        product_rows: List[Dict] = plan.result(products_stage)
+        hsn_rows: List[Dict] = plan.result(hsn_stage)
+
+    original_price_lookup: Dict[tuple, float] = {}
+    for row in original_items:
+        bid = row.get("billid")
+        pid = row.get("productid")
+        if not bid or not pid:
+            continue
+        try:
+            p = float(row.get("price") or 0)
+        except (TypeError, ValueError):
+            p = 0.0
+        # Only set first occurrence — multiple lines for the same
+        # product on a single bill would aggregate; the per-line
+        # price is what we care about.
+        key = (str(bid), str(pid))
+        if key not in original_price_lookup:
+            original_price_lookup[key] = p
+
+    product_ids = product_ids_of(all_items, replacements)
+    product_id_set = set(product_ids)
+    hsn_map: Dict[str, str] = {}
+    for row in product_rows:
+        hsn_ref = embedded_hsn(row)
+        if hsn_ref is not None:
+            row["tax"] = hsn_ref.get("tax", 0) or 0
+            if hsn_ref.get("hsn_code") and row.get("hsn_code_id") is not None:
+                hsn_map[str(row.get("hsn_code_id"))] = str(hsn_ref.get("hsn_code"))
+        else:
+            row["tax"] = row.get("tax", 0) or 0
     if product_ids and not product_rows:
         try:
             local_products = get_products_data()
@@ -546,35 +743,16 @@ def _enrich_bills_with_details(client, bills: List[Dict]) -> List[Dict]:
         except Exception as local_products_error:
             logger.warning(f"Failed to load local products fallback: {local_products_error}")
 
-    # Step 6: Build HSN lookup map for relevant products
-    hsn_ids: List[str] = []
-    hsn_id_set = set()
-    for product in product_rows:
-        hsn_code_id = product.get("hsn_code_id") or product.get("hsncodeid")
-        if hsn_code_id is None:
+    for code in hsn_rows:
+        code_id = code.get("id")
+        if code_id is None:
             continue
-        hsn_id = normalize_id(hsn_code_id)
-        if hsn_id and hsn_id not in hsn_id_set:
-            hsn_id_set.add(hsn_id)
-            hsn_ids.append(hsn_id)
-
-    hsn_map: Dict[str, str] = {}
-    if hsn_ids:
-        for chunk in chunked(hsn_ids):
-            hsn_response = execute_with_retry(
-                lambda chunk=chunk: client.table("hsn_codes").select("id,hsn_code").in_("id", chunk),
-                "hsn_codes for bills",
-            )
-            for code in hsn_response.data or []:
-                code_id = code.get("id")
-                if code_id is None:
-                    continue
-                display_code = (
-                    code.get("hsn_code")
-                    or code.get("hsncode")
-                    or str(code_id)
-                )
-                hsn_map[str(code_id)] = str(display_code)
+        display_code = (
+            code.get("hsn_code")
+            or code.get("hsncode")
+            or str(code_id)
+        )
+        hsn_map[str(code_id)] = str(display_code)
 
     # Step 7: Build product lookup map
     products_map: Dict[str, Dict] = {}
@@ -872,6 +1050,36 @@ def _enrich_bills_with_details(client, bills: List[Dict]) -> List[Dict]:
     return transformed_bills
 
 
+def get_local_bills_paginated(
+    page: int = 1,
+    page_size: int = 100,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    store_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    One page of local bills, same shape as get_bills_paginated. Only the
+    requested page is enriched with items and converted to camelCase.
+    """
+    start = max(0, (page - 1) * page_size)
+    end = start + page_size
+    page_rows, total, billitems_rows = _query_local_bills(
+        store_id=store_id,
+        from_date=from_date,
+        to_date=to_date,
+        limit=page_size,
+        offset=start,
+    )
+    page_rows = _enrich_local_bills_with_local_items(page_rows, billitems_rows)
+    return {
+        "data": [convert_snake_to_camel(bill) for bill in page_rows],
+        "page": page,
+        "pageSize": page_size,
+        "total": total,
+        "hasMore": end < total,
+    }
+
+
 def get_bills_paginated(
     page: int = 1,
     page_size: int = 100,
@@ -985,74 +1193,16 @@ def get_bills_paginated(
         else:
             logger.error("Paginated bills fetch failed: %s", e, exc_info=True)
         # Offline/local fallback so billing UI never goes blank when cloud paging fails.
+        # Store/date filtering, ordering and slicing happen in the local query,
+        # so only the requested page is enriched and converted.
         try:
-            local_rows = get_local_bills()
-
-            if store_id:
-                local_rows = [
-                    row for row in local_rows
-                    if str(
-                        row.get("storeId")
-                        or row.get("storeid")
-                        or row.get("store_id")
-                        or ""
-                    ) == str(store_id)
-                ]
-
-            def _to_dt(value: Any):
-                if not value:
-                    return None
-                try:
-                    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
-                except Exception:
-                    return None
-
-            from_dt = _to_dt(from_date)
-            to_dt = _to_dt(to_date)
-            if from_dt or to_dt:
-                filtered_rows = []
-                for row in local_rows:
-                    row_dt = _to_dt(
-                        row.get("createdAt")
-                        or row.get("created_at")
-                        or row.get("timestamp")
-                        or row.get("date")
-                    )
-                    if row_dt is None:
-                        continue
-                    if from_dt and row_dt < from_dt:
-                        continue
-                    if to_dt and row_dt > to_dt:
-                        continue
-                    filtered_rows.append(row)
-                local_rows = filtered_rows
-
-            local_rows.sort(
-                key=lambda r: str(
-                    r.get("createdAt")
-                    or r.get("created_at")
-                    or r.get("timestamp")
-                    or r.get("date")
-                    or ""
-                ),
-                reverse=True,
-            )
-
-            start = max(0, (page - 1) * page_size)
-            end = start + page_size
-            sliced = local_rows[start:end]
+            result = get_local_bills_paginated(page, page_size, from_date, to_date, store_id)
             logger.info(
                 "Paginated bills fallback to local JSON: returned %s rows (total=%s)",
-                len(sliced),
-                len(local_rows),
+                len(result["data"]),
+                result["total"],
             )
-            return {
-                "data": sliced,
-                "page": page,
-                "pageSize": page_size,
-                "total": len(local_rows),
-                "hasMore": end < len(local_rows),
-            }
+            return result
         except Exception as local_error:
             logger.error("Paginated bills local fallback failed: %s", local_error, exc_info=True)
             return {
@@ -1064,6 +1214,163 @@ def get_bills_paginated(
             }
 
 
+def _summarize_bills(bills: List[Dict], today_key: str) -> Dict[str, Any]:
+    """The summary tiles computed from bill rows (before rollups existed)."""
+    active_total_count = 0
+    cancelled_count = 0
+    total_revenue = 0.0
+    today_revenue = 0.0
+    today_count = 0
+    for bill in bills:
+        if str(bill.get("status") or "").strip().lower() in {"cancelled", "canceled", "void", "voided"}:
+            cancelled_count += 1
+            continue
+        active_total_count += 1
+        is_repl = bool(bill.get("isReplacement") or bill.get("is_replacement"))
+        repl_raw = bill.get("replacementFinalAmount", bill.get("replacement_final_amount"))
+        try:
+            repl_amt = float(repl_raw)
+        except (TypeError, ValueError):
+            repl_amt = None
+        if is_repl and repl_amt is not None:
+            amount = max(0.0, repl_amt)
+        else:
+            try:
+                amount = float(bill.get("total") or 0)
+            except (TypeError, ValueError):
+                amount = 0.0
+        total_revenue += amount
+        raw_date = (
+            bill.get("date")
+            or bill.get("timestamp")
+            or bill.get("created_at")
+            or bill.get("createdAt")
+            or ""
+        )
+        if str(raw_date)[:10] == today_key:
+            today_count += 1
+            today_revenue += amount
+    return {
+        "totalCount": active_total_count,
+        "totalRevenue": total_revenue,
+        "todayCount": today_count,
+        "todayRevenue": today_revenue,
+        "cancelledCount": cancelled_count,
+    }
+
+
+def _pending_outbox_bills(
+    from_day: Optional[str], to_day: Optional[str], store_id: Optional[str]
+) -> Tuple[List[Dict], int]:
+    """
+    Bills committed locally whose create is still in the outbox, in the
+    summary window (each with "date" set to its business day), and how many
+    bills have edits queued that the cloud figures do not show yet.
+    """
+    created: List[Dict] = []
+    edited = 0
+    for row in bill_outbox.pending_bills():
+        bill = row.get("bill")
+        if not row.get("created"):
+            edited += 1
+            continue
+        if bill is None or (store_id and bill.get("storeid") != store_id):
+            continue
+        stamp = _parse_datetime_for_edit_window(bill.get("timestamp") or bill.get("created_at"))
+        day = stamp.astimezone(BUSINESS_ZONE).date().isoformat() if stamp is not None else ""
+        if (from_day and day < from_day) or (to_day and day > to_day):
+            continue
+        created.append({**bill, "date": day})
+    return created, edited
+
+
+def get_bills_summary(
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    store_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Dashboard tile totals for a store/date window. Read from the per-store,
+    per-day rollups maintained in Supabase (migrations/
+    20261017_bill_daily_rollups.sql), so the cost does not grow with bill
+    history. Falls back to summing the bills while the rollups are not
+    installed or Supabase is unreachable.
+
+    Bills still waiting in the outbox are added on top (`pendingCount`);
+    `pendingEdits` counts bills whose queued edits are not reflected yet.
+    Days are calendar days in Config.BUSINESS_TIMEZONE.
+    """
+    today_key = datetime.now(BUSINESS_ZONE).date().isoformat()
+    from_day = (from_date or "")[:10] or None
+    to_day = (to_date or "")[:10] or None
+    pending, pending_edits = _pending_outbox_bills(from_day, to_day, store_id)
+    params = {
+        "from_day": from_day,
+        "to_day": to_day,
+        "store": store_id or None,
+        "today": today_key,
+    }
+    params = {k: v for k, v in params.items() if v is not None}
+    summary: Optional[Dict[str, Any]] = None
+    try:
+        response = _SUMMARY_RPC.call(db.client, params, "bills summary")
+        if response is not None and isinstance(response.data, dict):
+            data = response.data
+            summary = {
+                "totalCount": int(data.get("totalCount") or 0),
+                "totalRevenue": float(data.get("totalRevenue") or 0),
+                "todayCount": int(data.get("todayCount") or 0),
+                "todayRevenue": float(data.get("todayRevenue") or 0),
+                "cancelledCount": int(data.get("cancelledCount") or 0),
+                "source": "rollups",
+            }
+    except Exception as e:
+        logger.warning(f"Bill rollups unavailable, summing bills: {e}")
+
+    if summary is None:
+        result = get_bills_paginated(
+            page=1,
+            page_size=1_000_000,
+            from_date=from_date,
+            to_date=to_date,
+            store_id=store_id,
+            include_details=False,
+        )
+        bills = (result or {}).get("data") or []
+        summary = _summarize_bills(bills, today_key)
+        summary["source"] = "bills"
+        # The local fallback of get_bills_paginated already has them.
+        seen = {bill.get("id") for bill in bills}
+        pending = [bill for bill in pending if bill.get("id") not in seen]
+
+    extra = _summarize_bills(pending, today_key)
+    for field in ("totalCount", "totalRevenue", "todayCount", "todayRevenue", "cancelledCount"):
+        summary[field] += extra[field]
+    summary["pendingCount"] = len(pending)
+    summary["pendingEdits"] = pending_edits
+    return summary
+
+
+def rebuild_bill_rollups() -> Tuple[Optional[Dict], str, int]:
+    """
+    Recompute the daily rollups from bill history in Supabase.
+    Returns: (result, message, status_code)
+    """
+    try:
+        client = db.client
+        response = execute_with_retry(
+            lambda: client.rpc("rebuild_bill_daily_rollups", {}),
+            "bill rollups rebuild",
+            retries=0,
+        )
+        return {"bills": response.data}, "Bill rollups rebuilt", 200
+    except Exception as e:
+        if is_missing_rpc_error(e):
+            return None, "Bill rollups are not installed (apply migrations/20261017_bill_daily_rollups.sql)", 404
+        logger.error(f"Error rebuilding bill rollups: {e}", exc_info=True)
+        return None, str(e), 500
+
+
 def get_supabase_bills_with_details() -> List[Dict]:
     """
     Get bills with full item details from Supabase.
@@ -1202,15 +1509,8 @@ def create_bill(bill_data: dict) -> Tuple[Optional[str], str, int]:
 
         # Local availability check: available = max(0, product.stock - assigned_in_storeinventory)
         if requested_qty_by_product:
-            local_products = get_products_data()
-            local_inventory = get_store_inventory_data()
-            local_product_map = {p.get("id"): p for p in local_products if p.get("id")}
-            allocated_by_product: Dict[str, int] = {}
-            for row in local_inventory:
-                pid = row.get("productid")
-                if not pid:
-                    continue
-                allocated_by_product[pid] = allocated_by_product.get(pid, 0) + int(row.get("quantity") or 0)
+            local_product_map = get_products_by_ids(list(requested_qty_by_product))
+            allocated_by_product = _allocated_by_product()
 
             for pid, req_qty in requested_qty_by_product.items():
                 product_row = local_product_map.get(pid)
@@ -1231,93 +1531,29 @@ def create_bill(bill_data: dict) -> Tuple[Optional[str], str, int]:
                     ), 400
 
             # Reduce local product stock and clamp to zero
-            for product in local_products:
-                pid = product.get("id")
-                if pid in requested_qty_by_product:
-                    current_stock = int(product.get("stock") or 0)
-                    product["stock"] = max(0, current_stock - requested_qty_by_product[pid])
-                    product["updatedat"] = datetime.now().isoformat()
-            save_products_data(local_products)
-
-        # Save to local JSON first (offline-first)
-        bills = get_bills_data()
+            changed_products = []
+            for pid, req_qty in requested_qty_by_product.items():
+                product = local_product_map[pid]
+                current_stock = int(product.get("stock") or 0)
+                product["stock"] = max(0, current_stock - req_qty)
+                product["updatedat"] = datetime.now().isoformat()
+                changed_products.append(product)
+            _save_local_stock(changed_products)
+
+        # Save to local JSON first (offline-first). Journaled: only this bill
+        # is appended, bills.json is not rewritten per checkout.
         db_bill_data["items"] = items
-        existing_idx = next((i for i, b in enumerate(bills) if b.get("id") == bill_id), -1)
-        if existing_idx >= 0:
-            bills[existing_idx] = db_bill_data
-        else:
-            bills.append(db_bill_data)
-        save_bills_data(bills)
+        db_bill_data["sync_state"] = SYNC_PENDING
+        upsert_bills_data([db_bill_data])
         print(f"💾 Saved to local JSON")
 
-        # Best-effort cloud sync now (queued sync will retry if this fails)
+        # Cloud write-behind: the outbox writes the bill, its items and the
+        # stock change to Supabase in the background and retries until done.
+        bill_outbox.enqueue(bill_id, "create", requested_qty_by_product, bill=db_bill_data)
         supabase_synced = False
-        try:
-            client = db.client
-            print(f"☁️ Attempting immediate Supabase sync for bill...")
-            cloud_bill_data = dict(db_bill_data)
-            cloud_bill_data.pop("items", None)
-            supabase_response = client.table("bills").upsert(cloud_bill_data).execute()
-            supabase_synced = bool(supabase_response.data)
+        if not Config.BILL_CLOUD_WRITE_BEHIND:
+            supabase_synced = bill_outbox.drain_bill(bill_id)
 
-            if items:
-                execute_with_retry(
-                    lambda: client.table("billitems").delete().eq("billid", bill_id),
-                    f"billitems reset for bill {bill_id}",
-                    retries=2,
-                )
-                bill_items_for_db = []
-                next_item_id = _next_billitem_id(client)
-                for item in items:
-                    bill_items_for_db.append(
-                        {
-                            "id": next_item_id,
-                            "billid": bill_id,
-                            "productid": item.get("product_id")
-                            or item.get("productid")
-                            or item.get("productId"),
-                            "quantity": item.get("quantity"),
-                            "price": item.get("price"),
-                            "total": item.get("total"),
-                        }
-                    )
-                    next_item_id += 1
-                if bill_items_for_db:
-                    execute_with_retry(
-                        lambda: client.table("billitems").insert(bill_items_for_db),
-                        f"billitems insert for bill {bill_id}",
-                        retries=2,
-                    )
-
-            # Reduce Supabase product stock and clamp to zero
-            if requested_qty_by_product:
-                product_ids = list(requested_qty_by_product.keys())
-                products_response = execute_with_retry(
-                    lambda: client.table("products").select("id, stock").in_("id", product_ids),
-                    f"products stock lookup for bill {bill_id}",
-                    retries=2,
-                )
-                for row in products_response.data or []:
-                    pid = row.get("id")
-                    if not pid:
-                        continue
-                    current_stock = int(row.get("stock") or 0)
-                    new_stock = max(0, current_stock - int(requested_qty_by_product.get(pid, 0)))
-                    execute_with_retry(
-                        lambda pid=pid, new_stock=new_stock: client.table("products").update({
-                            "stock": new_stock,
-                            "updatedat": datetime.now().isoformat(),
-                        }).eq("id", pid),
-                        f"products stock update {pid} for bill {bill_id}",
-                        retries=2,
-                    )
-            if supabase_synced:
-                print("✅ Immediate Supabase sync completed for bill")
-        except Exception as supabase_error:
-            logger.warning(
-                f"Bill {bill_id} saved locally; Supabase sync deferred: {supabase_error}"
-            )
-        
         print(f"✅ Bill created: {bill_id}")
         logger.info(f"Bill created: {bill_id}")
         if supabase_synced:
@@ -1341,12 +1577,10 @@ def update_bill(bill_id: str, bill_data: dict) -> Tuple[bool, str, int]:
         if not bill_data:
             return False, "No bill data provided", 400
 
-        bills = get_bills_data()
-        bill_index = next((i for i, b in enumerate(bills) if b.get("id") == bill_id), -1)
-        if bill_index == -1:
+        existing_bill = get_bill_by_id(bill_id)
+        if existing_bill is None:
             return False, "Bill not found", 404
 
-        existing_bill = bills[bill_index]
         created_ts_raw = (
             existing_bill.get("timestamp")
             or existing_bill.get("created_at")
@@ -1373,15 +1607,8 @@ def update_bill(bill_id: str, bill_data: dict) -> Tuple[bool, str, int]:
 
         # Local stock validation/apply by delta:
         # +delta => consume more stock, -delta => restore stock
-        local_products = get_products_data()
-        local_inventory = get_store_inventory_data()
-        local_product_map = {p.get("id"): p for p in local_products if p.get("id")}
-        allocated_by_product: Dict[str, int] = {}
-        for row in local_inventory:
-            pid = row.get("productid")
-            if not pid:
-                continue
-            allocated_by_product[pid] = allocated_by_product.get(pid, 0) + int(row.get("quantity") or 0)
+        local_product_map = get_products_by_ids([pid for pid in qty_delta_by_product if pid])
+        allocated_by_product = _allocated_by_product()
 
         for pid, delta in qty_delta_by_product.items():
             if delta <= 0:
@@ -1403,17 +1630,16 @@ def update_bill(bill_id: str, bill_data: dict) -> Tuple[bool, str, int]:
                     allocated_qty=allocated,
                 ), 400
 
-        for product in local_products:
-            pid = product.get("id")
-            if not pid:
-                continue
+        changed_products = []
+        for pid, product in local_product_map.items():
             delta = int(qty_delta_by_product.get(pid, 0))
             if delta == 0:
                 continue
             current_stock = int(product.get("stock") or 0)
             product["stock"] = max(0, current_stock - delta)
             product["updatedat"] = datetime.now().isoformat()
-        save_products_data(local_products)
+            changed_products.append(product)
+        _save_local_stock(changed_products)
 
         customer_id = (
             bill_data.get("customerId")
@@ -1456,84 +1682,14 @@ def update_bill(bill_id: str, bill_data: dict) -> Tuple[bool, str, int]:
         if bill_data.get("customerPhone") is not None:
             updated_bill["customer_phone"] = bill_data.get("customerPhone")
 
-        bills[bill_index] = updated_bill
-        save_bills_data(bills)
+        updated_bill["sync_state"] = SYNC_PENDING
+        upsert_bills_data([updated_bill])
 
-        # Best-effort cloud sync
-        try:
-            client = db.client
-            cloud_bill_data = {
-                "customerid": customer_id,
-                "paymentmethod": payment_method,
-                "status": status,
-                "subtotal": subtotal,
-                "total": total,
-                "discount_amount": discount_amount,
-                "discount_percentage": discount_percentage,
-                "updated_at": datetime.now().isoformat(),
-            }
-            execute_with_retry(
-                lambda: client.table("bills").update(cloud_bill_data).eq("id", bill_id),
-                f"bill update {bill_id}",
-                retries=2,
-            )
-
-            execute_with_retry(
-                lambda: client.table("billitems").delete().eq("billid", bill_id),
-                f"billitems reset for bill {bill_id}",
-                retries=2,
-            )
-            bill_items_for_db = []
-            next_item_id = _next_billitem_id(client)
-            for item in updated_items:
-                bill_items_for_db.append(
-                    {
-                        "id": next_item_id,
-                        "billid": bill_id,
-                        "productid": item.get("product_id")
-                        or item.get("productid")
-                        or item.get("productId"),
-                        "quantity": item.get("quantity"),
-                        "price": item.get("price"),
-                        "total": item.get("total"),
-                    }
-                )
-                next_item_id += 1
-            if bill_items_for_db:
-                execute_with_retry(
-                    lambda: client.table("billitems").insert(bill_items_for_db),
-                    f"billitems insert for updated bill {bill_id}",
-                    retries=2,
-                )
-
-            # Apply stock delta in cloud
-            cloud_stock_deltas = {pid: delta for pid, delta in qty_delta_by_product.items() if delta != 0}
-            if cloud_stock_deltas:
-                cloud_product_ids = list(cloud_stock_deltas.keys())
-                products_response = execute_with_retry(
-                    lambda: client.table("products").select("id, stock").in_("id", cloud_product_ids),
-                    f"products stock lookup for updated bill {bill_id}",
-                    retries=2,
-                )
-                for row in products_response.data or []:
-                    pid = row.get("id")
-                    if not pid:
-                        continue
-                    delta = int(cloud_stock_deltas.get(pid, 0))
-                    current_stock = int(row.get("stock") or 0)
-                    new_stock = max(0, current_stock - delta)
-                    execute_with_retry(
-                        lambda pid=pid, new_stock=new_stock: client.table("products").update({
-                            "stock": new_stock,
-                            "updatedat": datetime.now().isoformat(),
-                        }).eq("id", pid),
-                        f"products stock update {pid} for updated bill {bill_id}",
-                        retries=2,
-                    )
-        except Exception as supabase_error:
-            logger.warning(
-                f"Bill {bill_id} updated locally; Supabase sync deferred: {supabase_error}"
-            )
+        # Written to Supabase by the outbox, after any earlier pending change
+        # of this bill.
+        bill_outbox.enqueue(bill_id, "update", qty_delta_by_product, bill=updated_bill)
+        if not Config.BILL_CLOUD_WRITE_BEHIND:
+            bill_outbox.drain_bill(bill_id)
 
         logger.info(f"Bill updated: {bill_id}")
         return True, "Bill updated", 200
@@ -1551,13 +1707,16 @@ def delete_bill(bill_id: str) -> Tuple[bool, str, int]:
     try:
         print(f"🗑️ Deleting bill: {bill_id}")
         
+        # Pending cloud writes of this bill go first; whatever could not be
+        # written is dropped, or the outbox would recreate it in Supabase
+        # after the delete. Refuse while one is still being written.
+        bill_outbox.drain_bill(bill_id)
+        if not bill_outbox.discard(bill_id):
+            return False, "Bill is being synced; try again shortly", 409
+
         # Delete from local JSON
-        bills = get_bills_data()
-        bill_index = next((i for i, b in enumerate(bills) if b.get("id") == bill_id), -1)
-        
-        if bill_index != -1:
-            bills.pop(bill_index)
-            save_bills_data(bills)
+        if get_bill_by_id(bill_id) is not None:
+            delete_bills_data([bill_id])
             print(f"✅ Deleted from local")
         else:
             print(f"⚠️  Bill not found in local storage")
@@ -1641,8 +1800,9 @@ def cancel_bill(
     2) mark the bill status as cancelled for audit/history
     """
     try:
-        bills = get_bills_data()
-        local_bill = next((b for b in bills if b.get("id") == bill_id), None)
+        # Land the bill's pending cloud writes before touching it in Supabase.
+        bill_outbox.drain_bill(bill_id)
+        local_bill = get_bill_by_id(bill_id)
 
         cloud_bill: Optional[Dict] = None
         try:
@@ -1699,15 +1859,16 @@ def cancel_bill(
         now_iso = datetime.now().isoformat()
         cancelled_by_value = str(cancelled_by or "").strip()
 
-        local_products = get_products_data()
-        local_product_map = {p.get("id"): p for p in local_products if p.get("id")}
+        local_product_map = get_products_by_ids(list(qty_by_product))
+        changed_products = []
         for pid, qty in qty_by_product.items():
             product_row = local_product_map.get(pid)
             if not product_row:
                 continue
             product_row["stock"] = int(product_row.get("stock") or 0) + qty
             product_row["updatedat"] = now_iso
-        save_products_data(local_products)
+            changed_products.append(product_row)
+        _save_local_stock(changed_products)
 
         local_inventory = get_store_inventory_data()
         for pid, qty in qty_by_product.items():
@@ -1741,7 +1902,7 @@ def cancel_bill(
                 local_bill["cancelled_by"] = cancelled_by_value
             local_bill["updated_at"] = now_iso
             local_bill["updatedat"] = now_iso
-            save_bills_data(bills)
+            upsert_bills_data([local_bill])
 
         cloud_sync_deferred = False
         try:
@@ -1759,7 +1920,7 @@ def cancel_bill(
                 if inv_resp.data:
                     inv_row = inv_resp.data[0]
                     new_qty = int(inv_row.get("quantity") or 0) + qty
-                    execute_with_retry(
+                    written = execute_with_retry(
                         lambda inv_id=inv_row.get("id"), new_qty=new_qty: client.table("storeinventory").update(
                             {"quantity": new_qty, "updatedat": now_iso}
                         ).eq("id", inv_id),
@@ -1767,7 +1928,7 @@ def cancel_bill(
                         retries=2,
                     )
                 else:
-                    execute_with_retry(
+                    written = execute_with_retry(
                         lambda pid=pid, qty=qty: client.table("storeinventory").insert(
                             {
                                 "id": f"SINV-{uuid.uuid4().hex[:12]}",
@@ -1781,22 +1942,14 @@ def cancel_bill(
                         f"storeinventory restock insert for cancel {bill_id}/{pid}",
                         retries=2,
                     )
+                allocation_index.record(written.data if written else [])
 
-                prod_resp = execute_with_retry(
-                    lambda pid=pid: client.table("products").select("id, stock").eq("id", pid).limit(1),
-                    f"products lookup for cancel {bill_id}/{pid}",
-                    retries=2,
-                )
-                if prod_resp.data:
-                    row = prod_resp.data[0]
-                    new_stock = int(row.get("stock") or 0) + qty
-                    execute_with_retry(
-                        lambda pid=pid, new_stock=new_stock: client.table("products").update(
-                            {"stock": new_stock, "updatedat": now_iso}
-                        ).eq("id", pid),
-                        f"products restock update for cancel {bill_id}/{pid}",
-                        retries=2,
-                    )
+            adjust_product_stock(
+                client,
+                {pid: -qty for pid, qty in qty_by_product.items()},
+                f"cancel {bill_id}",
+                now_iso,
+            )
 
             execute_with_retry(
                 lambda: client.table("bills").update({
@@ -1831,8 +1984,9 @@ def revise_bill(bill_id: str, store_id_override: Optional[str] = None) -> Tuple[
     2) deleting bill-related rows/data
     """
     try:
-        bills = get_bills_data()
-        local_bill = next((b for b in bills if b.get("id") == bill_id), None)
+        # Land the bill's pending cloud writes before touching it in Supabase.
+        bill_outbox.drain_bill(bill_id)
+        local_bill = get_bill_by_id(bill_id)
 
         cloud_bill: Optional[Dict] = None
         try:
@@ -1886,8 +2040,8 @@ def revise_bill(bill_id: str, store_id_override: Optional[str] = None) -> Tuple[
         now_iso = datetime.now().isoformat()
 
         # Step 1A: Local restock (storeinventory + products)
-        local_products = get_products_data()
-        local_product_map = {p.get("id"): p for p in local_products if p.get("id")}
+        local_product_map = get_products_by_ids(list(qty_by_product))
+        changed_products = []
         for pid, qty in qty_by_product.items():
             product_row = local_product_map.get(pid)
             if not product_row:
@@ -1895,7 +2049,8 @@ def revise_bill(bill_id: str, store_id_override: Optional[str] = None) -> Tuple[
             current_stock = int(product_row.get("stock") or 0)
             product_row["stock"] = current_stock + qty
             product_row["updatedat"] = now_iso
-        save_products_data(local_products)
+            changed_products.append(product_row)
+        _save_local_stock(changed_products)
 
         local_inventory = get_store_inventory_data()
         for pid, qty in qty_by_product.items():
@@ -1942,7 +2097,7 @@ def revise_bill(bill_id: str, store_id_override: Optional[str] = None) -> Tuple[
                 if inv_resp.data:
                     inv_row = inv_resp.data[0]
                     new_qty = int(inv_row.get("quantity") or 0) + qty
-                    execute_with_retry(
+                    written = execute_with_retry(
                         lambda inv_id=inv_row.get("id"), new_qty=new_qty: client.table("storeinventory").update(
                             {"quantity": new_qty, "updatedat": now_iso}
                         ).eq("id", inv_id),
@@ -1950,7 +2105,7 @@ def revise_bill(bill_id: str, store_id_override: Optional[str] = None) -> Tuple[
                         retries=2,
                     )
                 else:
-                    execute_with_retry(
+                    written = execute_with_retry(
                         lambda pid=pid, qty=qty: client.table("storeinventory").insert(
                             {
                                 "id": f"SINV-{uuid.uuid4().hex[:12]}",
@@ -1964,22 +2119,14 @@ def revise_bill(bill_id: str, store_id_override: Optional[str] = None) -> Tuple[
                         f"storeinventory restock insert for revise {bill_id}/{pid}",
                         retries=2,
                     )
+                allocation_index.record(written.data if written else [])
 
-                prod_resp = execute_with_retry(
-                    lambda pid=pid: client.table("products").select("id, stock").eq("id", pid).limit(1),
-                    f"products lookup for revise {bill_id}/{pid}",
-                    retries=2,
-                )
-                if prod_resp.data:
-                    row = prod_resp.data[0]
-                    new_stock = int(row.get("stock") or 0) + qty
-                    execute_with_retry(
-                        lambda pid=pid, new_stock=new_stock: client.table("products").update(
-                            {"stock": new_stock, "updatedat": now_iso}
-                        ).eq("id", pid),
-                        f"products restock update for revise {bill_id}/{pid}",
-                        retries=2,
-                    )
+            adjust_product_stock(
+                client,
+                {pid: -qty for pid, qty in qty_by_product.items()},
+                f"revise {bill_id}",
+                now_iso,
+            )
         except Exception as restock_error:
             cloud_restock_completed = False
             if is_circuit_open_error(restock_error) or is_transient_supabase_error(restock_error):
@@ -1996,8 +2143,7 @@ def revise_bill(bill_id: str, store_id_override: Optional[str] = None) -> Tuple[
 
         # Step 2A: Delete local bill + local discounts references
         if local_bill:
-            filtered_local_bills = [b for b in bills if b.get("id") != bill_id]
-            save_bills_data(filtered_local_bills)
+            delete_bills_data([bill_id])
 
         try:
             discounts = get_discounts_data()
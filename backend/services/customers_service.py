@@ -14,6 +14,7 @@ from utils.supabase_resilience import execute_with_retry, is_circuit_open_error
 from utils.json_helpers import get_customers_data, save_customers_data, get_bills_data
 from utils.json_utils import convert_camel_to_snake, convert_snake_to_camel
 from utils.concurrency_guard import extract_base_markers, safe_update_with_conflict_check
+from utils.single_flight import single_flight
 
 logger = logging.getLogger(__name__)
 
@@ -76,6 +77,7 @@ def get_supabase_customers() -> List[Dict]:
 # MERGED OPERATIONS
 # ============================================
 
+@single_flight("customers", ttl=15, stale=120, groups=("customers",))
 def get_merged_customers() -> Tuple[List[Dict], int]:
     """
     Get customers by merging local and Supabase (Supabase takes precedence).
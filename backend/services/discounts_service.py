@@ -18,6 +18,7 @@ from utils.supabase_resilience import (
 )
 from utils.json_helpers import get_discounts_data, save_discounts_data
 from utils.json_utils import convert_camel_to_snake, convert_snake_to_camel
+from utils.process_coordination import change_counter
 
 logger = logging.getLogger(__name__)
 
@@ -54,10 +55,18 @@ def _set_discounts_cache(status: Optional[str], limit: Optional[int], data: List
 
 
 def _invalidate_discounts_cache() -> None:
+    _drop_discounts_cache()
+    change_counter.bump("discounts")
+
+
+def _drop_discounts_cache() -> None:
     with _DISCOUNTS_CACHE_LOCK:
         _DISCOUNTS_CACHE.clear()
 
 
+change_counter.register("discounts", _drop_discounts_cache)
+
+
 def _create_discount_notification(discount_data: Dict) -> None:
     """Best-effort notification for new discount requests."""
     try:
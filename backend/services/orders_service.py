@@ -27,6 +27,8 @@ from utils.json_helpers import (
 from utils.json_utils import convert_snake_to_camel
 from utils.supabase_db import db
 from utils.supabase_resilience import execute_with_retry, is_transient_supabase_error
+from utils.single_flight import single_flight
+from utils.allocation_index import allocation_index
 
 logger = logging.getLogger(__name__)
 
@@ -551,6 +553,7 @@ def _enrich_orders_with_totals(client: Any, orders: List[Dict], store_id_for_lab
     return result
 
 
+@single_flight("transfer orders", ttl=15, stale=120, groups=("transfer_orders",))
 def get_transfer_orders(
     store_id: Optional[str] = None,
     status: Optional[str] = None,
@@ -1029,16 +1032,10 @@ def update_transfer_order(order_id: str, payload: Dict[str, Any]) -> Tuple[bool,
                 if product_id not in product_map:
                     return False, f"Product not found: {product_id}", 404, {}
 
-            allocations_response = execute_with_retry(
-                lambda: client.table("storeinventory").select("*"),
-                f"storeinventory for order edit {order_id}",
-            )
-            allocation_rows = allocations_response.data or []
+            allocated = allocation_index.by_product()
             total_allocated_by_product: Dict[str, int] = defaultdict(int)
-            for row in allocation_rows:
-                pid = row.get("productid") or row.get("productId")
-                if pid and pid in requested_by_product:
-                    total_allocated_by_product[str(pid)] += _to_int(row.get("quantity"))
+            for pid in requested_by_product:
+                total_allocated_by_product[str(pid)] = allocated.get(str(pid), 0)
 
             reserved_rows: List[Dict[str, Any]] = []
             select_expr = (
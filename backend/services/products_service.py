@@ -4,14 +4,21 @@ Handles all product-related business logic and database operations
 """
 
 import logging
+import re
 import time
 import threading
 import uuid
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from decimal import Decimal
+from config import Config
 from utils.supabase_db import db
-from utils.supabase_resilience import execute_with_retry, is_circuit_open_error
+from utils.supabase_resilience import (
+    execute_with_retry,
+    is_circuit_open_error,
+    is_missing_rpc_error,
+    is_missing_table_error,
+)
 from utils.json_helpers import (
     get_products_data,
     save_products_data,
@@ -20,9 +27,19 @@ from utils.json_helpers import (
     save_returns_data,
     get_store_inventory_data,
     save_store_inventory_data,
-    get_bill_items_data,
+    iter_bill_items,
+    sum_bill_item_quantities,
+    upsert_products_data,
 )
 from utils.json_utils import convert_camel_to_snake, convert_snake_to_camel
+from utils.product_projection import project_products
+from utils.supabase_pagination import fetch_all_rows
+from utils.delta_cache import DeltaAggregate, DeltaSource
+from utils.allocation_index import allocation_index
+from utils.barcode_index import barcode_index, barcodes_of
+from utils.product_search import product_search
+from utils.process_coordination import change_counter
+from utils.single_flight import invalidate as invalidate_cached, single_flight
 from utils.concurrency_guard import extract_base_markers, safe_update_with_conflict_check
 
 logger = logging.getLogger(__name__)
@@ -91,13 +108,7 @@ _HSN_TAX_CACHE: Dict[str, object] = {"map": None, "ts": 0.0}
 _HSN_TAX_CACHE_TTL = 60.0  # seconds
 _HSN_TAX_LOCK = threading.Lock()
 
-_INVENTORY_ALLOC_CACHE: Dict[str, object] = {"map": None, "ts": 0.0}
-_INVENTORY_ALLOC_TTL = 30.0  # seconds
-_INVENTORY_ALLOC_LOCK = threading.Lock()
-
-_SOLD_QTY_CACHE: Dict[str, object] = {"map": None, "ts": 0.0}
 _SOLD_QTY_TTL = 60.0  # seconds — bills come from the POS, not this service
-_SOLD_QTY_LOCK = threading.Lock()
 
 # Page size used when streaming the full catalog out of Supabase to the
 # frontend. Smaller pages trade extra round-trips for a faster time-to-first
@@ -117,32 +128,6 @@ def _safe_int(value) -> int:
         return 0
 
 
-def _paginate_table(table: str, select_expr: str, label: str) -> List[Dict]:
-    """Paginate a Supabase select using the larger internal page size. Only
-    used by cache builders — never serves rows directly to the UI."""
-    client = db.client
-    rows: List[Dict] = []
-    start = 0
-    while True:
-        end = start + _AGG_PAGE_SIZE - 1
-        resp = execute_with_retry(
-            lambda s=start, e=end: client.table(table).select(select_expr).range(s, e),
-            f"{label} agg page {start // _AGG_PAGE_SIZE + 1}",
-            retries=2,
-        )
-        page = resp.data if resp and resp.data is not None else []
-        if not page:
-            break
-        rows.extend(page)
-        if len(page) < _AGG_PAGE_SIZE:
-            break
-        start += _AGG_PAGE_SIZE
-        if start > 1_000_000:
-            logger.warning("Aggregation page cap hit for %s", label)
-            break
-    return rows
-
-
 def _get_hsn_tax_map(force_refresh: bool = False) -> Dict[str, float]:
     """Return HSN tax map keyed by HSN id from local JSON and Supabase.
 
@@ -194,208 +179,199 @@ def _get_hsn_tax_map(force_refresh: bool = False) -> Dict[str, float]:
         return tax_map
 
 
-def _get_inventory_allocation_map(force_refresh: bool = False) -> Dict[str, int]:
-    """Return total allocated stock per product across all stores.
+def _bill_item_contribution(row: Dict, agg) -> List[Tuple[str, int]]:
+    bill = agg.parent_row(_BILL_ITEMS_SOURCE, row)
+    status = str((bill or {}).get("status") or "").strip().lower()
+    if status and status not in ("completed", "paid"):
+        return []
+    return [(row.get("productid"), _safe_int(row.get("quantity")))]
 
-    Cached for `_INVENTORY_ALLOC_TTL` seconds. Heavy to compute because it has
-    to walk the entire storeinventory table, so caching is essential.
-    """
-    now = time.time()
-    cached = _INVENTORY_ALLOC_CACHE.get("map")
-    cached_ts = float(_INVENTORY_ALLOC_CACHE.get("ts") or 0)
-    if not force_refresh and cached is not None and (now - cached_ts) < _INVENTORY_ALLOC_TTL:
-        return cached  # type: ignore[return-value]
 
-    with _INVENTORY_ALLOC_LOCK:
-        cached = _INVENTORY_ALLOC_CACHE.get("map")
-        cached_ts = float(_INVENTORY_ALLOC_CACHE.get("ts") or 0)
-        if not force_refresh and cached is not None and (time.time() - cached_ts) < _INVENTORY_ALLOC_TTL:
-            return cached  # type: ignore[return-value]
+def _return_contribution(row: Dict, _agg) -> List[Tuple[str, int]]:
+    status = str(row.get("status") or "").strip().lower()
+    qty = _safe_int(row.get("return_quantity"))
+    if (status and status != "approved") or qty <= 0:
+        return []
+    return [(row.get("product_id"), -qty)]
 
-        allocated_by_product: Dict[str, int] = {}
-        try:
-            for row in _paginate_table("storeinventory", "productid, quantity", "storeinventory"):
-                pid = row.get("productid")
-                if not pid:
-                    continue
-                allocated_by_product[str(pid)] = (
-                    allocated_by_product.get(str(pid), 0) + _safe_int(row.get("quantity"))
-                )
-        except Exception as e:
-            logger.warning(
-                "Inventory allocation refresh failed; falling back to local cache: %s", e
+
+def _replacement_contribution(row: Dict, _agg) -> List[Tuple[str, int]]:
+    qty = _safe_int(row.get("quantity"))
+    return [(row.get("replaced_product_id"), -qty)] if qty > 0 else []
+
+
+_BILL_ITEMS_SOURCE = DeltaSource(
+    "billitems", "billitems", ["billid", "productid", "quantity"], _bill_item_contribution,
+    watermark=None, parent=("bills", "billid"),
+)
+
+# Net sold quantity per product, computed here until the Supabase
+# product_sales_ledger is installed. Bill items and replacements are only ever
+# written together with their bill, so they are re-read through it.
+_SOLD_QTY = DeltaAggregate(
+    "sold quantity",
+    [
+        DeltaSource("bills", "bills", ["status"], lambda row, agg: [], watermark="updated_at"),
+        _BILL_ITEMS_SOURCE,
+        DeltaSource("returns", "returns", ["product_id", "return_quantity", "status"],
+                    _return_contribution, key="return_id", watermark="updated_at"),
+        DeltaSource("replacements", "replacements", ["replaced_product_id", "quantity"],
+                    _replacement_contribution, watermark=None, parent=("bills", "bill_id")),
+    ],
+    ttl=_SOLD_QTY_TTL,
+    full_every=Config.DELTA_CACHE_FULL_REBUILD_SECONDS,
+    client=lambda: db.client,
+    finalize=lambda totals: {pid: max(0, qty) for pid, qty in totals.items()},
+    page_size=_AGG_PAGE_SIZE,
+)
+
+
+def _get_inventory_allocation_map(force_refresh: bool = False, wait: bool = True) -> Dict[str, int]:
+    """Return total allocated stock per product across all stores.
+
+    Read from the live allocation index (see utils/allocation_index.py).
+    With wait=False the index is never loaded or checked in this thread.
+    """
+    try:
+        if force_refresh:
+            allocation_index.mark_stale()
+        return allocation_index.by_product(wait=wait)
+    except Exception as e:
+        logger.warning(
+            "Inventory allocation refresh failed; falling back to local cache: %s", e
+        )
+    allocated_by_product: Dict[str, int] = {}
+    try:
+        for row in get_store_inventory_data() or []:
+            pid = row.get("productid") or row.get("productId")
+            if not pid:
+                continue
+            allocated_by_product[str(pid)] = (
+                allocated_by_product.get(str(pid), 0) + _safe_int(row.get("quantity"))
             )
-            try:
-                for row in get_store_inventory_data() or []:
-                    pid = row.get("productid") or row.get("productId")
-                    if not pid:
-                        continue
-                    allocated_by_product[str(pid)] = (
-                        allocated_by_product.get(str(pid), 0) + _safe_int(row.get("quantity"))
-                    )
-            except Exception:
-                pass
+    except Exception:
+        pass
+    return allocated_by_product
 
-        _INVENTORY_ALLOC_CACHE["map"] = allocated_by_product
-        _INVENTORY_ALLOC_CACHE["ts"] = time.time()
-        return allocated_by_product
 
+_SALES_LEDGER_MIGRATION = "20261017_product_sales_ledger.sql"
+_SALES_LEDGER_RETRY_SECONDS = 300.0
+_SALES_LEDGER_CACHE: Dict[str, object] = {"map": None, "ts": 0.0, "missing_since": None}
+_SALES_LEDGER_LOCK = threading.Lock()
 
-def _get_sold_quantity_map(force_refresh: bool = False) -> Dict[str, int]:
-    """Return net sold quantity per product = billitems (non-cancelled bills)
-    minus approved returns minus replacements (the replaced product was sent
-    back to inventory)."""
+
+def _read_sales_ledger(force_refresh: bool = False) -> Optional[Dict[str, int]]:
+    """Net sold quantity per product from the Supabase product_sales_ledger,
+    which triggers keep current (one row per product). None while the
+    migration is not applied."""
     now = time.time()
-    cached = _SOLD_QTY_CACHE.get("map")
-    cached_ts = float(_SOLD_QTY_CACHE.get("ts") or 0)
-    if not force_refresh and cached is not None and (now - cached_ts) < _SOLD_QTY_TTL:
+    missing_since = _SALES_LEDGER_CACHE.get("missing_since")
+    if missing_since is not None and now - float(missing_since) < _SALES_LEDGER_RETRY_SECONDS:
+        return None
+    cached = _SALES_LEDGER_CACHE.get("map")
+    if not force_refresh and cached is not None and now - float(_SALES_LEDGER_CACHE["ts"]) < _SOLD_QTY_TTL:
         return cached  # type: ignore[return-value]
 
-    with _SOLD_QTY_LOCK:
-        cached = _SOLD_QTY_CACHE.get("map")
-        cached_ts = float(_SOLD_QTY_CACHE.get("ts") or 0)
-        if not force_refresh and cached is not None and (time.time() - cached_ts) < _SOLD_QTY_TTL:
+    with _SALES_LEDGER_LOCK:
+        cached = _SALES_LEDGER_CACHE.get("map")
+        if not force_refresh and cached is not None and time.time() - float(_SALES_LEDGER_CACHE["ts"]) < _SOLD_QTY_TTL:
             return cached  # type: ignore[return-value]
-
-        sold_by_product: Dict[str, int] = {}
-
-        # 1) Build the set of bills that shouldn't count as a sale.
-        cancelled_or_voided: set = set()
         try:
-            for row in _paginate_table("bills", "id, status", "bills status"):
-                bill_id = row.get("id")
-                if not bill_id:
-                    continue
-                status = str(row.get("status") or "").strip().lower()
-                if status and status not in ("completed", "paid"):
-                    cancelled_or_voided.add(str(bill_id))
+            rows = fetch_all_rows(
+                db.client,
+                "product_sales_ledger",
+                "product_id,sold_qty",
+                label="product sales ledger",
+                page_size=_AGG_PAGE_SIZE,
+                key="product_id",
+            )
         except Exception as e:
-            logger.warning("Bills status lookup failed; treating all bills as completed: %s", e)
+            if not is_missing_table_error(e):
+                raise
+            if _SALES_LEDGER_CACHE.get("missing_since") is None:
+                logger.warning(
+                    "product_sales_ledger is not installed in Supabase; computing sold quantities here "
+                    f"(apply migrations/{_SALES_LEDGER_MIGRATION})"
+                )
+            _SALES_LEDGER_CACHE["missing_since"] = time.time()
+            return None
+        sold = {str(row["product_id"]): max(0, _safe_int(row.get("sold_qty"))) for row in rows if row.get("product_id")}
+        _SALES_LEDGER_CACHE.update({"map": sold, "ts": time.time(), "missing_since": None})
+        return sold
 
-        # 2) Sum billitems.quantity per product, skipping cancelled bills.
-        try:
-            for row in _paginate_table("billitems", "billid, productid, quantity", "billitems"):
-                bill_id = row.get("billid")
-                if bill_id and str(bill_id) in cancelled_or_voided:
-                    continue
-                pid = row.get("productid")
-                if not pid:
-                    continue
-                sold_by_product[str(pid)] = sold_by_product.get(str(pid), 0) + _safe_int(row.get("quantity"))
-        except Exception as e:
-            logger.warning("billitems aggregation failed; falling back to local cache: %s", e)
-            try:
-                for row in get_bill_items_data() or []:
-                    pid = row.get("productid") or row.get("product_id") or row.get("productId")
-                    if not pid:
-                        continue
-                    sold_by_product[str(pid)] = sold_by_product.get(str(pid), 0) + _safe_int(row.get("quantity"))
-            except Exception:
-                pass
-
-        # 3) Subtract approved returns.
-        try:
-            for row in _paginate_table("returns", "product_id, return_quantity, status", "returns"):
-                pid = row.get("product_id")
-                if not pid:
-                    continue
-                status = str(row.get("status") or "").strip().lower()
-                if status and status != "approved":
-                    continue
-                qty = _safe_int(row.get("return_quantity"))
-                if qty <= 0:
-                    continue
-                key = str(pid)
-                sold_by_product[key] = max(0, sold_by_product.get(key, 0) - qty)
-        except Exception as e:
-            logger.warning("Returns subtraction failed (ignoring): %s", e)
 
-        # 4) Subtract replacements (the replaced product went back to stock).
-        try:
-            for row in _paginate_table("replacements", "replaced_product_id, quantity", "replacements"):
-                pid = row.get("replaced_product_id")
-                if not pid:
-                    continue
-                qty = _safe_int(row.get("quantity"))
-                if qty <= 0:
-                    continue
-                key = str(pid)
-                sold_by_product[key] = max(0, sold_by_product.get(key, 0) - qty)
-        except Exception as e:
-            logger.warning("Replacements subtraction failed (ignoring): %s", e)
+def verify_sales_ledger() -> Optional[int]:
+    """Check the ledger against a full recomputation in Supabase (it is
+    rebuilt there if they differ). Returns the number of products that were
+    off, or None while the ledger is not installed."""
+    try:
+        response = execute_with_retry(
+            lambda: db.client.rpc("verify_product_sales_ledger", {}),
+            "product sales ledger verification",
+            retries=0,
+        )
+    except Exception as e:
+        if is_missing_rpc_error(e):
+            return None
+        raise
+    drift = _safe_int(response.data)
+    if drift:
+        logger.warning(f"Product sales ledger was off for {drift} products; rebuilt from history")
+        _SALES_LEDGER_CACHE["ts"] = 0.0
+        invalidate_cached("products")
+    return drift
 
-        _SOLD_QTY_CACHE["map"] = sold_by_product
-        _SOLD_QTY_CACHE["ts"] = time.time()
-        return sold_by_product
 
+def start_sales_ledger_verifier() -> None:
+    """Verify the ledger every Config.SALES_LEDGER_VERIFY_SECONDS (sync leader only)."""
 
-def invalidate_products_caches() -> None:
-    """Drop cached HSN + inventory + sold maps. Call after a write that
-    could have changed any of these (create/update/delete product, etc.)."""
-    _HSN_TAX_CACHE["map"] = None
-    _HSN_TAX_CACHE["ts"] = 0.0
-    _INVENTORY_ALLOC_CACHE["map"] = None
-    _INVENTORY_ALLOC_CACHE["ts"] = 0.0
-    _SOLD_QTY_CACHE["map"] = None
-    _SOLD_QTY_CACHE["ts"] = 0.0
-
-
-def _transform_product_row(
-    product: Dict,
-    hsn_tax_map: Dict[str, float],
-    allocated_by_product: Optional[Dict[str, int]] = None,
-    sold_by_product: Optional[Dict[str, int]] = None,
-) -> Dict:
-    """Shape a raw Supabase products row into the response format used by the
-    products page (camelCase, derived hsnCode/tax, parsed barcodes list,
-    optional availableStock + soldStock + lifetimeStock).
-    """
-    converted_product = convert_snake_to_camel(product)
+    def run():
+        while True:
+            time.sleep(Config.SALES_LEDGER_VERIFY_SECONDS)
+            try:
+                verify_sales_ledger()
+            except Exception as e:
+                logger.warning(f"Product sales ledger verification failed: {e}")
 
-    if 'hsnCodeId' in converted_product:
-        converted_product['hsnCode'] = converted_product.pop('hsnCodeId')
+    threading.Thread(target=run, name="sales-ledger-verify", daemon=True).start()
 
-    hsn_code_id = converted_product.get("hsnCode")
-    if hsn_code_id is not None and str(hsn_code_id).strip() != "":
-        converted_product["tax"] = hsn_tax_map.get(str(hsn_code_id), 0.0)
-    else:
-        converted_product["tax"] = 0.0
 
-    if 'sellingPrice' in converted_product and converted_product['sellingPrice']:
-        converted_product['displayPrice'] = converted_product['sellingPrice']
-    elif 'price' in converted_product:
-        converted_product['displayPrice'] = converted_product['price']
+def _get_sold_quantity_map(force_refresh: bool = False) -> Dict[str, int]:
+    """Return net sold quantity per product = billitems (non-cancelled bills)
+    minus approved returns minus replacements (the replaced product was sent
+    back to inventory)."""
+    try:
+        sold = _read_sales_ledger(force_refresh)
+        if sold is not None:
+            return sold
+        return _SOLD_QTY.get(force_refresh)
+    except Exception as e:
+        logger.warning("Sold quantity refresh failed; falling back to local cache: %s", e)
+    try:
+        return sum_bill_item_quantities()
+    except Exception:
+        return {}
 
-    barcode_str = converted_product.get('barcode')
-    if isinstance(barcode_str, str) and barcode_str.strip():
-        converted_product['barcodes'] = [b.strip() for b in barcode_str.split(',') if b.strip()]
-    else:
-        converted_product['barcodes'] = []
 
-    if 'batchid' in converted_product and converted_product['batchid']:
-        converted_product['batchId'] = converted_product['batchid']
-    elif 'batchId' not in converted_product:
-        converted_product['batchId'] = None
+def invalidate_products_caches() -> None:
+    """Drop cached HSN + inventory + sold maps. Call after a write that
+    could have changed any of these (create/update/delete product, etc.)."""
+    _clear_products_caches()
+    invalidate_cached("products")
 
-    product_id = str(converted_product.get("id") or "")
-    global_stock = int(converted_product.get("stock") or 0)
 
-    if allocated_by_product is not None:
-        allocated = int(allocated_by_product.get(product_id, 0))
-        converted_product["globalStock"] = global_stock
-        converted_product["allocatedStock"] = allocated
-        converted_product["inStoresStock"] = allocated
-        converted_product["availableStock"] = max(0, global_stock - allocated)
+def _clear_products_caches() -> None:
+    _HSN_TAX_CACHE["map"] = None
+    _HSN_TAX_CACHE["ts"] = 0.0
+    _SALES_LEDGER_CACHE["ts"] = 0.0
+    # Picked up from deltas on next use, not rebuilt.
+    _SOLD_QTY.invalidate()
 
-    if sold_by_product is not None:
-        sold_qty = int(sold_by_product.get(product_id, 0))
-        converted_product["soldStock"] = sold_qty
-        # "Lifetime stock" — currently owned + already sold.
-        converted_product["lifetimeStock"] = global_stock + sold_qty
 
-    return converted_product
+change_counter.register("products", _clear_products_caches)
 
 
+@single_flight("products page", ttl=10, stale=60, groups=("products",))
 def get_supabase_products_page(page: int, page_size: int = PRODUCTS_PAGE_SIZE) -> Dict:
     """Fetch a single page of products directly from Supabase with cached
     HSN tax + inventory allocation + sold-quantity lookups. Newest first.
@@ -431,10 +407,7 @@ def get_supabase_products_page(page: int, page_size: int = PRODUCTS_PAGE_SIZE) -
     allocated_by_product = _get_inventory_allocation_map()
     sold_by_product = _get_sold_quantity_map()
 
-    transformed = [
-        _transform_product_row(row, hsn_tax_map, allocated_by_product, sold_by_product)
-        for row in rows
-    ]
+    transformed = project_products(rows, hsn_tax_map, allocated_by_product, sold_by_product)
 
     has_more = bool(rows) and len(rows) >= page_size
     if total is not None:
@@ -608,43 +581,7 @@ def get_local_products() -> List[Dict]:
     """Get products from local JSON storage"""
     try:
         products = get_products_data()
-        transformed_products = []
-        hsn_tax_map = _get_hsn_tax_map()
-        
-        for product in products:
-            converted_product = convert_snake_to_camel(product)
-            
-            # Convert hsn_code_id to hsnCode for frontend
-            if 'hsnCodeId' in converted_product:
-                converted_product['hsnCode'] = converted_product.pop('hsnCodeId')
-
-            hsn_code_id = converted_product.get("hsnCode")
-            if hsn_code_id is not None and str(hsn_code_id).strip() != "":
-                converted_product["tax"] = hsn_tax_map.get(str(hsn_code_id), 0.0)
-            else:
-                converted_product["tax"] = 0.0
-            
-            # Set display price
-            if 'sellingPrice' in converted_product and converted_product['sellingPrice']:
-                converted_product['displayPrice'] = converted_product['sellingPrice']
-            elif 'price' in converted_product:
-                converted_product['displayPrice'] = converted_product['price']
-            
-            # Process barcodes for display
-            barcode_str = converted_product.get('barcode')
-            if isinstance(barcode_str, str) and barcode_str.strip():
-                converted_product['barcodes'] = [b.strip() for b in barcode_str.split(',') if b.strip()]
-            else:
-                converted_product['barcodes'] = []
-            
-            # Ensure batchId is properly set
-            if 'batchid' in converted_product and converted_product['batchid']:
-                converted_product['batchId'] = converted_product['batchid']
-            elif 'batchId' not in converted_product:
-                converted_product['batchId'] = None
-            
-            transformed_products.append(converted_product)
-        
+        transformed_products = project_products(products, _get_hsn_tax_map())
         return transformed_products
     except Exception as e:
         logger.error(f"Error getting local products: {e}", exc_info=True)
@@ -709,62 +646,9 @@ def get_supabase_products() -> List[Dict]:
         # the full catalog instead of silently truncating it for large product sets.
         # Page size kept small so the progressive loader on the frontend gets its
         # first page back fast.
-        products: List[Dict] = []
-        page_size = PRODUCTS_PAGE_SIZE
-        start = 0
-        while True:
-            end = start + page_size - 1
-            page_resp = execute_with_retry(
-                lambda s=start, e=end: client.table("products").select("*").range(s, e),
-                f"products page {start // page_size + 1}",
-                retries=2,
-            )
-            page = page_resp.data if page_resp and page_resp.data is not None else []
-            if not page:
-                break
-            products.extend(page)
-            if len(page) < page_size:
-                break
-            start += page_size
-            if start > 100000:
-                logger.warning("Pagination safety cap hit for products")
-                break
+        products = fetch_all_rows(client, "products", "*", label="products", page_size=PRODUCTS_PAGE_SIZE, key="id")
         
-        transformed_products = []
-        hsn_tax_map = _get_hsn_tax_map()
-        for product in products:
-            converted_product = convert_snake_to_camel(product)
-            
-            # Convert hsn_code_id to hsnCode for frontend
-            if 'hsnCodeId' in converted_product:
-                converted_product['hsnCode'] = converted_product.pop('hsnCodeId')
-
-            hsn_code_id = converted_product.get("hsnCode")
-            if hsn_code_id is not None and str(hsn_code_id).strip() != "":
-                converted_product["tax"] = hsn_tax_map.get(str(hsn_code_id), 0.0)
-            else:
-                converted_product["tax"] = 0.0
-            
-            # Set display price
-            if 'sellingPrice' in converted_product and converted_product['sellingPrice']:
-                converted_product['displayPrice'] = converted_product['sellingPrice']
-            elif 'price' in converted_product:
-                converted_product['displayPrice'] = converted_product['price']
-            
-            # Process barcodes for display
-            barcode_str = converted_product.get('barcode')
-            if isinstance(barcode_str, str) and barcode_str.strip():
-                converted_product['barcodes'] = [b.strip() for b in barcode_str.split(',') if b.strip()]
-            else:
-                converted_product['barcodes'] = []
-            
-            # Ensure batchId is properly set
-            if 'batchid' in converted_product and converted_product['batchid']:
-                converted_product['batchId'] = converted_product['batchid']
-            elif 'batchId' not in converted_product:
-                converted_product['batchId'] = None
-            
-            transformed_products.append(converted_product)
+        transformed_products = project_products(products, _get_hsn_tax_map())
         
         logger.debug(f"Returning {len(transformed_products)} products from Supabase.")
         return transformed_products
@@ -773,6 +657,7 @@ def get_supabase_products() -> List[Dict]:
         return []
 
 
+@single_flight("products for billing", ttl=10, stale=60, groups=("products",))
 def get_supabase_products_for_billing() -> List[Dict]:
     """
     Get products for billing with AVAILABLE stock only.
@@ -782,77 +667,20 @@ def get_supabase_products_for_billing() -> List[Dict]:
         client = db.client
 
         def _paginate(table: str, select_expr: str, label: str) -> List[Dict]:
-            out: List[Dict] = []
-            start = 0
-            page_size = PRODUCTS_PAGE_SIZE
-            while True:
-                end = start + page_size - 1
-                resp = execute_with_retry(
-                    lambda s=start, e=end: client.table(table).select(select_expr).range(s, e),
-                    f"{label} page {start // page_size + 1}",
-                    retries=2,
-                )
-                page = resp.data if resp and resp.data is not None else []
-                if not page:
-                    break
-                out.extend(page)
-                if len(page) < page_size:
-                    break
-                start += page_size
-                if start > 100000:
-                    logger.warning("Pagination safety cap hit for %s", label)
-                    break
-            return out
+            return fetch_all_rows(client, table, select_expr, label=label, page_size=PRODUCTS_PAGE_SIZE, key="id")
 
         products = _paginate("products", "*", "products for billing")
-        inventory_rows = _paginate("storeinventory", "productid, quantity", "storeinventory for billing products")
+        allocated_by_product = _get_inventory_allocation_map()
 
-        allocated_by_product: Dict[str, int] = {}
-        for row in inventory_rows:
-            pid = row.get("productid")
-            if not pid:
-                continue
-            allocated_by_product[pid] = allocated_by_product.get(pid, 0) + int(row.get("quantity") or 0)
-
-        transformed_products = []
-        hsn_tax_map = _get_hsn_tax_map()
-        for product in products:
-            converted_product = convert_snake_to_camel(product)
-            product_id = converted_product.get("id")
+        transformed_products = project_products(products, _get_hsn_tax_map())
+        for converted_product in transformed_products:
             global_stock = int(converted_product.get("stock") or 0)
-            allocated = int(allocated_by_product.get(product_id, 0))
+            allocated = int(allocated_by_product.get(str(converted_product.get("id") or ""), 0))
             available_stock = max(0, global_stock - allocated)
-
-            if 'hsnCodeId' in converted_product:
-                converted_product['hsnCode'] = converted_product.pop('hsnCodeId')
-
-            hsn_code_id = converted_product.get("hsnCode")
-            if hsn_code_id is not None and str(hsn_code_id).strip() != "":
-                converted_product["tax"] = hsn_tax_map.get(str(hsn_code_id), 0.0)
-            else:
-                converted_product["tax"] = 0.0
-
-            if 'sellingPrice' in converted_product and converted_product['sellingPrice']:
-                converted_product['displayPrice'] = converted_product['sellingPrice']
-            elif 'price' in converted_product:
-                converted_product['displayPrice'] = converted_product['price']
-
-            barcode_str = converted_product.get('barcode')
-            if isinstance(barcode_str, str) and barcode_str.strip():
-                converted_product['barcodes'] = [b.strip() for b in barcode_str.split(',') if b.strip()]
-            else:
-                converted_product['barcodes'] = []
-
-            if 'batchid' in converted_product and converted_product['batchid']:
-                converted_product['batchId'] = converted_product['batchid']
-            elif 'batchId' not in converted_product:
-                converted_product['batchId'] = None
-
             converted_product["globalStock"] = global_stock
             converted_product["allocatedStock"] = allocated
             converted_product["availableStock"] = available_stock
             converted_product["stock"] = available_stock
-            transformed_products.append(converted_product)
 
         logger.debug(f"Returning {len(transformed_products)} products for billing (available stock).")
         return transformed_products
@@ -960,6 +788,7 @@ def delete_product_from_supabase(product_id: str) -> bool:
             f"storeinventory delete for product {product_id}",
             retries=2,
         )
+        allocation_index.forget(product_id=product_id)
         execute_with_retry(
             lambda: client.table('products').delete().eq('id', product_id),
             f"product delete {product_id}",
@@ -977,6 +806,7 @@ def delete_product_from_supabase(product_id: str) -> bool:
 # MERGED OPERATIONS
 # ============================================
 
+@single_flight("products", ttl=10, stale=60, groups=("products",))
 def get_merged_products() -> Tuple[List[Dict], int]:
     """
     Get products by merging local and Supabase (Supabase takes precedence).
@@ -1039,37 +869,7 @@ def get_merged_products() -> Tuple[List[Dict], int]:
         except Exception as cache_err:
             logger.warning(f"Failed to refresh local products cache from merged set: {cache_err}")
 
-        try:
-            client = db.client
-            inventory_rows: List[Dict] = []
-            start = 0
-            page_size = PRODUCTS_PAGE_SIZE
-            while True:
-                end = start + page_size - 1
-                inv_resp = execute_with_retry(
-                    lambda s=start, e=end: client.table("storeinventory").select("productid, quantity").range(s, e),
-                    f"storeinventory for merged products page {start // page_size + 1}",
-                    retries=2,
-                )
-                page = inv_resp.data if inv_resp and inv_resp.data is not None else []
-                if not page:
-                    break
-                inventory_rows.extend(page)
-                if len(page) < page_size:
-                    break
-                start += page_size
-                if start > 100000:
-                    break
-        except Exception as inv_err:
-            logger.warning("Storeinventory fetch failed in get_merged_products; using local fallback: %s", inv_err)
-            inventory_rows = get_store_inventory_data() or []
-
-        allocated_by_product: Dict[str, int] = {}
-        for row in inventory_rows:
-            pid = row.get("productid") or row.get("productId")
-            if not pid:
-                continue
-            allocated_by_product[str(pid)] = allocated_by_product.get(str(pid), 0) + int(row.get("quantity") or 0)
+        allocated_by_product = _get_inventory_allocation_map()
 
         for p in merged_products:
             pid = str(p.get("id") or "")
@@ -1291,12 +1091,11 @@ def delete_product(product_id: str) -> Tuple[bool, str, int]:
     """
     try:
         # STEP 1: Check if product is associated with any bills
-        bill_items = get_bill_items_data()
         seen_bill_ids = set()
         associated_bill_ids = []
-        for item in bill_items:
+        for item in iter_bill_items(lambda row: row.get("productid") == product_id):
             billid = item.get("billid")
-            if item.get("productid") == product_id and billid and billid not in seen_bill_ids:
+            if billid and billid not in seen_bill_ids:
                 seen_bill_ids.add(billid)
                 associated_bill_ids.append(billid)
 
@@ -1353,6 +1152,130 @@ def delete_product(product_id: str) -> Tuple[bool, str, int]:
         logger.error(f"Error deleting product: {e}", exc_info=True)
         return False, str(e), 500
 
+# ============================================
+# BARCODE SCANS
+# ============================================
+
+MAX_BARCODE_BATCH = 500
+_CLOUD_BARCODE = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+def _fetch_cloud_products_by_barcode(codes: List[str]) -> List[Dict]:
+    """Products in Supabase carrying any of `codes` (not yet in the local
+    cache). Cached locally, which also puts them in the barcode index."""
+    codes = [c for c in codes if _CLOUD_BARCODE.match(c)]
+    if not codes:
+        return []
+    client = db.client
+    rows: List[Dict] = []
+    for i in range(0, len(codes), 50):
+        chunk = codes[i:i + 50]
+        resp = execute_with_retry(
+            lambda chunk=chunk: client.table("products")
+            .select("*")
+            .or_(",".join(f"barcode.ilike.*{code}*" for code in chunk)),
+            "products by barcode",
+            retries=0,
+        )
+        wanted = {c.casefold() for c in chunk}
+        rows.extend(r for r in (resp.data or []) if wanted.intersection(barcodes_of(r)))
+    if rows:
+        upsert_products_data(rows)
+    return rows
+
+
+def find_products_by_barcodes(codes: List[str], cloud_fallback: bool = True) -> Dict[str, List[Dict]]:
+    """
+    {code: [matching products]} for scanned barcodes, in the products-for-
+    billing shape (stock = available stock). Answered from the local barcode
+    index, local HSN taxes and the allocation index as it stands; codes it
+    does not know are looked up in Supabase once when reachable. Unknown
+    codes map to [].
+    """
+    found = barcode_index.lookup_many(codes)
+    missing = [code for code, rows in found.items() if not rows]
+    if missing and cloud_fallback:
+        try:
+            if _fetch_cloud_products_by_barcode(missing):
+                found.update(barcode_index.lookup_many(missing))
+        except Exception as e:
+            logger.info(f"Cloud barcode lookup skipped for {len(missing)} codes: {e}")
+
+    matched = [row for rows in found.values() for row in rows]
+    if not matched:
+        return found
+    # Local tax rates and allocations only: a scan never waits on the network.
+    projected = iter(project_products(
+        matched, product_search.tax_map(), _get_inventory_allocation_map(wait=False)
+    ))
+    result: Dict[str, List[Dict]] = {}
+    for code, rows in found.items():
+        products = [next(projected) for _ in rows]
+        for product in products:
+            product["stock"] = product["availableStock"]
+        result[code] = products
+    return result
+
+
+def _get_store_allocation_map(store_id: str, wait: bool = True) -> Dict[str, int]:
+    """{product_id: quantity} allocated to one store, from the live
+    allocation index or, when it cannot load, the local cache."""
+    try:
+        return allocation_index.for_store(store_id, wait=wait)
+    except Exception as e:
+        logger.warning(f"Store allocation lookup failed; falling back to local cache: {e}")
+    allocated: Dict[str, int] = {}
+    try:
+        for row in get_store_inventory_data() or []:
+            pid = row.get("productid") or row.get("productId")
+            sid = row.get("storeid") or row.get("storeId")
+            if pid and str(sid) == str(store_id):
+                allocated[str(pid)] = allocated.get(str(pid), 0) + _safe_int(row.get("quantity"))
+    except Exception:
+        pass
+    return allocated
+
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+
+def search_products(query: str, limit: int = SEARCH_DEFAULT_LIMIT, offset: int = 0,
+                    store_id: Optional[str] = None) -> Dict:
+    """
+    Ranked, typo-tolerant product search over name, barcodes, batch number and
+    HSN code, answered from the local search index. Results are in the
+    products-for-billing shape (stock = available stock); with `store_id`
+    each also carries storeStock, the quantity allocated to that store.
+    Nothing here waits on the network: taxes come from the index's local HSN
+    map and allocations from the allocation index as it stands.
+    Response: {data, query, limit, offset, total, hasMore}.
+    """
+    limit = max(1, min(int(limit), SEARCH_MAX_LIMIT))
+    offset = max(0, int(offset))
+    rows, total = product_search.search(query, limit=limit, offset=offset)
+
+    products: List[Dict] = []
+    if rows:
+        products = project_products(
+            rows, product_search.tax_map(), _get_inventory_allocation_map(wait=False)
+        )
+        store_stock = _get_store_allocation_map(store_id, wait=False) if store_id else None
+        for product in products:
+            product["stock"] = product["availableStock"]
+            if store_stock is not None:
+                product["storeStock"] = int(store_stock.get(str(product.get("id") or ""), 0))
+
+    return {
+        "data": products,
+        "query": query,
+        "limit": limit,
+        "offset": offset,
+        "total": total,
+        "hasMore": offset + len(products) < total,
+    }
+
+
 def get_product_availability(product_id: str) -> Tuple[Optional[List[Dict]], int]:
     """
     Get product availability across all stores.
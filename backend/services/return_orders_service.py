@@ -16,6 +16,8 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 
 from utils.supabase_db import db
+from utils.stock_adjustments import adjust_product_stock
+from utils.allocation_index import allocation_index
 
 logger = logging.getLogger(__name__)
 
@@ -58,11 +60,11 @@ def _adjust_store_inventory(client, store_id, product_id, delta, now_iso):
     if rows:
         row = rows[0]
         new_qty = max(0, int(row.get("quantity") or 0) + delta)
-        client.table("storeinventory").update(
+        written = client.table("storeinventory").update(
             {"quantity": new_qty, "updatedat": now_iso}
         ).eq("id", row.get("id")).execute()
     elif delta > 0:
-        client.table("storeinventory").insert(
+        written = client.table("storeinventory").insert(
             {
                 "id": str(uuid.uuid4()),
                 "storeid": store_id,
@@ -73,14 +75,9 @@ def _adjust_store_inventory(client, store_id, product_id, delta, now_iso):
                 "updatedat": now_iso,
             }
         ).execute()
-
-
-def _decrement_owner_stock(client, product_id, qty, now_iso):
-    resp = client.table("products").select("id, stock").eq("id", product_id).limit(1).execute()
-    rows = resp.data or []
-    if rows:
-        new_stock = max(0, int(rows[0].get("stock") or 0) - qty)
-        client.table("products").update({"stock": new_stock, "updatedat": now_iso}).eq("id", product_id).execute()
+    else:
+        return
+    allocation_index.record(written.data if written else [])
 
 
 def _attach_lines(headers: List[Dict], client) -> List[Dict]:
@@ -165,6 +162,7 @@ def verify_return_order(return_id: str, payload: Dict[str, Any], actor: Optional
 
         lines_resp = client.table("return_products").select("*").eq("return_id", return_id).execute()
         lines_by_id = {str(l.get("id")): l for l in (lines_resp.data or [])}
+        held_by_admin: Dict[str, int] = {}
 
         for decision in (payload.get("items") or []):
             line_id = str(decision.get("line_id") or decision.get("id") or "")
@@ -192,7 +190,7 @@ def verify_return_order(return_id: str, payload: Dict[str, Any], actor: Optional
                 # Goods left the store and are now held by admin: remove from the
                 # source store's inventory and from sellable global stock.
                 _adjust_store_inventory(client, store_id, product_id, -verified_qty, now_iso)
-                _decrement_owner_stock(client, product_id, verified_qty, now_iso)
+                held_by_admin[product_id] = held_by_admin.get(product_id, 0) + verified_qty
 
                 if reason_type in DAMAGE_REASON_TYPES:
                     update["holding_status"] = "routed_to_damage"
@@ -222,6 +220,8 @@ def verify_return_order(return_id: str, payload: Dict[str, Any], actor: Optional
 
             client.table("return_products").update(update).eq("id", line_id).execute()
 
+        adjust_product_stock(client, held_by_admin, f"return order {return_id}", now_iso)
+
         client.table("returns").update(
             {"admin_status": "verified", "updated_at": now_iso}
         ).eq("return_id", return_id).execute()
@@ -234,12 +234,13 @@ def verify_return_order(return_id: str, payload: Dict[str, Any], actor: Optional
         return False, str(e), 500
 
 
-def _increment_owner_stock(client, product_id, qty, now_iso):
-    resp = client.table("products").select("id, stock").eq("id", product_id).limit(1).execute()
-    rows = resp.data or []
-    if rows:
-        new_stock = int(rows[0].get("stock") or 0) + qty
-        client.table("products").update({"stock": new_stock, "updatedat": now_iso}).eq("id", product_id).execute()
+def _restock_owner(client, pairs, label, now_iso):
+    """Return (product_id, qty) pairs to global stock in one batched call."""
+    restock: Dict[str, int] = {}
+    for product_id, qty in pairs:
+        if product_id:
+            restock[product_id] = restock.get(product_id, 0) - qty
+    adjust_product_stock(client, restock, label, now_iso)
 
 
 def send_holdings_to_store(store_id, items, actor=None, note=None) -> Tuple[bool, str, int, Dict]:
@@ -319,8 +320,8 @@ def send_holdings_to_store(store_id, items, actor=None, note=None) -> Tuple[bool
         client.table("inventory_transfer_orders").insert(order_row).execute()
         client.table("inventory_transfer_items").insert(item_rows).execute()
 
+        _restock_owner(client, [(line.get("product_id"), qty) for line, _, qty in sent_lines], f"transfer {order_id}", now_iso)
         for line, held, qty in sent_lines:
-            _increment_owner_stock(client, line.get("product_id"), qty, now_iso)
             remaining = held - qty
             if remaining > 0:
                 # Partial send: keep the remainder held with admin.
@@ -390,8 +391,8 @@ def add_holdings_to_warehouse(items, actor=None, note=None) -> Tuple[bool, str,
         if not applied_lines:
             return False, "No eligible items to add (must be held with admin)", 400, {}
 
+        _restock_owner(client, [(line.get("product_id"), qty) for line, _, qty in applied_lines], "returns to stock", now_iso)
         for line, held, qty in applied_lines:
-            _increment_owner_stock(client, line.get("product_id"), qty, now_iso)
             remaining = held - qty
             if remaining > 0:
                 # Partial add: keep the remainder held with admin.
@@ -510,8 +511,8 @@ def send_damaged_to_store(store_id, ids, actor=None, note=None) -> Tuple[bool, s
         client.table("inventory_transfer_orders").insert(order_row).execute()
         client.table("inventory_transfer_items").insert(item_rows).execute()
 
+        _restock_owner(client, [(row.get("product_id"), qty) for row, qty in sent], f"transfer {order_id}", now_iso)
         for row, qty in sent:
-            _increment_owner_stock(client, row.get("product_id"), qty, now_iso)
             client.table("store_damage_returns").update(
                 {
                     "status": "sent_to_store",
@@ -13,6 +13,7 @@ from utils.supabase_db import db
 from utils.json_helpers import get_settings_data, save_settings_data
 from utils.json_utils import convert_camel_to_snake, convert_snake_to_camel
 from utils.concurrency_guard import extract_base_markers, safe_update_with_conflict_check
+from utils.process_coordination import change_counter
 from utils.supabase_resilience import (
     execute_with_retry,
     is_circuit_open_error,
@@ -43,10 +44,18 @@ def _set_cached_settings_response(data: Dict) -> None:
 
 
 def _invalidate_settings_cache() -> None:
+    _drop_settings_cache()
+    change_counter.bump("settings")
+
+
+def _drop_settings_cache() -> None:
     with _SETTINGS_CACHE_LOCK:
         _SETTINGS_CACHE["data"] = None
         _SETTINGS_CACHE["expires_at"] = 0.0
 
+
+change_counter.register("settings", _drop_settings_cache)
+
 # ============================================
 # CUSTOM CONVERSION FOR SYSTEMSETTINGS TABLE
 # ============================================
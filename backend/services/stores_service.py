@@ -29,8 +29,12 @@ from utils.json_helpers import (
     save_store_damage_returns_data,
 )
 from utils.json_utils import convert_camel_to_snake, convert_snake_to_camel
+from utils.stock_adjustments import adjust_product_stock
+from utils.supabase_pagination import fetch_all_rows
 from utils.concurrency_guard import extract_base_markers, safe_update_with_conflict_check
 from utils.helpers import is_cancelled_bill
+from utils.single_flight import invalidate as invalidate_cached, single_flight
+from utils.allocation_index import allocation_index
 
 logger = logging.getLogger(__name__)
 
@@ -46,30 +50,15 @@ def _chunked(values: List[str], size: int = _IN_FILTER_CHUNK) -> List[List[str]]
     return [values[i : i + size] for i in range(0, len(values), size)]
 
 
-def _fetch_all_rows(client: Any, table_name: str, select_expr: str, label: str, page_size: int = 1000) -> List[Dict]:
+def _fetch_all_rows(
+    client: Any, table_name: str, select_expr: str, label: str, page_size: int = 1000, key: str = "id"
+) -> List[Dict]:
     """
     PostgREST caps each request at ~1000 rows by default. For tables that may
-    exceed that (products, storeinventory), paginate via .range() until exhausted.
+    exceed that (products, storeinventory), walk keyset pages on `key` until
+    exhausted.
     """
-    rows: List[Dict] = []
-    start = 0
-    while True:
-        end = start + page_size - 1
-        response = execute_with_retry(
-            lambda s=start, e=end: client.table(table_name).select(select_expr).range(s, e),
-            f"{label} page {start // page_size + 1}",
-        )
-        page = response.data if response and response.data is not None else []
-        if not page:
-            break
-        rows.extend(page)
-        if len(page) < page_size:
-            break
-        start += page_size
-        if start > 100000:  # safety cap — 100k rows
-            logger.warning("Pagination safety cap hit for %s", label)
-            break
-    return rows
+    return fetch_all_rows(client, table_name, select_expr, label=label, page_size=page_size, key=key)
 
 # ============================================
 # LOCAL JSON OPERATIONS
@@ -222,6 +211,7 @@ def get_store_bill_stats(store_id: str) -> Tuple[float, int]:
             logger.error(f"Error getting bill stats for store {store_id}: {e}", exc_info=True)
         return 0.0, 0
 
+@single_flight("stores with inventory", ttl=15, stale=120, groups=("stores", "products", "bills"))
 def get_all_stores_with_inventory() -> Tuple[List[Dict], int]:
     """Get all stores with inventory and bill statistics included"""
     try:
@@ -772,6 +762,7 @@ def delete_store(store_id: str) -> Tuple[bool, str, int]:
 
         try:
             client.table("storeinventory").delete().eq("storeid", store_id).execute()
+            allocation_index.forget(store_id=store_id)
             try:
                 client.table("userstores").delete().eq("storeId", store_id).execute()
             except Exception:
@@ -1020,10 +1011,11 @@ def adjust_inventory(inventory_id: str, adjustment: int) -> Tuple[bool, str, int
         current_qty = record.get('quantity', 0)
         new_qty = max(0, current_qty + adjustment)
         
-        client.table('storeinventory').update({
+        update_resp = client.table('storeinventory').update({
             'quantity': new_qty,
             'updatedat': datetime.now().isoformat()
         }).eq('id', inventory_id).execute()
+        allocation_index.record(update_resp.data if update_resp else [])
         
         # Update local
         inventory = get_store_inventory_data()
@@ -1635,12 +1627,11 @@ def mark_store_damage_return_repaired(row_id: str, payload: Dict[str, Any]) -> T
             return False, "product_id missing in damaged return row", 400
 
         # Update global products stock
-        product_resp = client.table("products").select("id, stock").eq("id", product_id).limit(1).execute()
-        if not product_resp.data:
+        new_stock_by_product = adjust_product_stock(
+            client, {product_id: -restock_qty}, f"damage return {row_id}", now_iso
+        )
+        if str(product_id) not in new_stock_by_product:
             return False, "Product not found", 404
-        current_stock = int(product_resp.data[0].get("stock") or 0)
-        new_stock = current_stock + restock_qty
-        client.table("products").update({"stock": new_stock, "updatedat": now_iso}).eq("id", product_id).execute()
 
         resolution_status = payload.get("resolutionStatus") or payload.get("resolution_status") or "fixed"
         restock_action = payload.get("restockAction") or payload.get("restock_action") or "increase_stock"
@@ -1715,6 +1706,7 @@ def mark_store_damage_return_repaired(row_id: str, payload: Dict[str, Any]) -> T
                     p["updatedat"] = now_iso
                     break
             save_products_data(products)
+            invalidate_cached("products")
             return True, "Saved locally (offline fallback). Cloud sync pending.", 202
         except Exception:
             return False, str(e), 500
@@ -0,0 +1,119 @@
+"""
+The allocation index is built once, then updated in place by the rows that
+storeinventory writes return, and re-checked against the cloud by row count
+and newest updatedat.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from utils import supabase_circuit
+from utils.allocation_index import AllocationIndex
+
+
+class FakeQuery:
+    def __init__(self, client):
+        self.client = client
+        self.count = None
+        self.newest = False
+        self.since = None
+        self.start = 0
+        self.end = None
+
+    def select(self, columns, count=None):
+        self.count = count
+        return self
+
+    def order(self, column, desc=False, nullsfirst=None):
+        self.newest = column == "updatedat" and desc
+        return self
+
+    def gte(self, column, value):
+        self.since = value
+        return self
+
+    def limit(self, n):
+        self.end = n - 1
+        return self
+
+    def range(self, start, end):
+        self.start, self.end = start, end
+        return self
+
+    def execute(self):
+        rows = sorted(self.client.rows, key=lambda r: r["id"])
+        if self.since is not None:
+            self.client.delta_queries += 1
+            rows = [r for r in rows if r["updatedat"] >= self.since]
+        if self.newest:
+            rows = sorted(rows, key=lambda r: r["updatedat"], reverse=True)
+        if self.count:
+            return SimpleNamespace(data=rows[:1], count=len(self.client.rows))
+        end = len(rows) if self.end is None else self.end + 1
+        return SimpleNamespace(data=[dict(r) for r in rows[self.start:end]], count=None)
+
+
+class FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.delta_queries = 0
+
+    def table(self, name):
+        assert name == "storeinventory"
+        return FakeQuery(self)
+
+
+def _row(row_id, store, product, qty, ts):
+    return {"id": row_id, "storeid": store, "productid": product, "quantity": qty, "updatedat": ts}
+
+
+@pytest.fixture(autouse=True)
+def _config(monkeypatch):
+    supabase_circuit.mark_success()
+    monkeypatch.setattr("config.Config.ALLOCATION_INDEX_VERIFY_SECONDS", 0)
+    monkeypatch.setattr("config.Config.DELTA_CACHE_OVERLAP_SECONDS", 0)
+    monkeypatch.setattr("config.Config.SUPABASE_PAGE_CONCURRENCY", 1)
+
+
+def test_builds_then_applies_written_rows_in_place():
+    client = FakeClient([_row("a", "S1", "p1", 3, "2026-10-01T10:00:00"), _row("b", "S2", "p1", 2, "2026-10-01T10:00:00")])
+    index = AllocationIndex(lambda: client)
+    assert index.by_product() == {"p1": 5}
+    assert index.for_store("S2") == {"p1": 2}
+
+    written = _row("b", "S2", "p1", 7, "2026-10-02T10:00:00")
+    client.rows[1] = written
+    index.record([written])
+    assert index.by_product() == {"p1": 10}
+    assert index.available("p1", 12) == 2
+    assert index.checksum() == (2, "2026-10-02T10:00:00")
+    assert client.delta_queries == 0  # checksum matched, nothing re-read
+
+    index.forget(store_id="S1")
+    client.rows.pop(0)
+    assert index.by_product() == {"p1": 7}
+
+
+def test_checksum_mismatch_pulls_changed_rows_and_rebuilds_after_deletes():
+    client = FakeClient([_row("a", "S1", "p1", 3, "2026-10-01T10:00:00")])
+    index = AllocationIndex(lambda: client)
+    assert index.by_product() == {"p1": 3}
+
+    # Written straight to Supabase by another client.
+    client.rows.append(_row("c", "S1", "p2", 4, "2026-10-03T10:00:00"))
+    assert index.by_product() == {"p1": 3, "p2": 4}
+    assert client.delta_queries == 1 and index.rebuilds == 1
+
+    client.rows.pop(0)  # hard delete: count drops, newest timestamp does not move
+    assert index.by_product() == {"p2": 4}
+    assert index.rebuilds == 2
+
+
+def test_non_waiting_reads_load_in_the_background():
+    client = FakeClient([_row("a", "S1", "p1", 3, "2026-10-01T10:00:00")])
+    index = AllocationIndex(lambda: client)
+    with index._lock, pytest.raises(LookupError):  # hold the load back
+        index.by_product(wait=False)  # never loaded: the caller falls back
+    index._refresher.join(5)
+    assert index.by_product(wait=False) == {"p1": 3}
+    assert index.for_store("S1", wait=False) == {"p1": 3}
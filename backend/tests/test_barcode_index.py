@@ -0,0 +1,44 @@
+"""
+BarcodeIndex answers POS scans from the local products cache. These pin
+multi-barcode products, in-place maintenance from journaled writes, and a
+background rebuild after a full rewrite.
+"""
+from utils.barcode_index import BarcodeIndex
+from utils.json_helpers import _safe_json_delete, _safe_json_dump, _safe_json_upsert
+
+
+def test_every_barcode_of_a_product_is_indexed(tmp_path):
+    target = str(tmp_path / "products.json")
+    _safe_json_dump(target, [
+        {"id": "p1", "name": "Soap", "barcode": "8901, 8902 ,"},
+        {"id": "p2", "name": "Oil", "barcodes": ["ABC-1"]},
+    ])
+    index = BarcodeIndex(target)
+    index._register()
+
+    assert [p["id"] for p in index.lookup("8902")] == ["p1"]
+    assert [p["id"] for p in index.lookup(" abc-1 ")] == ["p2"]
+    found = index.lookup_many(["8901", "0000"])
+    assert [p["id"] for p in found["8901"]] == ["p1"] and found["0000"] == []
+
+
+def test_writes_update_the_index_in_place(tmp_path):
+    target = str(tmp_path / "products.json")
+    _safe_json_dump(target, [{"id": "p1", "barcode": "111"}])
+    index = BarcodeIndex(target)
+    index._register()
+    assert index.lookup("111")
+    rebuilds = index.rebuilds
+
+    _safe_json_upsert(target, [{"id": "p1", "barcode": "222"}, {"id": "p3", "barcode": "111,333"}])
+    assert [p["id"] for p in index.lookup("111")] == ["p3"]
+    assert [p["id"] for p in index.lookup("222")] == ["p1"]
+    _safe_json_delete(target, ["p3"])
+    assert index.lookup("333") == []
+    assert index.rebuilds == rebuilds  # applied from the journal ops
+
+    _safe_json_dump(target, [{"id": "p9", "barcode": "999"}])
+    assert [p["id"] for p in index.lookup("222")] == ["p1"]  # previous index until rebuilt
+    index._refresher.join(5)
+    assert [p["id"] for p in index.lookup("999")] == ["p9"]
+    assert index.lookup("222") == []
@@ -0,0 +1,103 @@
+"""
+Checkout writes the bill header and its items to Supabase with one
+save_bill_with_items call and leaves billitems ids to the database. These pin
+the RPC payload and the multi-request fallback used until it is installed.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from services import bills_service
+from utils import supabase_circuit
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.op = None
+
+    def _record(self, op, payload=None):
+        self.op = (op, self.table, payload)
+        return self
+
+    def upsert(self, payload):
+        return self._record("upsert", payload)
+
+    def update(self, payload):
+        return self._record("update", payload)
+
+    def insert(self, payload):
+        return self._record("insert", payload)
+
+    def delete(self):
+        return self._record("delete")
+
+    def select(self, *args, **kwargs):
+        return self._record("select")
+
+    def eq(self, col, value):
+        return self
+
+    def execute(self):
+        self.client.calls.append(self.op)
+        return SimpleNamespace(data=[{}])
+
+
+class FakeClient:
+    def __init__(self, has_rpc=True):
+        self.has_rpc = has_rpc
+        self.calls = []
+
+    def rpc(self, name, params):
+        def execute():
+            self.calls.append(("rpc", name, params))
+            if not self.has_rpc:
+                raise RuntimeError("{'code': 'PGRST202', 'message': 'Could not find the function'}")
+            return SimpleNamespace(data={"bill_id": params["bill"]["id"], "item_ids": [101, 102]})
+
+        return SimpleNamespace(execute=execute)
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+ITEMS = [
+    {"product_id": "p1", "quantity": 2, "price": 10, "total": 20},
+    {"productId": "p2", "quantity": 1, "price": 5, "total": 5},
+]
+
+
+@pytest.fixture(autouse=True)
+def _reset(monkeypatch):
+    supabase_circuit.mark_success()
+    monkeypatch.setattr(bills_service._SAVE_BILL_RPC, "missing_since", None)
+
+
+def test_header_and_items_in_one_rpc_without_item_ids():
+    client = FakeClient()
+    bills_service._save_cloud_bill(client, "B1", {"total": 25}, ITEMS, "bill B1")
+
+    assert len(client.calls) == 1
+    op, name, params = client.calls[0]
+    assert (op, name) == ("rpc", "save_bill_with_items")
+    assert params["bill"] == {"total": 25, "id": "B1"}
+    assert [row["productid"] for row in params["items"]] == ["p1", "p2"]
+    assert all("id" not in row and row["billid"] == "B1" for row in params["items"])
+
+
+def test_falls_back_to_separate_writes_until_migrated():
+    client = FakeClient(has_rpc=False)
+    bills_service._save_cloud_bill(client, "B1", {"total": 25}, ITEMS, "bill B1")
+    assert [c[:2] for c in client.calls] == [
+        ("rpc", "save_bill_with_items"),
+        ("upsert", "bills"),
+        ("delete", "billitems"),
+        ("insert", "billitems"),
+    ]
+    assert all("id" not in row for row in client.calls[-1][2])
+    assert not any(c[0] == "select" for c in client.calls)  # no max(id) lookup
+
+    client.calls.clear()
+    bills_service._save_cloud_bill(client, "B1", {"status": "paid"}, [], "updated bill B1", insert=False)
+    assert [c[:2] for c in client.calls] == [("update", "bills"), ("delete", "billitems")]
@@ -0,0 +1,118 @@
+"""
+BillOutbox makes bill cloud writes write-behind. These pin per-bill ordering,
+retry with backoff, inline drains, the depth/lag report, the journaled
+storage and discarding a deleted bill's entries.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from config import Config
+from utils.bill_outbox import BillOutbox
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = BillOutbox(str(tmp_path / "bill_outbox.json"))
+    yield box
+    box.stop()
+
+
+def test_entries_of_one_bill_run_in_order(outbox):
+    outbox.enqueue("B1", "create", {"p1": 2, "p2": 0})
+    outbox.enqueue("B2", "create", {"p1": 1})
+    outbox.enqueue("B1", "update", {"p1": -1})
+
+    first = outbox._claim()
+    second = outbox._claim()
+    assert (first["bill_id"], second["bill_id"]) == ("B1", "B2")
+    assert first["stock"] == {"p1": 2} and first["op_id"] != second["op_id"]
+    assert outbox._claim() is None  # B1's update waits for its create
+
+    outbox._finish(first, None)
+    third = outbox._claim()
+    assert (third["bill_id"], third["op"]) == ("B1", "update")
+
+
+def test_failures_back_off_and_workers_retry(outbox):
+    calls = []
+    done = threading.Event()
+
+    def handler(entry):
+        calls.append(entry["attempts"])
+        if len(calls) == 1:
+            raise ConnectionError("offline")
+        done.set()
+
+    outbox.set_handler(handler)
+    outbox.enqueue("B1", "create", {"p1": 1})
+    assert outbox.drain_bill("B1") is False
+    stats = outbox.stats()
+    assert stats["depth"] == 1 and stats["retrying"] == 1 and stats["last_error"] == "offline"
+    assert outbox._claim() is None  # backing off
+
+    outbox.start(workers=2)
+    assert done.wait(5)
+    for _ in range(100):
+        if outbox.stats()["depth"] == 0:
+            break
+        time.sleep(0.02)
+    assert calls == [0, 1]
+    assert outbox.stats()["depth"] == 0 and outbox.stats()["processed"] == 1
+
+
+def test_drain_bill_and_lag(outbox):
+    seen = []
+    outbox.set_handler(lambda entry: seen.append((entry["bill_id"], entry["op"])))
+    outbox.enqueue("B1", "create")
+    outbox.enqueue("B2", "create")
+    outbox.enqueue("B1", "update")
+    time.sleep(0.02)
+    assert outbox.stats()["lag_seconds"] > 0 and outbox.stats()["bills"] == 2
+
+    assert outbox.drain_bill("B1") is True
+    assert seen == [("B1", "create"), ("B1", "update")]
+    assert outbox.pending_for("B1") == 0 and outbox.pending_for("B2") == 1
+    assert outbox.drain_bill("B9") is True
+
+
+def test_transitions_are_journaled_and_compacted(outbox, monkeypatch):
+    from utils import json_journal
+    from utils.entity_store import stat_signature
+
+    outbox.set_handler(lambda entry: None)
+    outbox.enqueue("B1", "create", {"p1": 1}, bill={"id": "B1", "items": [{"product_id": "p1", "quantity": 1}]})
+    snapshot = stat_signature(outbox.path)
+    outbox.enqueue("B2", "create")
+    entry = outbox._claim()
+    assert entry["bill"]["items"][0]["product_id"] == "p1"
+    assert stat_signature(outbox.path) == snapshot  # appended, not rewritten
+    assert os.path.exists(json_journal.journal_path(outbox.path))
+
+    # Another process (no cached copy) sees the same state.
+    other = BillOutbox(outbox.path)
+    assert other.stats()["in_flight"] == 1 and other.pending_for("B2") == 1
+
+    outbox._finish(entry, None)
+    assert outbox.drain_bill("B2") is True
+    assert not os.path.exists(json_journal.journal_path(outbox.path))  # compacted once empty
+    assert BillOutbox(outbox.path).stats()["depth"] == 0
+
+    monkeypatch.setattr(Config, "JOURNAL_COMPACT_BYTES", 1)
+    outbox.enqueue("B3", "create")
+    assert not os.path.exists(json_journal.journal_path(outbox.path))
+    assert BillOutbox(outbox.path).pending_for("B3") == 1
+
+
+def test_discard_refuses_while_an_entry_is_in_flight(outbox):
+    outbox.enqueue("B1", "create")
+    outbox.enqueue("B1", "update")
+    claimed = outbox._claim("B1")
+    assert outbox.discard("B1") is False and outbox.pending_for("B1") == 2
+
+    outbox._finish(claimed, ConnectionError("offline"))
+    assert outbox.discard("B1") is True and outbox.pending_for("B1") == 0
+    outbox._finish(claimed, ConnectionError("offline"))  # a late finish does not resurrect it
+    assert outbox.pending_for("B1") == 0
@@ -0,0 +1,74 @@
+"""
+Scoped local bill reads go through the store/month partition in
+utils/bill_shards.py. These pin that a scoped read only returns (and only
+opens) the matching shards, that journaled bill and item writes keep the
+partition current without a rebuild, and that a full rewrite triggers one.
+"""
+import os
+
+import pytest
+
+from config import Config
+from utils.bill_shards import bill_shards, shard_root
+from utils.json_helpers import _safe_json_dump, _safe_json_load, upsert_bill_items_data, upsert_bills_data
+
+
+@pytest.fixture
+def bills_dir(tmp_path, monkeypatch):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    monkeypatch.setattr(Config, "JSON_DIR", str(json_dir))
+    monkeypatch.setattr(Config, "BILLS_FILE", str(json_dir / "bills.json"))
+    monkeypatch.setattr(Config, "BILL_ITEMS_FILE", str(json_dir / "billitems.json"))
+    monkeypatch.setattr(Config, "LOCAL_STORAGE_ENGINE", "json")
+    monkeypatch.setattr(Config, "LOCAL_BILL_SHARDS", True)
+    _safe_json_dump(Config.BILLS_FILE, [
+        {"id": "b1", "storeid": "s1", "created_at": "2024-01-05T10:00:00"},
+        {"id": "b2", "storeid": "s1", "created_at": "2024-02-05T10:00:00"},
+        {"id": "b3", "storeid": "s2", "created_at": "2024-01-06T10:00:00"},
+    ])
+    _safe_json_dump(Config.BILL_ITEMS_FILE, [
+        {"id": 1, "billid": "b1", "productid": "p", "quantity": 1},
+        {"id": 2, "billid": "b3", "productid": "p", "quantity": 2},
+    ])
+    return json_dir
+
+
+def test_scoped_read_opens_only_matching_shards(bills_dir):
+    bills, items = bill_shards.load_window("s1", "2024-01-01T00:00:00", "2024-01-31T23:59:59")
+    assert [b["id"] for b in bills] == ["b1"]
+    assert [i["billid"] for i in items] == ["b1"]
+
+    manifest = _safe_json_load(os.path.join(shard_root(), "manifest.json"), {})
+    assert sorted(manifest["shards"]) == ["s1/2024-01", "s1/2024-02", "s2/2024-01"]
+    assert bill_shards.load_window() is None
+
+
+def test_checkout_updates_shard_in_place(bills_dir):
+    bill_shards.ensure_current()
+    manifest_path = os.path.join(shard_root(), "manifest.json")
+    untouched = os.path.join(shard_root(), "s2", "2024-01.json")
+    before = os.stat(untouched).st_mtime_ns
+
+    assert upsert_bills_data([{"id": "b4", "storeid": "s1", "created_at": "2024-02-07T09:00:00"}])
+    manifest = _safe_json_load(manifest_path, {})
+    assert manifest["shards"]["s1/2024-02"]["bills"] == 2
+
+    assert upsert_bill_items_data([{"id": 3, "billid": "b4", "productid": "p", "quantity": 5}])
+    manifest = _safe_json_load(manifest_path, {})
+    assert manifest["shards"]["s1/2024-02"]["items"] == 1
+    assert manifest["source"] == bill_shards._source()  # still current: no rebuild
+
+    bills, items = bill_shards.load_window("s1", "2024-02-01T00:00:00")
+    assert sorted(b["id"] for b in bills) == ["b2", "b4"]
+    assert [i["id"] for i in items] == [3]
+    assert os.stat(untouched).st_mtime_ns == before
+
+
+def test_full_rewrite_rebuilds_and_drops_empty_shards(bills_dir):
+    bill_shards.ensure_current()
+    _safe_json_dump(Config.BILLS_FILE, [{"id": "b1", "storeid": "s1", "created_at": "2024-01-05T10:00:00"}])
+
+    bills, items = bill_shards.load_window("s2")
+    assert bills == [] and items == []
+    assert not os.path.exists(os.path.join(shard_root(), "s2", "2024-01.json"))
@@ -0,0 +1,86 @@
+"""
+/api/bills/summary reads the per-day rollups through bill_sales_summary and
+only sums bill rows while that function is not installed. Bills still in the
+outbox are added to either.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from services import bills_service
+from utils import supabase_circuit
+
+
+class FakeClient:
+    def __init__(self, has_rpc=True):
+        self.has_rpc = has_rpc
+        self.calls = []
+
+    def rpc(self, name, params):
+        def execute():
+            self.calls.append((name, params))
+            if not self.has_rpc:
+                raise RuntimeError("{'code': 'PGRST202', 'message': 'Could not find the function'}")
+            return SimpleNamespace(data={
+                "totalCount": 3, "totalRevenue": 250.5, "cancelledCount": 1,
+                "todayCount": 1, "todayRevenue": 50, "days": [],
+            })
+
+        return SimpleNamespace(execute=execute)
+
+
+@pytest.fixture(autouse=True)
+def _reset(monkeypatch):
+    supabase_circuit.mark_success()
+    monkeypatch.setattr(bills_service._SUMMARY_RPC, "missing_since", None)
+    monkeypatch.setattr(bills_service.bill_outbox, "pending_bills", lambda: [])
+
+
+def test_summary_reads_rollups(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(bills_service, "db", SimpleNamespace(client=client))
+    monkeypatch.setattr(bills_service, "get_bills_paginated", lambda **kw: pytest.fail("scanned bills"))
+
+    summary = bills_service.get_bills_summary("2026-10-01T00:00:00", None, "S1")
+
+    assert summary["totalCount"] == 3 and summary["totalRevenue"] == 250.5
+    assert summary["cancelledCount"] == 1 and summary["source"] == "rollups"
+    name, params = client.calls[0]
+    assert name == "bill_sales_summary"
+    assert params["from_day"] == "2026-10-01" and params["store"] == "S1"
+    assert "to_day" not in params
+
+
+def test_summary_sums_bills_until_migrated(monkeypatch):
+    monkeypatch.setattr(bills_service, "db", SimpleNamespace(client=FakeClient(has_rpc=False)))
+    bills = [
+        {"total": 100, "date": "2026-10-01"},
+        {"total": 80, "isReplacement": True, "replacementFinalAmount": 30, "date": "2026-10-02"},
+        {"total": 60, "status": "cancelled", "date": "2026-10-02"},
+    ]
+    monkeypatch.setattr(bills_service, "get_bills_paginated", lambda **kw: {"data": bills})
+
+    summary = bills_service.get_bills_summary()
+
+    assert summary["source"] == "bills"
+    assert (summary["totalCount"], summary["totalRevenue"], summary["cancelledCount"]) == (2, 130.0, 1)
+
+
+def test_summary_adds_bills_still_in_the_outbox(monkeypatch):
+    monkeypatch.setattr(bills_service, "db", SimpleNamespace(client=FakeClient()))
+    queued = [
+        {"bill_id": "B1", "created": True, "bill": {"id": "B1", "storeid": "S1", "total": 40,
+                                                    "timestamp": "2026-10-05T10:00:00+05:30"}},
+        {"bill_id": "B2", "created": True, "bill": {"id": "B2", "storeid": "S2", "total": 99,
+                                                    "timestamp": "2026-10-05T10:00:00+05:30"}},
+        {"bill_id": "B3", "created": True, "bill": {"id": "B3", "storeid": "S1", "total": 99,
+                                                    "timestamp": "2026-09-30T23:00:00+00:00"}},
+        {"bill_id": "B4", "created": False, "bill": {"id": "B4", "storeid": "S1", "total": 10}},
+    ]
+    monkeypatch.setattr(bills_service.bill_outbox, "pending_bills", lambda: queued)
+
+    summary = bills_service.get_bills_summary("2026-10-01", None, "S1")
+
+    # B3 is 1 October in the business timezone; B2 is another store's.
+    assert summary["totalCount"] == 5 and summary["totalRevenue"] == 250.5 + 40 + 99
+    assert summary["pendingCount"] == 2 and summary["pendingEdits"] == 1
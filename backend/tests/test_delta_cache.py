@@ -0,0 +1,148 @@
+"""
+DeltaAggregate keeps cloud aggregates current by reading only rows changed
+since the last refresh. These pin, against a fake multi-table PostgREST
+client, that deltas move the totals like a rebuild would, that a changed
+parent re-reads its children, and that failures fall back sensibly.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from utils import supabase_circuit
+from utils.delta_cache import DeltaAggregate, DeltaSource
+
+
+class FakeDb:
+    def __init__(self, **tables):
+        self.tables = tables
+        self.fetched = []  # (table, rows returned)
+        self.broken = set()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class FakeQuery:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.filters = []
+        self.orders = []
+        self.size = None
+
+    def select(self, expr, count=None):
+        return self
+
+    def gte(self, col, value):
+        if col in self.db.broken:
+            raise RuntimeError(f"column {col} does not exist")
+        self.filters.append(lambda r: str(r.get(col)) >= value)
+        return self
+
+    def gt(self, col, value):
+        self.filters.append(lambda r: r[col] > value)
+        return self
+
+    def in_(self, col, values):
+        self.filters.append(lambda r: r.get(col) in values)
+        return self
+
+    def order(self, col, desc=False):
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self.size = n
+        return self
+
+    def execute(self):
+        rows = [dict(r) for r in self.db.tables[self.name] if all(f(r) for f in self.filters)]
+        for col, desc in reversed(self.orders):
+            rows.sort(key=lambda r: str(r[col]), reverse=desc)
+        rows = rows[:self.size] if self.size else rows
+        self.db.fetched.append((self.name, len(rows)))
+        return SimpleNamespace(data=rows, count=None)
+
+
+def setup_function(_):
+    supabase_circuit.mark_success()
+
+
+def _inventory(db):
+    source = DeltaSource("inv", "storeinventory", ["productid", "quantity"],
+                         lambda row, agg: [(row["productid"], row["quantity"])], watermark="updatedat")
+    return DeltaAggregate("inv", [source], ttl=0, full_every=3600, client=lambda: db, overlap_seconds=0)
+
+
+def test_deltas_update_totals_and_read_only_changed_rows():
+    db = FakeDb(storeinventory=[
+        {"id": i, "productid": f"p{i % 3}", "quantity": 1, "updatedat": f"2025-12-{i % 28 + 1:02d}T00:00:00"}
+        for i in range(30)
+    ])
+    agg = _inventory(db)
+    assert agg.get() == {"p0": 10, "p1": 10, "p2": 10}
+
+    db.tables["storeinventory"][0].update(quantity=6, updatedat="2026-01-02T00:00:00")
+    db.tables["storeinventory"].append(
+        {"id": 30, "productid": "p9", "quantity": 2, "updatedat": "2026-01-02T00:00:00"})
+    db.fetched.clear()
+
+    assert agg.get() == {"p0": 15, "p1": 10, "p2": 10, "p9": 2}
+    # The two changed rows, plus the one sitting at the previous watermark.
+    assert sum(n for _, n in db.fetched) == 3
+    assert agg.stats()["full_rebuilds"] == 1 and agg.stats()["delta_refreshes"] == 1
+
+
+def test_changed_parent_rereads_its_children():
+    db = FakeDb(
+        bills=[{"id": "b1", "status": "completed", "updated_at": "2026-01-01T00:00:00"},
+               {"id": "b2", "status": "completed", "updated_at": "2026-01-01T00:00:00"}],
+        billitems=[{"id": 1, "billid": "b1", "productid": "p1", "quantity": 2},
+                   {"id": 2, "billid": "b1", "productid": "p2", "quantity": 1},
+                   {"id": 3, "billid": "b2", "productid": "p1", "quantity": 5}],
+        returns=[],
+    )
+    items = None
+
+    def item_contribution(row, agg):
+        bill = agg.parent_row(items, row) or {}
+        return [] if bill.get("status") == "cancelled" else [(row["productid"], row["quantity"])]
+
+    items = DeltaSource("items", "billitems", ["billid", "productid", "quantity"], item_contribution,
+                        watermark=None, parent=("bills", "billid"))
+    agg = DeltaAggregate(
+        "sold",
+        [
+            DeltaSource("bills", "bills", ["status"], lambda row, agg: [], watermark="updated_at"),
+            items,
+            DeltaSource("returns", "returns", ["product_id", "qty"],
+                        lambda row, agg: [(row["product_id"], -row["qty"])], key="return_id"),
+        ],
+        ttl=0, full_every=3600, client=lambda: db, overlap_seconds=0,
+        finalize=lambda totals: {k: max(0, v) for k, v in totals.items()},
+    )
+    assert agg.get() == {"p1": 7, "p2": 1}
+
+    # b1 revised (p2 line removed, new p3 line); b2 cancelled; a return.
+    db.tables["bills"][0]["updated_at"] = "2026-01-02T00:00:00"
+    db.tables["bills"][1].update(status="cancelled", updated_at="2026-01-02T00:00:00")
+    db.tables["billitems"][1:2] = [{"id": 4, "billid": "b1", "productid": "p3", "quantity": 3}]
+    db.tables["returns"].append({"return_id": "r1", "product_id": "p3", "qty": 5,
+                                 "updated_at": "2026-01-02T00:00:00"})
+
+    assert agg.get() == {"p1": 2, "p2": 0, "p3": 0}
+    assert agg.stats()["full_rebuilds"] == 1
+
+
+def test_failed_delta_rebuilds_and_failed_first_build_raises():
+    db = FakeDb(storeinventory=[{"id": 1, "productid": "p1", "quantity": 4, "updatedat": "2026-01-01T00:00:00"}])
+    agg = _inventory(db)
+    assert agg.get() == {"p1": 4}
+
+    db.broken.add("updatedat")  # e.g. the column was never added remotely
+    db.tables["storeinventory"][0]["quantity"] = 7
+    assert agg.get() == {"p1": 7}
+    assert agg.stats()["full_rebuilds"] == 2
+
+    with pytest.raises(Exception):
+        _inventory(FakeDb(storeinventory=None)).get()
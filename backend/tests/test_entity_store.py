@@ -0,0 +1,85 @@
+"""
+utils/json_helpers.py now serves repeat reads from the in-memory entity store
+(utils/entity_store.py). These pin the contract callers rely on: a cached read
+is indistinguishable from a fresh parse, callers can mutate what they get back
+without corrupting the cache, and a file replaced behind our back is re-read.
+"""
+import json
+import os
+
+from utils.entity_store import entity_store
+from utils.json_helpers import _safe_json_dump, _safe_json_load
+
+
+def test_repeat_reads_are_served_from_memory(tmp_path):
+    target = str(tmp_path / "products.json")
+    _safe_json_dump(target, [{"id": "a", "stock": 1}])
+
+    before = entity_store.stats()["hits"]
+    assert _safe_json_load(target, []) == [{"id": "a", "stock": 1}]
+    assert _safe_json_load(target, []) == [{"id": "a", "stock": 1}]
+    assert entity_store.stats()["hits"] == before + 2
+
+
+def test_mutating_a_read_does_not_leak_into_the_cache(tmp_path):
+    target = str(tmp_path / "bills.json")
+    _safe_json_dump(target, [{"id": "b1", "items": [{"productid": "p", "quantity": 2}]}])
+
+    rows = _safe_json_load(target, [])
+    rows[0]["status"] = "cancelled"
+    rows[0]["items"][0]["quantity"] = 99
+    rows.append({"id": "b2"})
+
+    assert _safe_json_load(target, []) == [
+        {"id": "b1", "items": [{"productid": "p", "quantity": 2}]}
+    ]
+
+
+def test_mutating_saved_data_after_dump_does_not_leak(tmp_path):
+    target = str(tmp_path / "stores.json")
+    payload = [{"id": "s1", "tags": ("x", "y"), 1: "int-key"}]
+    _safe_json_dump(target, payload)
+    payload[0]["id"] = "changed"
+
+    expected = json.loads(json.dumps([{"id": "s1", "tags": ("x", "y"), 1: "int-key"}]))
+    assert _safe_json_load(target, []) == expected
+
+
+def test_external_replace_is_picked_up(tmp_path):
+    target = str(tmp_path / "users.json")
+    _safe_json_dump(target, [{"id": "u1"}])
+    assert _safe_json_load(target, []) == [{"id": "u1"}]
+
+    other = str(tmp_path / "users.json.new")
+    with open(other, "w", encoding="utf-8") as f:
+        json.dump([{"id": "u1"}, {"id": "u2"}], f)
+    os.replace(other, target)
+
+    assert _safe_json_load(target, []) == [{"id": "u1"}, {"id": "u2"}]
+
+
+def test_group_index_follows_journaled_writes(tmp_path):
+    from utils.json_helpers import _safe_json_delete, _safe_json_upsert, get_by, get_by_id, get_by_many
+
+    target = str(tmp_path / "billitems.json")
+    _safe_json_dump(target, [
+        {"id": 1, "billid": "b1", "quantity": 1},
+        {"id": 2, "bill_id": "b2", "quantity": 2},
+        {"id": 3, "billid": "b1", "quantity": 3},
+    ])
+    aliases = ("billid", "bill_id")
+    assert [r["id"] for r in get_by(target, aliases, "b1")] == [1, 3]
+    assert get_by_id(target, "2")["quantity"] == 2
+
+    _safe_json_upsert(target, [{"id": 2, "billid": "b1", "quantity": 5}, {"id": 4, "billid": "b2"}])
+    grouped = get_by_many(target, aliases, ["b1", "b2", "nope"])
+    assert [r["id"] for r in grouped["b1"]] == [1, 2, 3]
+    assert [r["id"] for r in grouped["b2"]] == [4]
+    assert grouped["nope"] == []
+
+    _safe_json_delete(target, [1])
+    assert [r["id"] for r in get_by(target, aliases, "b1")] == [2, 3]
+
+    # Callers own what they get back.
+    get_by(target, aliases, "b1")[0]["quantity"] = 99
+    assert get_by_id(target, 2)["quantity"] == 5
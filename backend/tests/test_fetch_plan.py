@@ -0,0 +1,85 @@
+"""
+FetchPlan runs a request's chunked lookups concurrently. These pin the
+parallel fan-out, dependent stages waiting only for their inputs, optional
+stages and the per-request budget.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from utils import supabase_circuit
+from utils.fetch_plan import FetchBudgetExceeded, FetchPlan
+
+
+class FakeQuery:
+    def __init__(self, rows, delay=0.0, log=None, error=None):
+        self.rows, self.delay, self.log, self.error = rows, delay, log, error
+
+    def execute(self):
+        if self.log is not None:
+            self.log.append(threading.current_thread().name)
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return SimpleNamespace(data=self.rows)
+
+
+@pytest.fixture(autouse=True)
+def _circuit():
+    supabase_circuit.mark_success()
+
+
+def test_chunks_and_independent_stages_run_in_parallel():
+    ids = list(range(10))
+    started = time.perf_counter()
+    with FetchPlan("test", concurrency=6) as plan:
+        a = plan.chunked("a", ids, lambda chunk: FakeQuery([{"id": i} for i in chunk], 0.1), size=4)
+        b = plan.chunked("b", ids, lambda chunk: FakeQuery([{"b": i} for i in chunk], 0.1), size=4)
+        rows_a, rows_b = plan.result(a), plan.result(b)
+    elapsed = time.perf_counter() - started
+
+    assert [r["id"] for r in rows_a] == ids  # chunk order kept
+    assert len(rows_b) == 10
+    assert elapsed < 0.25  # 6 chunks of 0.1s on 6 threads, not 0.6s
+    stages = plan.timings()["stages"]
+    assert stages["a"]["calls"] == 3 and stages["a"]["rows"] == 10
+
+
+def test_dependent_stage_starts_when_its_inputs_are_ready():
+    seen = []
+    with FetchPlan("test", concurrency=2) as plan:
+        fast = plan.chunked("fast", [1], lambda c: FakeQuery([{"ref": 7}], 0.0))
+        slow = plan.chunked("slow", [1], lambda c: FakeQuery([{"x": 1}], 0.2))
+        child = plan.after(
+            "child",
+            [fast],
+            lambda rows: plan.chunked("child", [r["ref"] for r in rows], lambda c: FakeQuery(c, 0.0, seen)),
+        )
+        combined = plan.after("combined", [child, slow], lambda c, s: len(c) + len(s))
+        assert plan.result(child) == [7]
+        assert not slow.future.done()  # child did not wait for the slow stage
+        assert plan.result(combined) == 2
+        assert plan.result(plan.chunked("empty", [], lambda c: FakeQuery([]))) == []
+
+
+def test_optional_failures_and_budget():
+    with FetchPlan("test", concurrency=2) as plan:
+        opt = plan.chunked(
+            "opt", [1, 2], lambda c: FakeQuery([], error=ValueError("bad")) if c == [1] else FakeQuery([{"ok": 2}]),
+            size=1, optional=True,
+        )
+        assert plan.result(opt) == [{"ok": 2}]
+        required = plan.chunked("required", [1], lambda c: FakeQuery([], error=ValueError("bad")))
+        with pytest.raises(ValueError):
+            plan.result(required)
+        dependent = plan.after("dependent", [required], lambda rows: rows)
+        with pytest.raises(ValueError):
+            plan.result(dependent)
+
+    with pytest.raises(FetchBudgetExceeded):
+        with FetchPlan("test", budget=0.05, concurrency=1) as plan:
+            slow = plan.chunked("slow", [1, 2], lambda c: FakeQuery([{"x": 1}], 0.2), size=1)
+            plan.result(slow)
+    assert plan.timings()["stages"]["slow"]["done"] is False
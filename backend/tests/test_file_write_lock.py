@@ -1,17 +1,85 @@
 """
-Regression test for the confirmed race: scripts/sync_manager.py's background
-thread and live Flask request threads both read/write the same JSON files
-with no coordination. utils/json_helpers.py's _safe_json_load/_safe_json_dump
-are now wrapped in a per-path lock (utils/file_write_lock.py) -- this proves
-concurrent writers never produce a corrupted/interleaved file and a
-concurrent reader never observes a torn intermediate write.
+file_write_lock/file_read_lock form a per-path reader-writer lock. These pin
+that readers share it, writers exclude readers, and a waiting writer holds
+back new readers so saves cannot be starved -- and, as the original race
+regression tests, that concurrent writers never corrupt a file and a
+concurrent reader never observes a torn write.
 """
 import json
 import threading
+import time
 
+from utils.file_write_lock import ReadWriteLock, file_read_lock, file_write_lock, lock_stats
 from utils.json_helpers import _safe_json_dump, _safe_json_load
 
 
+def test_readers_share_the_lock(tmp_path):
+    path = str(tmp_path / "products.json")
+    inside = threading.Barrier(3, timeout=2)
+
+    def reader():
+        with file_read_lock(path):
+            inside.wait()  # only passes if all three hold the lock at once
+
+    threads = [threading.Thread(target=reader) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not inside.broken
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = ReadWriteLock()
+    order = []
+    lock.acquire_read()
+
+    def writer():
+        lock.acquire_write()
+        order.append("write")
+        lock.release_write()
+
+    def late_reader():
+        lock.acquire_read()
+        order.append("read")
+        lock.release_read()
+
+    w = threading.Thread(target=writer)
+    w.start()
+    while not lock._writers_waiting:
+        time.sleep(0.001)
+    r = threading.Thread(target=late_reader)
+    r.start()
+    time.sleep(0.02)
+    assert order == []  # the late reader queues behind the writer
+
+    lock.release_read()
+    w.join(2)
+    r.join(2)
+    assert order == ["write", "read"]
+    assert lock.contended == 2 and lock.write_wait_s > 0
+
+
+def test_write_lock_is_exclusive_and_counted(tmp_path):
+    path = str(tmp_path / "bills.json")
+    before = lock_stats()["write_acquires"]
+    got = threading.Event()
+
+    def reader():
+        with file_read_lock(path):
+            got.set()
+
+    with file_write_lock(path):
+        t = threading.Thread(target=reader, daemon=True)
+        t.start()
+        assert not got.wait(0.05)
+    assert got.wait(2)
+    t.join(2)
+    assert lock_stats()["write_acquires"] == before + 1
+    with file_write_lock(path):  # the reader released it
+        pass
+
+
 def test_concurrent_writes_never_corrupt_the_file(tmp_path):
     target = str(tmp_path / "concurrent.json")
     n_threads = 20
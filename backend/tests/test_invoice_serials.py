@@ -0,0 +1,59 @@
+"""
+InvoiceSerials hands out per-store daily invoice serials from a small state
+file instead of scanning bill history. These pin seeding-once, reservation
+blocks, and counters moving past bills written by someone else.
+"""
+import pytest
+
+from utils import json_journal
+from utils.invoice_serials import InvoiceSerials, split_invoice_id
+
+PREFIX = "INV-BLR-17102026"
+
+
+@pytest.fixture
+def serials(tmp_path):
+    return InvoiceSerials(str(tmp_path / "invoice_serials.json"))
+
+
+def test_seeded_once_then_incremented(serials):
+    seeds = []
+
+    def seed():
+        seeds.append(1)
+        return 41
+
+    assert serials.next_id("s1", PREFIX, seed) == f"{PREFIX}0042"
+    assert serials.next_id("s1", PREFIX, seed) == f"{PREFIX}0043"
+    assert len(seeds) == 1
+    assert serials.next_id("s2", PREFIX, lambda: 0) == f"{PREFIX}0001"  # per store
+
+    # State survives a restart; earlier days are dropped on the next write.
+    reopened = InvoiceSerials(serials.path)
+    assert reopened.next_id("s1", PREFIX, seed) == f"{PREFIX}0044" and len(seeds) == 1
+    reopened.next_id("s1", "INV-BLR-18102026", lambda: 0)
+    assert list(reopened.stats()) == ["s1|INV-BLR-18102026"]
+
+
+def test_reserved_blocks_are_never_reissued(serials):
+    assert serials.next_id("s1", PREFIX, lambda: 0) == f"{PREFIX}0001"
+    assert serials.reserve("s1", PREFIX, 10, lambda: 0) == (f"{PREFIX}0002", f"{PREFIX}0011")
+    assert serials.next_id("s1", PREFIX, lambda: 0) == f"{PREFIX}0012"
+    with pytest.raises(ValueError):
+        serials.reserve("s1", PREFIX, 0, lambda: 0)
+
+
+def test_bills_written_elsewhere_move_the_counter(serials):
+    serials.next_id("s1", PREFIX, lambda: 0)
+    ops = [json_journal.upsert_op({"id": f"{PREFIX}0030", "storeid": "s1"}),
+           json_journal.upsert_op({"id": "manual-7", "storeid": "s1"})]
+    serials._on_bills_write("bills.json", None, None, ops)
+    assert serials.next_id("s1", PREFIX, lambda: 0) == f"{PREFIX}0031"
+
+    # A full rewrite (sync pull) makes the counter re-check its seed once.
+    serials._on_bills_write("bills.json", None, None, None)
+    assert serials.next_id("s1", PREFIX, lambda: 50) == f"{PREFIX}0051"
+    assert serials.next_id("s1", PREFIX, lambda: 99) == f"{PREFIX}0052"
+
+    assert split_invoice_id(f"{PREFIX}0007") == (PREFIX, 7)
+    assert split_invoice_id("INV-1") is None
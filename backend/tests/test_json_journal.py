@@ -0,0 +1,97 @@
+"""
+Bill writes append to `<file>.journal` instead of rewriting the snapshot
+(utils/json_journal.py). These pin that readers always see the merged view,
+that a full save retires the journal, and that crash leftovers -- a torn last
+line, or a journal whose snapshot was since rewritten -- are handled safely.
+"""
+import json
+import os
+
+from config import Config
+from utils import json_journal
+from utils.entity_store import entity_store
+from utils.json_helpers import (
+    _safe_json_delete,
+    _safe_json_dump,
+    _safe_json_load,
+    _safe_json_patch,
+    _safe_json_upsert,
+)
+
+
+def test_upserts_append_without_rewriting_the_snapshot(tmp_path):
+    target = str(tmp_path / "bills.json")
+    _safe_json_dump(target, [{"id": "b1", "total": 10}])
+    with open(target, "rb") as f:
+        snapshot_bytes = f.read()
+
+    assert _safe_json_upsert(target, [{"id": "b2", "total": 20}])
+    assert _safe_json_upsert(target, [{"id": "b1", "total": 15}])
+    assert _safe_json_delete(target, ["b2"])
+
+    with open(target, "rb") as f:
+        assert f.read() == snapshot_bytes
+    assert _safe_json_load(target, []) == [{"id": "b1", "total": 15}]
+
+    # A cold process (empty cache) replays the same journal.
+    entity_store.invalidate(target)
+    assert _safe_json_load(target, []) == [{"id": "b1", "total": 15}]
+
+
+def test_full_save_compacts_and_stale_journal_is_ignored(tmp_path):
+    target = str(tmp_path / "bills.json")
+    _safe_json_dump(target, [])
+    _safe_json_upsert(target, [{"id": "b1"}])
+    journal = json_journal.journal_path(target)
+    with open(journal, "rb") as f:
+        leftover = f.read()
+
+    assert _safe_json_dump(target, _safe_json_load(target, []))
+    assert not os.path.exists(journal)
+
+    # Simulate a crash between writing the snapshot and removing the journal.
+    with open(journal, "wb") as f:
+        f.write(leftover)
+    entity_store.invalidate(target)
+    assert _safe_json_load(target, []) == [{"id": "b1"}]
+
+
+def test_torn_last_line_is_skipped_and_next_append_recovers(tmp_path):
+    target = str(tmp_path / "bills.json")
+    _safe_json_dump(target, [])
+    _safe_json_upsert(target, [{"id": "b1"}])
+    with open(json_journal.journal_path(target), "ab") as f:
+        f.write(b'{"op":"upsert","row":{"id":"b2"')
+
+    entity_store.invalidate(target)
+    assert _safe_json_load(target, []) == [{"id": "b1"}]
+
+    _safe_json_upsert(target, [{"id": "b3"}])
+    entity_store.invalidate(target)
+    assert _safe_json_load(target, []) == [{"id": "b1"}, {"id": "b3"}]
+
+
+def test_journal_compacts_past_threshold(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "JOURNAL_COMPACT_BYTES", 200)
+    target = str(tmp_path / "bills.json")
+    for i in range(10):
+        _safe_json_upsert(target, [{"id": f"b{i}", "note": "x" * 20}])
+
+    with open(target, encoding="utf-8") as f:
+        on_disk = json.load(f)
+    assert len(on_disk) >= 5
+    assert [row["id"] for row in _safe_json_load(target, [])] == [f"b{i}" for i in range(10)]
+
+
+def test_patch_sets_fields_on_the_current_row(tmp_path):
+    target = str(tmp_path / "bills.json")
+    _safe_json_dump(target, [{"id": "b1", "total": 10, "sync_state": "pending"}])
+    stale = _safe_json_load(target, [])[0]
+    assert _safe_json_upsert(target, [{**stale, "total": 12}])  # lands after `stale` was read
+
+    assert _safe_json_patch(target, "b1", {"sync_state": "synced"})
+    assert _safe_json_load(target, []) == [{"id": "b1", "total": 12, "sync_state": "synced"}]
+    entity_store.invalidate(target)  # also from a cold cache
+    assert _safe_json_patch(target, "b1", {"sync_error": None})
+    assert _safe_json_load(target, [])[0]["total"] == 12
+    assert _safe_json_patch(target, "missing", {"sync_state": "synced"}) is False
@@ -0,0 +1,76 @@
+"""
+iter_local_rows walks a local table without materializing it. These pin that
+the streamed rows equal what _safe_json_load returns -- journal included, in
+either snapshot format and on the SQLite engine -- and that the fold helpers
+aggregate the same way.
+"""
+import io
+import json
+
+import pytest
+
+from config import Config
+from utils import storage_codec
+from utils.entity_store import entity_store
+from utils.json_helpers import (
+    _safe_json_delete,
+    _safe_json_dump,
+    _safe_json_load,
+    _safe_json_upsert,
+    iter_bill_items,
+    iter_local_rows,
+    sum_bill_item_quantities,
+)
+
+ITEMS = [
+    {"id": 1, "billid": "b1", "productid": "p1", "quantity": 2, "note": "ünïcode"},
+    {"id": 2, "billid": "b1", "productid": "p2", "quantity": 1},
+    {"id": 3, "billid": "b2", "productid": "p1", "quantity": 5, "tags": ["x", {"y": 1}]},
+]
+
+
+@pytest.fixture(params=["json", "msgpack", "sqlite"])
+def items_file(request, tmp_path, monkeypatch):
+    if request.param == "msgpack":
+        pytest.importorskip("msgpack")
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    monkeypatch.setattr(Config, "JSON_DIR", str(json_dir))
+    monkeypatch.setattr(Config, "BILL_ITEMS_FILE", str(json_dir / "billitems.json"))
+    monkeypatch.setattr(Config, "SQLITE_DB_FILE", str(tmp_path / "local.sqlite3"))
+    monkeypatch.setattr(Config, "LOCAL_STORAGE_FORMAT", "msgpack" if request.param == "msgpack" else "json")
+    monkeypatch.setattr(Config, "LOCAL_STORAGE_ENGINE", "sqlite" if request.param == "sqlite" else "json")
+    _safe_json_dump(Config.BILL_ITEMS_FILE, ITEMS)
+    _safe_json_upsert(Config.BILL_ITEMS_FILE, [{"id": 2, "billid": "b1", "productid": "p2", "quantity": 4},
+                                               {"id": 4, "billid": "b3", "productid": "p3", "quantity": 1}])
+    _safe_json_delete(Config.BILL_ITEMS_FILE, [1])
+    return Config.BILL_ITEMS_FILE
+
+
+def test_streamed_rows_match_a_full_load(items_file):
+    expected = _safe_json_load(items_file, [])
+    assert [r["id"] for r in expected] == [2, 3, 4]
+    assert list(iter_local_rows(items_file)) == expected
+
+    # Cold cache: parsed from disk incrementally, journal replayed on the fly.
+    entity_store.invalidate(items_file)
+    assert list(iter_local_rows(items_file)) == expected
+    assert [r["id"] for r in iter_bill_items(lambda r: r["productid"] == "p1")] == [3]
+
+
+def test_sum_bill_item_quantities(items_file):
+    entity_store.invalidate(items_file)
+    assert sum_bill_item_quantities() == {"p2": 4, "p1": 5, "p3": 1}
+    assert sum_bill_item_quantities({"b2"}) == {"p2": 4, "p3": 1}
+
+
+def test_iter_array_handles_chunk_boundaries():
+    rows = [{"id": i, "name": "é" * (i % 7), "n": 10 ** i} for i in range(40)]
+    raw = b"\xef\xbb\xbf" + json.dumps(rows, ensure_ascii=False, indent=1).encode("utf-8")
+    assert list(storage_codec.iter_array(io.BytesIO(raw), chunk_size=3)) == rows
+    assert list(storage_codec.iter_array(io.BytesIO(b"[1, 23 ,456]"), chunk_size=1)) == [1, 23, 456]
+
+    with pytest.raises(ValueError):
+        list(storage_codec.iter_array(io.BytesIO(b'{"a": 1}')))
+    with pytest.raises(json.JSONDecodeError):
+        list(storage_codec.iter_array(io.BytesIO(b'[{"a": 1}, {"b"')))
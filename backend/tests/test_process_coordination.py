@@ -0,0 +1,75 @@
+"""
+Multi-worker mode (utils/process_coordination.py). These run the cross-process
+pieces from forked children: file locks exclude other processes, a counter
+bump from another worker invalidates our registered caches, and only one
+process wins the sync leadership.
+"""
+import os
+
+import pytest
+
+from config import Config
+from utils import process_coordination
+from utils.file_write_lock import file_write_lock
+from utils.process_coordination import ChangeCounter, SyncLeader
+
+pytestmark = pytest.mark.skipif(process_coordination.fcntl is None, reason="needs fcntl")
+
+
+@pytest.fixture
+def multiprocess(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, "JSON_DIR", str(tmp_path))
+    monkeypatch.setattr(Config, "LOCAL_STORAGE_MULTIPROCESS", True)
+    return tmp_path
+
+
+def _in_child(fn) -> int:
+    """Run `fn` in a forked child; return its exit status (0 on success)."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os._exit(0 if fn() else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
+def test_write_lock_excludes_other_processes(multiprocess):
+    path = str(multiprocess / "products.json")
+    lock_file = f"{path}.lock"
+
+    def child_cannot_lock():
+        import fcntl
+        fd = os.open(lock_file, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        return False
+
+    with file_write_lock(path):
+        assert _in_child(child_cannot_lock) == 0
+    assert _in_child(lambda: not child_cannot_lock()) == 0
+
+
+def test_bump_from_another_worker_invalidates(multiprocess):
+    counter = ChangeCounter()
+    cleared = []
+    counter.register("products", lambda: cleared.append(1))
+
+    counter.bump("products")  # our own write: nothing to drop locally
+    counter.poll()
+    assert cleared == []
+
+    assert _in_child(lambda: ChangeCounter().bump("products") or True) == 0
+    counter.poll()
+    assert cleared == [1]
+    counter.poll()
+    assert cleared == [1]
+
+
+def test_single_sync_leader(multiprocess):
+    leader = SyncLeader()
+    assert leader.is_leader()
+    assert _in_child(lambda: not SyncLeader().is_leader()) == 0
@@ -0,0 +1,57 @@
+"""
+project_products replaces four copies of the products transform loop; its
+output must match what convert_snake_to_camel plus the old derived-field code
+produced.
+"""
+from utils.json_utils import convert_snake_to_camel
+from utils.product_projection import project_products
+
+HSN = {"7": 18.0}
+
+
+def _legacy(product, hsn_tax_map):
+    converted = convert_snake_to_camel(product)
+    if "hsnCodeId" in converted:
+        converted["hsnCode"] = converted.pop("hsnCodeId")
+    hsn_code_id = converted.get("hsnCode")
+    if hsn_code_id is not None and str(hsn_code_id).strip() != "":
+        converted["tax"] = hsn_tax_map.get(str(hsn_code_id), 0.0)
+    else:
+        converted["tax"] = 0.0
+    if "sellingPrice" in converted and converted["sellingPrice"]:
+        converted["displayPrice"] = converted["sellingPrice"]
+    elif "price" in converted:
+        converted["displayPrice"] = converted["price"]
+    barcode_str = converted.get("barcode")
+    if isinstance(barcode_str, str) and barcode_str.strip():
+        converted["barcodes"] = [b.strip() for b in barcode_str.split(",") if b.strip()]
+    else:
+        converted["barcodes"] = []
+    if "batchid" in converted and converted["batchid"]:
+        converted["batchId"] = converted["batchid"]
+    elif "batchId" not in converted:
+        converted["batchId"] = None
+    return converted
+
+
+ROWS = [
+    {"id": "p1", "name": "Soap", "selling_price": 40, "price": 35, "hsn_code_id": 7,
+     "barcode": "111, 222,", "batchid": "B9", "stock": 10},
+    {"id": "p2", "name": "Oil", "selling_price": 0, "price": 99, "hsn_code_id": None,
+     "barcode": "", "stock": 3, "extra": {"nested_key": [{"deep_key": 1}]}},
+    {"id": "p3", "name": "Comb", "hsnCodeId": "8", "batchId": "X", "stock": "2"},
+]
+
+
+def test_matches_legacy_transform_including_key_order():
+    projected = project_products(ROWS, HSN)
+    expected = [_legacy(row, HSN) for row in ROWS]
+    assert projected == expected
+    assert [list(p) for p in projected] == [list(e) for e in expected]
+
+
+def test_stock_breakdown():
+    (p1, p3) = project_products([ROWS[0], ROWS[2]], HSN, {"p1": 4}, {"p3": 5})
+    assert (p1["globalStock"], p1["allocatedStock"], p1["availableStock"]) == (10, 4, 6)
+    assert p1["soldStock"] == 0 and p1["lifetimeStock"] == 10
+    assert p3["availableStock"] == 2 and p3["lifetimeStock"] == 7
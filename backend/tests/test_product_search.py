@@ -0,0 +1,76 @@
+"""
+ProductSearchIndex backs GET /products/search. These pin ranking across name,
+barcode, batch number and HSN code, typo tolerance, paging, in-place
+maintenance from journaled writes, and background refreshes after a rewrite.
+"""
+from utils.json_helpers import _safe_json_delete, _safe_json_dump, _safe_json_upsert
+from utils.product_search import ProductSearchIndex
+
+
+def _index(tmp_path, products):
+    paths = {name: str(tmp_path / f"{name}.json") for name in ("products", "batches", "hsn")}
+    _safe_json_dump(paths["products"], products)
+    _safe_json_dump(paths["batches"], [{"id": "b1", "batch_number": "LOT-77"}])
+    _safe_json_dump(paths["hsn"], [{"id": "h1", "hsn_code": "3401", "tax": "18"}])
+    index = ProductSearchIndex(paths["products"], paths["batches"], paths["hsn"])
+    index._register()
+    return index, paths["products"]
+
+
+def _ids(result):
+    return [row["id"] for row in result[0]]
+
+
+def test_ranks_name_prefix_and_code_fields_with_typos(tmp_path):
+    index, _ = _index(tmp_path, [
+        {"id": "p1", "name": "Herbal Shampoo 200ml", "barcode": "8901"},
+        {"id": "p2", "name": "Shampoo", "batchid": "b1"},
+        {"id": "p3", "name": "Bath Soap", "hsn_code_id": "h1"},
+        {"id": "p4", "name": "Soap Dish"},
+    ])
+    assert index.tax_map() == {"h1": 18.0}  # from the local HSN file, before any build
+
+    assert _ids(index.search("shampoo")) == ["p2", "p1"]  # shorter name first
+    assert _ids(index.search("shampo")) == ["p2", "p1"]   # prefix
+    assert _ids(index.search("shampooo")) == ["p2", "p1"]  # one typo
+    assert _ids(index.search("soap")) == ["p4", "p3"]     # name starts with query
+    assert _ids(index.search("herbal shamp")) == ["p1"]   # every term must match
+    assert _ids(index.search("lot 77")) == ["p2"]         # batch number
+    assert _ids(index.search("3401")) == ["p3"]           # HSN code
+    assert _ids(index.search("8901")) == ["p1"]
+    assert index.search("89") == ([], 0)                  # short numbers alone match whole terms
+    assert _ids(index.search("shampoo 2")) == ["p1"]      # ...and filter by prefix next to words
+    assert index.search("xyz") == ([], 0)
+
+    page, total = index.search("s", limit=1, offset=1)
+    assert total == 4 and len(page) == 1
+
+
+def test_writes_update_the_index_in_place(tmp_path):
+    index, products = _index(tmp_path, [{"id": "p1", "name": "Green Tea"}])
+    assert _ids(index.search("tea")) == ["p1"]
+    rebuilds = index.rebuilds
+
+    _safe_json_upsert(products, [{"id": "p1", "name": "Black Coffee"}, {"id": "p2", "name": "Masala Tea"}])
+    assert _ids(index.search("tea")) == ["p2"]
+    assert _ids(index.search("coffee")) == ["p1"]
+    _safe_json_delete(products, ["p2"])
+    assert index.search("tea") == ([], 0)
+    assert index.rebuilds == rebuilds  # applied from the journal ops
+    assert "tea" not in index._vocab and "masala" not in index._vocab
+
+    _safe_json_dump(products, [{"id": "p1", "name": "Black Coffee"}, {"id": "p9", "name": "Tea Bags"}])
+    assert index.search("tea") == ([], 0)  # the current index answers meanwhile
+    index._refresher.join(5)
+    assert _ids(index.search("tea")) == ["p9"]
+    assert index.rebuilds == rebuilds and index.resyncs == 1  # only p9 re-indexed
+
+
+def test_related_file_changes_rebuild_in_the_background(tmp_path):
+    index, _ = _index(tmp_path, [{"id": "p1", "name": "Shampoo", "batchid": "b1", "hsn_code_id": "h1"}])
+    assert _ids(index.search("lot 77")) == ["p1"]
+    _safe_json_dump(str(tmp_path / "batches.json"), [{"id": "b1", "batch_number": "LOT-88"}])
+    index.search("lot")
+    index._refresher.join(5)
+    assert _ids(index.search("lot 88")) == ["p1"] and index.search("lot 77") == ([], 0)
+    assert index.rebuilds == 2
@@ -0,0 +1,72 @@
+"""
+soldStock comes from the Supabase product_sales_ledger (kept current by
+triggers) and is only computed from bills/returns/replacements while that
+table is not installed.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from services import products_service
+from utils import supabase_circuit
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+
+    def select(self, *args, **kwargs):
+        return self
+
+    def order(self, *args, **kwargs):
+        return self
+
+    def limit(self, n):
+        return self
+
+    def execute(self):
+        self.client.reads.append(self.table)
+        if not self.client.installed:
+            raise RuntimeError("{'code': 'PGRST205', 'message': 'Could not find the table public.product_sales_ledger'}")
+        return SimpleNamespace(data=[
+            {"product_id": "p1", "sold_qty": 12},
+            {"product_id": "p2", "sold_qty": -3},
+        ])
+
+
+class FakeClient:
+    def __init__(self, installed=True):
+        self.installed = installed
+        self.reads = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+@pytest.fixture(autouse=True)
+def _reset(monkeypatch):
+    supabase_circuit.mark_success()
+    monkeypatch.setattr(
+        products_service, "_SALES_LEDGER_CACHE", {"map": None, "ts": 0.0, "missing_since": None}
+    )
+
+
+def test_sold_quantities_read_from_ledger(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(products_service, "db", SimpleNamespace(client=client))
+    monkeypatch.setattr(products_service._SOLD_QTY, "get", lambda force=False: pytest.fail("scanned bills"))
+
+    assert products_service._get_sold_quantity_map() == {"p1": 12, "p2": 0}
+    assert products_service._get_sold_quantity_map() == {"p1": 12, "p2": 0}
+    assert client.reads == ["product_sales_ledger"]  # cached between reads
+
+
+def test_falls_back_to_computed_map_until_migrated(monkeypatch):
+    client = FakeClient(installed=False)
+    monkeypatch.setattr(products_service, "db", SimpleNamespace(client=client))
+    monkeypatch.setattr(products_service._SOLD_QTY, "get", lambda force=False: {"p1": 5})
+
+    assert products_service._get_sold_quantity_map() == {"p1": 5}
+    assert products_service._get_sold_quantity_map() == {"p1": 5}
+    assert client.reads == ["product_sales_ledger"]  # not probed again right away
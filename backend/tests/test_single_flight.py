@@ -0,0 +1,93 @@
+"""
+SingleFlight coalesces identical concurrent reads and serves stale entries
+while refreshing them. These pin the leader/follower behaviour, the
+stale-while-revalidate path and what invalidation does to a running load.
+"""
+import threading
+import time
+
+import pytest
+
+from utils.single_flight import SingleFlight, SingleFlightTimeout, drop_group, single_flight
+
+
+def test_concurrent_calls_share_one_load():
+    calls = []
+    release = threading.Event()
+
+    @single_flight("test shared", ttl=60)
+    def load(store_id):
+        calls.append(store_id)
+        release.wait(2)
+        return [store_id], 200
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(load("s1"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert calls == ["s1"]
+    assert results == [(["s1"], 200)] * 8
+    assert load("s1") == (["s1"], 200) and calls == ["s1"]
+    stats = load.flight.stats()
+    assert stats["misses"] == 1 and stats["coalesced"] == 7 and stats["hits"] == 1
+
+    assert load("s2") == (["s2"], 200)  # keyed by arguments
+    assert calls == ["s1", "s2"]
+
+
+def test_stale_entries_are_served_while_refreshing():
+    flight = SingleFlight("test stale", ttl=0.05, stale=60)
+    version = [1]
+    refreshed = threading.Event()
+
+    def loader():
+        value = version[0]
+        if value > 1:
+            refreshed.set()
+        return value
+
+    assert flight.get("k", loader) == 1
+    time.sleep(0.06)
+    version[0] = 2
+    assert flight.get("k", loader) == 1  # stale, refresh started
+    assert refreshed.wait(2)
+    for _ in range(100):
+        if flight.peek("k") == 2:
+            break
+        time.sleep(0.01)
+    assert flight.get("k", loader) == 2
+    assert flight.stats()["stale_hits"] == 1
+
+
+def test_errors_timeouts_and_invalidation():
+    flight = SingleFlight("test errors", ttl=60, wait=0.05, groups=("test-group",))
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(2)
+        return "old"
+
+    leader = threading.Thread(target=lambda: flight.get("k", slow))
+    leader.start()
+    started.wait(2)
+    with pytest.raises(SingleFlightTimeout):
+        flight.get("k", slow)
+    drop_group("test-group")  # a write lands mid-load
+    release.set()
+    leader.join()
+    assert flight.peek("k") is None  # the pre-write result was not cached
+
+    def broken():
+        raise RuntimeError("supabase down")
+
+    with pytest.raises(RuntimeError):
+        flight.get("e", broken)
+    assert flight.peek("e") is None
+    assert flight.get("none", lambda: None) is None and flight.peek("none") is None
+    assert flight.stats()["timeouts"] == 1 and flight.stats()["errors"] == 1
@@ -0,0 +1,89 @@
+"""
+LOCAL_STORAGE_ENGINE=sqlite keeps the json_helpers API unchanged while
+storing rows in utils/sqlite_store.py. These pin that both engines return the
+same data and the same query results, and that a JSON file replaced from
+outside is re-imported.
+"""
+import json
+import os
+
+import pytest
+
+from config import Config
+from utils.json_helpers import (
+    _safe_json_delete,
+    _safe_json_dump,
+    _safe_json_load,
+    _safe_json_upsert,
+    get_by_id,
+    query_local_rows,
+)
+
+BILLS = [
+    {"id": "b1", "storeid": "s1", "created_at": "2024-01-01T10:00:00", "total": 1},
+    {"id": "b2", "storeid": "s2", "created_at": "2024-01-02T10:00:00", "total": 2},
+    {"id": "b3", "storeid": "s1", "created_at": "2024-01-03T04:30:00Z", "total": 3},
+    {"id": "b4", "storeid": "s1", "timestamp": "2024-01-02T12:00:00+05:30", "total": 4},
+]
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def engine(request, tmp_path, monkeypatch):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    monkeypatch.setattr(Config, "JSON_DIR", str(json_dir))
+    monkeypatch.setattr(Config, "SQLITE_DB_FILE", str(tmp_path / "local.sqlite3"))
+    monkeypatch.setattr(Config, "LOCAL_STORAGE_ENGINE", request.param)
+    return json_dir
+
+
+def test_existing_file_is_imported_and_round_trips(engine):
+    target = str(engine / "bills.json")
+    with open(target, "w", encoding="utf-8") as f:
+        json.dump(BILLS, f)
+
+    assert _safe_json_load(target, []) == BILLS
+    assert _safe_json_upsert(target, [{"id": "b5", "storeid": "s2"}])
+    assert _safe_json_delete(target, ["b2"])
+    assert [b["id"] for b in _safe_json_load(target, [])] == ["b1", "b3", "b4", "b5"]
+
+    assert _safe_json_dump(target, BILLS[:1])
+    assert _safe_json_load(target, []) == BILLS[:1]
+
+
+def test_queries_filter_sort_and_slice(engine):
+    target = str(engine / "bills.json")
+    _safe_json_dump(target, BILLS)
+
+    rows, total = query_local_rows(target, {"storeid": "s1"}, limit=2)
+    assert total == 3
+    assert [r["id"] for r in rows] == ["b3", "b4"]
+
+    rows, total = query_local_rows(
+        target, date_from="2024-01-02T00:00:00", date_to="2024-01-02T23:59:59"
+    )
+    assert [r["id"] for r in rows] == ["b2", "b4"]
+    assert get_by_id(target, "b2")["total"] == 2
+    assert get_by_id(target, "missing") is None
+
+
+def test_barcode_lookup_matches_any_listed_code(engine):
+    target = str(engine / "products.json")
+    _safe_json_dump(target, [{"id": "p1", "barcode": "111, 222"}, {"id": "p2", "barcodes": ["333"]}])
+
+    assert [r["id"] for r in query_local_rows(target, {"barcode": "222"})[0]] == ["p1"]
+    assert [r["id"] for r in query_local_rows(target, {"barcode": "333"})[0]] == ["p2"]
+
+
+def test_sqlite_reimports_a_file_replaced_from_outside(engine):
+    if Config.LOCAL_STORAGE_ENGINE != "sqlite":
+        pytest.skip("only meaningful for the SQLite engine")
+    target = str(engine / "bills.json")
+    _safe_json_dump(target, BILLS)
+    assert len(_safe_json_load(target, [])) == 4
+    assert not os.path.exists(target)
+
+    # e.g. the admin flush endpoint resetting the file in place
+    with open(target, "w", encoding="utf-8") as f:
+        json.dump([], f)
+    assert _safe_json_load(target, []) == []
@@ -0,0 +1,120 @@
+"""
+adjust_product_stock sends a whole bill's stock changes in one RPC. These pin
+the RPC payload, the fallback to per-product updates while the migration is
+not applied (never for an idempotent op_id adjustment), and the clamp-at-zero
+semantics of that fallback.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from utils import stock_adjustments, supabase_circuit
+from utils.stock_adjustments import StockOpsUnavailable, adjust_product_stock
+
+
+class FakeClient:
+    def __init__(self, stock, has_rpc=True):
+        self.stock = dict(stock)
+        self.has_rpc = has_rpc
+        self.calls = []
+
+    def rpc(self, name, params):
+        self.calls.append(("rpc", name))
+
+        def execute():
+            if not self.has_rpc:
+                raise RuntimeError("{'code': 'PGRST202', 'message': 'Could not find the function'}")
+            rows = []
+            for item in params["items"]:
+                pid = item["product_id"]
+                if pid in self.stock:
+                    self.stock[pid] = max(0, self.stock[pid] - item["qty"])
+                    rows.append({"product_id": pid, "stock": self.stock[pid]})
+            return SimpleNamespace(data=rows)
+
+        return SimpleNamespace(execute=execute)
+
+    def table(self, name):
+        return FakeProducts(self)
+
+
+class FakeProducts:
+    def __init__(self, client):
+        self.client = client
+        self.ids = None
+        self.values = None
+
+    def select(self, expr):
+        return self
+
+    def in_(self, col, ids):
+        self.ids = ids
+        return self
+
+    def update(self, values):
+        self.values = values
+        return self
+
+    def eq(self, col, pid):
+        self.ids = [pid]
+        return self
+
+    def execute(self):
+        if self.values is not None:
+            self.client.calls.append(("update", self.ids[0]))
+            self.client.stock[self.ids[0]] = self.values["stock"]
+            return SimpleNamespace(data=[])
+        self.client.calls.append(("select", tuple(self.ids)))
+        rows = [{"id": pid, "stock": self.client.stock[pid]} for pid in self.ids if pid in self.client.stock]
+        return SimpleNamespace(data=rows)
+
+
+@pytest.fixture(autouse=True)
+def _reset(monkeypatch):
+    supabase_circuit.mark_success()
+    monkeypatch.setattr(stock_adjustments._STOCK_RPC, "missing_since", None)
+
+
+def test_one_rpc_for_the_whole_bill():
+    client = FakeClient({"p1": 10, "p2": 1, "p3": 4})
+    result = adjust_product_stock(client, {"p1": 3, "p2": 5, "p3": 0, "gone": 1}, "bill B1")
+    assert result == {"p1": 7, "p2": 0}
+    assert client.calls == [("rpc", "apply_stock_adjustments")]
+
+    assert adjust_product_stock(client, {"p1": -2}, "cancel B1") == {"p1": 9}
+    assert adjust_product_stock(client, {}, "empty") == {}
+
+
+def test_falls_back_to_per_product_updates_until_migrated():
+    client = FakeClient({"p1": 10, "p2": 1}, has_rpc=False)
+    assert adjust_product_stock(client, {"p1": 3, "p2": 5}, "bill B1") == {"p1": 7, "p2": 0}
+    assert client.calls == [("rpc", "apply_stock_adjustments"), ("select", ("p1", "p2")),
+                            ("update", "p1"), ("update", "p2")]
+
+    client.calls.clear()
+    adjust_product_stock(client, {"p2": -4}, "cancel B1")
+    assert client.stock == {"p1": 7, "p2": 4}
+    assert ("rpc", "apply_stock_adjustments") not in client.calls  # not retried yet
+
+    # An idempotent (op_id) adjustment never takes the fallback: a retry of it
+    # would apply the change twice.
+    client.calls.clear()
+    with pytest.raises(StockOpsUnavailable):
+        adjust_product_stock(client, {"p1": 1}, "bill B9", op_id="bill:B9:1")
+    assert client.calls == [] and client.stock == {"p1": 7, "p2": 4}
+
+
+def test_other_rpc_errors_propagate():
+    client = FakeClient({"p1": 1})
+    client.rpc = lambda name, params: SimpleNamespace(execute=lambda: (_ for _ in ()).throw(ValueError("boom")))
+    with pytest.raises(ValueError):
+        adjust_product_stock(client, {"p1": 1}, "bill B2")
+    assert client.stock == {"p1": 1}
+
+
+def test_stock_writes_invalidate_cached_product_lists(monkeypatch):
+    dropped = []
+    monkeypatch.setattr(stock_adjustments, "invalidate_cached", dropped.append)
+    adjust_product_stock(FakeClient({"p1": 5}), {"p1": 2}, "bill B3")
+    adjust_product_stock(FakeClient({"p1": 5}, has_rpc=False), {"p1": 2}, "bill B4")
+    assert dropped == ["products", "products"]
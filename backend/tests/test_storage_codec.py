@@ -0,0 +1,61 @@
+"""
+utils/storage_codec.py decides how local snapshots are encoded. These pin
+that snapshots are written compact, that the format is sniffed on read so a
+file in either format loads, and that binary snapshots are limited to the
+configured large tables.
+"""
+import json
+from datetime import datetime
+
+import pytest
+
+from config import Config
+from utils import storage_codec
+from utils.json_helpers import _safe_json_dump, _safe_json_load
+
+ROWS = [{"id": "p1", "name": "Dal क", "qty": 3}, {"id": "p2", "price": 1.5}]
+
+
+def test_snapshot_is_compact_utf8_json(tmp_path):
+    target = tmp_path / "products.json"
+    assert _safe_json_dump(str(target), ROWS)
+    raw = target.read_bytes()
+    assert b"\n" not in raw and b"  " not in raw
+    assert json.loads(raw.decode("utf-8")) == ROWS
+
+
+def test_bom_and_indented_files_still_load(tmp_path):
+    target = tmp_path / "stores.json"
+    target.write_bytes(b"\xef\xbb\xbf" + json.dumps(ROWS, indent=2).encode("utf-8"))
+    assert _safe_json_load(str(target), []) == ROWS
+
+
+def test_msgpack_only_for_listed_tables(tmp_path, monkeypatch):
+    pytest.importorskip("msgpack")
+    monkeypatch.setattr(Config, "LOCAL_STORAGE_FORMAT", "msgpack")
+    table = tmp_path / "bills.json"
+    other = tmp_path / "settings.json"
+    assert _safe_json_dump(str(table), ROWS)
+    assert _safe_json_dump(str(other), [{"k": "v"}])
+
+    assert table.read_bytes().startswith(storage_codec.MSGPACK_MAGIC)
+    assert json.loads(other.read_text("utf-8")) == [{"k": "v"}]
+    assert storage_codec.read_file(str(table)) == ROWS
+
+    # Switching back reads the binary file and rewrites it as JSON on save.
+    monkeypatch.setattr(Config, "LOCAL_STORAGE_FORMAT", "json")
+    assert _safe_json_dump(str(table), _safe_json_load(str(table), []))
+    assert json.loads(table.read_text("utf-8")) == ROWS
+
+
+def test_default_hook_is_honoured():
+    class Odd:
+        pass
+
+    raw = storage_codec.encode({"x": Odd()}, default=lambda o: "odd")
+    assert storage_codec.decode(raw) == {"x": "odd"}
+
+    # datetimes go through the hook too, so orjson and the stdlib agree
+    stamp = datetime(2026, 10, 17, 8, 30)
+    raw = storage_codec.encode({"at": stamp}, default=str)
+    assert storage_codec.decode(raw) == {"at": "2026-10-17 08:30:00"}
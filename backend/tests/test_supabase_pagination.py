@@ -0,0 +1,212 @@
+"""
+fetch_all_rows replaces the serial .range() loops. These pin, against a fake
+PostgREST client, that concurrent pages come back in order, that a missing
+count falls back to serial paging, that rows added after the count are
+still read, and that keyset scans split into concurrent key ranges.
+"""
+import threading
+from types import SimpleNamespace
+
+from utils import supabase_circuit
+from utils.supabase_pagination import fetch_all_rows
+
+
+class FakeTable:
+    def __init__(self, rows, report_count=True):
+        self.rows = rows
+        self.report_count = report_count
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def table(self, name):
+        return FakeQuery(self)
+
+
+class FakeQuery:
+    def __init__(self, table):
+        self.t = table
+        self.count = None
+        self.span = None
+        self.ordering = None
+
+    def select(self, expr, count=None):
+        self.count = count
+        return self
+
+    def order(self, col, desc=False):
+        self.ordering = (col, desc)
+        return self
+
+    def range(self, start, end):
+        self.span = (start, end)
+        return self
+
+    def execute(self):
+        with self.t.lock:
+            self.t.requests.append(self.span)
+        start, end = self.span
+        count = len(self.t.rows) if self.count and self.t.report_count else None
+        return SimpleNamespace(data=self.t.rows[start:end + 1], count=count)
+
+
+def setup_function(_):
+    supabase_circuit.mark_success()
+
+
+def test_pages_fetched_concurrently_are_reassembled_in_order():
+    client = FakeTable([{"id": i} for i in range(95)])
+    rows = fetch_all_rows(client, "bills", page_size=10, concurrency=4)
+    assert [r["id"] for r in rows] == list(range(95))
+    assert sorted(client.requests) == [(s, s + 9) for s in range(0, 100, 10)]
+
+
+def test_without_count_pages_serially():
+    client = FakeTable([{"id": i} for i in range(25)], report_count=False)
+    rows = fetch_all_rows(client, "products", page_size=10)
+    assert [r["id"] for r in rows] == list(range(25))
+    assert client.requests == [(0, 9), (10, 19), (20, 29)]
+
+
+def test_rows_added_after_the_count_are_not_lost():
+    client = FakeTable([{"id": i} for i in range(20)])
+    original = FakeQuery.execute
+
+    def growing(self):
+        response = original(self)
+        if self.span == (0, 9):
+            self.t.rows = self.t.rows + [{"id": 20}, {"id": 21}]
+            response.count = 20
+        return response
+
+    FakeQuery.execute = growing
+    try:
+        rows = fetch_all_rows(client, "bills", page_size=10)
+    finally:
+        FakeQuery.execute = original
+    assert [r["id"] for r in rows] == list(range(22))
+    assert fetch_all_rows(FakeTable([{"id": 1}]), "x", page_size=10) == [{"id": 1}]
+
+
+class KeysetQuery(FakeQuery):
+    """Adds the filters iter_table uses: gt/gte/lt, or_ on (a, b), order, limit, range."""
+
+    def __init__(self, table):
+        super().__init__(table)
+        self.filters = []
+        self.orders = []
+        self.size = None
+        self.selected = None
+
+    def select(self, expr, count=None):
+        self.selected = expr
+        self.count = count
+        return self
+
+    def order(self, col, desc=False):
+        self.orders.append((col, desc))
+        return self
+
+    @property
+    def not_(self):
+        self.negate = True
+        return self
+
+    def is_(self, col, value):
+        negate, self.negate = getattr(self, "negate", False), False
+        self.filters.append(lambda r: (r[col] is None) != negate)
+        return self
+
+    def gt(self, col, value):
+        self.filters.append(lambda r: r[col] > value)
+        return self
+
+    def gte(self, col, value):
+        self.filters.append(lambda r: r[col] >= value)
+        return self
+
+    def lt(self, col, value):
+        self.filters.append(lambda r: r[col] < value)
+        return self
+
+    def or_(self, expr):
+        # Only the two-column form iter_table emits:
+        # a.op."x",and(a.eq."x",b.op."y")
+        first, second = expr.split(",and(")
+        a, op, x = first.split(".", 2)
+        _, rest = second.rstrip(")").split(",", 1)
+        b, _, y = rest.split(".", 2)
+        x, y = x.strip('"'), y.strip('"')
+        # SQL comparisons with NULL are never true.
+        cmp = (lambda p, q: p is not None and p > q) if op == "gt" else (lambda p, q: p is not None and p < q)
+        self.filters.append(lambda r: cmp(r[a], x) or (r[a] == x and cmp(r[b], y)))
+        return self
+
+    def limit(self, n):
+        self.size = n
+        return self
+
+    def execute(self):
+        rows = [r for r in self.t.rows if all(f(r) for f in self.filters)]
+        for col, desc in reversed(self.orders):
+            # Postgres default: NULLS LAST ascending, NULLS FIRST descending.
+            rows.sort(key=lambda r: (True,) if r[col] is None else (False, r[col]), reverse=desc)
+        with self.t.lock:
+            self.t.requests.append(self.selected)
+        count = len(rows) if self.count else None
+        if self.span is not None:
+            return SimpleNamespace(data=rows[self.span[0]:self.span[1] + 1], count=count)
+        return SimpleNamespace(data=rows[:self.size], count=count)
+
+
+class KeysetTable(FakeTable):
+    def table(self, name):
+        return KeysetQuery(self)
+
+
+def test_keyset_scan_sees_each_row_once_despite_inserts():
+    from utils.supabase_pagination import iter_table
+
+    client = KeysetTable([{"id": f"b{i:02d}", "created_at": f"2024-01-{i % 5 + 1:02d}"} for i in range(23)])
+    seen = []
+    for row in iter_table(client, "bills", "id", key="created_at,id", page_size=5, descending=True):
+        seen.append(row["id"])
+        if len(seen) == 7:  # a checkout lands mid-scan, ahead of the cursor
+            client.rows.append({"id": "new", "created_at": "2024-02-01"})
+
+    assert sorted(seen) == sorted(f"b{i:02d}" for i in range(23))
+    assert len(seen) == len(set(seen))
+    assert client.requests[0] == "id,created_at"  # key column added to the select
+
+
+def test_fetch_all_rows_with_key_uses_keyset():
+    client = KeysetTable([{"id": i} for i in range(12)])
+    rows = fetch_all_rows(client, "billitems", "id", page_size=5, key="id", concurrency=1)
+    assert [r["id"] for r in rows] == list(range(12))
+    assert len(client.requests) == 3
+
+
+def test_single_column_keys_are_walked_as_concurrent_ranges():
+    client = KeysetTable([{"id": i, "store": i % 2} for i in range(95)])
+    even = lambda q: q.gte("store", 0).lt("store", 1)
+    rows = fetch_all_rows(client, "storeinventory", "id,store", page_size=10, key="id", where=even, concurrency=4)
+    assert [r["id"] for r in rows] == list(range(0, 95, 2))
+    assert client.requests.count("id") == 3  # split points read for four ranges
+
+    rows = fetch_all_rows(client, "storeinventory", "id", page_size=10, order=("id", True), key="id")
+    assert [r["id"] for r in rows] == list(range(94, -1, -1))
+
+
+def test_keyset_scan_walks_null_leading_keys_separately():
+    from utils.supabase_pagination import iter_table
+
+    rows = [{"id": f"b{i:02d}", "created_at": f"2024-01-{i % 5 + 1:02d}"} for i in range(12)]
+    rows += [{"id": f"n{i}", "created_at": None} for i in range(1, 8)]  # more than a page
+    client = KeysetTable(rows)
+
+    seen = [r["id"] for r in iter_table(client, "bills", "id", key="created_at,id", page_size=5, descending=True)]
+    assert seen[:7] == [f"n{i}" for i in range(7, 0, -1)]  # NULLS FIRST when descending
+    assert sorted(seen) == sorted(r["id"] for r in rows) and len(seen) == len(set(seen))
+
+    seen = [r["id"] for r in iter_table(client, "bills", "id", key="created_at,id", page_size=5)]
+    assert seen[-7:] == [f"n{i}" for i in range(1, 8)]
+    assert sorted(seen) == sorted(r["id"] for r in rows) and len(seen) == len(set(seen))
@@ -0,0 +1,287 @@
+"""
+Live index of stock allocated to stores (storeinventory), per product and per
+store.
+
+The products list, the billing list and transfer-order edits each paginated
+the whole storeinventory table to add up allocations, and the shared map was
+rebuilt from deltas every 30 seconds. The index is loaded once and then kept
+current in place: every backend path that writes storeinventory (audits,
+return orders, bill cancel/revise restocks, inventory adjustments, store and
+product deletes) hands it the rows it wrote, and other workers are told
+through the "storeinventory" change counter.
+
+Writes made outside this backend (the frontend verifying transfers straight
+against Supabase) are caught by a cheap consistency check every
+Config.ALLOCATION_INDEX_VERIFY_SECONDS: the cloud's row count and newest
+updatedat against the index's. On a mismatch only the rows changed since the
+newest timestamp seen are fetched; if the counts still disagree (rows deleted)
+the index is rebuilt. A full rebuild also runs every
+Config.DELTA_CACHE_FULL_REBUILD_SECONDS, for updates that did not move
+updatedat.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from config import Config
+from utils.single_flight import invalidate as invalidate_cached
+from utils.process_coordination import change_counter
+from utils.supabase_db import db
+from utils.supabase_pagination import fetch_all_rows
+from utils.supabase_resilience import execute_with_retry
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = "id,storeid,productid,quantity,updatedat"
+
+
+def _qty(value: Any) -> int:
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class AllocationIndex:
+    """storeinventory totals by product and by store, updated in place."""
+
+    def __init__(self, client: Callable[[], Any], page_size: int = 1000):
+        self._client = client
+        self._page_size = page_size
+        self._lock = threading.RLock()
+        self._rows: Dict[str, Tuple[str, str, int]] = {}
+        self._by_product: Dict[str, int] = {}
+        self._by_store: Dict[str, Dict[str, int]] = {}
+        self._mark: Optional[str] = None
+        self._loaded = False
+        self._built = 0.0
+        self._checked = 0.0
+        self._refresher: Optional[threading.Thread] = None
+        self._refresher_guard = threading.Lock()
+        self.rebuilds = 0
+        self.delta_rows = 0
+        self.events = 0
+
+    # ------------------------------------------------------------------ state
+
+    def _put(self, row: Dict) -> None:
+        row_id = row.get("id")
+        if row_id is None:
+            return
+        row_id = str(row_id)
+        self._drop(row_id)
+        store_id = str(row.get("storeid") or row.get("storeId") or "")
+        product_id = str(row.get("productid") or row.get("productId") or "")
+        if not product_id:
+            self._rows[row_id] = (store_id, "", 0)  # still counted by the checksum
+            return
+        qty = _qty(row.get("quantity"))
+        self._rows[row_id] = (store_id, product_id, qty)
+        self._by_product[product_id] = self._by_product.get(product_id, 0) + qty
+        store = self._by_store.setdefault(store_id, {})
+        store[product_id] = store.get(product_id, 0) + qty
+        mark = row.get("updatedat")
+        if mark and (self._mark is None or str(mark) > self._mark):
+            self._mark = str(mark)
+
+    def _drop(self, row_id: str) -> None:
+        old = self._rows.pop(row_id, None)
+        if old is None:
+            return
+        store_id, product_id, qty = old
+        if not product_id:
+            return
+        self._by_product[product_id] = self._by_product.get(product_id, 0) - qty
+        if not self._by_product[product_id]:
+            del self._by_product[product_id]
+        store = self._by_store.get(store_id, {})
+        store[product_id] = store.get(product_id, 0) - qty
+        if not store[product_id]:
+            del store[product_id]
+
+    def _copy_maps(self) -> None:
+        # Readers hold the previous dicts; mutate fresh copies.
+        self._by_product = dict(self._by_product)
+        self._by_store = {store: dict(products) for store, products in self._by_store.items()}
+
+    # ----------------------------------------------------------------- events
+
+    def record(self, rows: Iterable[Dict]) -> None:
+        """Apply storeinventory rows just inserted or updated (full rows, as
+        returned by the write)."""
+        rows = [r for r in (rows or []) if isinstance(r, dict)]
+        if not rows:
+            return
+        with self._lock:
+            if self._loaded:
+                self._copy_maps()
+                for row in rows:
+                    self._put(row)
+                self.events += len(rows)
+        change_counter.bump("storeinventory")
+        invalidate_cached("products")  # cached lists carry allocatedStock
+
+    def forget(self, store_id: Optional[str] = None, product_id: Optional[str] = None) -> None:
+        """Drop the rows of a deleted store and/or product."""
+        with self._lock:
+            if self._loaded:
+                self._copy_maps()
+                for row_id, (sid, pid, _qty_) in list(self._rows.items()):
+                    if (store_id is None or sid == str(store_id)) and (product_id is None or pid == str(product_id)):
+                        self._drop(row_id)
+                self.events += 1
+        change_counter.bump("storeinventory")
+        invalidate_cached("products")
+
+    def mark_stale(self) -> None:
+        """Verify against the cloud on next use (another worker wrote)."""
+        self._checked = 0.0
+
+    # ------------------------------------------------------------ cloud sync
+
+    def _fetch(self, where=None, key: str = "id"):
+        return fetch_all_rows(
+            self._client(),
+            "storeinventory",
+            _COLUMNS,
+            label="storeinventory allocation index",
+            page_size=self._page_size,
+            max_rows=1_000_000,
+            key=key,
+            where=where,
+        )
+
+    def _rebuild(self) -> None:
+        rows = self._fetch()
+        self._rows, self._by_product, self._by_store, self._mark = {}, {}, {}, None
+        for row in rows:
+            self._put(row)
+        self._loaded = True
+        self._built = time.time()
+        self.rebuilds += 1
+        logger.info(f"Allocation index built from {len(rows)} storeinventory rows")
+
+    def cloud_checksum(self) -> Tuple[Optional[int], Optional[str]]:
+        """(row count, newest updatedat) of storeinventory in Supabase."""
+        client = self._client()
+        count_resp = execute_with_retry(
+            lambda: client.table("storeinventory").select("id", count="exact").limit(1),
+            "storeinventory count",
+            retries=1,
+        )
+        newest_resp = execute_with_retry(
+            lambda: client.table("storeinventory")
+            .select("updatedat")
+            .order("updatedat", desc=True, nullsfirst=False)
+            .limit(1),
+            "storeinventory newest updatedat",
+            retries=1,
+        )
+        newest = (newest_resp.data or [{}])[0].get("updatedat") if newest_resp else None
+        return (count_resp.count if count_resp else None), (str(newest) if newest else None)
+
+    def checksum(self) -> Tuple[int, Optional[str]]:
+        """(row count, newest updatedat) held by the index."""
+        return len(self._rows), self._mark
+
+    def _since(self) -> Optional[str]:
+        if not self._mark:
+            return None
+        try:
+            parsed = datetime.fromisoformat(self._mark.replace("Z", "+00:00"))
+        except ValueError:
+            return self._mark
+        return (parsed - timedelta(seconds=Config.DELTA_CACHE_OVERLAP_SECONDS)).isoformat()
+
+    def _verify(self) -> None:
+        cloud = self.cloud_checksum()
+        if cloud == self.checksum():
+            return
+        since = self._since()
+        if since is None:
+            self._rebuild()
+            return
+        rows = self._fetch(where=lambda q: q.gte("updatedat", since), key="updatedat,id")
+        self._copy_maps()
+        for row in rows:
+            self._put(row)
+        self.delta_rows += len(rows)
+        if rows:
+            invalidate_cached("products")  # written outside this backend
+        if cloud[0] is not None and cloud[0] != len(self._rows):
+            logger.info(f"Allocation index has {len(self._rows)} rows, cloud {cloud[0]}; rebuilding")
+            self._rebuild()
+
+    def _ensure(self) -> None:
+        now = time.time()
+        if self._loaded and now - self._checked < Config.ALLOCATION_INDEX_VERIFY_SECONDS:
+            return
+        with self._lock:
+            if self._loaded and time.time() - self._checked < Config.ALLOCATION_INDEX_VERIFY_SECONDS:
+                return
+            try:
+                if not self._loaded or time.time() - self._built >= Config.DELTA_CACHE_FULL_REBUILD_SECONDS:
+                    self._rebuild()
+                else:
+                    self._verify()
+            except Exception:
+                if not self._loaded:
+                    raise
+                logger.warning("Allocation index check failed; serving the current index", exc_info=True)
+            self._checked = time.time()
+
+    def _ensure_soon(self) -> None:
+        """_ensure() without waiting: a due load or check runs in a background
+        thread. Raises LookupError until the index has loaded."""
+        if not self._loaded or time.time() - self._checked >= Config.ALLOCATION_INDEX_VERIFY_SECONDS:
+            with self._refresher_guard:
+                if self._refresher is None or not self._refresher.is_alive():
+                    self._refresher = threading.Thread(
+                        target=self._refresh, name="allocation-index-refresh", daemon=True
+                    )
+                    self._refresher.start()
+        if not self._loaded:
+            raise LookupError("allocation index is still loading")
+
+    def _refresh(self) -> None:
+        try:
+            self._ensure()
+        except Exception as e:
+            logger.warning(f"Background allocation index load failed: {e}")
+
+    # ---------------------------------------------------------------- lookups
+
+    def by_product(self, wait: bool = True) -> Dict[str, int]:
+        """{product_id: quantity allocated across all stores}. Raises when the
+        index was never loaded and the cloud is unreachable. With wait=False
+        the calling thread never touches the network (see _ensure_soon)."""
+        self._ensure() if wait else self._ensure_soon()
+        return self._by_product
+
+    def for_store(self, store_id: str, wait: bool = True) -> Dict[str, int]:
+        """{product_id: quantity} allocated to one store."""
+        self._ensure() if wait else self._ensure_soon()
+        return self._by_store.get(str(store_id), {})
+
+    def available(self, product_id: str, stock: Any) -> int:
+        """Global stock left after store allocations."""
+        return max(0, _qty(stock) - self.by_product().get(str(product_id), 0))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self._loaded,
+            "rows": len(self._rows),
+            "products": len(self._by_product),
+            "stores": len(self._by_store),
+            "newest_updatedat": self._mark,
+            "rebuilds": self.rebuilds,
+            "delta_rows": self.delta_rows,
+            "events": self.events,
+        }
+
+
+# Global instance
+allocation_index = AllocationIndex(lambda: db.client)
+change_counter.register("storeinventory", allocation_index.mark_stale)
@@ -0,0 +1,156 @@
+"""
+In-memory barcode -> product index over the local products cache.
+
+Products keep their barcodes as one comma-separated string (see
+products_service.process_barcodes), so a scan could only be answered by
+downloading the catalog (the POS did) or by a remote ILIKE query. This index
+maps every barcode of every product in Config.PRODUCTS_FILE to its product
+rows, so a scan is a dictionary lookup and works offline.
+
+It is built on first use and kept current by a write listener on the
+products file: journaled upserts/deletes are applied in place, anything else
+(a full rewrite, a write from another worker process) shows up as a changed
+local_signature(). The first build runs in the scanning thread; later ones
+run in a background thread and are swapped in when done, so a scan never
+waits for one (it sees the previous index meanwhile).
+"""
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import Config
+from utils.entity_store import index_key
+from utils.json_helpers import add_write_listener, iter_local_rows, local_signature
+
+logger = logging.getLogger(__name__)
+
+
+def barcodes_of(row: Dict) -> List[str]:
+    """Normalized barcodes of a products row ('barcode' string and/or 'barcodes')."""
+    codes: List[str] = []
+    for field in ("barcode", "barcodes"):
+        value = row.get(field)
+        parts = value if isinstance(value, list) else str(value or "").split(",")
+        for part in parts:
+            key = index_key(part, fold=True)
+            if key is not None and key not in codes:
+                codes.append(key)
+    return codes
+
+
+class BarcodeIndex:
+    """barcode -> product ids, product id -> row, for one products file."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._lock = threading.Lock()
+        self._signature: Any = None
+        self._codes: Dict[str, List[str]] = {}
+        self._rows: Dict[str, Dict] = {}
+        self._loaded = False
+        self._refresher: Optional[threading.Thread] = None
+        self._refresher_guard = threading.Lock()
+        self._registered = False
+        self.rebuilds = 0
+
+    @property
+    def path(self) -> str:
+        return self._path or Config.PRODUCTS_FILE
+
+    # ------------------------------------------------------------------ state
+
+    def _add(self, row: Dict) -> None:
+        product_id = index_key(row.get("id"))
+        if product_id is None:
+            return
+        self._remove(product_id)
+        self._rows[product_id] = row
+        for code in barcodes_of(row):
+            self._codes.setdefault(code, []).append(product_id)
+
+    def _remove(self, product_id: str) -> None:
+        old = self._rows.pop(product_id, None)
+        if old is None:
+            return
+        for code in barcodes_of(old):
+            ids = self._codes.get(code)
+            if ids and product_id in ids:
+                ids.remove(product_id)
+                if not ids:
+                    del self._codes[code]
+
+    def _rebuild(self) -> None:
+        # Read outside self._lock: reading takes the file lock, and write
+        # listeners run under the file lock and then take self._lock.
+        signature = local_signature(self.path)
+        rows = list(iter_local_rows(self.path)) if signature is not None else []
+        fresh = BarcodeIndex(self._path)  # built aside; lookups keep the current one
+        for row in rows:
+            fresh._add(row)
+        with self._lock:
+            self._codes, self._rows = fresh._codes, fresh._rows
+            self._signature = signature
+            self._loaded = True
+        self.rebuilds += 1
+        logger.debug(f"Barcode index built: {len(self._codes)} barcodes, {len(rows)} products")
+
+    def _refresh(self) -> None:
+        try:
+            self._rebuild()
+        except Exception as e:
+            logger.warning(f"Background barcode index rebuild failed: {e}")
+
+    def _ensure(self) -> None:
+        if self._signature is not None and self._signature == local_signature(self.path):
+            return
+        if not self._loaded:
+            self._rebuild()
+            return
+        with self._refresher_guard:
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(target=self._refresh, name="barcode-index-rebuild", daemon=True)
+                self._refresher.start()
+
+    def _on_products_write(self, path, before, after, ops) -> None:
+        with self._lock:
+            if ops is None or self._signature is None or self._signature != before:
+                self._signature = None  # rebuilt on next lookup
+                return
+            for op in ops:
+                if op.get("op") == "upsert" and isinstance(op.get("row"), dict):
+                    self._add(op["row"])
+                elif op.get("op") == "delete":
+                    key = index_key(op.get("key"))
+                    if key is not None:
+                        self._remove(key)
+            self._signature = after
+
+    def _register(self) -> None:
+        if not self._registered:
+            add_write_listener(self.path, self._on_products_write)
+            self._registered = True
+
+    # ---------------------------------------------------------------- lookups
+
+    def lookup_many(self, codes: Iterable[Any]) -> Dict[str, List[Dict]]:
+        """{code as given: [product rows carrying it]}; unknown codes map to []."""
+        self._ensure()
+        found: Dict[str, List[Dict]] = {}
+        with self._lock:
+            for code in codes:
+                key = index_key(code, fold=True)
+                ids = self._codes.get(key, ()) if key is not None else ()
+                found[str(code)] = [dict(self._rows[pid]) for pid in ids if pid in self._rows]
+        return found
+
+    def lookup(self, code: Any) -> List[Dict]:
+        """Product rows carrying barcode `code` (usually one)."""
+        return self.lookup_many([code]).get(str(code), [])
+
+    def stats(self) -> Dict[str, int]:
+        return {"barcodes": len(self._codes), "products": len(self._rows), "rebuilds": self.rebuilds}
+
+
+# Global instance
+barcode_index = BarcodeIndex()
+barcode_index._register()
@@ -0,0 +1,320 @@
+"""
+Durable write-behind outbox for bill cloud writes.
+
+Checkout used to write the bill header, its billitems and the product stock
+to Supabase inline, so a POS request waited on every round trip, retry and
+circuit-breaker probe. Now a bill is committed locally, one entry is appended
+here (Config.BILL_OUTBOX_FILE) and the request returns. A small pool of worker
+threads in the sync leader process drains the outbox by calling the handler
+that bills_service registers.
+
+- Each entry carries the bill as it was written (header and items), so the
+  push never depends on the local bills file, which a sync pull may replace.
+- Every transition (enqueue, claim, retry, finish) is one line appended to the
+  file's journal (utils/json_journal.py) under the file lock; the snapshot is
+  only rewritten when the journal is compacted, once it grows past
+  Config.JOURNAL_COMPACT_BYTES or the outbox empties.
+
+- Per-bill order: only the oldest entry of a bill can be claimed, so a bill's
+  create always lands before its edits.
+- Claims are leases written to the file, so an inline drain_bill() in any
+  worker process never runs an entry a pool thread is already running, and a
+  crashed claimant's entries are picked up again once the lease expires.
+- Failures back off exponentially and are retried until they succeed. Every
+  handler step must therefore be idempotent; each entry carries an op_id for
+  the one step that is not naturally so (the stock adjustment).
+- discard() drops a bill's entries (a deleted bill), refusing while one of
+  them is being written.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from utils import json_journal
+from utils.entity_store import normalized, signature_of, stat_signature
+from utils.file_write_lock import file_write_lock
+from utils.json_utils import save_json_file
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 120.0
+MAX_BACKOFF_SECONDS = 300.0
+
+
+class BillOutbox:
+    """Pending cloud writes, one entry per bill change, oldest first."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._handler: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._wake = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopped = False
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._processed = 0
+        self._failures = 0
+        # ((snapshot signature, journal signature), entries) of the last read.
+        self._cache: Optional[Tuple[tuple, List[Dict[str, Any]]]] = None
+
+    @property
+    def path(self) -> str:
+        return self._path or Config.BILL_OUTBOX_FILE
+
+    def set_handler(self, fn: Callable[[Dict[str, Any]], None]) -> None:
+        """`fn(entry)` writes one entry to the cloud; raising means retry later."""
+        self._handler = fn
+
+    def _load(self) -> List[Dict[str, Any]]:
+        """The entries, snapshot plus journal. Caller holds the file lock."""
+        signature = (stat_signature(self.path), stat_signature(json_journal.journal_path(self.path)))
+        if self._cache is not None and self._cache[0] == signature:
+            return [dict(e) for e in self._cache[1]]
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return []
+        except json.JSONDecodeError as e:
+            # Never overwrite pending writes with an empty list.
+            backup = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, backup)
+            logger.error(f"Corrupt bill outbox backed up to {backup}: {e}")
+            return []
+        entries = entries if isinstance(entries, list) else []
+        ops, _, _ = json_journal.read_ops(self.path, signature[0])
+        json_journal.apply_ops(entries, ops, "id", json_journal.build_positions(entries, "id"))
+        self._cache = (signature, entries)
+        return [dict(e) for e in entries]
+
+    def _append(self, ops: List[Dict[str, Any]], compact: bool = False) -> None:
+        """Durably journal `ops`. Caller holds the file lock."""
+        base = stat_signature(self.path)
+        if base is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            save_json_file(self.path, [])
+            base = stat_signature(self.path)
+        current = (base, stat_signature(json_journal.journal_path(self.path)))
+        journal_stat = json_journal.append_ops(self.path, base, ops)
+        if self._cache is not None and self._cache[0] == current:
+            # Keep the parsed copy current instead of re-reading the file.
+            entries = self._cache[1]
+            json_journal.apply_ops(entries, ops, "id", json_journal.build_positions(entries, "id"))
+            self._cache = ((base, signature_of(journal_stat)), entries)
+        else:
+            self._cache = None
+        if compact or journal_stat.st_size > Config.JOURNAL_COMPACT_BYTES:
+            self._compact()
+
+    def _compact(self) -> None:
+        # A crash between the two steps leaves a journal whose base no longer
+        # matches the new snapshot, so it is ignored rather than replayed.
+        entries = self._load()
+        save_json_file(self.path, entries)
+        json_journal.remove(self.path)
+        self._cache = None
+
+    def enqueue(
+        self,
+        bill_id: str,
+        op: str,
+        stock: Optional[Dict[str, int]] = None,
+        bill: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """
+        Durably record that `bill_id` must be written to the cloud. `bill` is
+        the bill as written locally, items included; the handler pushes it.
+        """
+        now = time.time()
+        entry = {
+            "id": uuid.uuid4().hex,
+            "bill_id": bill_id,
+            "op": op,
+            "bill": normalized(bill) if bill is not None else None,
+            "stock": {pid: int(qty) for pid, qty in (stock or {}).items() if int(qty or 0) != 0},
+            "op_id": f"bill:{bill_id}:{uuid.uuid4().hex}",
+            "created_at": now,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "claimed_by": None,
+            "claimed_until": 0,
+            "last_error": None,
+        }
+        with file_write_lock(self.path):
+            self._append([json_journal.upsert_op(entry)])
+        with self._wake:
+            self._wake.notify()
+        return entry["id"]
+
+    def _claim(self, bill_id: Optional[str] = None, ignore_backoff: bool = False) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with file_write_lock(self.path):
+            seen_bills = set()
+            for entry in self._load():
+                bid = entry.get("bill_id")
+                if bid in seen_bills:
+                    continue
+                seen_bills.add(bid)  # later entries of this bill wait for it
+                if bill_id is not None and bid != bill_id:
+                    continue
+                if entry.get("claimed_until", 0) > now:
+                    continue
+                if not ignore_backoff and entry.get("next_attempt_at", 0) > now:
+                    continue
+                entry["claimed_by"] = self._owner
+                entry["claimed_until"] = now + LEASE_SECONDS
+                self._append([json_journal.upsert_op(entry)])
+                return dict(entry)
+        return None
+
+    def _finish(self, entry: Dict[str, Any], error: Optional[Exception]) -> None:
+        with file_write_lock(self.path):
+            entries = self._load()
+            current = next((e for e in entries if e.get("id") == entry["id"]), None)
+            if current is None:
+                pass  # discarded while it ran
+            elif error is None:
+                self._append([json_journal.delete_op(entry["id"])], compact=len(entries) == 1)
+            else:
+                current["attempts"] = int(current.get("attempts") or 0) + 1
+                current["next_attempt_at"] = time.time() + min(MAX_BACKOFF_SECONDS, 2.0 ** current["attempts"])
+                current["last_error"] = str(error)[:500]
+                current["claimed_by"] = None
+                current["claimed_until"] = 0
+                self._append([json_journal.upsert_op(current)])
+        if error is None:
+            self._processed += 1
+        else:
+            self._failures += 1
+
+    def discard(self, bill_id: str) -> bool:
+        """
+        Drop every pending entry of `bill_id` (the bill is being deleted).
+        False, dropping nothing, while one of them is being written: the
+        write could land after the caller's delete.
+        """
+        now = time.time()
+        with file_write_lock(self.path):
+            entries = [e for e in self._load() if e.get("bill_id") == bill_id]
+            if any(e.get("claimed_until", 0) > now for e in entries):
+                return False
+            if entries:
+                logger.warning(
+                    f"Discarding {len(entries)} unsent outbox entries of deleted bill {bill_id}"
+                )
+                self._append([json_journal.delete_op(e["id"]) for e in entries])
+        return True
+
+    def _run(self, entry: Dict[str, Any]) -> bool:
+        try:
+            if self._handler is None:
+                raise RuntimeError("bill outbox has no handler")
+            self._handler(entry)
+        except Exception as e:
+            logger.warning(
+                f"Bill {entry.get('bill_id')} cloud write failed (attempt {int(entry.get('attempts') or 0) + 1}): {e}"
+            )
+            self._finish(entry, e)
+            return False
+        self._finish(entry, None)
+        return True
+
+    def drain_bill(self, bill_id: str, timeout: float = 10.0) -> bool:
+        """
+        Write `bill_id`'s pending entries now, in the calling thread, ignoring
+        backoff. Waits (up to `timeout`) for entries a pool thread is already
+        running. True once the bill has nothing left in the outbox.
+        """
+        deadline = time.time() + timeout
+        while True:
+            entry = self._claim(bill_id, ignore_backoff=True)
+            if entry is not None:
+                if not self._run(entry):
+                    return False
+                continue
+            if not self.pending_for(bill_id):
+                return True
+            if time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def pending_for(self, bill_id: str) -> int:
+        with file_write_lock(self.path):
+            return sum(1 for e in self._load() if e.get("bill_id") == bill_id)
+
+    def pending_bills(self) -> List[Dict[str, Any]]:
+        """
+        One row per bill with pending entries: its latest queued copy
+        (`bill`) and whether the bill has not reached the cloud at all yet
+        (`created`, its create is still queued).
+        """
+        with file_write_lock(self.path):
+            entries = self._load()
+        pending: Dict[str, Dict[str, Any]] = {}
+        for entry in entries:
+            bid = entry.get("bill_id")
+            row = pending.setdefault(bid, {"bill_id": bid, "bill": None, "created": entry.get("op") == "create"})
+            if entry.get("bill") is not None:
+                row["bill"] = entry["bill"]
+        return list(pending.values())
+
+    def _worker(self) -> None:
+        while not self._stopped:
+            try:
+                entry = self._claim()
+            except Exception as e:
+                logger.error(f"Bill outbox claim failed: {e}", exc_info=True)
+                entry = None
+            if entry is None:
+                with self._wake:
+                    self._wake.wait(Config.BILL_OUTBOX_POLL_SECONDS)
+                continue
+            self._run(entry)
+
+    def start(self, workers: Optional[int] = None) -> None:
+        """Start the drain threads (once per process; the sync leader's)."""
+        if self._threads:
+            return
+        self._stopped = False
+        count = max(1, int(workers or Config.BILL_OUTBOX_WORKERS))
+        for i in range(count):
+            t = threading.Thread(target=self._worker, name=f"bill-outbox-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"Bill outbox started with {count} workers")
+
+    def stop(self) -> None:
+        self._stopped = True
+        with self._wake:
+            self._wake.notify_all()
+        for t in self._threads:
+            t.join(timeout=5)
+        self._threads = []
+
+    def stats(self) -> Dict[str, Any]:
+        """Depth and lag of the outbox, for the status endpoint."""
+        now = time.time()
+        with file_write_lock(self.path):
+            entries = self._load()
+        oldest = min((e.get("created_at", now) for e in entries), default=None)
+        retrying = [e for e in entries if int(e.get("attempts") or 0) > 0]
+        return {
+            "depth": len(entries),
+            "bills": len({e.get("bill_id") for e in entries}),
+            "in_flight": sum(1 for e in entries if e.get("claimed_until", 0) > now),
+            "retrying": len(retrying),
+            "lag_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "max_attempts": max((int(e.get("attempts") or 0) for e in entries), default=0),
+            "last_error": next((e.get("last_error") for e in reversed(retrying) if e.get("last_error")), None),
+            "workers": len(self._threads),
+            "processed": self._processed,
+            "failures": self._failures,
+        }
+
+
+# Global instance
+bill_outbox = BillOutbox()
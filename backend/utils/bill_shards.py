@@ -0,0 +1,295 @@
+"""
+Per-store, per-month partition of the local bills cache.
+
+bills.json and billitems.json hold every bill ever made, so a store- or
+date-scoped local read (the billing page while Supabase is unreachable) used
+to load, enrich and camelCase the whole history before filtering. This module
+keeps a derived copy split by store and month:
+
+    data/json/bills/<storeid>/<YYYY-MM>.json        bills
+    data/json/bills/<storeid>/<YYYY-MM>.items.json  their billitems rows
+    data/json/bills/manifest.json
+
+The flat files stay the source of truth. The manifest records the
+local_signature of both files the shards were built from; a scoped read
+whose sources have moved on rebuilds the partition first. Journaled bill
+upserts (checkout, edit, cancel) and billitems upserts are applied to their
+shard in place (items go to the shard of their bill), so the common path
+never rebuilds. Deletes, items whose bill is not in the partition yet, and
+full rewrites (sync pulls, admin flush) leave the manifest stale and the
+next scoped read rebuilds it.
+
+Shards are keyed by the store and the UTC month of created_at/timestamp.
+Bills without a store go under "_unassigned", bills without a date under
+"undated" (skipped by any date-bounded read). Disabled with the SQLite
+engine, which already answers these queries from its indexes.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from config import Config
+from utils import json_journal
+from utils.file_write_lock import file_write_lock
+from utils.json_helpers import (
+    _safe_json_dump,
+    _safe_json_load,
+    add_write_listener,
+    get_bill_items_data,
+    get_bills_data,
+    get_by_many,
+    local_signature,
+)
+from utils.sqlite_store import date_key, indexed_values
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+UNASSIGNED_STORE = "_unassigned"
+UNDATED = "undated"
+
+
+def enabled() -> bool:
+    return Config.LOCAL_BILL_SHARDS and Config.LOCAL_STORAGE_ENGINE != "sqlite"
+
+
+def shard_root() -> str:
+    return os.path.join(Config.JSON_DIR, "bills")
+
+
+def _manifest_path() -> str:
+    return os.path.join(shard_root(), "manifest.json")
+
+
+def _token(signature) -> Optional[str]:
+    return json.dumps(signature) if signature is not None else None
+
+
+def shard_key_for(bill: Dict[str, Any]) -> Tuple[str, str, str]:
+    """(shard key, store id, month) for a bill row."""
+    cols = indexed_values(bill)
+    store = cols["storeid"] or UNASSIGNED_STORE
+    month = cols["created_at"][:7] if cols["created_at"] else UNDATED
+    return f"{quote(store, safe='')}/{month}", store, month
+
+
+def _shard_paths(key: str) -> Tuple[str, str]:
+    base = os.path.join(shard_root(), *key.split("/"))
+    return f"{base}.json", f"{base}.items.json"
+
+
+def _bill_id_of_item(row: Dict[str, Any]) -> str:
+    return str(row.get("billid") or row.get("bill_id") or row.get("billId") or "").strip()
+
+
+class BillShards:
+    """Builds, maintains and reads the store/month partition."""
+
+    @staticmethod
+    def _lock():
+        # Serializes manifest edits, across worker processes too. Taken after
+        # the bills file lock by write listeners, and never held while
+        # reading the flat files, so the two cannot deadlock. Keyed on its own
+        # name: the shard and manifest files are read and written under their
+        # own (non-reentrant) locks inside it.
+        return file_write_lock(os.path.join(shard_root(), "shards"))
+
+    def _register(self) -> None:
+        add_write_listener(Config.BILLS_FILE, self._on_bills_write)
+        add_write_listener(Config.BILL_ITEMS_FILE, self._on_items_write)
+
+    def _source(self) -> Dict[str, Optional[str]]:
+        return {
+            "bills": _token(local_signature(Config.BILLS_FILE)),
+            "items": _token(local_signature(Config.BILL_ITEMS_FILE)),
+        }
+
+    def ensure_current(self) -> Optional[Dict[str, Any]]:
+        """The manifest, rebuilt first if the flat files changed since it was
+        written. None when the partition is disabled or could not be built."""
+        if not enabled():
+            return None
+        self._register()
+        for _ in range(3):
+            source = self._source()
+            if source["bills"] is None:
+                return None
+            manifest = _safe_json_load(_manifest_path(), {})
+            if manifest.get("version") == MANIFEST_VERSION and manifest.get("source") == source:
+                return manifest
+            bills = get_bills_data()
+            items = get_bill_items_data()
+            # Only trust the copy if nothing was written while we read it.
+            if self._source() == source:
+                return self._rebuild(bills, items, source)
+        logger.warning("Bill shards kept changing during rebuild; using flat files")
+        return None
+
+    def _rebuild(self, bills: List[Dict], items: List[Dict], source: Dict[str, Optional[str]]) -> Optional[Dict[str, Any]]:
+        shards: Dict[str, Dict[str, Any]] = {}
+        bills_by_key: Dict[str, List[Dict]] = {}
+        key_by_bill: Dict[str, str] = {}
+        for bill in bills:
+            if not isinstance(bill, dict):
+                continue
+            key, store, month = shard_key_for(bill)
+            bills_by_key.setdefault(key, []).append(bill)
+            shards.setdefault(key, {"store": store, "month": month})
+            bill_id = str(bill.get("id") or "").strip()
+            if bill_id:
+                key_by_bill[bill_id] = key
+        items_by_key: Dict[str, List[Dict]] = {}
+        for row in items:
+            key = key_by_bill.get(_bill_id_of_item(row)) if isinstance(row, dict) else None
+            if key is not None:
+                items_by_key.setdefault(key, []).append(row)
+
+        manifest_path = _manifest_path()
+        with self._lock():
+            old = _safe_json_load(manifest_path, {})
+            for key, meta in shards.items():
+                bills_path, items_path = _shard_paths(key)
+                shard_bills = bills_by_key.get(key, [])
+                shard_items = items_by_key.get(key, [])
+                meta["bills"] = len(shard_bills)
+                meta["items"] = len(shard_items)
+                # Unchanged shards are left alone, so a rebuild after a sync
+                # pull only rewrites the months that actually moved.
+                for path, rows in ((bills_path, shard_bills), (items_path, shard_items)):
+                    if _safe_json_load(path, None) != rows and not _safe_json_dump(path, rows):
+                        return None
+            for key in set(old.get("shards") or {}) - set(shards):
+                for path in _shard_paths(key):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            manifest = {"version": MANIFEST_VERSION, "source": source, "shards": shards}
+            if not _safe_json_dump(manifest_path, manifest):
+                return None
+        logger.info(f"Rebuilt local bill shards: {len(shards)} shards from {len(bills)} bills")
+        return manifest
+
+    # ------------------------------------------------------------ maintenance
+
+    def _on_bills_write(self, path, before, after, ops) -> None:
+        if not enabled() or ops is None:
+            return
+        if any(op.get("op") != json_journal.OP_UPSERT for op in ops):
+            return  # left stale; the next scoped read rebuilds
+        manifest_path = _manifest_path()
+        with self._lock():
+            manifest = _safe_json_load(manifest_path, {})
+            source = manifest.get("source") or {}
+            if manifest.get("version") != MANIFEST_VERSION or source.get("bills") != _token(before):
+                return
+            rows_by_key: Dict[str, List[Dict]] = {}
+            for op in ops:
+                row = op.get("row")
+                if isinstance(row, dict):
+                    key, store, month = shard_key_for(row)
+                    rows_by_key.setdefault(key, []).append(row)
+                    manifest["shards"].setdefault(key, {"store": store, "month": month, "bills": 0, "items": 0})
+            for key, rows in rows_by_key.items():
+                # A bill's store and date do not change on edit/cancel, so an
+                # upsert always lands in the shard that already holds it.
+                bills_path, items_path = _shard_paths(key)
+                shard = _safe_json_load(bills_path, [])
+                json_journal.apply_ops(
+                    shard,
+                    [json_journal.upsert_op(r) for r in rows],
+                    "id",
+                    json_journal.build_positions(shard, "id"),
+                )
+                if not _safe_json_dump(bills_path, shard):
+                    return
+                if not os.path.exists(items_path):
+                    _safe_json_dump(items_path, [])
+                manifest["shards"][key]["bills"] = len(shard)
+            source["bills"] = _token(after)
+            manifest["source"] = source
+            _safe_json_dump(manifest_path, manifest)
+
+    def _on_items_write(self, path, before, after, ops) -> None:
+        if not enabled() or ops is None:
+            return
+        if any(op.get("op") != json_journal.OP_UPSERT for op in ops):
+            return  # left stale; the next scoped read rebuilds
+        rows = [op["row"] for op in ops if isinstance(op.get("row"), dict)]
+        # An item lands in its bill's shard. Read the bills before taking the
+        # shard lock (flat files first, then the partition -- see _lock).
+        bill_ids = sorted({_bill_id_of_item(row) for row in rows} - {""})
+        bills = get_by_many(Config.BILLS_FILE, "id", bill_ids) if bill_ids else {}
+        manifest_path = _manifest_path()
+        with self._lock():
+            manifest = _safe_json_load(manifest_path, {})
+            source = manifest.get("source") or {}
+            if manifest.get("version") != MANIFEST_VERSION or source.get("items") != _token(before):
+                return
+            rows_by_key: Dict[str, List[Dict]] = {}
+            for row in rows:
+                found = bills.get(_bill_id_of_item(row))
+                key = shard_key_for(found[0])[0] if found else None
+                if key not in manifest["shards"]:
+                    return  # bill not in the partition (yet): left stale
+                rows_by_key.setdefault(key, []).append(row)
+            for key, shard_rows in rows_by_key.items():
+                _bills_path, items_path = _shard_paths(key)
+                shard = _safe_json_load(items_path, [])
+                json_journal.apply_ops(
+                    shard,
+                    [json_journal.upsert_op(r) for r in shard_rows],
+                    "id",
+                    json_journal.build_positions(shard, "id"),
+                )
+                if not _safe_json_dump(items_path, shard):
+                    return
+                manifest["shards"][key]["items"] = len(shard)
+            source["items"] = _token(after)
+            manifest["source"] = source
+            _safe_json_dump(manifest_path, manifest)
+
+    # ------------------------------------------------------------------ reads
+
+    def load_window(
+        self,
+        store_id: Optional[str] = None,
+        from_date: Optional[str] = None,
+        to_date: Optional[str] = None,
+    ) -> Optional[Tuple[List[Dict], List[Dict]]]:
+        """
+        (bills, billitems rows) from only the shards that can hold bills of
+        `store_id` between the dates. Rows are not filtered within a shard;
+        callers apply the exact bounds. None for an unscoped request or when
+        the partition is unavailable -- read the flat files instead.
+        """
+        if not (store_id or from_date or to_date):
+            return None
+        manifest = self.ensure_current()
+        if manifest is None:
+            return None
+        lower = (date_key(from_date) or "")[:7] if from_date else None
+        upper = (date_key(to_date) or "")[:7] if to_date else None
+        bills: List[Dict] = []
+        items: List[Dict] = []
+        for key, meta in sorted((manifest.get("shards") or {}).items()):
+            if store_id and meta.get("store") != str(store_id):
+                continue
+            month = meta.get("month")
+            if (lower or upper) and month == UNDATED:
+                continue
+            if lower and month < lower:
+                continue
+            if upper and month > upper:
+                continue
+            bills_path, items_path = _shard_paths(key)
+            bills.extend(_safe_json_load(bills_path, []))
+            items.extend(_safe_json_load(items_path, []))
+        return bills, items
+
+
+# Global instance
+bill_shards = BillShards()
+bill_shards._register()
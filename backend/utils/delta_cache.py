@@ -0,0 +1,302 @@
+"""
+Cloud-backed aggregates refreshed from deltas instead of full re-downloads.
+
+The product list decorates every row with maps such as "allocated stock per
+product" and "net sold quantity per product". Each expiry used to walk the
+whole of storeinventory, bills, billitems, returns and replacements again.
+A DeltaAggregate keeps, per source table, the rows it has seen and what each
+row contributed to the map. A refresh asks only for rows whose watermark
+column (updated_at, created_at...) is at or past the newest value seen, minus
+a small overlap for late-arriving timestamps, and applies them: retract the
+row's old contribution, add the new one.
+
+Two things cannot be seen through a watermark: hard deletes and rows whose
+timestamp predates the overlap (e.g. offline bills synced much later with
+their original timestamps). A full
+rebuild every `full_every` seconds corrects that drift. A source whose
+watermark query fails (say the column does not exist) forces a full rebuild.
+
+Sources can hang off a parent (billitems under bills): contributions may
+depend on the parent row (a cancelled bill's items do not count), and when a
+parent changes its children are re-fetched by foreign key, so items removed
+by a bill revision disappear without waiting for the full rebuild.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import Config
+from utils.supabase_pagination import fetch_all_rows
+from utils.supabase_resilience import execute_with_retry
+
+logger = logging.getLogger(__name__)
+
+Contribution = Iterable[Tuple[str, int]]
+
+
+class DeltaSource:
+    """One table feeding an aggregate."""
+
+    def __init__(
+        self,
+        name: str,
+        table: str,
+        columns: List[str],
+        contribute: Callable[[Dict, "DeltaAggregate"], Contribution],
+        key: str = "id",
+        watermark: Optional[str] = "updated_at",
+        parent: Optional[Tuple[str, str]] = None,
+    ):
+        self.name = name
+        self.table = table
+        self.key = key
+        self.watermark = watermark
+        # (parent source name, foreign-key column in this table)
+        self.parent = parent
+        # Without a watermark a child source is refreshed only through its
+        # parent (bill items never change without their bill changing).
+        wanted = [key] + ([watermark] if watermark else []) + ([parent[1]] if parent else [])
+        self.columns = columns + [c for c in wanted if c not in columns]
+        self.contribute = contribute
+
+    @property
+    def select(self) -> str:
+        return ",".join(self.columns)
+
+
+class DeltaAggregate:
+    """A {key: int} map over several sources, maintained from deltas."""
+
+    def __init__(
+        self,
+        name: str,
+        sources: List[DeltaSource],
+        ttl: float,
+        full_every: float,
+        client: Callable[[], Any],
+        finalize: Optional[Callable[[Dict[str, int]], Dict[str, int]]] = None,
+        overlap_seconds: Optional[float] = None,
+        page_size: int = 1000,
+    ):
+        self.name = name
+        self.sources = sources  # parents before children
+        self.ttl = ttl
+        self.full_every = full_every
+        self._client = client
+        self._finalize = finalize or dict
+        self._overlap = overlap_seconds
+        self._page_size = page_size
+        self._lock = threading.Lock()
+        self._view: Optional[Dict[str, int]] = None
+        self._checked = 0.0
+        self._built = 0.0
+        self._force_full = True
+        self._reset()
+        self.full_rebuilds = 0
+        self.delta_refreshes = 0
+        self.delta_rows = 0
+
+    # ------------------------------------------------------------------ state
+
+    def _reset(self) -> None:
+        self._rows: Dict[str, Dict[Any, Dict]] = {s.name: {} for s in self.sources}
+        self._contrib: Dict[str, Dict[Any, List[Tuple[str, int]]]] = {s.name: {} for s in self.sources}
+        self._children: Dict[str, Dict[Any, Set[Any]]] = {s.name: {} for s in self.sources if s.parent}
+        self._marks: Dict[str, Optional[str]] = {s.name: None for s in self.sources}
+        self._totals: Dict[str, int] = {}
+
+    def parent_row(self, source: DeltaSource, row: Dict) -> Optional[Dict]:
+        """The parent row of `row` (for contribute functions)."""
+        if not source.parent:
+            return None
+        parent_name, fk = source.parent
+        return self._rows[parent_name].get(row.get(fk))
+
+    def _retract(self, source: DeltaSource, key: Any) -> None:
+        for map_key, amount in self._contrib[source.name].pop(key, ()):
+            self._totals[map_key] = self._totals.get(map_key, 0) - amount
+
+    def _apply(self, source: DeltaSource, key: Any) -> None:
+        row = self._rows[source.name][key]
+        contribution = [(str(k), int(v)) for k, v in source.contribute(row, self) if k]
+        for map_key, amount in contribution:
+            self._totals[map_key] = self._totals.get(map_key, 0) + amount
+        if contribution:
+            self._contrib[source.name][key] = contribution
+
+    def _upsert(self, source: DeltaSource, row: Dict) -> Optional[Any]:
+        key = row.get(source.key)
+        if key is None:
+            return None
+        self._remove(source, key)
+        self._rows[source.name][key] = row
+        if source.parent:
+            self._children[source.name].setdefault(row.get(source.parent[1]), set()).add(key)
+        self._apply(source, key)
+        mark = row.get(source.watermark) if source.watermark else None
+        if mark and (self._marks[source.name] is None or str(mark) > self._marks[source.name]):
+            self._marks[source.name] = str(mark)
+        return key
+
+    def _remove(self, source: DeltaSource, key: Any) -> None:
+        old = self._rows[source.name].pop(key, None)
+        if old is None:
+            return
+        self._retract(source, key)
+        if source.parent:
+            siblings = self._children[source.name].get(old.get(source.parent[1]))
+            if siblings is not None:
+                siblings.discard(key)
+
+    def _reapply_children(self, parent: DeltaSource, keys: Iterable[Any]) -> None:
+        for child in self.sources:
+            if not child.parent or child.parent[0] != parent.name:
+                continue
+            for parent_key in keys:
+                for child_key in list(self._children[child.name].get(parent_key, ())):
+                    self._retract(child, child_key)
+                    self._apply(child, child_key)
+
+    # ---------------------------------------------------------------- fetches
+
+    def _fetch(self, source: DeltaSource, where=None, key: Optional[str] = None) -> List[Dict]:
+        return fetch_all_rows(
+            self._client(),
+            source.table,
+            source.select,
+            label=f"{self.name} {source.table}",
+            page_size=self._page_size,
+            max_rows=1_000_000,
+            key=key or source.key,
+            where=where,
+        )
+
+    def _since(self, mark: str) -> str:
+        overlap = Config.DELTA_CACHE_OVERLAP_SECONDS if self._overlap is None else self._overlap
+        try:
+            parsed = datetime.fromisoformat(mark.replace("Z", "+00:00"))
+        except ValueError:
+            return mark
+        return (parsed - timedelta(seconds=overlap)).isoformat()
+
+    def _fetch_children(self, child: DeltaSource, parent_keys: List[Any]) -> List[Dict]:
+        rows: List[Dict] = []
+        fk = child.parent[1]
+        for i in range(0, len(parent_keys), 200):
+            chunk = parent_keys[i:i + 200]
+            resp = execute_with_retry(
+                lambda chunk=chunk: self._client().table(child.table).select(child.select).in_(fk, chunk),
+                f"{self.name} {child.table} for changed {child.parent[0]}",
+                retries=2,
+            )
+            if resp is not None and resp.data:
+                rows.extend(resp.data)
+        return rows
+
+    # -------------------------------------------------------------- refreshes
+
+    def _rebuild(self) -> None:
+        fetched = {source.name: self._fetch(source) for source in self.sources}
+        self._reset()
+        for source in self.sources:
+            for row in fetched[source.name]:
+                self._upsert(source, row)
+        self._built = time.time()
+        self._force_full = False
+        self.full_rebuilds += 1
+        logger.info(f"{self.name}: full rebuild ({sum(len(r) for r in fetched.values())} rows)")
+
+    def _refresh_deltas(self) -> None:
+        changed_parents: Dict[str, List[Any]] = {}
+        applied = 0
+        for source in self.sources:
+            mark = self._marks[source.name]
+            if source.watermark is None:
+                rows = []
+            elif mark is None:
+                rows = self._fetch(source)
+            else:
+                since = self._since(mark)
+                rows = self._fetch(
+                    source,
+                    where=lambda q, col=source.watermark, since=since: q.gte(col, since),
+                    key=f"{source.watermark},{source.key}",
+                )
+            keys = []
+            for row in rows:
+                previous = self._rows[source.name].get(row.get(source.key))
+                if previous == row:
+                    continue  # re-read inside the overlap window
+                key = self._upsert(source, row)
+                if key is not None:
+                    keys.append(key)
+            applied += len(keys)
+            if keys:
+                changed_parents[source.name] = keys
+                self._reapply_children(source, keys)
+
+            if source.parent and changed_parents.get(source.parent[0]):
+                # A changed parent may have lost children (bill revised).
+                parent_keys = changed_parents[source.parent[0]]
+                current = self._fetch_children(source, parent_keys)
+                current_keys = {row.get(source.key) for row in current}
+                for parent_key in parent_keys:
+                    for child_key in list(self._children[source.name].get(parent_key, ())):
+                        if child_key not in current_keys:
+                            self._remove(source, child_key)
+                for row in current:
+                    if self._rows[source.name].get(row.get(source.key)) != row:
+                        self._upsert(source, row)
+                        applied += 1
+        self.delta_refreshes += 1
+        self.delta_rows += applied
+
+    def get(self, force_refresh: bool = False) -> Dict[str, int]:
+        """The current map; refreshes it first once older than `ttl`. Raises
+        when there is no map yet and the cloud is unreachable."""
+        view = self._view
+        if not force_refresh and view is not None and (time.time() - self._checked) < self.ttl:
+            return view
+        with self._lock:
+            if not force_refresh and self._view is not None and (time.time() - self._checked) < self.ttl:
+                return self._view
+            full = self._force_full or self._view is None or (time.time() - self._built) >= self.full_every
+            try:
+                if full:
+                    self._rebuild()
+                else:
+                    try:
+                        self._refresh_deltas()
+                    except Exception as e:
+                        if self._view is None:
+                            raise
+                        logger.warning(f"{self.name}: delta refresh failed, rebuilding: {e}")
+                        self._rebuild()
+            except Exception:
+                if self._view is None:
+                    raise
+                logger.warning(f"{self.name}: refresh failed; serving the previous map", exc_info=True)
+                self._force_full = True
+                self._checked = time.time()
+                return self._view
+            self._view = self._finalize(self._totals)
+            self._checked = time.time()
+            return self._view
+
+    def invalidate(self, full: bool = False) -> None:
+        """Refresh on next use: from deltas, or from scratch with `full`."""
+        with self._lock:
+            self._checked = 0.0
+            if full:
+                self._force_full = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rows": {name: len(rows) for name, rows in self._rows.items()},
+            "watermarks": dict(self._marks),
+            "full_rebuilds": self.full_rebuilds,
+            "delta_refreshes": self.delta_refreshes,
+            "delta_rows": self.delta_rows,
+        }
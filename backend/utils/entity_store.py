@@ -0,0 +1,392 @@
+"""
+Process-wide in-memory store of parsed local JSON files.
+
+Every get_*_data() helper used to json.load() its whole file on each call, so a
+single checkout re-parsed products/storeinventory/bills/stores/users from disk.
+The store keeps one parsed copy per path and revalidates it with a cheap
+os.stat() (mtime/size/inode) before each use, so a file replaced by another
+writer -- sync thread, export script, an editor -- is still picked up.
+
+Callers freely mutate the lists/dicts they get back (read-modify-save is the
+pattern everywhere), so the cached copy is never handed out directly: reads get
+a snapshot whose containers are fresh objects, and writes store a normalized
+copy of what was just serialized.
+"""
+import bisect
+import os
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+Signature = Tuple[int, int, int]
+# Group index spec: (fields tried in order, casefold string keys?)
+IndexSpec = Tuple[Tuple[str, ...], bool]
+
+_SCALAR_TYPES = (str, int, float, bool, type(None))
+
+
+class _Unstorable(TypeError):
+    """Raised when data holds values JSON would not round-trip verbatim."""
+
+
+def signature_of(stat_result: os.stat_result) -> Signature:
+    return (stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino)
+
+
+def stat_signature(path: str) -> Optional[Signature]:
+    try:
+        return signature_of(os.stat(path))
+    except OSError:
+        return None
+
+
+def _json_key(key: Any) -> str:
+    # Mirror json.dumps' coercion of non-string dict keys.
+    if isinstance(key, str):
+        return key
+    if key is True:
+        return "true"
+    if key is False:
+        return "false"
+    if key is None:
+        return "null"
+    if isinstance(key, (int, float)):
+        return repr(key) if isinstance(key, float) else str(key)
+    raise _Unstorable(f"unsupported key type {type(key)}")
+
+
+def _normalized_copy(value: Any) -> Any:
+    """Deep copy `value` exactly as a json.dump + json.load round trip would
+    return it (tuples -> lists, keys -> str). Anything that only serialized
+    thanks to a `default=` hook (datetime, Decimal...) aborts the copy."""
+    if isinstance(value, dict):
+        return {_json_key(k): _normalized_copy(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalized_copy(v) for v in value]
+    if isinstance(value, _SCALAR_TYPES):
+        return value
+    raise _Unstorable(f"unsupported value type {type(value)}")
+
+
+def normalized(value: Any) -> Any:
+    """Public form of _normalized_copy; raises TypeError for non-JSON values."""
+    return _normalized_copy(value)
+
+
+def _deep_copy(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_deep_copy(v) for v in value]
+    if isinstance(value, dict):
+        out = dict(value)
+        for k, v in out.items():
+            if isinstance(v, (list, dict)):
+                out[k] = _deep_copy(v)
+        return out
+    return value
+
+
+def index_key(value: Any, fold: bool = False) -> Optional[str]:
+    """Hash key for an indexed value: its stripped string form, so 42 and
+    "42" meet. Empty values, booleans and containers are not indexed."""
+    if value is None or isinstance(value, (bool, list, dict)):
+        return None
+    key = str(value).strip()
+    if not key:
+        return None
+    return key.casefold() if fold else key
+
+
+def _group_value(row: Any, spec: IndexSpec) -> Optional[str]:
+    if not isinstance(row, dict):
+        return None
+    fields, fold = spec
+    for field in fields:
+        key = index_key(row.get(field), fold)
+        if key is not None:
+            return key
+    return None
+
+
+class _Group:
+    """value -> ascending row indices, plus each row's current value so a
+    replaced row can be moved between buckets without a rebuild."""
+    __slots__ = ("buckets", "values")
+
+    def __init__(self, rows: list, spec: IndexSpec):
+        self.buckets: Dict[str, List[int]] = {}
+        self.values: List[Optional[str]] = []
+        for idx, row in enumerate(rows):
+            value = _group_value(row, spec)
+            self.values.append(value)
+            if value is not None:
+                self.buckets.setdefault(value, []).append(idx)
+
+    def update(self, idx: int, value: Optional[str]) -> None:
+        while len(self.values) <= idx:
+            self.values.append(None)
+        old = self.values[idx]
+        if old == value:
+            return
+        if old is not None:
+            bucket = self.buckets.get(old)
+            if bucket:
+                pos = bisect.bisect_left(bucket, idx)
+                if pos < len(bucket) and bucket[pos] == idx:
+                    bucket.pop(pos)
+                if not bucket:
+                    del self.buckets[old]
+        if value is not None:
+            bisect.insort(self.buckets.setdefault(value, []), idx)
+        self.values[idx] = value
+
+
+def _nested_keys(rows: list) -> list:
+    """Per row, the keys holding containers (None for flat rows). Lets
+    snapshots of flat tables like products.json cost one dict() per row."""
+    out = []
+    for row in rows:
+        if isinstance(row, dict):
+            keys = tuple(k for k, v in row.items() if isinstance(v, (list, dict)))
+            out.append(keys or None)
+        else:
+            out.append(False)
+    return out
+
+
+def _row_copy(row: Any, keys) -> Any:
+    """Copy one cached row; `keys` is its _nested_keys() entry."""
+    if keys is None:
+        return dict(row)
+    if keys is False:
+        return _deep_copy(row)
+    copy = dict(row)
+    for k in keys:
+        copy[k] = _deep_copy(copy[k])
+    return copy
+
+
+class _Entry:
+    __slots__ = ("signature", "data", "nested", "version", "positions", "groups")
+
+    def __init__(self, signature: Signature, data: Any, version: int):
+        self.signature = signature
+        self.data = data
+        self.nested = _nested_keys(data) if isinstance(data, list) else None
+        self.version = version
+        self.positions: Dict[str, Dict[Any, int]] = {}
+        self.groups: Dict[IndexSpec, _Group] = {}
+
+    def group_for(self, spec: IndexSpec) -> _Group:
+        group = self.groups.get(spec)
+        if group is None:
+            group = _Group(self.data, spec)
+            self.groups[spec] = group
+        return group
+
+    def row_snapshot(self, idx: int) -> Any:
+        return _row_copy(self.data[idx], self.nested[idx])
+
+    def positions_for(self, key: str) -> Dict[Any, int]:
+        positions = self.positions.get(key)
+        if positions is None:
+            positions = {}
+            for idx, row in enumerate(self.data):
+                if isinstance(row, dict):
+                    value = row.get(key)
+                    if value is not None:
+                        positions[value] = idx
+            self.positions[key] = positions
+        return positions
+
+    def snapshot(self) -> Any:
+        data = self.data
+        if self.nested is None:
+            return _deep_copy(data)
+        out = []
+        append = out.append
+        for row, keys in zip(data, self.nested):
+            if keys is None:
+                append(dict(row))
+            elif keys is False:
+                append(_deep_copy(row))
+            else:
+                copy = dict(row)
+                for k in keys:
+                    copy[k] = _deep_copy(copy[k])
+                append(copy)
+        return out
+
+
+class EntityStore:
+    """Parsed-file cache keyed by absolute path, validated by stat signature."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, _Entry] = {}
+        self._versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    def _bump(self, key: str) -> int:
+        version = self._versions.get(key, 0) + 1
+        self._versions[key] = version
+        return version
+
+    def lookup(self, path: str, signature: Optional[Signature]) -> Tuple[bool, Any]:
+        """Return (True, snapshot) when the cached copy matches `signature`."""
+        if signature is None:
+            return False, None
+        with self._lock:
+            entry = self._entries.get(self._key(path))
+            if entry is None or entry.signature != signature:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            # Copied under the lock: mutate() edits entries in place.
+            return True, entry.snapshot()
+
+    def lookup_by(
+        self,
+        path: str,
+        signature: Any,
+        spec: IndexSpec,
+        values: List[Any],
+    ) -> Tuple[bool, Dict[str, List[Any]]]:
+        """
+        Return (True, {key: [row copies]}) for the rows whose `spec` value
+        matches each of `values` (keys are index_key() forms, file order
+        within a key), when the cached copy matches `signature`. The group
+        index is built on first use and kept current by mutate().
+        """
+        if signature is None:
+            return False, {}
+        with self._lock:
+            entry = self._entries.get(self._key(path))
+            if entry is None or entry.signature != signature or not isinstance(entry.data, list):
+                return False, {}
+            self.hits += 1
+            group = entry.group_for(spec)
+            found: Dict[str, List[Any]] = {}
+            for value in values:
+                key = index_key(value, spec[1])
+                if key is None or key in found:
+                    continue
+                found[key] = [entry.row_snapshot(i) for i in group.buckets.get(key, ())]
+            return True, found
+
+    def iter_rows(self, path: str, signature: Any) -> Optional[Iterator[Any]]:
+        """
+        Row copies of the cached list, made one at a time as the caller
+        iterates, when the cached copy matches `signature`; None otherwise.
+        Cached rows are replaced, never edited, by mutate(), so the rows
+        captured here stay valid after the lock is released.
+        """
+        if signature is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(self._key(path))
+            if entry is None or entry.signature != signature or not isinstance(entry.data, list):
+                return None
+            self.hits += 1
+            rows = list(zip(entry.data, entry.nested))
+        return (_row_copy(row, keys) for row, keys in rows)
+
+    def fill(self, path: str, signature: Signature, data: Any) -> Any:
+        """Cache freshly parsed `data` and return a snapshot for the caller."""
+        key = self._key(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            # Parallel cold readers of one version each parse it; the first
+            # to finish is kept so its indexes and version stay put.
+            if entry is None or entry.signature != signature:
+                entry = _Entry(signature, data, self._bump(key))
+                self._entries[key] = entry
+            return entry.snapshot()
+
+    def store(self, path: str, signature: Signature, data: Any) -> None:
+        """Record `data` as the content just written to `path`. The caller
+        keeps ownership of `data`, so a normalized copy is cached."""
+        key = self._key(path)
+        try:
+            normalized = _normalized_copy(data)
+        except (_Unstorable, RecursionError):
+            self.invalidate(path)
+            return
+        if isinstance(normalized, dict):
+            normalized = {str(k): v for k, v in normalized.items()}
+        with self._lock:
+            self._entries[key] = _Entry(signature, normalized, self._bump(key))
+
+    def mutate(
+        self,
+        path: str,
+        expected: Any,
+        signature: Any,
+        key: str,
+        fn: Callable[[list, Dict[Any, int]], Optional[List[int]]],
+    ) -> bool:
+        """
+        Apply an in-place row change to the cached copy of `path` if it is
+        still at signature `expected`, re-keying it to `signature`. `fn`
+        receives (rows, positions-by-`key`) and returns the indices it touched,
+        or None when rows were removed. Returns False (and drops the entry)
+        when the cache was not at `expected`; the next read then re-parses.
+        """
+        k = self._key(path)
+        with self._lock:
+            entry = self._entries.get(k)
+            if entry is None or entry.signature != expected or not isinstance(entry.data, list):
+                if self._entries.pop(k, None) is not None:
+                    self._bump(k)
+                return False
+            touched = fn(entry.data, entry.positions_for(key))
+            if touched is None:
+                entry.nested = _nested_keys(entry.data)
+                entry.positions = {key: entry.positions[key]}
+                # Rows shifted; group indexes rebuild on next use.
+                entry.groups = {}
+            else:
+                for idx in touched:
+                    keys = _nested_keys([entry.data[idx]])[0]
+                    if idx < len(entry.nested):
+                        entry.nested[idx] = keys
+                    else:
+                        entry.nested.append(keys)
+                    for spec, group in entry.groups.items():
+                        group.update(idx, _group_value(entry.data[idx], spec))
+                # Other key indexes may now point at replaced rows.
+                entry.positions = {key: entry.positions[key]}
+            entry.signature = signature
+            entry.version = self._bump(k)
+            return True
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        with self._lock:
+            if path is None:
+                for key in list(self._entries):
+                    self._bump(key)
+                self._entries.clear()
+                return
+            key = self._key(path)
+            if self._entries.pop(key, None) is not None:
+                self._bump(key)
+
+    def version(self, path: str) -> int:
+        """Monotonic per-path counter, bumped whenever the cached content changes."""
+        with self._lock:
+            return self._versions.get(self._key(path), 0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Global instance
+entity_store = EntityStore()
@@ -0,0 +1,217 @@
+"""
+Dependency-aware concurrent fetch plans for read endpoints.
+
+Enriching a page of bills used to run every chunked `in_` query one after
+another -- billitems, then replacements, then the replaced bills' items, then
+products, then HSN codes. A FetchPlan runs the same queries on a bounded
+per-request thread pool instead:
+
+    with FetchPlan("bill details", budget=20) as plan:
+        items = plan.chunked("billitems", bill_ids, lambda ids: q.in_("billid", ids))
+        repl = plan.chunked("replacements", bill_ids, ...)
+        orig = plan.after("original items", [repl], lambda rows: plan.chunked(...))
+        rows = plan.result(items)
+
+Independent stages run in parallel; an `after` stage starts the moment its
+inputs are complete (from the thread that finished the last of them), so
+worker threads never block on each other and the pool cannot deadlock. The
+plan's budget bounds the whole request: chunks not yet started when it runs
+out are skipped and result() raises FetchBudgetExceeded. On exit the plan
+logs a per-stage timing breakdown.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from config import Config
+from utils.supabase_resilience import execute_with_retry
+
+logger = logging.getLogger(__name__)
+
+
+class FetchBudgetExceeded(TimeoutError):
+    """The plan ran out of its time budget before a stage finished."""
+
+
+class Stage:
+    """A named step of a plan; result() gives its rows (or value)."""
+
+    def __init__(self, plan: "FetchPlan", name: str):
+        self.plan = plan
+        self.name = name
+        self.future: Future = Future()
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.calls = 0
+        self.rows = 0
+        self.skipped = False
+
+    def _done(self, value: Any = None, error: Optional[BaseException] = None) -> None:
+        self.finished = time.perf_counter()
+        if error is not None:
+            self.future.set_exception(error)
+        else:
+            self.future.set_result(value)
+
+    def result(self) -> Any:
+        return self.plan.result(self)
+
+
+class FetchPlan:
+    """Bounded-concurrency fetch plan with a per-request time budget."""
+
+    def __init__(self, label: str, budget: Optional[float] = None, concurrency: Optional[int] = None):
+        self.label = label
+        self.budget = float(budget if budget is not None else Config.FETCH_PLAN_BUDGET_SECONDS)
+        self.concurrency = max(1, int(concurrency or Config.FETCH_PLAN_CONCURRENCY))
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="fetch-plan")
+        self._started = time.perf_counter()
+        self._deadline = self._started + self.budget
+        self._stages: List[Stage] = []
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "FetchPlan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._pool.shutdown(wait=exc_type is None, cancel_futures=True)
+        self.log()
+
+    def remaining(self) -> float:
+        return self._deadline - time.perf_counter()
+
+    def _stage(self, name: str) -> Stage:
+        stage = Stage(self, name)
+        with self._lock:
+            self._stages.append(stage)
+        return stage
+
+    def chunked(
+        self,
+        name: str,
+        values: Sequence[Any],
+        build: Callable[[List[Any]], Any],
+        size: int = 200,
+        optional: bool = False,
+    ) -> Stage:
+        """
+        One query per `size` values, all submitted at once; the stage result
+        is every chunk's rows in chunk order. `build(chunk)` returns the
+        PostgREST query (executed with execute_with_retry). An optional stage
+        logs a failed chunk and carries on without its rows.
+        """
+        stage = self._stage(name)
+        chunks = [list(values[i:i + size]) for i in range(0, len(values), size)]
+        if not chunks:
+            stage._done([])
+            return stage
+
+        results: List[Optional[List[Dict]]] = [None] * len(chunks)
+        pending = [len(chunks)]
+        failed: List[BaseException] = []
+
+        def run(index: int, chunk: List[Any]) -> None:
+            error: Optional[BaseException] = None
+            if self.remaining() <= 0:
+                stage.skipped = True
+                error = FetchBudgetExceeded(f"{self.label}: budget spent before {name}")
+            else:
+                try:
+                    response = execute_with_retry(lambda: build(chunk), f"{name} for {self.label}")
+                    results[index] = response.data or []
+                except Exception as e:
+                    error = e
+            with self._lock:
+                stage.calls += 1
+                if error is not None:
+                    if optional and not isinstance(error, FetchBudgetExceeded):
+                        logger.warning(f"{self.label}: {name} chunk failed, continuing without it: {error}")
+                    else:
+                        failed.append(error)
+                pending[0] -= 1
+                last = pending[0] == 0
+            if last:
+                if failed:
+                    stage._done(error=failed[0])
+                else:
+                    rows = [row for part in results if part for row in part]
+                    stage.rows = len(rows)
+                    stage._done(rows)
+
+        for index, chunk in enumerate(chunks):
+            self._pool.submit(run, index, chunk)
+        return stage
+
+    def after(self, name: str, inputs: Sequence[Stage], fn: Callable[..., Any]) -> Stage:
+        """
+        Run `fn(*input results)` once every input stage is done. `fn` may
+        return a Stage (e.g. from chunked()), whose result becomes this one's.
+        """
+        stage = self._stage(name)
+        remaining = [len(inputs)]
+
+        def fire() -> None:
+            errors = [s.future.exception() for s in inputs if s.future.exception() is not None]
+            if errors:
+                stage._done(error=errors[0])
+                return
+            stage.started = time.perf_counter()
+            try:
+                value = fn(*[s.future.result() for s in inputs])
+            except Exception as e:
+                stage._done(error=e)
+                return
+            if isinstance(value, Stage):
+                value.future.add_done_callback(
+                    lambda f: stage._done(error=f.exception()) if f.exception() else stage._done(f.result())
+                )
+            else:
+                stage._done(value)
+
+        def on_input_done(_f: Future) -> None:
+            with self._lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                fire()
+
+        if not inputs:
+            fire()
+        for s in inputs:
+            s.future.add_done_callback(on_input_done)
+        return stage
+
+    def result(self, stage: Stage) -> Any:
+        """The stage's result, waiting at most for what is left of the budget."""
+        wait = max(0.0, self.remaining())
+        try:
+            return stage.future.result(timeout=wait)
+        except FutureTimeout:
+            if stage.future.done():
+                raise
+            raise FetchBudgetExceeded(f"{self.label}: {stage.name} not done within {self.budget:.1f}s")
+
+    def timings(self) -> Dict[str, Any]:
+        total = time.perf_counter() - self._started
+        stages = {}
+        with self._lock:
+            for s in self._stages:
+                end = s.finished if s.finished is not None else time.perf_counter()
+                stages[s.name] = {
+                    "ms": round((end - s.started) * 1000, 1),
+                    "calls": s.calls,
+                    "rows": s.rows,
+                    "done": s.finished is not None and not s.skipped,
+                }
+        return {"total_ms": round(total * 1000, 1), "budget_ms": round(self.budget * 1000), "stages": stages}
+
+    def log(self) -> None:
+        timings = self.timings()
+        parts = ", ".join(
+            f"{name} {t['ms']}ms/{t['calls']} calls" + ("" if t["done"] else " (unfinished)")
+            for name, t in timings["stages"].items()
+        )
+        logger.info(f"{self.label}: {timings['total_ms']}ms of {timings['budget_ms']}ms budget -- {parts}")
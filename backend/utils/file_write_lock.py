@@ -3,26 +3,149 @@ Per-path locking for local JSON file access.
 
 The background sync thread (scripts/sync_manager.py) and live Flask request
 threads both read/write the same JSON files with no coordination today --
-a confirmed lost-update race. This app runs single-process (PyInstaller
-onedir, plain app.run(), no gunicorn workers), so an in-process lock is
-fully sufficient; this would need revisiting only if that ever changes.
+a confirmed lost-update race. The desktop build runs single-process
+(PyInstaller onedir, plain app.run()), where an in-process lock is fully
+sufficient. When several gunicorn workers share the data directory
+(LOCAL_STORAGE_MULTIPROCESS), each lock additionally takes an flock on a
+`<path>.lock` sidecar once the in-process part is held; see
+utils/process_coordination.py.
+
+Each path has a reader-writer lock. file_write_lock is exclusive;
+file_read_lock lets any number of readers parse the same file at once, so
+concurrent catalog GETs no longer queue behind each other. Writers are
+preferred: once one is waiting, new readers wait too, so a steady stream of
+reads cannot starve a save. Neither lock is reentrant.
+
+Readers of an unchanged file do not lock at all: json_helpers serves them
+from the entity store after a stat() check, and snapshots are replaced with
+os.replace, so only a cold read (which also replays the append-only journal)
+needs the shared lock.
 """
 import os
 import threading
+import time
 from contextlib import contextmanager
+from typing import Dict, Optional
+
+from utils import process_coordination
+from utils.process_coordination import OsLock
+
+
+class ReadWriteLock:
+    """Writer-preferring reader-writer lock with wait-time counters."""
+
+    def __init__(self, os_lock: Optional[OsLock] = None):
+        self._os = os_lock
+        self._os_guard = threading.Lock()
+        self._os_readers = 0
+        self._os_held = False
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self.read_acquires = 0
+        self.write_acquires = 0
+        self.read_wait_s = 0.0
+        self.write_wait_s = 0.0
+        self.contended = 0
+
+    def acquire_read(self) -> None:
+        with self._cond:
+            if self._writer or self._writers_waiting:
+                self.contended += 1
+                started = time.perf_counter()
+                while self._writer or self._writers_waiting:
+                    self._cond.wait()
+                self.read_wait_s += time.perf_counter() - started
+            self._readers += 1
+            self.read_acquires += 1
+
+        try:
+            self._os_enter_read()
+        except BaseException:
+            self._release_read_local()
+            raise
+
+    def release_read(self) -> None:
+        try:
+            self._os_exit_read()
+        finally:
+            self._release_read_local()
+
+    def _release_read_local(self) -> None:
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        with self._cond:
+            if self._writer or self._readers:
+                self.contended += 1
+                started = time.perf_counter()
+                self._writers_waiting += 1
+                try:
+                    while self._writer or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._writers_waiting -= 1
+                self.write_wait_s += time.perf_counter() - started
+            self._writer = True
+            self.write_acquires += 1
+        try:
+            self._os_held = self._os is not None and process_coordination.enabled()
+            if self._os_held:
+                self._os.acquire(shared=False)
+        except BaseException:
+            self._os_held = False
+            self._release_write_local()
+            raise
+
+    def release_write(self) -> None:
+        try:
+            if self._os_held:
+                self._os_held = False
+                self._os.release()
+        finally:
+            self._release_write_local()
+
+    def _release_write_local(self) -> None:
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    # Readers of one process share a single flock: the first takes it, the
+    # last drops it.
+
+    def _os_enter_read(self) -> None:
+        with self._os_guard:
+            if self._os_readers == 0:
+                held = self._os is not None and process_coordination.enabled()
+                if held:
+                    self._os.acquire(shared=True)
+                self._os_held = held
+            self._os_readers += 1
+
+    def _os_exit_read(self) -> None:
+        with self._os_guard:
+            self._os_readers -= 1
+            if self._os_readers == 0 and self._os_held:
+                self._os_held = False
+                self._os.release()
+
 
 _locks_guard = threading.Lock()
-_locks: dict[str, threading.Lock] = {}
+_locks: Dict[str, ReadWriteLock] = {}
 
 
-def _lock_for(path: str) -> threading.Lock:
+def _lock_for(path: str) -> ReadWriteLock:
     key = os.path.normcase(os.path.abspath(path))
     lock = _locks.get(key)
     if lock is None:
         with _locks_guard:
             lock = _locks.get(key)
             if lock is None:
-                lock = threading.Lock()
+                lock = ReadWriteLock(OsLock(path))
                 _locks[key] = lock
     return lock
 
@@ -30,5 +153,32 @@ def _lock_for(path: str) -> threading.Lock:
 @contextmanager
 def file_write_lock(path: str):
     lock = _lock_for(path)
-    with lock:
+    lock.acquire_write()
+    try:
+        yield
+    finally:
+        lock.release_write()
+
+
+@contextmanager
+def file_read_lock(path: str):
+    lock = _lock_for(path)
+    lock.acquire_read()
+    try:
         yield
+    finally:
+        lock.release_read()
+
+
+def lock_stats() -> Dict[str, float]:
+    """Totals across all paths, for diagnostics."""
+    with _locks_guard:
+        locks = list(_locks.values())
+    return {
+        "paths": len(locks),
+        "read_acquires": sum(l.read_acquires for l in locks),
+        "write_acquires": sum(l.write_acquires for l in locks),
+        "contended": sum(l.contended for l in locks),
+        "read_wait_ms": round(sum(l.read_wait_s for l in locks) * 1000, 3),
+        "write_wait_ms": round(sum(l.write_wait_s for l in locks) * 1000, 3),
+    }
@@ -0,0 +1,136 @@
+"""
+Group commit for whole-file writes.
+
+A burst of checkouts used to queue on file_write_lock, each thread serializing
+and fsyncing its own full copy of the same file only for the next thread to
+overwrite it milliseconds later. Every save is a complete replacement, so when
+several are waiting only the newest one needs to reach disk: it already
+contains everything the older ones wrote (each was a read-modify-write of the
+state before it).
+
+Writers for a path join the pending batch (their payload replaces the batch's
+payload); whichever waiting thread finds the path idle becomes the writer,
+optionally lingers for a short window to let more writers join, and writes the
+batch once. Every caller in the batch returns only after that write is durable
+and gets its result, so `_safe_json_dump` keeps its synchronous contract.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    __slots__ = ("payload", "done", "ok", "writers")
+
+    def __init__(self):
+        self.payload: Any = None
+        self.done = False
+        self.ok = False
+        self.writers = 0
+
+
+class _PathState:
+    __slots__ = ("cond", "pending", "writing", "commits", "coalesced")
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending: Optional[_Batch] = None
+        self.writing = False
+        self.commits = 0
+        self.coalesced = 0
+
+
+class GroupCommitter:
+    """Coalesces concurrent whole-file writes per path."""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._states: Dict[str, _PathState] = {}
+
+    def _state(self, path: str) -> _PathState:
+        key = os.path.normcase(os.path.abspath(path))
+        state = self._states.get(key)
+        if state is None:
+            with self._guard:
+                state = self._states.get(key)
+                if state is None:
+                    state = _PathState()
+                    self._states[key] = state
+        return state
+
+    def submit(self, path: str, payload: Any, write: Callable[[Any], bool], window: float = 0.0) -> bool:
+        """
+        Queue `payload` as the next content of `path` and block until a write
+        covering it has completed. `write(payload)` performs one durable write
+        and returns success; it runs on one of the submitting threads.
+        """
+        state = self._state(path)
+        with state.cond:
+            batch = state.pending
+            if batch is None:
+                batch = state.pending = _Batch()
+            batch.payload = payload
+            batch.writers += 1
+
+            while not batch.done:
+                if state.writing:
+                    state.cond.wait()
+                    continue
+
+                state.writing = True
+                if window > 0:
+                    # Let concurrent writers join before we take the batch.
+                    deadline = time.monotonic() + window
+                    remaining = window
+                    while remaining > 0:
+                        state.cond.wait(remaining)
+                        remaining = deadline - time.monotonic()
+                current = state.pending
+                state.pending = None
+                ok = False
+                state.cond.release()
+                try:
+                    ok = bool(write(current.payload))
+                except Exception as e:
+                    logger.error(f"Group commit write failed for {path}: {e}")
+                finally:
+                    state.cond.acquire()
+                    current.ok = ok
+                    current.done = True
+                    current.payload = None
+                    state.commits += 1
+                    state.coalesced += current.writers - 1
+                    state.writing = False
+                    state.cond.notify_all()
+            return batch.ok
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until no path has a write pending or in flight. True if idle."""
+        deadline = time.monotonic() + timeout
+        with self._guard:
+            states = list(self._states.values())
+        for state in states:
+            with state.cond:
+                while state.writing or state.pending is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    state.cond.wait(remaining)
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._guard:
+            states = list(self._states.values())
+        return {
+            "paths": len(states),
+            "commits": sum(s.commits for s in states),
+            "coalesced": sum(s.coalesced for s in states),
+        }
+
+
+# Global instance
+group_committer = GroupCommitter()
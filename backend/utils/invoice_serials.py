@@ -0,0 +1,173 @@
+"""
+Per-store daily invoice serial allocator.
+
+Invoice ids are INV-<storecode>-<DDMMYYYY><serial>. Finding the next serial
+used to mean scanning every local bill and querying Supabase with
+like("id", "INV-...%") on each checkout. This module keeps the last issued
+serial per (store, day prefix) in a small state file
+(Config.INVOICE_SERIALS_FILE), so allocating is one increment under a file
+lock, shared with the other worker processes.
+
+A counter is seeded once, on its first use of the day, by a caller-supplied
+function that returns the highest serial already in use (local bills plus a
+best-effort cloud lookup). Every bill upserted into the local bills file also
+moves its counter forward, and a full rewrite of that file (a sync pull) makes
+each counter re-check on its next use, so an id issued elsewhere is never
+handed out again here.
+
+reserve() hands out a contiguous block for a terminal that will bill offline;
+the block is consumed at once and the terminal numbers its bills itself.
+Counters of earlier days are dropped on the next write.
+"""
+import json
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import Config
+from utils.file_write_lock import file_write_lock
+from utils.json_helpers import add_write_listener
+from utils.json_utils import save_json_file
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+SERIAL_WIDTH = 4
+_INVOICE_ID = re.compile(r"^(INV-[A-Z0-9]+-(\d{8}))(\d{4,})$")
+
+
+def _key(store_id: str, prefix: str) -> str:
+    return f"{store_id}|{prefix}"
+
+
+def _day_of(prefix: str) -> str:
+    return prefix.rsplit("-", 1)[-1]
+
+
+def split_invoice_id(invoice_id: Any) -> Optional[Tuple[str, int]]:
+    """(prefix, serial) of an invoice id, None for anything else."""
+    match = _INVOICE_ID.match(str(invoice_id or ""))
+    if not match:
+        return None
+    return match.group(1), int(match.group(3))
+
+
+def format_invoice_id(prefix: str, serial: int) -> str:
+    return f"{prefix}{serial:0{SERIAL_WIDTH}d}"
+
+
+class InvoiceSerials:
+    """Last issued serial per (store id, day prefix), persisted across restarts."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._registered = False
+
+    @property
+    def path(self) -> str:
+        return self._path or Config.INVOICE_SERIALS_FILE
+
+    def _load(self) -> Dict[str, Any]:
+        empty = {"counters": {}, "verified": []}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return empty
+        except Exception as e:
+            logger.warning(f"Invoice serial state unreadable, reseeding: {e}")
+            return empty
+        if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+            return empty
+        return {
+            "counters": dict(state.get("counters") or {}),
+            "verified": list(state.get("verified") or []),
+        }
+
+    def _save(self, state: Dict[str, Any], today: Optional[str] = None) -> None:
+        counters = state["counters"]
+        if today is not None:
+            counters = {k: v for k, v in counters.items() if _day_of(k) == today}
+        verified = [k for k in state["verified"] if k in counters]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        save_json_file(self.path, {"version": STATE_VERSION, "counters": counters, "verified": verified})
+
+    def _take(self, store_id: str, prefix: str, count: int, seed: Callable[[], int]) -> int:
+        """Advance the counter by `count`; returns the first serial taken."""
+        key = _key(store_id, prefix)
+        with file_write_lock(self.path):
+            needs_seed = key not in self._load()["verified"]
+        # The seed reads the bills file, whose write listener takes this lock:
+        # never hold it while seeding. Two workers seeding at once are still
+        # safe -- the second finds the counter already set and moves past it.
+        floor = max(0, int(seed() or 0)) if needs_seed else 0
+        with file_write_lock(self.path):
+            state = self._load()
+            last = max(int(state["counters"].get(key) or 0), floor)
+            if needs_seed:
+                logger.info(f"Invoice serials for {prefix} (store {store_id}) seeded at {last}")
+                if key not in state["verified"]:
+                    state["verified"].append(key)
+            state["counters"][key] = last + count
+            self._save(state, _day_of(prefix))
+        return last + 1
+
+    def next_id(self, store_id: str, prefix: str, seed: Callable[[], int]) -> str:
+        return format_invoice_id(prefix, self._take(store_id, prefix, 1, seed))
+
+    def reserve(self, store_id: str, prefix: str, count: int, seed: Callable[[], int]) -> Tuple[str, str]:
+        """First and last id of a block of `count` serials nobody else will be given."""
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        first = self._take(store_id, prefix, count, seed)
+        return format_invoice_id(prefix, first), format_invoice_id(prefix, first + count - 1)
+
+    def observe(self, rows) -> None:
+        """Move counters past the ids of bills written elsewhere."""
+        seen: Dict[str, int] = {}
+        for row in rows:
+            if not isinstance(row, dict):
+                continue
+            parsed = split_invoice_id(row.get("id"))
+            store_id = str(row.get("storeid") or row.get("storeId") or "")
+            if parsed is None or not store_id:
+                continue
+            key = _key(store_id, parsed[0])
+            seen[key] = max(seen.get(key, 0), parsed[1])
+        if not seen:
+            return
+        with file_write_lock(self.path):
+            state = self._load()
+            counters = state["counters"]
+            # Only counters already in use; one that is not will find these
+            # bills when it is seeded.
+            moved = {k: v for k, v in seen.items() if k in counters and v > int(counters[k] or 0)}
+            if moved:
+                counters.update(moved)
+                self._save(state)
+
+    def _on_bills_write(self, path, before, after, ops) -> None:
+        if ops is not None:
+            self.observe(op.get("row") for op in ops)
+            return
+        # A full rewrite (sync pull, restore) may bring in any id: every
+        # counter is checked against the bills again on its next use.
+        with file_write_lock(self.path):
+            state = self._load()
+            if state["verified"]:
+                state["verified"] = []
+                self._save(state)
+
+    def _register(self) -> None:
+        if not self._registered:
+            add_write_listener(Config.BILLS_FILE, self._on_bills_write)
+            self._registered = True
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._load()["counters"])
+
+
+# Global instance
+invoice_serials = InvoiceSerials()
+invoice_serials._register()
@@ -5,16 +5,108 @@ Handles reading and writing to local JSON files (offline-first storage)
 import os
 import json
 import logging
-from typing import Any, Dict, List, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 from config import Config
-from utils.file_write_lock import file_write_lock
+from utils.file_write_lock import file_read_lock, file_write_lock
+from utils.group_commit import group_committer
+from utils.entity_store import entity_store, index_key, normalized, signature_of, stat_signature
+from utils import json_journal, sqlite_store, storage_codec
 
 logger = logging.getLogger(__name__)
 
+# path key -> callbacks run (under the path lock) after each committed write:
+# fn(path, before, after, ops), where before/after are local_signature()
+# values and ops the journal-style row changes, [] for a rewrite with the
+# same content (compaction), or None for an arbitrary full rewrite.
+_write_listeners: Dict[str, List[Callable]] = {}
+
+
+def add_write_listener(path: str, fn: Callable) -> None:
+    """Register `fn` to be told about every write to `path` made through these helpers."""
+    key = os.path.normcase(os.path.abspath(path))
+    callbacks = _write_listeners.setdefault(key, [])
+    if fn not in callbacks:
+        callbacks.append(fn)
+
+
+def _notify(path: str, before, after, ops) -> None:
+    callbacks = _write_listeners.get(os.path.normcase(os.path.abspath(path)))
+    if not callbacks:
+        return
+    for fn in list(callbacks):
+        try:
+            fn(path, before, after, ops)
+        except Exception as e:
+            logger.warning(f"Write listener {getattr(fn, '__name__', fn)} failed for {path}: {e}")
+
+
+def _composite_signature(path: str):
+    """(snapshot signature, journal signature) -- the version of the merged
+    view; None when the snapshot itself is missing."""
+    snapshot = stat_signature(path)
+    if snapshot is None:
+        return None
+    return (snapshot, stat_signature(json_journal.journal_path(path)))
+
+
+def _read_merged_locked(path: str) -> tuple:
+    """Parse `path` and replay its journal. Caller holds the path lock."""
+    with open(path, 'rb') as f:
+        data = storage_codec.decode(f.read())
+        # fstat of the handle we actually read, so the cached copy is
+        # keyed by exactly the file version it came from.
+        snapshot = signature_of(os.fstat(f.fileno()))
+
+    ops, key, journal_stat = json_journal.read_ops(path, snapshot)
+    if ops and isinstance(data, list):
+        json_journal.apply_ops(data, ops, key, json_journal.build_positions(data, key))
+    journal = signature_of(journal_stat) if journal_stat is not None else None
+
+    # Ensure top-level dictionary keys are strings to prevent TypeError with jsonify
+    if isinstance(data, dict):
+        data = {str(k): v for k, v in data.items()}
+    return data, (snapshot, journal)
+
+
+def _sqlite_entity(path: str) -> Optional[Tuple[sqlite_store.SqliteStore, str]]:
+    """(store, entity name) when `path` is served by the SQLite engine."""
+    if Config.LOCAL_STORAGE_ENGINE != "sqlite":
+        return None
+    rel = os.path.relpath(os.path.abspath(path), os.path.abspath(Config.JSON_DIR))
+    if rel == os.curdir or rel.startswith(os.pardir) or os.path.isabs(rel):
+        return None
+    return sqlite_store.get_store(Config.SQLITE_DB_FILE), rel.replace(os.sep, "/")
+
+
+def _sqlite_source(path: str) -> Optional[str]:
+    signature = _composite_signature(path)
+    return json.dumps(signature) if signature is not None else None
+
+
+def _sqlite_refresh(store: sqlite_store.SqliteStore, entity: str, path: str, locked: bool = False) -> Optional[int]:
+    """Import `path` into the database when the file was (re)written outside
+    json_helpers since the last import. Returns the entity's version."""
+    version, source = store.meta(entity)
+    current = _sqlite_source(path)
+    if current is None or current == source:
+        return version
+    if not locked:
+        with file_write_lock(path):
+            return _sqlite_refresh(store, entity, path, locked=True)
+    data, signature = _read_merged_locked(path)
+    logger.info(f"Importing {path} into local SQLite store")
+    return store.replace(entity, data, source=json.dumps(signature))
+
+
 def _safe_json_load(path: str, default: Any) -> Any:
     """
     Safely load JSON data from a file.
 
+    Parsed files are kept in the process-wide entity store and revalidated
+    with os.stat, so repeat reads of an unchanged file skip json.load. The
+    caller always receives its own copy and may mutate it freely. Rows
+    appended through _safe_json_upsert/_safe_json_delete are merged in.
+
     Args:
         path: Path to the JSON file
         default: Default value to return if file doesn't exist or is invalid
@@ -22,22 +114,25 @@ def _safe_json_load(path: str, default: Any) -> Any:
     Returns:
         Loaded data or default value
     """
-    if not os.path.exists(path):
+    located = _sqlite_entity(path)
+    if located is not None:
+        return _sqlite_load(path, default, *located)
+
+    signature = _composite_signature(path)
+    if signature is None:
         return default
 
-    # Locking the read too (not just the write) means a save-then-read-back
-    # call pattern elsewhere can never observe a torn intermediate state from
-    # a *different* writer racing on the same path.
-    with file_write_lock(path):
+    hit, cached = entity_store.lookup(path, signature)
+    if hit:
+        return cached
+
+    # The shared lock keeps a writer (snapshot replace + journal retire, or a
+    # journal append) from landing mid-read, while concurrent cold reads of
+    # the same file proceed in parallel.
+    with file_read_lock(path):
         try:
-            # utf-8-sig tolerates BOM-prefixed files (common when edited by Windows tools)
-            with open(path, 'r', encoding='utf-8-sig') as f:
-                data = json.load(f)
-
-            # Ensure top-level dictionary keys are strings to prevent TypeError with jsonify
-            if isinstance(data, dict):
-                return {str(k): v for k, v in data.items()}
-            return data
+            data, signature = _read_merged_locked(path)
+            return entity_store.fill(path, signature, data)
         except json.JSONDecodeError:
             logger.error(f"JSON decode error in {path}, returning default")
             return default
@@ -46,6 +141,58 @@ def _safe_json_load(path: str, default: Any) -> Any:
             return default
 
 
+def _sqlite_load(path: str, default: Any, store: sqlite_store.SqliteStore, entity: str) -> Any:
+    try:
+        version = _sqlite_refresh(store, entity, path)
+        if version is None:
+            return default
+        hit, cached = entity_store.lookup(path, ("sqlite", version))
+        if hit:
+            return cached
+        version, data = store.load(entity)
+        if version is None:
+            return default
+        return entity_store.fill(path, ("sqlite", version), data)
+    except Exception as e:
+        logger.error(f"Error loading {entity} from local SQLite store: {e}")
+        return default
+
+
+def _write_snapshot_locked(path: str, data: Any, default=None) -> tuple:
+    """Atomically replace `path` with `data` and retire its journal. Caller
+    holds the path lock; raises on failure. Returns the new local_signature."""
+    tmp = f"{path}.tmp"
+    try:
+        payload = storage_codec.encode(data, storage_codec.format_for(path, data), default=default)
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+            # os.replace keeps inode/mtime/size, so this is the signature
+            # the next reader will stat at `path`.
+            signature = signature_of(os.fstat(f.fileno()))
+        os.replace(tmp, path)
+    except Exception:
+        entity_store.invalidate(path)
+        try:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    # The new snapshot already contains everything the journal held. If we
+    # crash before the remove, the journal's base no longer matches and it
+    # is ignored on the next load.
+    try:
+        json_journal.remove(path)
+    except OSError as e:
+        logger.warning(f"Could not remove journal for {path}: {e}")
+        entity_store.invalidate(path)
+        return _composite_signature(path)
+    entity_store.store(path, (signature, None), data)
+    return (signature, None)
+
+
 def _safe_json_dump(path: str, data: Any, default=None) -> bool:
     """
     Safely write JSON data to a file.
@@ -54,7 +201,7 @@ def _safe_json_dump(path: str, data: Any, default=None) -> bool:
         path: Path to the JSON file
         data: Data to write
         default: optional json.dump-style serializer for non-JSON-native
-            types (e.g. datetime) -- passed straight through to json.dump
+            types (e.g. datetime) -- passed straight through to the encoder
 
     Returns:
         True if successful, False otherwise
@@ -69,29 +216,429 @@ def _safe_json_dump(path: str, data: Any, default=None) -> bool:
             logger.error(f"Failed to create directory {parent_dir}: {e}")
             return False
 
+    # Concurrent saves of the same file share one write: only the newest
+    # payload is serialized and fsynced, and every caller returns once it is
+    # durable (see utils/group_commit.py).
+    return group_committer.submit(
+        path,
+        (data, default),
+        lambda payload: _dump_locked(path, *payload),
+        window=Config.JSON_GROUP_COMMIT_WINDOW_MS / 1000.0,
+    )
+
+
+def _dump_locked(path: str, data: Any, default=None) -> bool:
     # Atomic write: serialize to a temp file, fsync, then os.replace. This
     # guarantees readers never see a half-written/truncated file (which a crash
     # mid-write would otherwise leave behind and corrupt the local cache).
     # The lock additionally prevents two concurrent writers (a live request
     # thread and the background sync thread) from racing a read-modify-write
     # cycle and silently losing one side's update.
-    tmp = f"{path}.tmp"
     with file_write_lock(path):
         try:
-            with open(tmp, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False, default=default)
-                f.flush()
-                os.fsync(f.fileno())
-            os.replace(tmp, path)
+            located = _sqlite_entity(path)
+            if located is not None:
+                store, entity = located
+                before = store.version(entity)
+                # Record the file as imported so it is not re-read over this write.
+                version = store.replace(entity, data, default=default, source=_sqlite_source(path))
+                entity_store.store(path, ("sqlite", version), data)
+                _notify(path, ("sqlite", before), ("sqlite", version), None)
+                return True
+            before = _composite_signature(path)
+            after = _write_snapshot_locked(path, data, default)
+            _notify(path, before, after, None)
             return True
         except Exception as e:
             logger.error(f"Failed to write JSON to {path}: {e}")
+            entity_store.invalidate(path)
+            return False
+
+
+def flush_pending_writes(timeout: float = 10.0) -> bool:
+    """Block until every queued local JSON save has reached disk (shutdown hook)."""
+    return group_committer.flush(timeout)
+
+
+def _safe_json_append(path: str, ops: List[Dict], key: str) -> bool:
+    """
+    Commit keyed row changes to `path` by appending them to its journal (one
+    small fsync) instead of rewriting the whole array. Compacts the journal
+    into the snapshot once it exceeds Config.JOURNAL_COMPACT_BYTES.
+    """
+    if not ops:
+        return True
+    with file_write_lock(path):
+        return _append_locked(path, ops, key)
+
+
+def _append_locked(path: str, ops: List[Dict], key: str) -> bool:
+    """_safe_json_append's body; the caller holds the path lock."""
+    located = _sqlite_entity(path)
+    if located is not None:
+        return _sqlite_append(path, ops, key, *located)
+
+    jpath = json_journal.journal_path(path)
+    try:
+        snapshot = stat_signature(path)
+        base, journal_key = json_journal.read_header(jpath)
+        if snapshot is None or (base == snapshot and journal_key != key):
+            # Nothing to append to yet, or a live journal addressed by a
+            # different key: fold everything into a fresh snapshot.
+            if snapshot is None:
+                parent_dir = os.path.dirname(path)
+                if parent_dir:
+                    os.makedirs(parent_dir, exist_ok=True)
+                rows: List[Dict] = []
+            else:
+                rows, _ = _read_merged_locked(path)
+            before = _composite_signature(path)
+            json_journal.apply_ops(rows, ops, key, json_journal.build_positions(rows, key))
+            after = _write_snapshot_locked(path, rows)
+            _notify(path, before, after, ops)
+            return True
+
+        before = (snapshot, stat_signature(jpath))
+        journal_stat = json_journal.append_ops(path, snapshot, ops, key)
+        after = (snapshot, signature_of(journal_stat))
+        entity_store.mutate(
+            path, before, after, key,
+            lambda rows, positions: json_journal.apply_ops(rows, ops, key, positions),
+        )
+        _notify(path, before, after, ops)
+
+        if journal_stat.st_size > Config.JOURNAL_COMPACT_BYTES:
             try:
-                if os.path.exists(tmp):
-                    os.remove(tmp)
-            except OSError:
-                pass
+                rows, _ = _read_merged_locked(path)
+                compacted = _write_snapshot_locked(path, rows)
+                _notify(path, after, compacted, [])
+            except Exception as e:
+                # The append above is already durable; compaction retries next time.
+                logger.warning(f"Journal compaction failed for {path}: {e}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to append JSON changes to {path}: {e}")
+        entity_store.invalidate(path)
+        return False
+
+
+def _sqlite_append(path: str, ops: List[Dict], key: str, store: sqlite_store.SqliteStore, entity: str) -> bool:
+    try:
+        before = _sqlite_refresh(store, entity, path, locked=True)
+        version = store.apply(entity, ops, key)
+        if version is None:
+            # Never stored (no file to import): start the entity from these rows.
+            rows: List[Dict] = []
+            json_journal.apply_ops(rows, ops, key, json_journal.build_positions(rows, key))
+            version = store.replace(entity, rows)
+            entity_store.store(path, ("sqlite", version), rows)
+            _notify(path, ("sqlite", None), ("sqlite", version), ops)
+            return True
+        entity_store.mutate(
+            path, ("sqlite", before), ("sqlite", version), key,
+            lambda rows, positions: json_journal.apply_ops(rows, ops, key, positions),
+        )
+        _notify(path, ("sqlite", before), ("sqlite", version), ops)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to apply changes to {entity} in local SQLite store: {e}")
+        entity_store.invalidate(path)
+        return False
+
+
+def _safe_json_upsert(path: str, rows: List[Dict], key: str = "id") -> bool:
+    """Insert or replace `rows` (matched on `key`) in a JSON array file."""
+    try:
+        ops = [json_journal.upsert_op(normalized(row)) for row in rows]
+    except (TypeError, RecursionError) as e:
+        logger.error(f"Refusing to journal non-JSON rows for {path}: {e}")
+        return False
+    return _safe_json_append(path, ops, key)
+
+
+def _safe_json_delete(path: str, key_values: List[Any], key: str = "id") -> bool:
+    """Remove the rows whose `key` is in `key_values` from a JSON array file."""
+    return _safe_json_append(path, [json_journal.delete_op(v) for v in key_values], key)
+
+
+def _safe_json_patch(path: str, key_value: Any, fields: Dict[str, Any], key: str = "id") -> bool:
+    """
+    Set `fields` on the row whose `key` is `key_value`, leaving its other
+    fields as they are now. The row is read and written back under the path
+    lock, so an upsert of the same row racing with the patch is never undone
+    by it. False when the row does not exist.
+    """
+    with file_write_lock(path):
+        try:
+            row = _current_row_locked(path, key, key_value)
+        except Exception as e:
+            logger.error(f"Failed to read {key}={key_value} from {path} for a patch: {e}")
+            return False
+        if row is None:
+            return False
+        row.update(fields)
+        try:
+            ops = [json_journal.upsert_op(normalized(row))]
+        except (TypeError, RecursionError) as e:
+            logger.error(f"Refusing to journal non-JSON patch for {path}: {e}")
             return False
+        return _append_locked(path, ops, key)
+
+
+def _current_row_locked(path: str, key: str, key_value: Any) -> Optional[Dict]:
+    """The row a write to `path` would replace; the caller holds the path lock."""
+    located = _sqlite_entity(path)
+    if located is not None:
+        store, entity = located
+        version = _sqlite_refresh(store, entity, path, locked=True)
+        signature = ("sqlite", version) if version is not None else None
+    else:
+        signature = _composite_signature(path)
+    if signature is None:
+        return None
+
+    wanted = index_key(key_value)
+    hit, found = entity_store.lookup_by(path, signature, _index_spec(key, False), [key_value])
+    if not hit:
+        if located is not None:
+            version, data = store.load(entity)
+            signature = ("sqlite", version)
+        else:
+            data, signature = _read_merged_locked(path)
+        data = entity_store.fill(path, signature, data)
+        found = {wanted: [r for r in data if isinstance(r, dict) and index_key(r.get(key)) == wanted]}
+    # apply_ops replaces the last row with a key, so that is the live one.
+    rows = found.get(wanted) or []
+    return rows[-1] if rows else None
+
+
+def query_local_rows(
+    path: str,
+    filters: Optional[Dict[str, Any]] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    newest_first: bool = True,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Tuple[List[Dict], int]:
+    """
+    Filter, sort and slice a local JSON array by its indexed fields.
+
+    `filters` keys are any of id/storeid/productid/barcode (store and product
+    ids match their snake/camel variants); dates compare against the row's
+    created_at/timestamp/date. Rows come back newest first (ties keep file
+    order). Returns (page of rows, total matching). With the SQLite engine
+    this is an indexed query; with JSON files it is a single scan.
+    """
+    located = _sqlite_entity(path)
+    if located is not None:
+        store, entity = located
+        if _sqlite_refresh(store, entity, path) is None:
+            return [], 0
+        return store.query(entity, filters, date_from, date_to, newest_first, limit, offset)
+
+    return filter_rows(
+        _safe_json_load(path, []), filters, date_from, date_to, newest_first, limit, offset
+    )
+
+
+def filter_rows(
+    rows: List[Dict],
+    filters: Optional[Dict[str, Any]] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    newest_first: bool = True,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Tuple[List[Dict], int]:
+    """In-memory form of query_local_rows with identical matching and ordering."""
+    for field in filters or {}:
+        if field not in sqlite_store.QUERYABLE_FIELDS:
+            raise ValueError(f"Not an indexed field: {field}")
+    wanted = {
+        f: (str(v).strip() if f == "barcode" else v if f == "id" else str(v))
+        for f, v in (filters or {}).items()
+    }
+    lower = sqlite_store.date_key(date_from) if date_from else None
+    upper = sqlite_store.date_key(date_to) if date_to else None
+
+    matched = []
+    for row in rows:
+        cols = sqlite_store.indexed_values(row)
+        if any(
+            (value not in sqlite_store.barcodes_of(row)) if field == "barcode" else cols[field] != value
+            for field, value in wanted.items()
+        ):
+            continue
+        created = cols["created_at"]
+        if (lower or upper) and created is None:
+            continue
+        if lower and created < lower:
+            continue
+        if upper and created > upper:
+            continue
+        matched.append((created or "", row))
+
+    matched.sort(key=lambda pair: pair[0], reverse=newest_first)
+    total = len(matched)
+    start = max(0, int(offset))
+    end = None if limit is None else start + int(limit)
+    return [row for _, row in matched[start:end]], total
+
+
+def local_signature(path: str):
+    """Opaque version of the merged content of `path` (None if there is none);
+    changes whenever the content may have. Comparable with the before/after
+    values passed to write listeners."""
+    located = _sqlite_entity(path)
+    if located is not None:
+        store, entity = located
+        version = _sqlite_refresh(store, entity, path)
+        return ("sqlite", version) if version is not None else None
+    return _composite_signature(path)
+
+
+def _index_spec(field: Union[str, Tuple[str, ...]], fold: bool) -> tuple:
+    return ((field,) if isinstance(field, str) else tuple(field), bool(fold))
+
+
+def get_by_many(
+    path: str,
+    field: Union[str, Tuple[str, ...]],
+    values: List[Any],
+    fold: bool = False,
+) -> Dict[str, List[Dict]]:
+    """
+    Rows of a local JSON array grouped by `field` for each of `values`, via a
+    hash index kept in the entity store and updated on every write made
+    through these helpers. `field` may be a tuple of aliases (first non-empty
+    wins, e.g. ("billid", "bill_id")). Values match on their stripped string
+    form (casefolded when `fold`); result keys use that form, rows keep file
+    order, and each row is the caller's own copy.
+    """
+    spec = _index_spec(field, fold)
+    for _ in range(2):
+        signature = local_signature(path)
+        if signature is None:
+            return {}
+        hit, found = entity_store.lookup_by(path, signature, spec, values)
+        if hit:
+            return found
+        # Cold or stale cache: one load fills it, then the lookup is O(1).
+        _safe_json_load(path, [])
+
+    # Cache unavailable (non-list file, changing underneath us): plain scan.
+    wanted = {index_key(v, fold) for v in values} - {None}
+    found: Dict[str, List[Dict]] = {k: [] for k in wanted}
+    for row in _safe_json_load(path, []):
+        if not isinstance(row, dict):
+            continue
+        for f in spec[0]:
+            key = index_key(row.get(f), fold)
+            if key is not None:
+                if key in found:
+                    found[key].append(row)
+                break
+    return found
+
+
+def get_by(path: str, field: Union[str, Tuple[str, ...]], value: Any, fold: bool = False) -> List[Dict]:
+    """Rows of a local JSON array whose `field` equals `value` (see get_by_many)"""
+    key = index_key(value, fold)
+    if key is None:
+        return []
+    return get_by_many(path, field, [value], fold).get(key, [])
+
+
+def get_by_id(path: str, row_id: Any) -> Optional[Dict]:
+    """The first row of a local JSON array whose id is `row_id`, or None"""
+    rows = get_by(path, "id", row_id)
+    return rows[0] if rows else None
+
+
+def iter_local_rows(path: str, predicate: Optional[Callable[[Dict], bool]] = None) -> Iterator[Dict]:
+    """
+    Walk the rows of a local JSON array one at a time, optionally only those
+    for which `predicate(row)` is true. Unlike _safe_json_load this never
+    builds the whole list: a cached copy is iterated row by row, otherwise the
+    file is parsed incrementally and its journal replayed on the fly (and the
+    result is not cached). Rows are the caller's own copies. Iteration sees
+    the version current when it started, even if writes land meanwhile.
+    """
+    located = _sqlite_entity(path)
+    if located is not None:
+        store, entity = located
+        try:
+            if _sqlite_refresh(store, entity, path) is None:
+                return
+            rows = store.iter_rows(entity)
+        except Exception as e:
+            logger.error(f"Error reading {entity} from local SQLite store: {e}")
+            return
+    else:
+        rows = entity_store.iter_rows(path, _composite_signature(path))
+        if rows is None:
+            rows = _stream_merged(path)
+    for row in rows:
+        if isinstance(row, dict) and (predicate is None or predicate(row)):
+            yield row
+
+
+def _stream_merged(path: str) -> Iterator[Any]:
+    # Open the snapshot and read its journal under the lock so the pair is
+    # consistent; the open handle keeps reading this version after the lock
+    # is released, even if a writer os.replace()s the file meanwhile.
+    try:
+        with file_read_lock(path):
+            fh = open(path, 'rb')
+            try:
+                snapshot = signature_of(os.fstat(fh.fileno()))
+                ops, key, _ = json_journal.read_ops(path, snapshot)
+            except Exception:
+                fh.close()
+                raise
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.error(f"Error opening {path} for streaming: {e}")
+        return
+    with fh:
+        try:
+            yield from json_journal.iter_replayed(storage_codec.iter_array(fh), ops, key)
+        except ValueError as e:  # includes json.JSONDecodeError
+            logger.error(f"Error streaming rows from {path}: {e}")
+
+
+def fold_local_rows(
+    path: str,
+    fn: Callable[[Any, Dict], Any],
+    initial: Any,
+    predicate: Optional[Callable[[Dict], bool]] = None,
+) -> Any:
+    """Reduce the rows of a local JSON array with `fn(acc, row) -> acc`,
+    streaming them through iter_local_rows."""
+    acc = initial
+    for row in iter_local_rows(path, predicate):
+        acc = fn(acc, row)
+    return acc
+
+
+def get_rows_by_store(path: str, store_id: str) -> List[Dict]:
+    """Rows of a local JSON array that belong to `store_id`, newest first"""
+    rows, _ = query_local_rows(path, {"storeid": store_id})
+    return rows
+
+
+def get_rows_in_date_range(
+    path: str,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    store_id: Optional[str] = None,
+) -> List[Dict]:
+    """Rows of a local JSON array created within [date_from, date_to], newest first"""
+    filters = {"storeid": store_id} if store_id else None
+    rows, _ = query_local_rows(path, filters, date_from, date_to)
+    return rows
 
 
 # ============================================
@@ -108,6 +655,22 @@ def save_products_data(products: List[Dict]) -> bool:
     return _safe_json_dump(Config.PRODUCTS_FILE, products)
 
 
+def upsert_products_data(products: List[Dict]) -> bool:
+    """Insert or replace products by id (journaled, no full rewrite)"""
+    return _safe_json_upsert(Config.PRODUCTS_FILE, products)
+
+
+def get_products_by_ids(product_ids: List[str]) -> Dict[str, Dict]:
+    """Get local products keyed by the requested ids (indexed lookup; missing ids are absent)"""
+    found = get_by_many(Config.PRODUCTS_FILE, "id", product_ids)
+    products: Dict[str, Dict] = {}
+    for pid in product_ids:
+        rows = found.get(index_key(pid))
+        if rows:
+            products[pid] = rows[0]
+    return products
+
+
 # ============================================
 # CUSTOMERS
 # ============================================
@@ -136,11 +699,84 @@ def save_bills_data(bills: List[Dict]) -> bool:
     return _safe_json_dump(Config.BILLS_FILE, bills)
 
 
+def get_bill_by_id(bill_id: str) -> Optional[Dict]:
+    """Get one bill from local JSON by id"""
+    return get_by_id(Config.BILLS_FILE, bill_id)
+
+
+def query_bills_data(
+    store_id: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Tuple[List[Dict], int]:
+    """Page of local bills (newest first) for a store/date window, plus the total"""
+    filters = {"storeid": store_id} if store_id else None
+    return query_local_rows(Config.BILLS_FILE, filters, from_date, to_date, limit=limit, offset=offset)
+
+
+def upsert_bills_data(bills: List[Dict]) -> bool:
+    """Insert or replace bills by id (journaled, no full rewrite)"""
+    return _safe_json_upsert(Config.BILLS_FILE, bills)
+
+
+def delete_bills_data(bill_ids: List[str]) -> bool:
+    """Remove bills by id (journaled, no full rewrite)"""
+    return _safe_json_delete(Config.BILLS_FILE, bill_ids)
+
+
+def patch_bill_data(bill_id: str, fields: Dict[str, Any]) -> bool:
+    """Set only `fields` on one bill, atomically with respect to other bill writes"""
+    return _safe_json_patch(Config.BILLS_FILE, bill_id, fields)
+
+
 def get_bill_items_data() -> List[Dict]:
     """Get bill items from local JSON"""
     return _safe_json_load(Config.BILL_ITEMS_FILE, [])
 
 
+def iter_bill_items(predicate: Optional[Callable[[Dict], bool]] = None) -> Iterator[Dict]:
+    """Stream local bill items without loading the whole file"""
+    return iter_local_rows(Config.BILL_ITEMS_FILE, predicate)
+
+
+def sum_bill_item_quantities(exclude_bill_ids: Optional[set] = None) -> Dict[str, int]:
+    """Total quantity per product id over local bill items (streamed),
+    skipping items of `exclude_bill_ids`"""
+    def add(totals: Dict[str, int], row: Dict) -> Dict[str, int]:
+        pid = row.get("productid") or row.get("product_id") or row.get("productId")
+        if not pid:
+            return totals
+        if exclude_bill_ids:
+            bill_id = row.get("billid") or row.get("bill_id") or row.get("billId")
+            if bill_id and str(bill_id) in exclude_bill_ids:
+                return totals
+        try:
+            qty = int(row.get("quantity") or 0)
+        except (TypeError, ValueError):
+            qty = 0
+        totals[str(pid)] = totals.get(str(pid), 0) + qty
+        return totals
+
+    return fold_local_rows(Config.BILL_ITEMS_FILE, add, {})
+
+
+def upsert_bill_items_data(items: List[Dict]) -> bool:
+    """Insert or replace bill items by id (journaled, no full rewrite)"""
+    return _safe_json_upsert(Config.BILL_ITEMS_FILE, items)
+
+
+def delete_bill_items_data(item_ids: List[Any]) -> bool:
+    """Remove bill items by id (journaled, no full rewrite)"""
+    return _safe_json_delete(Config.BILL_ITEMS_FILE, item_ids)
+
+
+def get_bill_items_by_bill(bill_ids: List[str]) -> Dict[str, List[Dict]]:
+    """Get local bill items grouped by bill id (indexed lookup)"""
+    return get_by_many(Config.BILL_ITEMS_FILE, ("billid", "bill_id", "billId"), bill_ids)
+
+
 # ============================================
 # USERS
 # ============================================
@@ -155,6 +791,16 @@ def save_users_data(users: List[Dict]) -> bool:
     return _safe_json_dump(Config.USERS_FILE, users)
 
 
+def get_user_by_id(user_id: str) -> Optional[Dict]:
+    """Get one user from local JSON by id (indexed lookup)"""
+    return get_by_id(Config.USERS_FILE, user_id)
+
+
+def get_users_by(field: str, value: str) -> List[Dict]:
+    """Get local users whose `field` matches `value` case-insensitively (indexed lookup)"""
+    return get_by(Config.USERS_FILE, field, value, fold=True)
+
+
 # ============================================
 # STORES
 # ============================================
@@ -169,6 +815,11 @@ def save_stores_data(stores: List[Dict]) -> bool:
     return _safe_json_dump(Config.STORES_FILE, stores)
 
 
+def get_store_by_id(store_id: str) -> Optional[Dict]:
+    """Get one store from local JSON by id (indexed lookup)"""
+    return get_by_id(Config.STORES_FILE, store_id)
+
+
 # ============================================
 # BATCHES
 # ============================================
@@ -0,0 +1,251 @@
+"""
+Append-only journal of keyed row changes layered over a JSON array snapshot.
+
+Rewriting and fsyncing all of bills.json to add one bill costs megabytes per
+checkout once history grows. Instead, single-row changes are appended to
+`<file>.journal` -- one JSON line per change, one small fsync per commit -- and
+readers see the snapshot with the journal replayed on top. Once the journal
+grows past a threshold it is compacted: the merged view is written as the new
+snapshot and the journal is removed.
+
+The first journal line records the stat signature of the snapshot it applies
+to and the row key the ops are addressed by. Any full rewrite of the snapshot (a normal _safe_json_dump, a sync pull,
+an admin flush) changes that signature, so a journal left behind by a crash
+between "write new snapshot" and "remove journal" is recognised as stale and
+ignored instead of being replayed over newer data.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+OP_UPSERT = "upsert"
+OP_DELETE = "delete"
+DEFAULT_KEY = "id"
+
+
+def journal_path(path: str) -> str:
+    return f"{path}.journal"
+
+
+def upsert_op(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {"op": OP_UPSERT, "row": row}
+
+
+def delete_op(key_value: Any) -> Dict[str, Any]:
+    return {"op": OP_DELETE, "key": key_value}
+
+
+def _encode(entry: Dict[str, Any]) -> bytes:
+    return (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def read_ops(path: str, base_signature) -> Tuple[List[Dict[str, Any]], str, Optional[os.stat_result]]:
+    """
+    Return (ops, key, journal_stat) for `path`'s journal when it belongs to the
+    snapshot identified by `base_signature`; ([], key, stat) for a stale
+    journal and ([], "id", None) when there is none. Undecodable lines -- a
+    torn final append from a crash -- are skipped.
+    """
+    jpath = journal_path(path)
+    try:
+        fh = open(jpath, "rb")
+    except FileNotFoundError:
+        return [], DEFAULT_KEY, None
+
+    with fh:
+        st = os.fstat(fh.fileno())
+        header_line = fh.readline()
+        try:
+            header = json.loads(header_line)
+            base = tuple(header.get("base") or ())
+            key = header.get("key") or DEFAULT_KEY
+        except (ValueError, AttributeError):
+            logger.warning("Unreadable journal header in %s; ignoring journal", jpath)
+            return [], DEFAULT_KEY, st
+        if base != tuple(base_signature):
+            logger.info("Journal %s belongs to an older snapshot; ignoring it", jpath)
+            return [], key, st
+
+        ops: List[Dict[str, Any]] = []
+        for line_no, line in enumerate(fh, start=2):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping torn journal line %s in %s", line_no, jpath)
+                continue
+            if isinstance(entry, dict) and entry.get("op") in (OP_UPSERT, OP_DELETE):
+                ops.append(entry)
+        return ops, key, st
+
+
+def append_ops(path: str, base_signature, ops: List[Dict[str, Any]], key: str = DEFAULT_KEY) -> os.stat_result:
+    """
+    Durably append `ops` to the journal of `path`, creating it for the
+    snapshot identified by `base_signature` when missing or stale. Must be
+    called with the path lock held, and only after checking (read_header) that
+    a live journal is not keyed by a different column. Returns the journal's
+    stat afterwards.
+    """
+    jpath = journal_path(path)
+    existing, _ = read_header(jpath)
+    fresh = existing != tuple(base_signature)
+
+    payload = b"".join(_encode(op) for op in ops)
+    with open(jpath, "wb" if fresh else "ab+") as fh:
+        if fresh:
+            fh.write(_encode({"base": list(base_signature), "key": key}))
+        else:
+            # A crash mid-append can leave a partial last line; terminate it so
+            # our entry starts on its own line and the torn one is skipped.
+            size = fh.seek(0, os.SEEK_END)
+            if size:
+                fh.seek(size - 1)
+                if fh.read(1) != b"\n":
+                    fh.write(b"\n")
+        fh.write(payload)
+        fh.flush()
+        os.fsync(fh.fileno())
+        return os.fstat(fh.fileno())
+
+
+def read_header(jpath: str) -> Tuple[Optional[tuple], Optional[str]]:
+    """(base signature, key) from a journal's first line; (None, None) when
+    the journal is missing or its header unreadable."""
+    try:
+        with open(jpath, "rb") as fh:
+            header = json.loads(fh.readline())
+        return tuple(header.get("base") or ()), header.get("key") or DEFAULT_KEY
+    except (ValueError, AttributeError, OSError):
+        return None, None
+
+
+def remove(path: str) -> None:
+    try:
+        os.remove(journal_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def apply_ops(rows: List[Any], ops: List[Dict[str, Any]], key: str, positions: Dict[Any, int]) -> Optional[List[int]]:
+    """
+    Replay `ops` onto `rows` in place. `positions` maps key value -> index and
+    is kept in sync. Returns the indices touched, or None when rows were
+    removed (indices shifted; the caller should rebuild anything positional).
+    """
+    touched: List[int] = []
+    structural = False
+    for op in ops:
+        if op.get("op") == OP_UPSERT:
+            row = op.get("row")
+            if not isinstance(row, dict):
+                continue
+            value = row.get(key)
+            idx = positions.get(value) if value is not None else None
+            if idx is None:
+                idx = len(rows)
+                rows.append(row)
+                if value is not None:
+                    positions[value] = idx
+            else:
+                rows[idx] = row
+            touched.append(idx)
+        elif op.get("op") == OP_DELETE:
+            idx = positions.pop(op.get("key"), None)
+            if idx is None:
+                continue
+            rows[idx] = _DELETED
+            structural = True
+
+    if structural:
+        rows[:] = [r for r in rows if r is not _DELETED]
+        positions.clear()
+        positions.update(build_positions(rows, key))
+        return None
+    return touched
+
+
+def iter_replayed(rows: Iterable[Any], ops: List[Dict[str, Any]], key: str) -> Iterator[Any]:
+    """
+    Streaming counterpart of apply_ops: yield the rows `apply_ops` would leave
+    behind, in the same order, while walking `rows` only once. Rows touched
+    by the journal are resolved from that key's ops alone; rows it appends
+    come out after the snapshot's rows, in the order they were appended.
+    (With duplicate keys in the snapshot, apply_ops edits only the last copy;
+    here every copy is edited.)
+    """
+    if not ops:
+        yield from rows
+        return
+    by_key: Dict[Any, List[Tuple[int, Dict[str, Any]]]] = {}
+    appended: List[Tuple[int, Any]] = []
+    for seq, op in enumerate(ops):
+        if op.get("op") == OP_UPSERT:
+            row = op.get("row")
+            if not isinstance(row, dict):
+                continue
+            value = row.get(key)
+            if value is None:
+                appended.append((seq, row))
+                continue
+        elif op.get("op") == OP_DELETE:
+            value = op.get("key")
+        else:
+            continue
+        by_key.setdefault(value, []).append((seq, op))
+
+    def resolve(value, in_snapshot: bool) -> Tuple[str, Any, int]:
+        # ("keep" | "replace" | "append" | "gone", row, append order)
+        kind, row, seq = ("keep" if in_snapshot else "gone"), None, -1
+        for op_seq, op in by_key[value]:
+            if op.get("op") == OP_UPSERT:
+                if kind == "gone":
+                    kind, seq = "append", op_seq
+                elif kind == "keep":
+                    kind = "replace"
+                row = op["row"]
+            else:
+                kind, row, seq = "gone", None, -1
+        return kind, row, seq
+
+    resolved: Dict[Any, Tuple[str, Any, int]] = {}
+    for row in rows:
+        value = row.get(key) if isinstance(row, dict) else None
+        if value is None or value not in by_key:
+            yield row
+            continue
+        outcome = resolved.get(value)
+        if outcome is None:
+            outcome = resolved[value] = resolve(value, True)
+            if outcome[0] == "append":
+                appended.append((outcome[2], outcome[1]))
+        if outcome[0] == "keep":
+            yield row
+        elif outcome[0] == "replace":
+            yield outcome[1]
+
+    for value in by_key:
+        if value not in resolved:
+            kind, new_row, seq = resolve(value, False)
+            if kind == "append":
+                appended.append((seq, new_row))
+    appended.sort(key=lambda item: item[0])
+    for _, row in appended:
+        yield row
+
+
+def build_positions(rows: List[Any], key: str) -> Dict[Any, int]:
+    positions: Dict[Any, int] = {}
+    for idx, row in enumerate(rows):
+        if isinstance(row, dict):
+            value = row.get(key)
+            if value is not None:
+                positions[value] = idx
+    return positions
+
+
+_DELETED = object()
@@ -0,0 +1,199 @@
+"""
+Coordination between gunicorn worker processes sharing one data directory.
+
+The server image used to pin a single worker because everything that keeps
+local storage consistent -- file_write_lock, the response caches, the
+background sync thread -- lived inside one process. With
+LOCAL_STORAGE_MULTIPROCESS on (implied by WEB_WORKERS > 1) this module adds
+the cross-process half:
+
+- OsLock: an fcntl.flock on a `<path>.lock` sidecar, taken by
+  file_write_lock/file_read_lock after their in-process lock, so atomic
+  snapshot replaces, journal appends and cold reads are exclusive (or shared)
+  across workers too.
+- change_counter: named generation counters in JSON_DIR/.changes. A worker
+  that invalidates a response cache after a write bumps the counter; every
+  worker polls the counters at the start of each request and drops its own
+  copy when another worker moved one. (Parsed JSON files need no counter:
+  the entity store already revalidates them with stat().)
+- sync_leader: exactly one worker holds JSON_DIR/.sync-leader.lock and runs
+  the background sync scheduler and the startup export. The others retry
+  periodically and take over if the leader dies, since the OS drops the lock
+  with the process.
+
+fcntl is POSIX-only. The Windows desktop build runs one process, so there
+everything here is a no-op. Workers must be forked without --preload,
+otherwise they would inherit the master's leader lock.
+"""
+import logging
+import os
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows desktop build: single process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_COUNTER = struct.Struct("<Q")
+
+
+def enabled() -> bool:
+    return bool(Config.LOCAL_STORAGE_MULTIPROCESS) and fcntl is not None
+
+
+def _open_lock_file(path: str) -> int:
+    parent = os.path.dirname(path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+
+class OsLock:
+    """flock on a sidecar file; the descriptor stays open for reuse."""
+
+    def __init__(self, path: str):
+        self.path = f"{path}.lock"
+        self._fd: Optional[int] = None
+
+    def _descriptor(self) -> int:
+        if self._fd is None:
+            self._fd = _open_lock_file(self.path)
+        return self._fd
+
+    def acquire(self, shared: bool = False) -> None:
+        fcntl.flock(self._descriptor(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class ChangeCounter:
+    """Named cross-process generation counters driving cache invalidation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners: Dict[str, List[Callable[[], None]]] = {}
+        self._seen: Dict[str, int] = {}
+
+    @staticmethod
+    def _path(name: str) -> str:
+        return os.path.join(Config.JSON_DIR, ".changes", name)
+
+    def _read(self, name: str) -> int:
+        try:
+            with open(self._path(name), "rb") as f:
+                raw = f.read(_COUNTER.size)
+        except FileNotFoundError:
+            return 0
+        return _COUNTER.unpack(raw)[0] if len(raw) == _COUNTER.size else 0
+
+    def register(self, name: str, fn: Callable[[], None]) -> None:
+        """Run `fn` (a local-only cache clear) whenever another process bumps
+        `name`."""
+        with self._lock:
+            self._listeners.setdefault(name, []).append(fn)
+            self._seen.setdefault(name, self._read(name) if enabled() else 0)
+
+    def bump(self, name: str) -> None:
+        """Tell the other workers that `name`'s cached data is stale."""
+        if not enabled():
+            return
+        try:
+            fd = _open_lock_file(self._path(name))
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                raw = os.pread(fd, _COUNTER.size, 0)
+                old = _COUNTER.unpack(raw)[0] if len(raw) == _COUNTER.size else 0
+                os.pwrite(fd, _COUNTER.pack(old + 1), 0)
+            finally:
+                os.close(fd)  # also drops the flock
+        except OSError as e:
+            logger.warning(f"Could not bump change counter {name}: {e}")
+            return
+        with self._lock:
+            # Our own bump needs no local invalidation, unless another worker
+            # moved the counter since we last looked.
+            if self._seen.get(name) == old:
+                self._seen[name] = old + 1
+
+    def poll(self) -> None:
+        """Drop local caches whose counter another worker moved."""
+        if not enabled():
+            return
+        stale: List[Callable[[], None]] = []
+        with self._lock:
+            for name, listeners in self._listeners.items():
+                current = self._read(name)
+                if current != self._seen.get(name):
+                    self._seen[name] = current
+                    stale.extend(listeners)
+        for fn in stale:
+            try:
+                fn()
+            except Exception as e:
+                logger.warning(f"Cache invalidation {getattr(fn, '__name__', fn)} failed: {e}")
+
+
+class SyncLeader:
+    """Elects the one worker that runs background sync."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def is_leader(self) -> bool:
+        """True in single-process mode, else whether this worker holds (or
+        just took) the leader lock."""
+        if not enabled():
+            return True
+        with self._lock:
+            if self._fd is not None:
+                return True
+            fd = _open_lock_file(os.path.join(Config.JSON_DIR, ".sync-leader.lock"))
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            os.ftruncate(fd, 0)
+            os.write(fd, str(os.getpid()).encode("ascii"))
+            logger.info(f"Worker {os.getpid()} elected sync leader")
+            return True
+
+    def run_when_elected(self, fn: Callable[[], None]) -> None:
+        """Call `fn` now if this worker leads, otherwise from a daemon thread
+        as soon as it takes over leadership."""
+        if self.is_leader():
+            fn()
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            def wait_for_leadership():
+                while True:
+                    time.sleep(Config.SYNC_LEADER_RETRY_SECONDS)
+                    if self.is_leader():
+                        try:
+                            fn()
+                        except Exception as e:
+                            logger.error(f"Sync leader startup failed: {e}", exc_info=True)
+                        return
+
+            self._thread = threading.Thread(target=wait_for_leadership, name="sync-leader-election", daemon=True)
+            self._thread.start()
+
+
+# Global instances
+change_counter = ChangeCounter()
+sync_leader = SyncLeader()
@@ -0,0 +1,113 @@
+"""
+Product row projection: raw products rows -> the camelCase shape the
+frontend expects (hsnCode, tax, displayPrice, barcodes list, batchId and the
+optional stock breakdown).
+
+The products list, the billing list and the products page each used to run
+their own copy of this loop, calling the recursive convert_snake_to_camel on
+every row, which re-split and re-capitalized every key of every row. Here the
+snake->camel key plan is computed once per column set (rows from one query
+share their columns) and each row is built with a single dict comprehension
+plus the derived fields. Output is identical to the old loops; see
+scripts/bench_product_projection.py for the per-row cost.
+"""
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.json_utils import _snake_to_camel_case, convert_snake_to_camel
+
+_NESTED = (dict, list)
+
+
+@lru_cache(maxsize=4096)
+def _camel_key(name: str) -> str:
+    return _snake_to_camel_case(name)
+
+
+@lru_cache(maxsize=64)
+def _key_plan(columns: Tuple[str, ...]) -> Tuple[Tuple[Tuple[str, str], ...], Optional[str]]:
+    """
+    ((source, target) pairs in column order, hsn source column). The HSN id
+    column is renamed to hsnCode and moved last, as the old pop/re-insert did.
+    """
+    pairs = []
+    hsn_source = None
+    for column in columns:
+        target = _camel_key(column)
+        if target == "hsnCodeId":
+            hsn_source = column
+            continue
+        pairs.append((column, target))
+    return tuple(pairs), hsn_source
+
+
+def project_products(
+    rows: Iterable[Dict],
+    hsn_tax_map: Dict[str, float],
+    allocated_by_product: Optional[Dict[str, int]] = None,
+    sold_by_product: Optional[Dict[str, int]] = None,
+) -> List[Dict]:
+    """
+    Shape raw products rows for the API. With `allocated_by_product` each row
+    also gets globalStock/allocatedStock/inStoresStock/availableStock; with
+    `sold_by_product`, soldStock and lifetimeStock.
+    """
+    out: List[Dict] = []
+    append = out.append
+    last_columns: Optional[Tuple[str, ...]] = None
+    pairs: Tuple[Tuple[str, str], ...] = ()
+    hsn_source: Optional[str] = None
+    tax_for = hsn_tax_map.get
+
+    for row in rows:
+        columns = tuple(row)
+        if columns != last_columns:
+            pairs, hsn_source = _key_plan(columns)
+            last_columns = columns
+
+        product = {
+            target: (convert_snake_to_camel(row[source]) if isinstance(row[source], _NESTED) else row[source])
+            for source, target in pairs
+        }
+        if hsn_source is not None:
+            product["hsnCode"] = row[hsn_source]
+
+        hsn_code = product.get("hsnCode")
+        if hsn_code is not None and str(hsn_code).strip() != "":
+            product["tax"] = tax_for(str(hsn_code), 0.0)
+        else:
+            product["tax"] = 0.0
+
+        if product.get("sellingPrice"):
+            product["displayPrice"] = product["sellingPrice"]
+        elif "price" in product:
+            product["displayPrice"] = product["price"]
+
+        barcode = product.get("barcode")
+        if isinstance(barcode, str) and barcode.strip():
+            product["barcodes"] = [b.strip() for b in barcode.split(",") if b.strip()]
+        else:
+            product["barcodes"] = []
+
+        if product.get("batchid"):
+            product["batchId"] = product["batchid"]
+        elif "batchId" not in product:
+            product["batchId"] = None
+
+        if allocated_by_product is not None or sold_by_product is not None:
+            product_id = str(product.get("id") or "")
+            global_stock = int(product.get("stock") or 0)
+            if allocated_by_product is not None:
+                allocated = int(allocated_by_product.get(product_id, 0))
+                product["globalStock"] = global_stock
+                product["allocatedStock"] = allocated
+                product["inStoresStock"] = allocated
+                product["availableStock"] = max(0, global_stock - allocated)
+            if sold_by_product is not None:
+                sold_qty = int(sold_by_product.get(product_id, 0))
+                product["soldStock"] = sold_qty
+                # "Lifetime stock" — currently owned + already sold.
+                product["lifetimeStock"] = global_stock + sold_qty
+
+        append(product)
+    return out
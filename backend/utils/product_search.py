@@ -0,0 +1,511 @@
+"""
+In-process product search over the local products cache.
+
+There was no search endpoint: every tablet downloaded the merged catalog and
+filtered it client-side. This index covers product name, barcodes, batch
+number and HSN code, and answers a query without touching every product:
+
+- Text is split into lowercase alphanumeric terms. Each term has a posting
+  map {product id: field weight}.
+- A sorted vocabulary gives prefix matches by bisection ("soa" -> "soap",
+  "soaps").
+- A trigram -> terms map over the vocabulary gives typo-tolerant matches
+  ("shampooo" -> "shampoo") for alphabetic terms with no exact or prefix
+  match: terms sharing enough trigrams are checked with a bounded edit
+  distance (1 edit from 4 letters, 2 from 8).
+
+Every query term must match (exact > prefix > fuzzy, times the field weight);
+the most selective term is resolved first and the others only filter it.
+Ties go to names starting with the query, then shorter names.
+
+Like utils/barcode_index.py it is built on first use and kept current by a
+write listener on the products file; batches/HSN changes, full rewrites and
+other workers' writes show up as a changed local_signature(). Only the first
+build runs in the searching thread. Later ones run in a background thread
+while the current index keeps answering: a products rewrite (get_merged_products
+saves one whenever it recomputes) is diffed against the indexed rows and only
+the changed ones are re-indexed; a batches/HSN change, or a rewrite touching
+much of the catalog, builds a new index off to the side and swaps it in.
+tax_map() reads the HSN tax rates from the same local HSN file, so
+callers never wait on the network for them.
+"""
+import bisect
+import logging
+import re
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import Config
+from utils.barcode_index import barcodes_of
+from utils.entity_store import index_key
+from utils.json_helpers import add_write_listener, iter_local_rows, local_signature
+
+logger = logging.getLogger(__name__)
+
+_TERM = re.compile(r"[0-9a-z]+")
+
+# Field weights: a barcode or batch hit is as telling as a name hit.
+NAME_WEIGHT = 1.0
+CODE_WEIGHT = 1.0
+HSN_WEIGHT = 0.6
+
+EXACT, PREFIX, FUZZY = 3.0, 2.0, 1.0
+
+# Shorter numeric terms are never expanded over the whole vocabulary ("8"
+# would complete to every barcode): alone they match whole terms only, next
+# to other words they filter those words' matches by prefix ("tea 25").
+MIN_DIGIT_PREFIX = 3
+
+# A rewritten products file is diffed against the index when at most this
+# many rows (or 1/RESYNC_FRACTION of the catalog, if more) changed;
+# otherwise a new index is built.
+RESYNC_MIN_ROWS = 256
+RESYNC_FRACTION = 8
+
+# What a rebuild replaces wholesale.
+_STATE = (
+    "_batches", "_hsn", "_postings", "_vocab", "_grams",
+    "_docs", "_doc_terms", "_names", "_by_length", "_by_name",
+)
+
+
+def terms_of(text: Any) -> List[str]:
+    return _TERM.findall(str(text or "").casefold())
+
+
+def _trigrams(term: str) -> Set[str]:
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _completes(term: str) -> bool:
+    return len(term) >= MIN_DIGIT_PREFIX or not term.isdigit()
+
+
+def _tax(value: Any) -> float:
+    try:
+        return float(value) if value not in (None, "") else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _max_edits(term: str) -> int:
+    if len(term) >= 8:
+        return 2
+    return 1 if len(term) >= 4 else 0
+
+
+def _within_edits(a: str, b: str, limit: int) -> bool:
+    """Levenshtein distance of a and b is at most `limit` (banded DP)."""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        lo, hi = max(1, i - limit), min(len(b), i + limit)
+        if lo > 1:
+            current[lo - 1] = limit + 1
+        for j in range(lo, hi + 1):
+            cost = 0 if ca == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        if hi < len(b):
+            current[hi + 1:] = [limit + 1] * (len(b) - hi)
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+class ProductSearchIndex:
+    """Term postings, sorted vocabulary and trigram map for one products file."""
+
+    def __init__(self, path: Optional[str] = None, batches_path: Optional[str] = None, hsn_path: Optional[str] = None):
+        self._path = path
+        self._batches_path = batches_path
+        self._hsn_path = hsn_path
+        self._lock = threading.Lock()
+        self._signature: Any = None
+        self._batches: Dict[str, str] = {}
+        self._hsn: Dict[str, str] = {}
+        self._tax_cache: Optional[Tuple[Any, Dict[str, float]]] = None
+        self._reset()
+        self._loaded = False
+        self._signature_of_related: Any = None
+        self._refresher: Optional[threading.Thread] = None
+        self._refresher_guard = threading.Lock()
+        self._registered = False
+        self.rebuilds = 0
+        self.resyncs = 0
+
+    @property
+    def path(self) -> str:
+        return self._path or Config.PRODUCTS_FILE
+
+    def _related_paths(self) -> Tuple[str, str]:
+        return self._batches_path or Config.BATCHES_FILE, self._hsn_path or Config.HSN_CODES_FILE
+
+    def _current_signature(self) -> Any:
+        batches, hsn = self._related_paths()
+        return (local_signature(self.path), local_signature(batches), local_signature(hsn))
+
+    def _reset(self) -> None:
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._vocab: List[str] = []
+        self._grams: Dict[str, Set[str]] = {}
+        self._docs: Dict[str, Dict] = {}
+        self._doc_terms: Dict[str, List[str]] = {}
+        self._names: Dict[str, str] = {}
+        self._by_length: List[Tuple[int, str, str]] = []  # (len(name), name, id), sorted
+        self._by_name: List[Tuple[str, str]] = []  # (name, id), sorted
+        self._bulk = False
+
+    # ------------------------------------------------------------------ state
+
+    def _fields(self, row: Dict) -> List[Tuple[str, float]]:
+        batch_id = row.get("batchid") or row.get("batch_id") or row.get("batchId")
+        hsn_id = row.get("hsn_code_id") or row.get("hsnCodeId") or row.get("hsn_code")
+        fields = [(str(row.get("name") or ""), NAME_WEIGHT)]
+        fields += [(code, CODE_WEIGHT) for code in barcodes_of(row)]
+        if batch_id:
+            fields.append((str(batch_id), CODE_WEIGHT))
+            fields.append((self._batches.get(str(batch_id), ""), CODE_WEIGHT))
+        if hsn_id is not None:
+            fields.append((self._hsn.get(str(hsn_id), str(hsn_id)), HSN_WEIGHT))
+        return fields
+
+    def _add_term(self, term: str) -> None:
+        if not self._bulk:  # a rebuild sorts the vocabulary once at the end
+            bisect.insort(self._vocab, term)
+        for gram in _trigrams(term):
+            self._grams.setdefault(gram, set()).add(term)
+
+    def _drop_term(self, term: str) -> None:
+        i = bisect.bisect_left(self._vocab, term)
+        if i < len(self._vocab) and self._vocab[i] == term:
+            del self._vocab[i]
+        for gram in _trigrams(term):
+            terms = self._grams.get(gram)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self._grams[gram]
+
+    def _add(self, row: Dict) -> None:
+        doc_id = index_key(row.get("id"))
+        if doc_id is None:
+            return
+        self._remove(doc_id)
+        weights: Dict[str, float] = {}
+        for text, weight in self._fields(row):
+            for term in terms_of(text):
+                if weight > weights.get(term, 0.0):
+                    weights[term] = weight
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._add_term(term)
+            postings[doc_id] = weight
+        self._docs[doc_id] = row
+        self._doc_terms[doc_id] = list(weights)
+        name = self._names[doc_id] = str(row.get("name") or "").casefold()
+        if not self._bulk:
+            bisect.insort(self._by_length, (len(name), name, doc_id))
+            bisect.insort(self._by_name, (name, doc_id))
+
+    def _remove(self, doc_id: str) -> None:
+        if self._docs.pop(doc_id, None) is None:
+            return
+        name = self._names.pop(doc_id, "")
+        entry = (len(name), name, doc_id)
+        i = bisect.bisect_left(self._by_length, entry)
+        if i < len(self._by_length) and self._by_length[i] == entry:
+            del self._by_length[i]
+        i = bisect.bisect_left(self._by_name, (name, doc_id))
+        if i < len(self._by_name) and self._by_name[i] == (name, doc_id):
+            del self._by_name[i]
+        for term in self._doc_terms.pop(doc_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                self._drop_term(term)
+
+    def _rebuild(self) -> None:
+        # Read outside self._lock (see BarcodeIndex._rebuild).
+        signature = self._current_signature()
+        rows = list(iter_local_rows(self.path)) if signature[0] is not None else []
+        if self._loaded and self._signature_of_related == signature[1:] and self._resync(rows, signature):
+            return
+
+        batches_path, hsn_path = self._related_paths()
+        batches = {
+            str(b.get("id")): str(b.get("batch_number") or b.get("batchNumber") or "")
+            for b in iter_local_rows(batches_path) if b.get("id") is not None
+        } if signature[1] is not None else {}
+        hsn = {
+            str(h.get("id")): str(h.get("hsn_code") or h.get("hsnCode") or "")
+            for h in iter_local_rows(hsn_path) if h.get("id") is not None
+        } if signature[2] is not None else {}
+
+        # Built off to the side, so searches keep using the current index.
+        fresh = ProductSearchIndex(self._path, self._batches_path, self._hsn_path)
+        fresh._batches, fresh._hsn = batches, hsn
+        fresh._bulk = True
+        for row in rows:
+            fresh._add(row)
+        fresh._vocab = sorted(fresh._postings)
+        fresh._by_length = sorted((len(name), name, doc_id) for doc_id, name in fresh._names.items())
+        fresh._by_name = sorted((name, doc_id) for doc_id, name in fresh._names.items())
+        fresh._bulk = False
+        with self._lock:
+            for name in _STATE:
+                setattr(self, name, getattr(fresh, name))
+            self._signature = signature
+            self._signature_of_related = signature[1:]
+            self._loaded = True
+        self.rebuilds += 1
+        logger.debug(f"Product search index built: {len(rows)} products, {len(self._vocab)} terms")
+
+    def _resync(self, rows: List[Dict], signature: Any) -> bool:
+        """Re-index only the rows that differ from the indexed ones. False,
+        changing nothing, when so many differ that a fresh build is cheaper."""
+        with self._lock:
+            indexed = dict(self._docs)
+        changed = []
+        for row in rows:
+            doc_id = index_key(row.get("id"))
+            if doc_id is not None and indexed.pop(doc_id, None) != row:
+                changed.append(row)
+        if len(changed) + len(indexed) > max(RESYNC_MIN_ROWS, len(rows) // RESYNC_FRACTION):
+            return False
+        with self._lock:
+            for doc_id in indexed:
+                self._remove(doc_id)
+            for row in changed:
+                self._add(row)
+            self._signature = signature
+        self.resyncs += 1
+        logger.debug(f"Product search index resynced: {len(changed)} changed, {len(indexed)} removed")
+        return True
+
+    def _refresh(self) -> None:
+        try:
+            self._rebuild()
+        except Exception as e:
+            logger.warning(f"Background product search rebuild failed: {e}")
+
+    def _ensure(self) -> None:
+        if self._signature is not None and self._signature == self._current_signature():
+            return
+        if not self._loaded:
+            self._rebuild()
+            return
+        with self._refresher_guard:
+            if self._refresher is None or not self._refresher.is_alive():
+                self._refresher = threading.Thread(target=self._refresh, name="product-search-rebuild", daemon=True)
+                self._refresher.start()
+
+    def _on_products_write(self, path, before, after, ops) -> None:
+        with self._lock:
+            if ops is None or self._signature is None or self._signature[0] != before:
+                self._signature = None  # rebuilt on next search
+                return
+            for op in ops:
+                if op.get("op") == "upsert" and isinstance(op.get("row"), dict):
+                    self._add(op["row"])
+                elif op.get("op") == "delete":
+                    key = index_key(op.get("key"))
+                    if key is not None:
+                        self._remove(key)
+            self._signature = (after,) + tuple(self._signature[1:])
+
+    def _register(self) -> None:
+        if not self._registered:
+            add_write_listener(self.path, self._on_products_write)
+            self._registered = True
+
+    # ----------------------------------------------------------------- search
+
+    def _prefix_range(self, term: str) -> Tuple[int, int]:
+        """Slice of the sorted vocabulary holding `term` and its completions."""
+        return bisect.bisect_left(self._vocab, term), bisect.bisect_left(self._vocab, term + "\uffff")
+
+    def _typo_kinds(self, term: str) -> Dict[str, float]:
+        """{vocabulary term: FUZZY} within the edit budget of `term`. Codes
+        (barcodes, batch numbers, HSN) match exactly or by prefix only."""
+        limit = _max_edits(term)
+        if not limit or not term.isalpha():
+            return {}
+        grams = _trigrams(term)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for vocab_term in self._grams.get(gram, ()):
+                shared[vocab_term] = shared.get(vocab_term, 0) + 1
+        # Each edit destroys at most 3 trigrams.
+        needed = max(1, len(grams) - 3 * limit)
+        return {
+            vocab_term: FUZZY
+            for vocab_term, count in shared.items()
+            if count >= needed and _within_edits(term, vocab_term, limit)
+        }
+
+    def _expand(self, term: str, complete: bool = True) -> Dict[str, float]:
+        """{vocabulary term: match kind} for one query term: the term and its
+        completions, or its typo neighbours when it has neither."""
+        if not complete:
+            return {term: EXACT} if term in self._postings else {}
+        lo, hi = self._prefix_range(term)
+        if lo == hi:
+            return self._typo_kinds(term)
+        return {t: (EXACT if t == term else PREFIX) for t in self._vocab[lo:hi]}
+
+    def _estimate(self, term: str) -> int:
+        """Rough number of docs matching `term`, without expanding long
+        completion ranges (each vocabulary term has at least one doc)."""
+        lo, hi = self._prefix_range(term)
+        if hi - lo > 64:
+            return hi - lo
+        if lo == hi:
+            return sum(len(self._postings[t]) for t in self._typo_kinds(term))
+        return sum(len(self._postings[t]) for t in self._vocab[lo:hi])
+
+    def _collect(self, kinds: Dict[str, float]) -> Dict[str, float]:
+        """{doc id: best score} over the postings of the expanded terms."""
+        scores: Dict[str, float] = {}
+        best = scores.get
+        postings = self._postings
+        for vocab_term, kind in kinds.items():
+            for doc_id, weight in postings[vocab_term].items():
+                score = kind * weight
+                if score > best(doc_id, 0.0):
+                    scores[doc_id] = score
+        return scores
+
+    def _narrow(self, combined: Dict[str, float], term: str) -> Dict[str, float]:
+        """Add one more query term to a small candidate set by checking each
+        candidate's own terms instead of walking large postings."""
+        lo, hi = self._prefix_range(term)
+        kinds: Optional[Dict[str, float]] = None
+        if lo == hi:
+            kinds = self._typo_kinds(term)
+            if not kinds:
+                return {}
+        elif hi - lo <= 4096:
+            kinds = dict.fromkeys(self._vocab[lo:hi], PREFIX)
+            if term in kinds:
+                kinds[term] = EXACT
+        matching = set(kinds) if kinds is not None else None
+        postings = self._postings
+        out: Dict[str, float] = {}
+        for doc_id, total in combined.items():
+            doc_terms = self._doc_terms.get(doc_id, ())
+            if matching is not None:
+                hits = [(t, kinds[t]) for t in matching.intersection(doc_terms)]
+            else:
+                hits = [(t, EXACT if t == term else PREFIX) for t in doc_terms if t.startswith(term)]
+            if hits:
+                out[doc_id] = total + max(kind * postings[t][doc_id] for t, kind in hits)
+        return out
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict], int]:
+        """(product rows for this page, total matches), best first."""
+        self._ensure()
+        terms = terms_of(query)
+        if not terms:
+            return [], 0
+        phrase = " ".join(terms)
+        with self._lock:
+            # Most selective term first; later ones only filter its matches.
+            planned = sorted(
+                (not _completes(term), self._estimate(term), term) for term in dict.fromkeys(terms)
+            )
+            combined: Optional[Dict[str, float]] = None
+            for short_number, estimate, term in planned:
+                if combined is None:
+                    combined = self._collect(self._expand(term, complete=not short_number))
+                elif estimate <= 4 * len(combined):
+                    matches = self._collect(self._expand(term))
+                    combined = {d: s + matches[d] for d, s in combined.items() if d in matches}
+                else:
+                    combined = self._narrow(combined, term)
+                if not combined:
+                    return [], 0
+
+            ordered = self._top(combined, phrase, offset + limit)
+            page = [dict(self._docs[doc_id]) for doc_id in ordered[offset:offset + limit]]
+            return page, len(combined)
+
+    def _top(self, combined: Dict[str, float], phrase: str, count: int) -> List[str]:
+        """The best `count` doc ids: by score, then names starting with the
+        query, then shorter names. Short queries tie thousands of docs on
+        score; a large tie is resolved by walking the length order until enough
+        are found (taking few name-prefix hits from the name order first)
+        instead of sorting it."""
+        buckets: Dict[float, List[str]] = {}
+        for doc_id, score in combined.items():
+            buckets.setdefault(score, []).append(doc_id)
+        names = self._names
+        ordered: List[str] = []
+        for score in sorted(buckets, reverse=True):
+            need = count - len(ordered)
+            if need <= 0:
+                break
+            ids = buckets[score]
+            # Sorting costs ~16x a walk step; walk only when ties are dense.
+            if len(ids) * 16 <= len(self._by_length):
+                ids.sort(key=lambda d: (not names[d].startswith(phrase), len(names[d]), names[d], d))
+                ordered += ids[:need]
+                continue
+            members = set(ids)
+            # Names starting with the query sit together in the name order;
+            # when there are few, take them from there and walk for the rest.
+            lo = bisect.bisect_left(self._by_name, (phrase,))
+            hi = bisect.bisect_left(self._by_name, (phrase + "\uffff",))
+            few = (hi - lo) * 16 <= len(self._by_length)
+            starters: List[str] = []
+            if few:
+                hits = sorted((len(n), n, d) for n, d in self._by_name[lo:hi] if d in members)
+                starters = [doc_id for _length, _name, doc_id in hits[:need]]
+            others: List[str] = []
+            for _length, name, doc_id in self._by_length:
+                if len(starters) == need or (few and len(starters) + len(others) == need):
+                    break
+                if doc_id not in members:
+                    continue
+                if not name.startswith(phrase):
+                    if len(others) < need:
+                        others.append(doc_id)
+                elif not few:
+                    starters.append(doc_id)
+            ordered += (starters + others)[:need]
+        return ordered
+
+    def tax_map(self) -> Dict[str, float]:
+        """{HSN id: tax rate} from the local HSN file, re-read when it changes.
+        Needs no index build, so barcode scans can use it too."""
+        hsn_path = self._related_paths()[1]
+        signature = local_signature(hsn_path)
+        cached = self._tax_cache
+        if cached is None or cached[0] != signature:
+            taxes = {
+                str(h.get("id")): _tax(h.get("tax"))
+                for h in iter_local_rows(hsn_path) if h.get("id") is not None
+            } if signature is not None else {}
+            cached = self._tax_cache = (signature, taxes)
+        return cached[1]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "products": len(self._docs),
+            "terms": len(self._vocab),
+            "rebuilds": self.rebuilds,
+            "resyncs": self.resyncs,
+        }
+
+
+# Global instance
+product_search = ProductSearchIndex()
+product_search._register()
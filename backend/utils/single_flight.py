@@ -0,0 +1,269 @@
+"""
+Request coalescing (single-flight) and stale-while-revalidate for expensive
+reads.
+
+A dashboard refresh from ten tablets used to run ten identical full-table
+Supabase scans. routes/bills.py and the transfer-orders route hand-rolled a
+leader/follower map of threading.Events for this; SingleFlight is that
+pattern made reusable:
+
+- fresh hit: an entry younger than `ttl` is returned as is;
+- stale hit: an entry younger than `stale` is returned immediately while one
+  background thread refreshes it;
+- miss: the first caller (leader) runs the function, concurrent callers with
+  the same key wait up to `wait` seconds for its result (or its exception)
+  instead of running it again. A follower that times out gets
+  SingleFlightTimeout from get(); decorated functions then run uncoalesced.
+
+Results are cached only when `cache_if(result)` holds (by default: not None,
+and for `(data, status)` tuples status 200). Entries are shared between
+callers and must not be mutated.
+
+Each cache belongs to invalidation groups ("products", "bills", ...).
+invalidate(group) drops every cache of the group in this process and bumps
+the group's change counter so the other workers drop theirs (see
+utils/process_coordination.py). A load that started before an invalidation
+is returned to its callers but not cached.
+"""
+import functools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from utils.process_coordination import change_counter
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightTimeout(TimeoutError):
+    """A follower gave up waiting for the leader's result."""
+
+
+def _default_cache_if(result: Any) -> bool:
+    if result is None:
+        return False
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[1], int):
+        return result[1] == 200
+    return True
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """A keyed result cache whose misses are computed once."""
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        stale: float = 0.0,
+        wait: float = 6.0,
+        cache_if: Optional[Callable[[Any], bool]] = None,
+        groups: Iterable[str] = (),
+        max_entries: int = 256,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale = max(stale, ttl)
+        self.wait = wait
+        self.cache_if = cache_if or _default_cache_if
+        self.groups = tuple(groups)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}  # key -> (stored_at, value)
+        self._inflight: Dict[Hashable, _Flight] = {}
+        self._generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        with _registry_lock:
+            _registry.append(self)
+        for group in self.groups:
+            change_counter.register(group, self.invalidate)
+
+    def __call__(self, fn: Callable) -> Callable:
+        """Use as a decorator; the key is the call's arguments."""
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            try:
+                return self.get(key, lambda: fn(*args, **kwargs))
+            except SingleFlightTimeout:
+                # A stuck leader must not fail every caller behind it.
+                return fn(*args, **kwargs)
+
+        wrapper.flight = self
+        return wrapper
+
+    # ---------------------------------------------------------------- reads
+
+    def peek(self, key: Hashable, allow_stale: bool = False) -> Any:
+        """The cached value for `key`, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        age = time.time() - entry[0]
+        if age < self.ttl or (allow_stale and age < self.stale):
+            return entry[1]
+        return None
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+
+        refresh = False
+        with self._lock:
+            entry = self._entries.get(key)
+            age = time.time() - entry[0] if entry is not None else None
+            if age is not None and age < self.ttl:
+                self.hits += 1
+                return entry[1]
+            flight = self._inflight.get(key)
+            if age is not None and age < self.stale:
+                self.stale_hits += 1
+                if flight is None:
+                    self._inflight[key] = _Flight()
+                    refresh = True
+                stale_value = entry[1]
+            elif flight is None:
+                flight = self._inflight[key] = _Flight()
+                self.misses += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+            generation = self._generation
+
+        if age is not None and age < self.stale:
+            if refresh:
+                threading.Thread(
+                    target=self._background_refresh,
+                    args=(key, loader, generation),
+                    name=f"swr-{self.name}",
+                    daemon=True,
+                ).start()
+            return stale_value
+
+        if leader:
+            return self._lead(key, loader, generation)
+
+        if not flight.done.wait(self.wait):
+            self.timeouts += 1
+            raise SingleFlightTimeout(f"{self.name}: gave up after {self.wait}s waiting for {key!r}")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _lead(self, key: Hashable, loader: Callable[[], Any], generation: int) -> Any:
+        with self._lock:
+            flight = self._inflight[key]
+        try:
+            flight.result = loader()
+        except BaseException as e:
+            self.errors += 1
+            flight.error = e
+            raise
+        else:
+            self._store(key, flight.result, generation)
+            return flight.result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def _background_refresh(self, key: Hashable, loader: Callable[[], Any], generation: int) -> None:
+        try:
+            self._lead(key, loader, generation)
+        except Exception as e:
+            logger.warning(f"{self.name}: background refresh of {key!r} failed: {e}")
+
+    def _store(self, key: Hashable, value: Any, generation: int) -> None:
+        if not self.cache_if(value):
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.time(), value)
+            if len(self._entries) > self.max_entries:
+                oldest = sorted(self._entries.items(), key=lambda item: item[1][0])
+                for old_key, _ in oldest[: len(self._entries) - self.max_entries]:
+                    self._entries.pop(old_key, None)
+
+    # -------------------------------------------------------- invalidation
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            generation = self._generation
+        self._store(key, value, generation)
+
+    def invalidate(self, match: Optional[Callable[[Hashable], bool]] = None) -> None:
+        """Drop every entry, or those whose key satisfies `match`."""
+        with self._lock:
+            self._generation += 1
+            if match is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if match(k)]:
+                    self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
+
+
+_registry_lock = threading.Lock()
+_registry: List[SingleFlight] = []
+
+
+def single_flight(
+    name: str,
+    ttl: float,
+    stale: float = 0.0,
+    wait: float = 6.0,
+    cache_if: Optional[Callable[[Any], bool]] = None,
+    groups: Iterable[str] = (),
+) -> SingleFlight:
+    """Decorator form: @single_flight("customers", ttl=15, stale=120,
+    groups=("customers",))."""
+    return SingleFlight(name, ttl, stale=stale, wait=wait, cache_if=cache_if, groups=groups)
+
+
+def drop_group(group: str) -> None:
+    """Drop this process's caches of `group`."""
+    with _registry_lock:
+        flights = [f for f in _registry if group in f.groups]
+    for flight in flights:
+        flight.invalidate()
+
+
+def invalidate(group: str) -> None:
+    """Drop `group`'s caches here and in the other workers."""
+    drop_group(group)
+    change_counter.bump(group)
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    with _registry_lock:
+        flights = list(_registry)
+    return {f.name: f.stats() for f in flights}
@@ -0,0 +1,386 @@
+"""
+Optional SQLite engine for the local offline-first store.
+
+With LOCAL_STORAGE_ENGINE=sqlite, utils/json_helpers keeps every file under
+Config.JSON_DIR as rows in one WAL-mode database instead of a JSON array.
+get_*_data()/save_*_data() behave exactly as before; the query helpers
+(by id, by store, by date range) become indexed lookups instead of Python
+scans over the whole file.
+
+Each row is stored verbatim as a JSON document plus a few extracted, indexed
+columns (id, storeid, productid, created_at, barcodes). Row order is kept via
+`pos`, so a full load returns the array in the order it was saved.
+
+The JSON files stay the import source: the first time an entity is read --
+and again whenever its file is replaced from outside (admin flush, a restored
+backup) -- the file is imported. Writes through json_helpers only touch the
+database, so the file's signature stays at what was last imported.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils import json_journal
+
+logger = logging.getLogger(__name__)
+
+# Extracted columns: name -> candidate keys, first non-empty wins.
+_INDEXED_FIELDS = {
+    "id": ("id",),
+    "storeid": ("storeid", "store_id", "storeId"),
+    "productid": ("productid", "product_id", "productId"),
+    "created_at": ("created_at", "createdat", "createdAt", "timestamp", "date"),
+}
+QUERYABLE_FIELDS = ("id", "storeid", "productid", "barcode")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    source TEXT,
+    doc TEXT
+);
+CREATE TABLE IF NOT EXISTS rows (
+    entity TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    id,
+    storeid TEXT,
+    productid TEXT,
+    created_at TEXT,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (entity, pos)
+);
+CREATE INDEX IF NOT EXISTS rows_id ON rows (entity, id);
+CREATE INDEX IF NOT EXISTS rows_store ON rows (entity, storeid, created_at);
+CREATE INDEX IF NOT EXISTS rows_product ON rows (entity, productid);
+CREATE INDEX IF NOT EXISTS rows_created ON rows (entity, created_at);
+CREATE TABLE IF NOT EXISTS row_barcodes (
+    entity TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    barcode TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS row_barcodes_code ON row_barcodes (entity, barcode);
+CREATE INDEX IF NOT EXISTS row_barcodes_pos ON row_barcodes (entity, pos);
+"""
+
+
+def date_key(value: Any) -> Optional[str]:
+    """Sortable form of an ISO timestamp: aware values are converted to UTC
+    and stripped, so mixed 'Z'/offset/naive strings order consistently."""
+    if not value:
+        return None
+    text = str(value)
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return text
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat()
+
+
+def _first(row: Dict[str, Any], keys: Tuple[str, ...]) -> Any:
+    for k in keys:
+        value = row.get(k)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def barcodes_of(row: Dict[str, Any]) -> List[str]:
+    codes: List[str] = []
+    for k in ("barcode", "barcodes"):
+        value = row.get(k)
+        if isinstance(value, list):
+            parts = value
+        elif isinstance(value, str):
+            parts = value.split(",")
+        else:
+            continue
+        for part in parts:
+            code = str(part).strip()
+            if code and code not in codes:
+                codes.append(code)
+    return codes
+
+
+def indexed_values(row: Any) -> Dict[str, Any]:
+    """The indexed columns for `row`, exactly as the database stores them."""
+    if not isinstance(row, dict):
+        return {"id": None, "storeid": None, "productid": None, "created_at": None}
+    store = _first(row, _INDEXED_FIELDS["storeid"])
+    product = _first(row, _INDEXED_FIELDS["productid"])
+    return {
+        "id": row.get("id"),
+        "storeid": str(store) if store is not None else None,
+        "productid": str(product) if product is not None else None,
+        "created_at": date_key(_first(row, _INDEXED_FIELDS["created_at"])),
+    }
+
+
+class SqliteStore:
+    """Rows of every local entity in one WAL-mode SQLite file."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        parent = os.path.dirname(db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------------------------------------------------------------- metadata
+
+    def version(self, entity: str) -> Optional[int]:
+        row = self._conn().execute(
+            "SELECT version FROM entities WHERE name = ?", (entity,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def meta(self, entity: str) -> Tuple[Optional[int], Optional[str]]:
+        """(version, source) for `entity`; (None, None) if never stored."""
+        row = self._conn().execute(
+            "SELECT version, source FROM entities WHERE name = ?", (entity,)
+        ).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    # ------------------------------------------------------------ whole entity
+
+    def load(self, entity: str) -> Tuple[Optional[int], Any]:
+        """(version, data) for `entity`; (None, None) if it was never stored."""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            meta = conn.execute(
+                "SELECT version, doc FROM entities WHERE name = ?", (entity,)
+            ).fetchone()
+            if meta is None:
+                return None, None
+            version, doc = meta
+            if doc is not None:
+                return version, json.loads(doc)
+            rows = conn.execute(
+                "SELECT doc FROM rows WHERE entity = ? ORDER BY pos", (entity,)
+            ).fetchall()
+            return version, [json.loads(r[0]) for r in rows]
+        finally:
+            conn.execute("COMMIT")
+
+    def iter_rows(self, entity: str) -> Iterator[Any]:
+        """Rows of a list entity in order, decoded one at a time. The
+        cursor reads a consistent snapshot even while writers commit."""
+        cursor = self._conn().execute(
+            "SELECT doc FROM rows WHERE entity = ? ORDER BY pos", (entity,)
+        )
+        try:
+            for (doc,) in cursor:
+                yield json.loads(doc)
+        finally:
+            cursor.close()
+
+    def replace(self, entity: str, data: Any, default=None, source: Any = ...) -> int:
+        """Store `data` as the whole content of `entity`; returns the new
+        version. `source` (the imported file's signature) is kept unless given."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM rows WHERE entity = ?", (entity,))
+            conn.execute("DELETE FROM row_barcodes WHERE entity = ?", (entity,))
+            doc = None
+            if isinstance(data, list):
+                self._insert_rows(conn, entity, enumerate(data), default)
+            else:
+                doc = json.dumps(data, ensure_ascii=False, default=default)
+            version = self._bump(conn, entity, doc=doc, source=source)
+            conn.execute("COMMIT")
+            return version
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ---------------------------------------------------------- keyed changes
+
+    def apply(self, entity: str, ops: List[Dict[str, Any]], key: str) -> Optional[int]:
+        """Apply json_journal-style upsert/delete ops; returns the new version,
+        or None when `entity` is not a stored list (caller falls back)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            meta = conn.execute(
+                "SELECT doc FROM entities WHERE name = ?", (entity,)
+            ).fetchone()
+            if meta is None or meta[0] is not None:
+                conn.execute("ROLLBACK")
+                return None
+            if key != "id":
+                # Only `id` is a column; other keys go through a full rewrite.
+                rows = [json.loads(r[0]) for r in conn.execute(
+                    "SELECT doc FROM rows WHERE entity = ? ORDER BY pos", (entity,)
+                )]
+                json_journal.apply_ops(rows, ops, key, json_journal.build_positions(rows, key))
+                conn.execute("DELETE FROM rows WHERE entity = ?", (entity,))
+                conn.execute("DELETE FROM row_barcodes WHERE entity = ?", (entity,))
+                self._insert_rows(conn, entity, enumerate(rows), None)
+            else:
+                next_pos = conn.execute(
+                    "SELECT COALESCE(MAX(pos), -1) + 1 FROM rows WHERE entity = ?", (entity,)
+                ).fetchone()[0]
+                for op in ops:
+                    if op.get("op") == json_journal.OP_DELETE:
+                        self._delete_positions(conn, entity, op.get("key"))
+                        continue
+                    row = op.get("row")
+                    if not isinstance(row, dict):
+                        continue
+                    hit = None
+                    if row.get("id") is not None:
+                        hit = conn.execute(
+                            "SELECT MAX(pos) FROM rows WHERE entity = ? AND id = ?",
+                            (entity, row.get("id")),
+                        ).fetchone()[0]
+                    if hit is None:
+                        hit, next_pos = next_pos, next_pos + 1
+                    else:
+                        conn.execute("DELETE FROM rows WHERE entity = ? AND pos = ?", (entity, hit))
+                        conn.execute("DELETE FROM row_barcodes WHERE entity = ? AND pos = ?", (entity, hit))
+                    self._insert_rows(conn, entity, [(hit, row)], None)
+            version = self._bump(conn, entity)
+            conn.execute("COMMIT")
+            return version
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    # ------------------------------------------------------------------ query
+
+    def query(
+        self,
+        entity: str,
+        filters: Optional[Dict[str, Any]] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        newest_first: bool = True,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """(rows, total matching) using the indexed columns only."""
+        where = ["r.entity = ?"]
+        params: List[Any] = [entity]
+        join = ""
+        for field, value in (filters or {}).items():
+            if field == "barcode":
+                join = " JOIN row_barcodes b ON b.entity = r.entity AND b.pos = r.pos"
+                where.append("b.barcode = ?")
+                params.append(str(value).strip())
+            elif field == "id":
+                where.append("r.id = ?")
+                params.append(value)
+            elif field in ("storeid", "productid"):
+                where.append(f"r.{field} = ?")
+                params.append(str(value))
+            else:
+                raise ValueError(f"Not an indexed field: {field}")
+        if date_from:
+            where.append("r.created_at >= ?")
+            params.append(date_key(date_from))
+        if date_to:
+            where.append("r.created_at <= ?")
+            params.append(date_key(date_to))
+        clause = " AND ".join(where)
+
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            total = conn.execute(
+                f"SELECT COUNT(DISTINCT r.pos) FROM rows r{join} WHERE {clause}", params
+            ).fetchone()[0]
+            order = "r.created_at DESC, r.pos" if newest_first else "r.created_at, r.pos"
+            sql = f"SELECT DISTINCT r.pos, r.doc, r.created_at FROM rows r{join} WHERE {clause} ORDER BY {order}"
+            page_params = list(params)
+            if limit is not None:
+                sql += " LIMIT ? OFFSET ?"
+                page_params += [int(limit), max(0, int(offset))]
+            elif offset:
+                sql += " LIMIT -1 OFFSET ?"
+                page_params.append(max(0, int(offset)))
+            rows = [json.loads(r[1]) for r in conn.execute(sql, page_params)]
+        finally:
+            conn.execute("COMMIT")
+        return rows, total
+
+    # --------------------------------------------------------------- internals
+
+    def _insert_rows(self, conn, entity: str, numbered: Iterable[Tuple[int, Any]], default) -> None:
+        rows = []
+        codes = []
+        for pos, row in numbered:
+            cols = indexed_values(row)
+            rows.append((
+                entity, pos, cols["id"], cols["storeid"], cols["productid"], cols["created_at"],
+                json.dumps(row, ensure_ascii=False, default=default),
+            ))
+            if isinstance(row, dict):
+                codes.extend((entity, pos, code) for code in barcodes_of(row))
+        conn.executemany(
+            "INSERT INTO rows (entity, pos, id, storeid, productid, created_at, doc) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        if codes:
+            conn.executemany(
+                "INSERT INTO row_barcodes (entity, pos, barcode) VALUES (?, ?, ?)", codes
+            )
+
+    def _delete_positions(self, conn, entity: str, key_value: Any) -> None:
+        if key_value is None:
+            return
+        positions = [r[0] for r in conn.execute(
+            "SELECT pos FROM rows WHERE entity = ? AND id = ?", (entity, key_value)
+        )]
+        for pos in positions:
+            conn.execute("DELETE FROM rows WHERE entity = ? AND pos = ?", (entity, pos))
+            conn.execute("DELETE FROM row_barcodes WHERE entity = ? AND pos = ?", (entity, pos))
+
+    @staticmethod
+    def _bump(conn, entity: str, doc: Optional[str] = None, source: Any = ...) -> int:
+        row = conn.execute(
+            "SELECT version, source FROM entities WHERE name = ?", (entity,)
+        ).fetchone()
+        version = (row[0] if row else 0) + 1
+        keep_source = row[1] if row else None
+        conn.execute(
+            "INSERT OR REPLACE INTO entities (name, version, source, doc) VALUES (?, ?, ?, ?)",
+            (entity, version, keep_source if source is ... else source, doc),
+        )
+        return version
+
+
+_stores_guard = threading.Lock()
+_stores: Dict[str, SqliteStore] = {}
+
+
+def get_store(db_path: str) -> SqliteStore:
+    """Process-wide SqliteStore for `db_path`."""
+    key = os.path.normcase(os.path.abspath(db_path))
+    store = _stores.get(key)
+    if store is None:
+        with _stores_guard:
+            store = _stores.get(key)
+            if store is None:
+                store = SqliteStore(db_path)
+                _stores[key] = store
+    return store
@@ -0,0 +1,106 @@
+"""
+Batched product stock adjustments in Supabase.
+
+Stock used to be adjusted one product at a time: SELECT the current stock,
+compute the new value in Python, UPDATE it -- N sequential round trips for an
+N-line bill, and a lost update whenever two terminals sold the same product
+at once. adjust_product_stock sends every (product, qty) pair to the
+apply_stock_adjustments Postgres function (migrations/
+20261017_apply_stock_adjustments.sql), which applies
+stock = greatest(0, stock - qty) to all of them in one locked statement.
+
+Until the migration is applied the function is missing (PGRST202); the old
+per-product loop is then used (see OptionalRpc).
+
+Without an op_id the RPC is not idempotent, so it is sent without
+transient-error retries: a retry after a timed-out response could apply the
+adjustment twice. Callers already treat a failed stock update as "cloud sync
+deferred". With an op_id (migrations/20261017_stock_adjustment_ops.sql) a
+repeated call is a no-op, so it is retried like any read. The per-product
+fallback cannot honour an op_id, so a call carrying one raises
+StockOpsUnavailable instead of falling back while the function is missing;
+the bill outbox keeps such entries pending until the migration is applied.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional
+
+from utils.single_flight import invalidate as invalidate_cached
+from utils.supabase_resilience import OptionalRpc, execute_with_retry
+
+logger = logging.getLogger(__name__)
+
+_STOCK_RPC = OptionalRpc("apply_stock_adjustments", "20261017_apply_stock_adjustments.sql")
+
+
+class StockOpsUnavailable(RuntimeError):
+    """An idempotent (op_id) adjustment was asked for but the function that
+    records op_ids is not installed."""
+
+
+def _adjust_one_by_one(client: Any, qty_by_product: Dict[str, int], label: str, now_iso: str) -> Dict[str, int]:
+    product_ids = list(qty_by_product.keys())
+    response = execute_with_retry(
+        lambda: client.table("products").select("id, stock").in_("id", product_ids),
+        f"products stock lookup for {label}",
+        retries=2,
+    )
+    new_stock_by_product: Dict[str, int] = {}
+    for row in response.data or []:
+        pid = row.get("id")
+        if not pid:
+            continue
+        new_stock = max(0, int(row.get("stock") or 0) - int(qty_by_product.get(pid, 0)))
+        execute_with_retry(
+            lambda pid=pid, new_stock=new_stock: client.table("products").update({
+                "stock": new_stock,
+                "updatedat": now_iso,
+            }).eq("id", pid),
+            f"products stock update {pid} for {label}",
+            retries=2,
+        )
+        new_stock_by_product[str(pid)] = new_stock
+    return new_stock_by_product
+
+
+def adjust_product_stock(
+    client: Any,
+    qty_by_product: Mapping[Any, int],
+    label: str,
+    now_iso: Optional[str] = None,
+    op_id: Optional[str] = None,
+) -> Dict[str, int]:
+    """
+    Apply stock = max(0, stock - qty) to each product in Supabase and return
+    {product_id: new_stock} for the products that exist. Positive qty sells,
+    negative qty restocks. A call with an op_id already applied changes
+    nothing; one with an op_id raises StockOpsUnavailable rather than use the
+    non-idempotent fallback. Raises whatever the Supabase call raises.
+    """
+    adjustments = {str(pid): int(qty or 0) for pid, qty in qty_by_product.items() if pid}
+    adjustments = {pid: qty for pid, qty in adjustments.items() if qty != 0}
+    if not adjustments:
+        return {}
+
+    items = [{"product_id": pid, "qty": qty} for pid, qty in adjustments.items()]
+    params: Dict[str, Any] = {"items": items}
+    if op_id:
+        params["op_id"] = op_id
+    response = _STOCK_RPC.call(client, params, label, retries=2 if op_id else 0)
+    if response is None and op_id:
+        logger.warning(
+            f"Stock for {label} left pending: apply_stock_adjustments with op_id is not installed "
+            "(apply migrations/20261017_apply_stock_adjustments.sql and 20261017_stock_adjustment_ops.sql)"
+        )
+        raise StockOpsUnavailable(f"apply_stock_adjustments(op_id) unavailable for {label}")
+    if response is not None:
+        new_stock = {
+            str(row.get("product_id")): int(row.get("stock") or 0)
+            for row in response.data or []
+            if row.get("product_id")
+        }
+    else:
+        new_stock = _adjust_one_by_one(client, adjustments, label, now_iso or datetime.now().isoformat())
+    # The cached product lists carry stock; drop them in every worker.
+    invalidate_cached("products")
+    return new_stock
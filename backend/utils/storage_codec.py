@@ -0,0 +1,204 @@
+"""
+On-disk encoding of the local data files.
+
+Snapshots used to be written with json.dump(indent=2), which roughly doubles
+the size of products.json, bills.json and billitems.json and the time spent
+producing and parsing them. Every snapshot now goes through this module:
+
+- JSON (the default) is written compact, through orjson when it is installed
+  (the "fast" extra) and the stdlib json module otherwise. Both produce
+  ordinary UTF-8 JSON, so any tool that read the old files still reads the
+  new ones.
+- With LOCAL_STORAGE_FORMAT=msgpack (and the "msgpack" extra installed) the
+  large tables listed in LOCAL_BINARY_FILES are written as a MessagePack
+  snapshot behind a short magic header instead. Everything else stays JSON, because a few
+  modules (sync_utils, the Tauri side) still read their files directly.
+
+decode() sniffs the header, so a file written in either format is read back
+regardless of the current setting and switching formats needs no migration:
+each file converts on its next save. scripts/export_local_json.py prints or
+exports any local file as indented JSON for debugging.
+"""
+import json
+import logging
+import os
+from typing import Any, BinaryIO, Callable, Iterator, Optional
+
+from config import Config
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional binary format
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_JSON = "json"
+FORMAT_MSGPACK = "msgpack"
+
+# Never valid at the start of a JSON document, so it cannot be mistaken for one.
+MSGPACK_MAGIC = b"\x00BLMP1\n"
+_UTF8_BOM = b"\xef\xbb\xbf"
+
+_warned_missing = False
+
+
+def format_for(path: str, data: Any) -> str:
+    """The format a snapshot of `data` at `path` should be written in."""
+    global _warned_missing
+    if Config.LOCAL_STORAGE_FORMAT != FORMAT_MSGPACK or not isinstance(data, list):
+        return FORMAT_JSON
+    if os.path.basename(path) not in Config.LOCAL_BINARY_FILES:
+        return FORMAT_JSON
+    if msgpack is None:
+        if not _warned_missing:
+            logger.warning("LOCAL_STORAGE_FORMAT=msgpack but msgpack is not installed; writing JSON")
+            _warned_missing = True
+        return FORMAT_JSON
+    return FORMAT_MSGPACK
+
+
+def encode(data: Any, fmt: str = FORMAT_JSON, default: Optional[Callable] = None) -> bytes:
+    """Serialize `data`. `default` is a json.dump-style hook for types the
+    encoder does not handle natively (e.g. datetime)."""
+    if fmt == FORMAT_MSGPACK:
+        return MSGPACK_MAGIC + msgpack.packb(data, default=default, use_bin_type=True)
+    if orjson is not None:
+        # orjson serializes datetimes and dataclasses itself; hand them to
+        # `default` instead, as json.dump would, so both paths agree.
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if default else 0
+        try:
+            return orjson.dumps(data, default=default, option=option)
+        except TypeError:
+            # Non-string keys, integers beyond 64 bits, NaN handling and the
+            # like: fall back to the stdlib so behaviour matches json.dump.
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=default).encode("utf-8")
+
+
+def detect(raw: bytes) -> str:
+    return FORMAT_MSGPACK if raw.startswith(MSGPACK_MAGIC) else FORMAT_JSON
+
+
+def decode(raw: bytes) -> Any:
+    """Parse a snapshot in whichever format it was written. Raises
+    json.JSONDecodeError (or ValueError for msgpack) on corrupt input."""
+    if raw.startswith(MSGPACK_MAGIC):
+        if msgpack is None:
+            raise ValueError("file is a msgpack snapshot but msgpack is not installed")
+        return msgpack.unpackb(raw[len(MSGPACK_MAGIC):], raw=False, strict_map_key=False)
+    # Tolerate BOM-prefixed files (common when edited by Windows tools).
+    if raw.startswith(_UTF8_BOM):
+        raw = raw[len(_UTF8_BOM):]
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib decides
+    return json.loads(raw.decode("utf-8"))
+
+
+def iter_array(fh: BinaryIO, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """
+    Yield the elements of a top-level array snapshot read from `fh` one at a
+    time, without parsing (or holding) the whole document. Raises ValueError
+    when the snapshot is not an array and json.JSONDecodeError on corrupt
+    input, possibly after some elements were already yielded.
+    """
+    head = fh.read(len(MSGPACK_MAGIC))
+    if head.startswith(MSGPACK_MAGIC):
+        if msgpack is None:
+            raise ValueError("file is a msgpack snapshot but msgpack is not installed")
+        unpacker = msgpack.Unpacker(fh, raw=False, strict_map_key=False)
+        try:
+            count = unpacker.read_array_header()
+        except msgpack.UnpackValueError:
+            raise ValueError("snapshot is not an array")
+        for _ in range(count):
+            yield unpacker.unpack()
+        return
+
+    decoder = json.JSONDecoder()
+    pending = head
+    if pending.startswith(_UTF8_BOM):
+        pending = pending[len(_UTF8_BOM):]
+    buf = ""
+    pos = 0
+    eof = False
+
+    def more() -> bool:
+        nonlocal buf, pos, pending, eof
+        if eof:
+            return False
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            eof = True
+        pending += chunk
+        # Only decode whole UTF-8 sequences; a multi-byte character may
+        # straddle the chunk boundary.
+        text = pending.decode("utf-8", errors="strict") if eof else _decode_prefix(pending)
+        pending = pending[len(text.encode("utf-8")):]
+        buf = buf[pos:] + text
+        pos = 0
+        return True
+
+    def skip_ws() -> bool:
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf):
+                return True
+            if not more():
+                return False
+
+    if not skip_ws() or buf[pos] != "[":
+        raise ValueError("snapshot is not an array")
+    pos += 1
+    first = True
+    while True:
+        if not skip_ws():
+            raise json.JSONDecodeError("unterminated array", buf, pos)
+        if buf[pos] == "]":
+            return
+        if not first:
+            if buf[pos] != ",":
+                raise json.JSONDecodeError("expected ',' or ']'", buf, pos)
+            pos += 1
+            if not skip_ws():
+                raise json.JSONDecodeError("unterminated array", buf, pos)
+        first = False
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if more():
+                    continue
+                raise
+            # A number may continue past the buffered text; only trust a
+            # value that is followed by something (or by the end of file).
+            if end == len(buf) and more():
+                continue
+            break
+        pos = end
+        yield value
+
+
+def _decode_prefix(raw: bytes) -> str:
+    """Decode the longest prefix of `raw` that ends on a character boundary."""
+    for cut in range(len(raw), max(len(raw) - 4, -1), -1):
+        try:
+            return raw[:cut].decode("utf-8")
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8")  # genuinely invalid; let it raise
+
+
+def read_file(path: str) -> Any:
+    with open(path, "rb") as f:
+        return decode(f.read())
@@ -0,0 +1,364 @@
+"""
+Full-table Supabase reads with concurrent page fetches.
+
+PostgREST caps each response at ~1000 rows, so every full-table load walked
+.range() pages one after another: a 100k-row table cost 100 serial round
+trips. fetch_all_rows asks for the first page together with an exact row
+count, then fetches the remaining ranges on a small thread pool (each page
+through execute_with_retry) and reassembles them in order.
+
+Offset ranges make Postgres skip an ever-growing prefix on every page and
+shift under concurrent inserts (rows duplicated or missed). Tables with a
+unique, indexed key are therefore walked with iter_table instead:
+keyset pages (`key > last seen`, ordered by the key) cost the same at any
+depth and see each row exactly once. Keyset pages depend on each other, so
+fetch_all_rows splits a single-column key into ranges instead: the first
+page comes with an exact count, and the key values at evenly spaced offsets
+(one-row reads, fetched concurrently like the offset pages) cut the rest of
+the key space into [lo, hi) ranges that are walked by keyset on the thread
+pool and joined in key order. Composite keys are walked one page after
+another; the concurrent offset path remains for tables without such a key.
+
+Concurrency per call is capped by SUPABASE_PAGE_CONCURRENCY; with the
+8 request threads per worker that stays inside the shared httpx pool
+(max_connections=40 in utils/supabase_db.py). Rows inserted after the count
+was taken are still picked up by continuing serially past the counted end.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from utils.supabase_resilience import execute_with_retry
+
+logger = logging.getLogger(__name__)
+
+
+def _split_columns(expr: str) -> List[str]:
+    """Top-level columns of a select expression (embedded resources kept whole)."""
+    out, depth, token = [], 0, ""
+    for ch in expr:
+        if ch == "," and depth == 0:
+            out.append(token.strip())
+            token = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        token += ch
+    if token.strip():
+        out.append(token.strip())
+    return out
+
+
+def _with_key_columns(select_expr: str, key_cols: List[str]) -> str:
+    columns = _split_columns(select_expr)
+    if "*" in columns:
+        return select_expr
+    missing = [c for c in key_cols if c not in columns]
+    return ",".join(columns + missing) if missing else select_expr
+
+
+def _quote(value: Any) -> str:
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{text}"'
+
+
+def _after(query: Any, key_cols: List[str], last: List[Any], descending: bool) -> Any:
+    """Restrict `query` to rows strictly past `last` in key order."""
+    op = "lt" if descending else "gt"
+    if len(key_cols) == 1:
+        return getattr(query, op)(key_cols[0], last[0])
+    # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), nested for more columns.
+    clauses = []
+    for i, col in enumerate(key_cols):
+        equal = [f"{key_cols[j]}.eq.{_quote(last[j])}" for j in range(i)]
+        strict = f"{col}.{op}.{_quote(last[i])}"
+        clauses.append(f"and({','.join(equal + [strict])})" if equal else strict)
+    return query.or_(",".join(clauses))
+
+
+def iter_table(
+    client: Any,
+    table: str,
+    select_expr: str = "*",
+    key: str = "id",
+    label: Optional[str] = None,
+    page_size: int = 1000,
+    descending: bool = False,
+    max_rows: Optional[int] = None,
+    retries: int = 2,
+    where: Optional[Callable[[Any], Any]] = None,
+) -> Iterator[Dict]:
+    """
+    Yield the rows of `table` ordered by `key` (comma-separated columns, e.g.
+    "created_at,id"), one keyset page at a time. The key must be unique and
+    its last column non-null; its columns are added to `select_expr` when
+    missing. `where` adds filters to every page's query (e.g.
+    lambda q: q.gte("updated_at", t)).
+
+    Leading key columns may be null (bills.created_at). Postgres sorts those
+    rows first when descending and last when ascending, and no cursor
+    comparison matches them. A page ending on such a row, or an ascending
+    scan that paged past its first page, continues with the null rows
+    (column IS NULL) by the remaining key columns. A descending scan then
+    goes on with the non-null rows (column NOT NULL). A null in the last key
+    column raises ValueError rather than silently ending the scan.
+    """
+    label = label or table
+    key_cols = [c.strip() for c in key.split(",") if c.strip()]
+    select_expr = _with_key_columns(select_expr, key_cols)
+    counter = {"seen": 0, "capped": False}
+    yield from _scan(client, table, select_expr, key_cols, label, page_size, descending,
+                     max_rows, retries, where, None, counter)
+    if counter["capped"]:
+        logger.warning("Pagination safety cap (%s) hit for %s", max_rows, label)
+
+
+def _scan(
+    client: Any,
+    table: str,
+    select_expr: str,
+    key_cols: List[str],
+    label: str,
+    page_size: int,
+    descending: bool,
+    max_rows: Optional[int],
+    retries: int,
+    where: Optional[Callable[[Any], Any]],
+    last: Optional[List[Any]],
+    counter: Dict[str, Any],
+) -> Iterator[Dict]:
+    """Keyset pages past `last`; see iter_table for how null keys are walked."""
+    nullable = len(key_cols) > 1
+    lead = key_cols[0]
+
+    def absent(query, where=where):
+        query = where(query) if where is not None else query
+        return query.is_(lead, "null")
+
+    def present(query, where=where):
+        query = where(query) if where is not None else query
+        return query.not_.is_(lead, "null")
+
+    page_no = 0
+    while True:
+        if max_rows is not None and counter["seen"] >= max_rows:
+            counter["capped"] = True
+            return
+        page_no += 1
+
+        def build(last=last):
+            query = client.table(table).select(select_expr)
+            if where is not None:
+                query = where(query)
+            if last is not None:
+                query = _after(query, key_cols, last, descending)
+            for col in key_cols:
+                query = query.order(col, desc=descending)
+            return query.limit(page_size)
+
+        resp = execute_with_retry(build, f"{label} keyset page {page_no}", retries=retries)
+        page = resp.data if resp is not None and resp.data is not None else []
+        for row in page:
+            counter["seen"] += 1
+            yield row
+        if len(page) < page_size:
+            # A cursor comparison is never true for NULL: ascending
+            # (NULLS LAST), pages after the first skipped those rows.
+            if nullable and not descending and last is not None:
+                yield from _scan(client, table, select_expr, key_cols[1:], f"{label} (null {lead})",
+                                 page_size, descending, max_rows, retries, absent, None, counter)
+            return
+        last = [page[-1].get(col) for col in key_cols]
+        if last[-1] is None:
+            raise ValueError(f"Keyset scan of {label}: null {key_cols[-1]} on page {page_no}")
+        if last[0] is not None:
+            continue
+
+        # The page ended on a row whose leading column is null: there is no
+        # value to page past, so finish those rows by the remaining columns...
+        yield from _scan(client, table, select_expr, key_cols[1:], f"{label} (null {lead})", page_size,
+                         descending, max_rows, retries, absent, last[1:], counter)
+        # ...and, descending (NULLS FIRST), the non-null rows still follow.
+        if descending:
+            yield from _scan(client, table, select_expr, key_cols, label, page_size,
+                             descending, max_rows, retries, present, None, counter)
+        return
+
+
+def _fetch_key_ranges(
+    client: Any,
+    table: str,
+    select_expr: str,
+    key_col: str,
+    label: str,
+    page_size: int,
+    descending: bool,
+    max_rows: int,
+    retries: int,
+    where: Optional[Callable[[Any], Any]],
+    workers: int,
+) -> List[Dict]:
+    """
+    Keyset scan of `table` by the single column `key_col`. The first page
+    comes with an exact count; the rest of the table is split into up to
+    `workers` key ranges walked concurrently. The split points may move while
+    they are read (inserts, deletes), but the ranges always partition the key
+    space, so each row is still seen once.
+    """
+    select_expr = _with_key_columns(select_expr, [key_col])
+
+    def filtered(query):
+        return where(query) if where is not None else query
+
+    def build_first():
+        query = filtered(client.table(table).select(select_expr, count="exact"))
+        return query.order(key_col, desc=descending).limit(page_size)
+
+    first = execute_with_retry(build_first, f"{label} keyset page 1", retries=retries)
+    rows: List[Dict] = list(first.data or []) if first is not None else []
+    if len(rows) < page_size:
+        return rows
+    edge = rows[-1].get(key_col)
+    if edge is None:
+        raise ValueError(f"Keyset scan of {label}: null {key_col} on page 1")
+
+    total = getattr(first, "count", None)
+    parts = 1
+    if isinstance(total, int):
+        parts = min(workers, -(-(min(total, max_rows) - len(rows)) // page_size))
+    if parts < 2:
+        counter = {"seen": len(rows), "capped": False}
+        rows.extend(_scan(client, table, select_expr, [key_col], label, page_size, descending,
+                          max_rows, retries, where, [edge], counter))
+        if counter["capped"]:
+            logger.warning("Pagination safety cap (%s) hit for %s", max_rows, label)
+        return rows
+
+    def key_at(offset: int):
+        def build():
+            return filtered(client.table(table).select(key_col)).order(key_col).range(offset, offset)
+
+        return execute_with_retry(build, f"{label} split at row {offset}", retries=retries)
+
+    # Split points over the whole table, ascending; keep those past the first page.
+    offsets = [total * i // parts for i in range(1, parts)]
+    with ThreadPoolExecutor(max_workers=len(offsets), thread_name_prefix="supabase-page") as pool:
+        found = [resp.data[0].get(key_col) for resp in pool.map(key_at, offsets) if resp is not None and resp.data]
+    inner = sorted({v for v in found if v is not None and (v < edge if descending else v > edge)})
+    # [lo, hi) ranges; the first page's edge is an exclusive bound.
+    bounds: List[Any] = [None] + inner + [edge] if descending else [edge] + inner + [None]
+    spans = list(zip(bounds, bounds[1:]))
+
+    def scan(span: Tuple[Any, Any]) -> List[Dict]:
+        lo, hi = span
+
+        def within(query):
+            query = filtered(query)
+            if lo is not None:
+                query = query.gt(key_col, lo) if lo == edge else query.gte(key_col, lo)
+            if hi is not None:
+                query = query.lt(key_col, hi)
+            return query
+
+        counter = {"seen": 0, "capped": False}
+        return list(_scan(client, table, select_expr, [key_col], f"{label} [{lo}, {hi})", page_size,
+                          descending, max_rows, retries, within, None, counter))
+
+    with ThreadPoolExecutor(max_workers=len(spans), thread_name_prefix="supabase-page") as pool:
+        chunks = list(pool.map(scan, spans))
+    if descending:
+        chunks.reverse()
+    for chunk in chunks:
+        rows.extend(chunk)
+    if len(rows) > max_rows:
+        logger.warning("Pagination safety cap (%s) hit for %s", max_rows, label)
+        del rows[max_rows:]
+    return rows
+
+
+def fetch_all_rows(
+    client: Any,
+    table: str,
+    select_expr: str = "*",
+    label: Optional[str] = None,
+    page_size: int = 1000,
+    order: Optional[Tuple[str, bool]] = None,
+    max_rows: int = 100000,
+    retries: int = 2,
+    concurrency: Optional[int] = None,
+    key: Optional[str] = None,
+    where: Optional[Callable[[Any], Any]] = None,
+) -> List[Dict]:
+    """
+    Every row of `table` (up to `max_rows`). With `key` the table is walked
+    by keyset (see iter_table; `order` then only gives the direction, and
+    `where` filters every page); a single-column key is split into ranges
+    walked concurrently.
+    Otherwise offset pages are fetched concurrently and returned in the order
+    PostgREST serves them; `order` is (column, descending). Raises whatever
+    execute_with_retry raises for a page that keeps failing, like the serial
+    loops did.
+    """
+    label = label or table
+    workers = max(1, int(concurrency or Config.SUPABASE_PAGE_CONCURRENCY))
+    if key:
+        descending = bool(order and order[1])
+        if "," not in key and workers > 1:
+            return _fetch_key_ranges(client, table, select_expr, key.strip(), label, page_size,
+                                     descending, max_rows, retries, where, workers)
+        return list(iter_table(
+            client, table, select_expr, key=key, label=label, page_size=page_size,
+            descending=descending, max_rows=max_rows, retries=retries, where=where,
+        ))
+    if where is not None:
+        raise ValueError("fetch_all_rows: `where` needs a keyset `key`")
+
+    def fetch(start: int, with_count: bool = False):
+        end = start + page_size - 1
+
+        def build():
+            query = client.table(table).select(select_expr, count="exact") if with_count \
+                else client.table(table).select(select_expr)
+            if order is not None:
+                query = query.order(order[0], desc=order[1])
+            return query.range(start, end)
+
+        return execute_with_retry(build, f"{label} page {start // page_size + 1}", retries=retries)
+
+    first = fetch(0, with_count=True)
+    rows: List[Dict] = list(first.data or []) if first is not None else []
+    if len(rows) < page_size:
+        return rows
+
+    total = getattr(first, "count", None)
+    starts: List[int] = []
+    if isinstance(total, int):
+        starts = list(range(page_size, min(total, max_rows), page_size))
+
+    if starts:
+        with ThreadPoolExecutor(max_workers=min(workers, len(starts)), thread_name_prefix="supabase-page") as pool:
+            pages = list(pool.map(fetch, starts))
+        last_page: List[Dict] = []
+        for resp in pages:
+            last_page = list(resp.data or []) if resp is not None else []
+            rows.extend(last_page)
+        if len(last_page) < page_size:
+            return rows
+        start = starts[-1] + page_size
+    else:
+        start = page_size
+
+    # No count, or the table grew since it was taken: continue serially.
+    while start < max_rows:
+        resp = fetch(start)
+        page = resp.data if resp is not None and resp.data is not None else []
+        if not page:
+            break
+        rows.extend(page)
+        if len(page) < page_size:
+            break
+        start += page_size
+    else:
+        logger.warning("Pagination safety cap (%s) hit for %s", max_rows, label)
+    return rows
@@ -121,3 +121,49 @@ def execute_with_retry(build_query: Callable[[], T], label: str, retries: int =
             time.sleep(delay)
             attempt += 1
     raise last_err
+
+
+def is_missing_rpc_error(err: Exception) -> bool:
+    """True when PostgREST reports that the called function does not exist."""
+    text = str(err)
+    return "PGRST202" in text or "Could not find the function" in text
+
+
+def is_missing_table_error(err: Exception) -> bool:
+    """True when PostgREST reports that the queried table does not exist."""
+    text = str(err)
+    return "PGRST205" in text or "42P01" in text or "Could not find the table" in text
+
+
+class OptionalRpc:
+    """
+    A Postgres function shipped as a migration that may not be applied to the
+    shared Supabase project yet. call() returns None while it is missing (the
+    caller then takes its old multi-request path) and probes again every
+    `retry_seconds`.
+    """
+
+    def __init__(self, name: str, migration: str, retry_seconds: float = 300.0):
+        self.name = name
+        self.migration = migration
+        self.retry_seconds = retry_seconds
+        self.missing_since: Optional[float] = None
+
+    def call(self, client, params: dict, label: str, retries: int = 2):
+        if self.missing_since is not None and time.time() - self.missing_since < self.retry_seconds:
+            return None
+        try:
+            response = execute_with_retry(lambda: client.rpc(self.name, params), f"{self.name} for {label}", retries=retries)
+        except Exception as err:
+            if not is_missing_rpc_error(err):
+                raise
+            if self.missing_since is None:
+                logger.warning(
+                    "%s is not installed in Supabase; using the fallback path (apply migrations/%s)",
+                    self.name,
+                    self.migration,
+                )
+            self.missing_since = time.time()
+            return None
+        self.missing_since = None
+        return response